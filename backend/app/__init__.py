@@ -6,6 +6,18 @@ from dotenv import load_dotenv
 
 from app.api import register_blueprints
 from app.config import config_by_name
+from app.utils.session_store import init_session_store
+from app.utils.shared_volumes import init_shared_volumes
+from app.utils.memory_governor import init_memory_governor
+from app.utils.render_pool import init_render_pool
+from app.utils.image_cache import init_image_cache
+from app.utils.mask_cache import init_mask_cache
+from app.utils.overlay_kernel import init_overlay_kernel
+from app.utils.prefetch import init_prefetcher
+from app.utils.timing import init_timing
+from app.utils.metrics import init_metrics
+from app.utils.profiling import init_profiler
+from app.logging_config import configure_logging
 
 jwt = JWTManager()
 
@@ -21,10 +33,24 @@ def create_app(config_name="development"):
     # Initialize extensions
     CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)
     jwt.init_app(app)
+    init_session_store(app)
+    init_shared_volumes(app)
+    init_memory_governor(app)
+    init_overlay_kernel(app)
+    init_render_pool(app)
+    init_image_cache(app)
+    init_mask_cache(app)
+    init_prefetcher(app)
+    init_timing(app)
+    init_metrics(app)
+    init_profiler(app)
     
     # Register blueprints
     register_blueprints(app)
     
+    if not app.testing:
+        configure_logging(app)
+    
     # Ensure upload directories exist
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     
@@ -3,10 +3,14 @@ from app.api.auth import auth_bp
 from app.api.upload import upload_bp
 from app.api.viewer import viewer_bp
 from app.api.roi import roi_bp
+from app.api.metrics import metrics_bp
+from app.api.profiling import profiling_bp
 
 def register_blueprints(app):
     """Register all blueprints for the app."""
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(upload_bp, url_prefix='/api/upload')
     app.register_blueprint(viewer_bp, url_prefix='/api/viewer')
-    app.register_blueprint(roi_bp, url_prefix='/api/roi')
\ No newline at end of file
+    app.register_blueprint(roi_bp, url_prefix='/api/roi')
+    app.register_blueprint(profiling_bp, url_prefix='/api/profiling')
+    app.register_blueprint(metrics_bp)
\ No newline at end of file
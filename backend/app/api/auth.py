@@ -1,9 +1,12 @@
 import uuid
+import logging
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 
+logger = logging.getLogger(__name__)
+
 auth_bp = Blueprint('auth', __name__)
 
 # Mock user database (replace with a real database in production)
@@ -91,6 +94,19 @@ def jwt_required_with_error_handling():
         return wrapper
     return decorator
 
+def admin_required():
+    """JWT検証に加えて管理者ロールを要求するデコレータ"""
+    def decorator(fn):
+        @wraps(fn)
+        @jwt_required()
+        def wrapper(*args, **kwargs):
+            current_user = get_jwt_identity() or {}
+            if current_user.get('role') != 'admin':
+                return jsonify({"error": "Admin privileges required"}), 403
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
 @auth_bp.route('/user', methods=['GET'])
 @jwt_required_with_error_handling()
 def get_user():
@@ -0,0 +1,47 @@
+import hmac
+import logging
+from flask import Blueprint, Response, request, jsonify, current_app
+
+from app.utils.metrics import get_metrics
+from app.utils.shared_volumes import get_shared_volumes
+
+logger = logging.getLogger(__name__)
+
+metrics_bp = Blueprint('metrics', __name__)
+
+def _shared_volume_gauges():
+    registry = get_shared_volumes()
+    if registry is None:
+        return {}
+
+    gauges = {
+        'shared_volumes_loaded': [],
+        'shared_volumes_bytes': [],
+        'shared_volumes_budget_bytes': [({}, registry.budget_bytes)]
+    }
+    for kind, (count, nbytes) in sorted(registry.usage_by_kind().items()):
+        gauges['shared_volumes_loaded'].append(({'kind': kind}, count))
+        gauges['shared_volumes_bytes'].append(({'kind': kind}, nbytes))
+    return gauges
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_prometheus_metrics():
+    """Expose metrics of all workers in Prometheus text format."""
+    metrics = get_metrics()
+    if metrics is None:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    
+    token = current_app.config.get('METRICS_TOKEN')
+    if token:
+        supplied = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode()):
+            return jsonify({"error": "Unauthorized"}), 401
+    
+    try:
+        metrics.snapshot(force=True)
+        body = metrics.render(extra_gauges=_shared_volume_gauges())
+    except Exception as e:
+        logger.error(f"Error rendering metrics: {str(e)}")
+        return jsonify({"error": "Failed to render metrics"}), 500
+    
+    return Response(body, mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,98 @@
+import logging
+from flask import Blueprint, request, jsonify, current_app, send_file
+
+from app.api.auth import admin_required
+from app.utils.profiling import get_profiler, MODES, CAPTURE_FILES, PROFILE_HEADER
+
+logger = logging.getLogger(__name__)
+
+profiling_bp = Blueprint('profiling', __name__)
+
+@profiling_bp.route('/arm', methods=['POST'])
+@admin_required()
+def arm_profiling():
+    """Profile the next N requests to a route, or issue a header token."""
+    data = request.get_json() or {}
+
+    mode = data.get('mode', 'cprofile')
+    if mode not in MODES:
+        return jsonify({"error": f"Invalid mode. Use one of: {', '.join(MODES)}"}), 400
+    trace_memory = bool(data.get('tracemalloc', True))
+
+    profiler = get_profiler()
+    try:
+        if data.get('route'):
+            route = data['route']
+            if not any(rule.rule == route for rule in current_app.url_map.iter_rules()):
+                return jsonify({"error": f"Unknown route: {route}"}), 400
+            count = int(data.get('count', 1))
+            if count < 1:
+                return jsonify({"error": "count must be at least 1"}), 400
+
+            profiler.arm_route(route, count, mode=mode, trace_memory=trace_memory)
+            return jsonify({
+                "status": "success",
+                "route": route,
+                "count": count,
+                "mode": mode
+            }), 200
+
+        ttl = min(int(data.get('ttl', 600)), current_app.config['PROFILE_MAX_TOKEN_TTL'])
+        if ttl < 1:
+            return jsonify({"error": "ttl must be at least 1"}), 400
+        token = profiler.create_token(ttl, mode=mode, trace_memory=trace_memory)
+        return jsonify({
+            "status": "success",
+            "header": PROFILE_HEADER,
+            "token": token,
+            "expires_in": ttl,
+            "mode": mode
+        }), 200
+
+    except (TypeError, ValueError):
+        return jsonify({"error": "count and ttl must be integers"}), 400
+    except Exception as e:
+        logger.error(f"Error arming profiler: {str(e)}")
+        return jsonify({"error": "Failed to arm profiler"}), 500
+
+@profiling_bp.route('/disarm', methods=['POST'])
+@admin_required()
+def disarm_profiling():
+    """Cancel all armed routes and header tokens."""
+    get_profiler().disarm()
+    return jsonify({"status": "success"}), 200
+
+@profiling_bp.route('/status', methods=['GET'])
+@admin_required()
+def get_profiling_status():
+    """Get the armed routes and live header tokens."""
+    return jsonify(get_profiler().status()), 200
+
+@profiling_bp.route('/captures', methods=['GET'])
+@admin_required()
+def list_captures():
+    """List stored profile captures, newest first."""
+    return jsonify({"captures": get_profiler().captures()}), 200
+
+@profiling_bp.route('/captures/<capture_id>/<filename>', methods=['GET'])
+@admin_required()
+def download_capture(capture_id, filename):
+    """Download one file of a profile capture."""
+    path = get_profiler().capture_path(capture_id, filename)
+    if path is None:
+        return jsonify({"error": "Capture file not found"}), 404
+
+    return send_file(
+        path,
+        mimetype=CAPTURE_FILES[filename],
+        as_attachment=True,
+        download_name=f"{capture_id}_{filename}"
+    )
+
+@profiling_bp.route('/captures/<capture_id>', methods=['DELETE'])
+@admin_required()
+def delete_capture(capture_id):
+    """Delete a profile capture."""
+    if not get_profiler().delete(capture_id):
+        return jsonify({"error": "Capture not found"}), 404
+    return jsonify({"status": "success"}), 200
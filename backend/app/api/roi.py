@@ -1,37 +1,174 @@
 import os
+import re
 import json
+import uuid
+import hashlib
+import zipfile
+import numpy as np
 from flask import Blueprint, request, jsonify, current_app, send_file
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from io import BytesIO
 import logging
-from redis import Redis
-from app.config import Config
 
-from app.utils.file_utils import get_user_upload_dir
+from app.api.auth import admin_required
+from app.utils.file_utils import get_user_upload_dir, get_series_cache_dir
+from app.utils.ingest import load_roi_masks
+from app.utils.mask_cache import get_mask_cache
+from app.utils.mesh_utils import crop_roi, mesh_roi_crop, MESH_FORMATS
 from app.utils.nifti_utils import (
     load_nifti_file, 
-    create_roi_masks, 
-    get_roi_slice, 
-    create_roi_overlay_image
+    get_roi_overlay_layers,
+    get_roi_contours,
+    encode_contour_path,
+    CONTOUR_SCALE,
+    create_roi_overlay_image,
+    create_roi_mask_image,
+    encode_roi_nifti
 )
-from app.utils.dicom_utils import get_dicom_slice
+from app.utils.roi_edit import (
+    rasterize_runs,
+    rasterize_polygon,
+    paint_pixels,
+    interpolate_slices,
+    restore_box,
+    box_index,
+    touched_slices,
+    roi_slice_version,
+    count_values,
+    encode_delta,
+    decode_delta
+)
+from app.utils.dicom_utils import (
+    get_dicom_slice,
+    get_volume_spacing,
+    load_hounsfield_ranges,
+    build_hounsfield_lookup,
+    apply_hounsfield_segmentation
+)
+from app.utils.roi_algebra import PackedMask, evaluate, ALGEBRA_OPS
+from app.utils.overlay_kernel import get_overlay_kernel
+from app.utils.render_pool import render_image, get_render_pool, RenderQueueFull, RenderTimeout
+from app.utils.image_cache import get_image_cache
+from app.utils.prefetch import get_prefetcher
+from app.utils.session_store import get_session, get_redis, SessionBusy
+from app.utils.shared_volumes import (
+    share_array, release_array, resolve_array, array_digest, get_shared_volumes, SessionDataLost
+)
+from app.utils.memory_governor import admit_load, release_load, estimate_mask_bytes, MemoryBudgetExceeded
+from app.utils.timing import stage
 
-# Initialize session storage
-redis_client = Redis.from_url(Config.REDIS_URL)
+logger = logging.getLogger(__name__)
+roi_bp = Blueprint('roi', __name__)
 
-def get_session_data(user_id):
-    data = redis_client.get(f"session:{user_id}")
-    return json.loads(data) if data else {}
+EDIT_OPS = ('paint', 'erase', 'polygon', 'interpolate')
 
-def set_session_data(user_id, data):
-    redis_client.setex(
-        f"session:{user_id}",
-        Config.SESSION_TIMEOUT,
-        json.dumps(data)
-    )
+def open_roi_for_edit(user_id, session, roi_index):
+    """
+    Get an ROI mask ready to be edited in place.
+    
+    Masks are shared by content between sessions, so the first edit gives
+    the ROI a private copy (charged to the session as ``edits``) along with
+    its edit state: an id, a revision, the version of the untouched slices
+    along each axis and the voxel count of every label.
+    
+    Returns:
+        dict: ROI info with the ``edit`` state.
+        The session value of the mask (shared reference or array).
+        numpy.ndarray: The writable mask.
+    """
+    roi_info = list(session.get('roi_masks', []))
+    info = roi_info[roi_index]
+    value = session.get(f"roi_mask:{roi_index}")
+    
+    if info.get('edit') is None:
+        source = resolve_array(value)
+        nbytes = sum(other['edit']['nbytes'] for other in roi_info if other.get('edit')) + int(source.nbytes)
+        admission = admit_load(user_id, 'edits', nbytes)
+        try:
+            edit_id = uuid.uuid4().hex[:16]
+            series_id = session.get('dicom_series_id', 'unknown')
+            copy = share_array(user_id, f"{series_id}:roi:edit-{edit_id}", source)
+            if not isinstance(copy, dict):
+                copy = np.array(source)
+            counts = count_values(source)
+        except Exception:
+            admission.cancel()
+            raise
+        admission.commit(nbytes)
+        release_array(user_id, value)
+        
+        info = dict(info, edit={
+            'id': edit_id,
+            'revision': 0,
+            'base': [info.get('digest')] * 3,
+            'slices': [{}, {}, {}],
+            'nbytes': int(source.nbytes)
+        }, voxels={str(v): int(n) for v, n in enumerate(counts) if v and n})
+        roi_info[roi_index] = info
+        value = copy
+        session.update({'roi_masks': roi_info, f"roi_mask:{roi_index}": value})
+    
+    return info, value, resolve_array(value, writable=True)
 
-logger = logging.getLogger(__name__)
-roi_bp = Blueprint('roi', __name__)
+def commit_roi_edit(user_id, session, roi_index, info, value, mask, box, before, record=True):
+    """
+    Record an in-place edit of a box of an ROI mask.
+    
+    Bumps the ROI version (its ``digest``) and the version of the touched
+    slices, updates the voxel counts from the box alone and pushes the undo
+    record. Image cache keys carry the slice versions, so every worker stops
+    serving the old images of the touched slices.
+    
+    Returns:
+        dict: The updated ROI info.
+        int: Number of voxels that changed.
+    """
+    after = mask[box_index(box)]
+    changed = int(np.count_nonzero(after != before))
+    if not changed:
+        return info, 0
+    
+    counts = count_values(after) - count_values(before)
+    voxels = {int(v): n for v, n in info['voxels'].items()}
+    for v in np.flatnonzero(counts):
+        if v:
+            voxels[int(v)] = voxels.get(int(v), 0) + int(counts[v])
+    
+    edit = dict(info['edit'], revision=info['edit']['revision'] + 1)
+    digest = f"{edit['id']}-{edit['revision']}"
+    base = list(edit['base'])
+    slices = [dict(versions) for versions in edit['slices']]
+    for axis in range(3):
+        for index in range(box[0][axis], box[1][axis]):
+            slices[axis][str(index)] = digest
+        if len(slices[axis]) > mask.shape[axis] // 2:
+            # Most slices along this axis changed; start it over rather than carry every slice along
+            base[axis], slices[axis] = digest, {}
+    edit['base'], edit['slices'] = base, slices
+    
+    info = dict(info, digest=digest, edit=edit, voxels={str(v): n for v, n in sorted(voxels.items()) if n})
+    if info.get('labels'):
+        info['unique_values'] = [0] + [int(v) for v in info['voxels']]
+    
+    if record:
+        key = f"roi_undo:{user_id}:{edit['id']}"
+        pipe = get_redis().pipeline(transaction=True)
+        pipe.lpush(key, encode_delta(box, before))
+        pipe.ltrim(key, 0, current_app.config['ROI_UNDO_DEPTH'] - 1)
+        pipe.expire(key, current_app.config['SESSION_TIMEOUT'])
+        pipe.execute()
+    
+    roi_info = list(session.get('roi_masks', []))
+    roi_info[roi_index] = info
+    mapping = {'roi_masks': roi_info}
+    if not isinstance(value, dict):
+        # Not in shared memory: the session holds the mask itself
+        mapping[f"roi_mask:{roi_index}"] = mask
+    session.update(mapping)
+    
+    # Speculative renders queued before the edit are keyed on the old versions
+    get_prefetcher().reset(user_id)
+    return info, changed
 
 @roi_bp.route('/process', methods=['POST'])
 @jwt_required()
@@ -66,21 +203,47 @@ def process_rois():
     if not nifti_file_info:
         return jsonify({"error": "No valid NIfTI files found"}), 400
     
+    admission = None
     try:
-        # Create ROI masks
-        roi_masks = create_roi_masks(nifti_file_info, tuple(dicom_shape))
+        # Masks of a resampled volume go on its grid, whatever shape the client sent
+        session = get_session(user_id)
+        grid = session.get_many('dicom_resampling', 'dicom_shape')
+        if grid['dicom_resampling']:
+            dicom_shape = grid['dicom_shape']
+        
+        # Reserve memory for the masks before decoding anything (estimated from the headers)
+        peak_bytes, resident_bytes = estimate_mask_bytes([f['path'] for f in nifti_file_info], dicom_shape)
+        admission = admit_load(user_id, 'rois', peak_bytes)
+        
+        # Create ROI masks (or reuse those processed earlier for this grid, by anyone)
+        series_id = session.get('dicom_series_id', 'unknown')
+        roi_masks = load_roi_masks(
+            nifti_file_info, tuple(dicom_shape), get_mask_cache(), refresh=bool(data.get('refresh'))
+        )
         
-        # Store in session
-        session_data = get_session_data(user_id)
-        session_data['roi_masks'] = [
-            {
+        # Publish the masks to the other workers and store them in the session
+        stored_masks = []
+        for mask in roi_masks:
+            digest = array_digest(mask['mask'])
+            stored_masks.append({
                 'filename': mask['filename'],
                 'label': mask['label'],
-                'mask': mask['mask'].tolist()  # numpy arrayをリストに変換
-            }
-            for mask in roi_masks
-        ]
-        set_session_data(user_id, session_data)
+                'unique_values': mask['unique_values'],
+                'digest': digest,
+                'mask': share_array(user_id, f"{series_id}:roi:{digest}", mask['mask'])
+            })
+        # Edits of the previous ROIs on other workers must not land in the new list
+        with session.locked('roi_masks'):
+            for previous in session.get_many(*[f"roi_mask:{i}" for i in range(len(session.get('roi_masks', [])))]).values():
+                release_array(user_id, previous)
+            admission.commit(resident_bytes * len(roi_masks) // max(len(nifti_file_info), 1))
+            release_load(user_id, 'tissue', 'edits', 'derived')  # The new ROI list replaces every other ROI
+            session.set_roi_masks(stored_masks)
+        
+        # Cache keys carry the ROI digests, so no worker serves views of the
+        # previous ROIs; this only frees this worker's copies early
+        get_image_cache().invalidate_user(user_id)
+        get_prefetcher().reset(user_id)
         
         # Return ROI info
         roi_info = []
@@ -98,10 +261,114 @@ def process_rois():
             "roi_info": roi_info
         }), 200
         
+    except (MemoryBudgetExceeded, SessionDataLost, SessionBusy):
+        if admission is not None:
+            admission.cancel()
+        raise
     except Exception as e:
+        if admission is not None:
+            admission.cancel()
         logger.error(f"Error processing ROI files: {str(e)}")
         return jsonify({"error": "Failed to process ROI files"}), 500
 
+@roi_bp.route('/classify_tissue', methods=['POST'])
+@jwt_required()
+def classify_tissue():
+    """Classify the loaded volume by Hounsfield ranges into a multi-label ROI."""
+    current_user = get_jwt_identity()
+    user_id = current_user.get('user_id')
+    
+    data = request.get_json() or {}
+    ranges = data.get('ranges') or load_hounsfield_ranges()
+    names = data.get('names') or {}
+    
+    try:
+        ranges = [[float(min_hu), float(max_hu), int(value)] for min_hu, max_hu, value in ranges]
+        build_hounsfield_lookup(ranges)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid Hounsfield ranges: {str(e)}"}), 400
+    
+    session = get_session(user_id)
+    fields = session.get_many('dicom_shape', 'dicom_series_id')
+    if fields['dicom_shape'] is None:
+        return jsonify({"error": "No DICOM data loaded. Please load DICOM data first."}), 400
+    
+    admission = None
+    try:
+        # One uint8 label per voxel
+        label_bytes = int(np.prod(fields['dicom_shape']))
+        admission = admit_load(user_id, 'tissue', label_bytes)
+        
+        # Label volumes are shared per (series, ranges), so another user or
+        # worker may already have computed this one
+        ranges_key = hashlib.sha1(json.dumps(ranges).encode('utf-8')).hexdigest()[:16]
+        name = f"{fields['dicom_series_id']}:roi:tissue:{ranges_key}"
+        registry = get_shared_volumes()
+        label_volume = registry.attach(name) if registry is not None else None
+        cached = label_volume is not None
+        if label_volume is None:
+            with stage('classify'):
+                label_volume = apply_hounsfield_segmentation(session.get_array('dicom_volume'), ranges)
+        
+        counts = np.bincount(label_volume.ravel(), minlength=256)
+        layers = {}
+        for min_hu, max_hu, value in ranges:
+            if counts[value] and value not in layers:
+                layers[value] = names.get(str(value), f"HU {min_hu:g} to {max_hu:g}")
+        
+        # Replace an earlier classification, keep the ROIs loaded from files
+        new_mask = share_array(user_id, name, label_volume)
+        # The ROI list is re-read under the lock, so edits made meanwhile on other workers are kept
+        with session.locked('roi_masks'):
+            roi_info = session.get('roi_masks', [])
+            stored = session.get_many(*[f"roi_mask:{i}" for i in range(len(roi_info))])
+            roi_masks = []
+            for i, info in enumerate(roi_info):
+                value = stored[f"roi_mask:{i}"]
+                if info.get('kind') == 'tissue':
+                    if not (isinstance(value, dict) and isinstance(new_mask, dict) and value == new_mask):
+                        release_array(user_id, value)
+                    continue
+                roi_masks.append(dict(info, mask=value))
+            
+            roi_masks.append({
+                'filename': None,
+                'label': 'Tissue classification',
+                'kind': 'tissue',
+                'unique_values': [0] + sorted(layers),
+                'labels': [[value, layer_name] for value, layer_name in sorted(layers.items())],
+                'digest': f"{fields['dicom_series_id']}-tissue-{ranges_key}",
+                'mask': new_mask
+            })
+            admission.commit(label_bytes)
+            session.set_roi_masks(roi_masks)
+        
+        # Cache keys carry the ROI digests, so no worker serves views of the
+        # previous ROIs; this only frees this worker's copies early
+        get_image_cache().invalidate_user(user_id)
+        get_prefetcher().reset(user_id)
+        
+        return jsonify({
+            "status": "success",
+            "roi_index": len(roi_masks) - 1,
+            "cached": cached,
+            "shape": label_volume.shape,
+            "labels": [
+                {"value": value, "name": layer_name, "voxels": int(counts[value])}
+                for value, layer_name in sorted(layers.items())
+            ]
+        }), 200
+        
+    except (MemoryBudgetExceeded, SessionDataLost, SessionBusy):
+        if admission is not None:
+            admission.cancel()
+        raise
+    except Exception as e:
+        if admission is not None:
+            admission.cancel()
+        logger.error(f"Error classifying tissue: {str(e)}")
+        return jsonify({"error": "Failed to classify tissue"}), 500
+
 @roi_bp.route('/get_slice', methods=['GET'])
 @jwt_required()
 def get_roi_slice_image():
@@ -117,16 +384,16 @@ def get_roi_slice_image():
     axis_map = {'axial': 0, 'coronal': 1, 'sagittal': 2}
     axis = axis_map.get(view, 0)
     
-    if user_id not in get_session_data(user_id) or 'roi_masks' not in get_session_data(user_id):
+    session = get_session(user_id)
+    roi_info = session.get('roi_masks')
+    if not roi_info:
         return jsonify({"error": "No ROI data loaded. Please process ROI files first."}), 400
     
-    roi_masks = get_session_data(user_id)['roi_masks']
-    
-    if roi_index >= len(roi_masks):
+    if roi_index < 0 or roi_index >= len(roi_info):
         return jsonify({"error": "ROI index out of range"}), 400
     
     try:
-        roi_data = roi_masks[roi_index]['mask']
+        roi_data = session.get_roi_masks([roi_index])[0]['mask']
         
         # Get slice
         if axis == 0:
@@ -143,27 +410,12 @@ def get_roi_slice_image():
             slice_data = roi_data[:, :, slice_index]
         
         # Create and return the image
-        from matplotlib import pyplot as plt
-        from matplotlib.colors import LinearSegmentedColormap
-        import numpy as np
-        from io import BytesIO
-        
-        # Create a custom colormap with transparency for zero values
-        colors = [(0, 0, 0, 0), (1, 0, 0, 1)]  # Transparent to red
-        cmap = LinearSegmentedColormap.from_list('custom_cmap', colors, N=2)
-        
-        fig, ax = plt.subplots(figsize=(10, 10))
-        im = ax.imshow(slice_data, cmap=cmap, interpolation='nearest')
-        ax.axis('off')
-        plt.tight_layout()
-        
-        buf = BytesIO()
-        plt.savefig(buf, format='png', dpi=100, bbox_inches='tight', pad_inches=0, transparent=True)
-        plt.close(fig)
-        buf.seek(0)
+        image_data = render_image(create_roi_mask_image, slice_data)
         
-        return send_file(buf, mimetype='image/png')
+        return send_file(BytesIO(image_data), mimetype='image/png')
         
+    except (RenderQueueFull, RenderTimeout, SessionDataLost):
+        raise
     except Exception as e:
         logger.error(f"Error creating ROI slice image: {str(e)}")
         return jsonify({"error": f"Error creating ROI slice image: {str(e)}"}), 500
@@ -182,37 +434,569 @@ def get_overlay_image():
     axis_map = {'axial': 0, 'coronal': 1, 'sagittal': 2}
     axis = axis_map.get(view, 0)
     
-    if user_id not in get_session_data(user_id):
-        return jsonify({"error": "No data loaded"}), 400
+    session = get_session(user_id)
+    fields = session.get_many('dicom_shape', 'dicom_stats', 'roi_masks')
     
-    if 'dicom_volume' not in get_session_data(user_id):
+    if fields['dicom_shape'] is None:
         return jsonify({"error": "No DICOM data loaded"}), 400
     
-    if 'roi_masks' not in get_session_data(user_id) or not get_session_data(user_id)['roi_masks']:
+    if not fields['roi_masks']:
         return jsonify({"error": "No ROI data loaded"}), 400
     
+    num_slices = fields['dicom_shape'][axis]
+    if not 0 <= slice_index < num_slices:
+        return jsonify({"error": f"slice_index must be in [0, {num_slices - 1}]"}), 400
+    
     try:
-        dicom_volume = get_session_data(user_id)['dicom_volume']
-        roi_masks = get_session_data(user_id)['roi_masks']
+        dicom_volume = session.get_array('dicom_volume')
+        roi_masks = session.get_roi_masks()
         
         # Get DICOM slice
         dicom_slice = get_dicom_slice(dicom_volume, slice_index, axis)
         
+        # Precomputed range of this slice, so the renderer does not rescan it
+        value_range = None
+        stats = fields['dicom_stats']
+        if stats is not None:
+            value_range = (stats['slice_min'][axis][slice_index], stats['slice_max'][axis][slice_index])
+        
         # Get ROI slices
-        roi_slices = []
-        roi_names = []
-        for roi_mask in roi_masks:
-            roi_data = roi_mask['mask']
-            roi_slice = get_roi_slice(roi_data, slice_index, axis)
-            roi_slices.append(roi_slice)
-            roi_names.append(roi_mask['label'])
+        roi_slices, roi_names = get_roi_overlay_layers(roi_masks, slice_index, axis)
         
         # Create overlay image
-        overlay_image = create_roi_overlay_image(dicom_slice, roi_slices, roi_names)
+        overlay_image = render_image(
+            create_roi_overlay_image, dicom_slice, roi_slices, roi_names,
+            value_range=value_range, kernel=get_overlay_kernel()
+        )
         
         # Return the image
         return send_file(BytesIO(overlay_image), mimetype='image/png')
         
+    except (RenderQueueFull, RenderTimeout, SessionDataLost):
+        raise
     except Exception as e:
         logger.error(f"Error creating overlay image: {str(e)}")
-        return jsonify({"error": f"Error creating overlay image: {str(e)}"}), 500
\ No newline at end of file
+        return jsonify({"error": f"Error creating overlay image: {str(e)}"}), 500
+
+@roi_bp.route('/contours', methods=['GET'])
+@jwt_required()
+def get_contours():
+    """Get ROI outlines on a slice as vector polylines."""
+    current_user = get_jwt_identity()
+    user_id = current_user.get('user_id')
+    
+    view = request.args.get('view', 'axial')
+    encoding = request.args.get('encoding', 'delta')
+    rois = request.args.get('rois')
+    
+    if encoding not in ('delta', 'none'):
+        return jsonify({"error": "Invalid encoding. Use 'delta' or 'none'"}), 400
+    
+    try:
+        slice_index = int(request.args.get('slice_index', 0))
+        tolerance = float(request.args.get('tolerance', current_app.config['CONTOUR_TOLERANCE']))
+        indices = [int(i) for i in rois.split(',')] if rois else None
+    except ValueError:
+        return jsonify({"error": "slice_index must be an integer, tolerance a number and rois a comma-separated list of indices"}), 400
+    
+    # Map view to axis
+    axis_map = {'axial': 0, 'coronal': 1, 'sagittal': 2}
+    axis = axis_map.get(view, 0)
+    
+    session = get_session(user_id)
+    fields = session.get_many('dicom_shape', 'roi_masks')
+    if not fields['roi_masks']:
+        return jsonify({"error": "No ROI data loaded"}), 400
+    
+    roi_info = fields['roi_masks']
+    if indices is None:
+        indices = list(range(len(roi_info)))
+    indices = [i for i in indices if 0 <= i < len(roi_info)]
+    
+    shape = fields['dicom_shape'] or []
+    if len(shape) == 3 and not -shape[axis] <= slice_index < shape[axis]:
+        return jsonify({"error": "Slice index out of range"}), 400
+    if len(shape) == 3:
+        slice_index %= shape[axis]
+    
+    try:
+        # Outlines are cached per ROI slice content, so toggling ROIs,
+        # revisiting a slice or editing another slice never traces them again
+        redis = get_redis()
+        keys = [
+            f"contours:{roi_slice_version(roi_info[i], axis, slice_index) or f'{user_id}:{i}'}"
+            f":{axis}:{slice_index}:{tolerance:g}:{encoding}"
+            for i in indices
+        ]
+        cached = redis.mget(keys) if keys else []
+        
+        missing = [n for n, value in enumerate(cached) if value is None]
+        if missing:
+            roi_masks = session.get_roi_masks([indices[n] for n in missing])
+            pipe = redis.pipeline(transaction=False)
+            with stage('contours'):
+                for n, roi_mask in zip(missing, roi_masks):
+                    layers = get_roi_contours(roi_mask, slice_index, axis, tolerance)
+                    for layer in layers:
+                        layer['paths'] = [encode_contour_path(path, encoding) for path in layer['paths']]
+                    cached[n] = json.dumps(layers)
+                    pipe.set(keys[n], cached[n], ex=current_app.config['CONTOUR_CACHE_TTL'])
+            pipe.execute()
+        
+        return jsonify({
+            "status": "success",
+            "view": view,
+            "slice_index": slice_index,
+            "encoding": encoding,
+            "scale": CONTOUR_SCALE if encoding == 'delta' else 1,
+            "rois": [
+                {
+                    "index": i,
+                    "label": roi_info[i]['label'],
+                    "layers": json.loads(value)
+                }
+                for i, value in zip(indices, cached)
+            ]
+        }), 200
+        
+    except SessionDataLost:
+        raise
+    except Exception as e:
+        logger.error(f"Error extracting ROI contours: {str(e)}")
+        return jsonify({"error": "Failed to extract ROI contours"}), 500
+
+@roi_bp.route('/mesh', methods=['GET'])
+@jwt_required()
+def get_roi_mesh():
+    """Export ROI surfaces as triangle meshes in physical coordinates."""
+    current_user = get_jwt_identity()
+    user_id = current_user.get('user_id')
+    
+    fmt = request.args.get('format', 'ply')
+    rois = request.args.get('rois')
+    if fmt not in MESH_FORMATS:
+        return jsonify({"error": f"Invalid format. Use one of: {', '.join(MESH_FORMATS)}"}), 400
+    
+    try:
+        step_size = int(request.args.get('step_size', 1))
+        smoothing = float(request.args.get('smoothing', 0))
+        indices = [int(i) for i in rois.split(',')] if rois else None
+    except ValueError:
+        return jsonify({"error": "step_size, smoothing and rois must be numbers"}), 400
+    if not 1 <= step_size <= 16 or not 0 <= smoothing <= 10:
+        return jsonify({"error": "step_size must be 1-16 and smoothing 0-10"}), 400
+    
+    session = get_session(user_id)
+    fields = session.get_many('dicom_metadata', 'dicom_resampling', 'dicom_series_id', 'roi_masks')
+    if not fields['roi_masks']:
+        return jsonify({"error": "No ROI data loaded"}), 400
+    
+    roi_info = fields['roi_masks']
+    if indices is None:
+        indices = list(range(len(roi_info)))
+    indices = [i for i in indices if 0 <= i < len(roi_info)]
+    if not indices:
+        return jsonify({"error": "No valid ROI indices"}), 400
+    
+    if fields['dicom_resampling']:
+        spacing = tuple(fields['dicom_resampling']['spacing'])
+    else:
+        spacing = get_volume_spacing(fields['dicom_metadata'] or {})
+    
+    try:
+        # Meshes are cached per mask content and settings, so an edited ROI
+        # (new digest) is meshed again and an unchanged one never is
+        mesh_dir = os.path.join(get_series_cache_dir(fields['dicom_series_id'] or 'unknown'), 'meshes')
+        os.makedirs(mesh_dir, exist_ok=True)
+        
+        entries = []  # (archive name, cache path)
+        jobs = []
+        roi_masks = None
+        for i in indices:
+            info = roi_info[i]
+            layers = [(value, name) for value, name in info['labels']] if info.get('labels') else [(None, info['label'])]
+            for value, name in layers:
+                safe_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', str(name)).strip('_') or 'roi'
+                version = info.get('digest') or f"{user_id}-{i}"
+                path = os.path.join(
+                    mesh_dir, f"{version}-{'all' if value is None else value}-s{step_size}-g{smoothing:g}.{fmt}"
+                )
+                entries.append((f"{i}_{safe_name}.{fmt}", path))
+                if os.path.exists(path):
+                    continue
+                
+                if roi_masks is None:
+                    roi_masks = {n: m for n, m in zip(indices, session.get_roi_masks(indices))}
+                with stage('roi_crop'):
+                    crop, origin = crop_roi(roi_masks[i]['mask'], value)
+                if crop is None:
+                    entries.pop()
+                    continue
+                jobs.append((path, (crop, origin, spacing, step_size, smoothing, fmt, str(name))))
+        
+        # Every ROI (and every label) is meshed in its own job, in parallel
+        with stage('mesh'):
+            meshes = get_render_pool().imap(
+                ((mesh_roi_crop, args) for _, args in jobs), timeout=current_app.config['MESH_TIMEOUT']
+            )
+            meshes = [(path, result[0]) for (path, _), result in zip(jobs, meshes)]
+        for path, data in meshes:
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        
+        if not entries:
+            return jsonify({"error": "The selected ROIs are empty"}), 400
+        
+        if len(entries) == 1:
+            name, path = entries[0]
+            response = send_file(path, mimetype=MESH_FORMATS[fmt], as_attachment=True, download_name=name)
+        else:
+            buf = BytesIO()
+            with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+                for name, path in entries:
+                    archive.write(path, name)
+            buf.seek(0)
+            response = send_file(buf, mimetype='application/zip', as_attachment=True, download_name='roi_meshes.zip')
+        response.headers['X-Mesh-Cached'] = str(len(entries) - len(jobs))
+        return response
+        
+    except (RenderQueueFull, RenderTimeout, SessionDataLost):
+        raise
+    except Exception as e:
+        logger.error(f"Error exporting ROI meshes: {str(e)}")
+        return jsonify({"error": "Failed to export ROI meshes"}), 500
+
+@roi_bp.route('/edit', methods=['POST'])
+@jwt_required()
+def edit_roi():
+    """Edit an ROI mask in place (brush paint/erase, polygon fill or slice interpolation)."""
+    current_user = get_jwt_identity()
+    user_id = current_user.get('user_id')
+    
+    data = request.get_json() or {}
+    op = data.get('op')
+    view = data.get('view', 'axial')
+    if op not in EDIT_OPS:
+        return jsonify({"error": f"Invalid op. Use one of: {', '.join(EDIT_OPS)}"}), 400
+    
+    # Map view to axis
+    axis_map = {'axial': 0, 'coronal': 1, 'sagittal': 2}
+    axis = axis_map.get(view, 0)
+    
+    try:
+        roi_index = int(data.get('roi_index', 0))
+        slice_index = int(data.get('slice_index', 0))
+        value = 0 if op == 'erase' else int(data.get('value', 1))
+        to_slice = int(data['to_slice']) if op == 'interpolate' else None
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "roi_index, slice_index, value and to_slice (interpolate) must be integers"}), 400
+    
+    session = get_session(user_id)
+    fields = session.get_many('dicom_shape', 'roi_masks')
+    roi_info = fields['roi_masks']
+    if not roi_info or fields['dicom_shape'] is None:
+        return jsonify({"error": "No ROI data loaded"}), 400
+    if roi_index < 0 or roi_index >= len(roi_info):
+        return jsonify({"error": "ROI index out of range"}), 400
+    
+    shape = fields['dicom_shape']
+    if not 0 <= slice_index < shape[axis] or (to_slice is not None and not 0 <= to_slice < shape[axis]):
+        return jsonify({"error": "Slice index out of range"}), 400
+    
+    # A multi-label ROI is edited one of its labels at a time
+    labels = roi_info[roi_index].get('labels')
+    allowed = [label_value for label_value, _ in labels] if labels else [1]
+    if op != 'erase' and value not in allowed:
+        return jsonify({"error": f"Invalid value for this ROI. Use one of: {', '.join(map(str, allowed))}"}), 400
+    
+    # Strokes arrive as run-length encoded rows (or polygon vertices) on the slice
+    slice_shape = [n for a, n in enumerate(shape) if a != axis]
+    try:
+        if op in ('paint', 'erase'):
+            rows, cols = rasterize_runs(data.get('runs') or [], slice_shape)
+        elif op == 'polygon':
+            rows, cols = rasterize_polygon(data.get('points') or [], slice_shape)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid stroke: {str(e)}"}), 400
+    
+    try:
+        # Edits of all workers take turns, so none writes back a stale ROI list
+        with session.locked('roi_masks'):
+            info, stored, mask = open_roi_for_edit(user_id, session, roi_index)
+            with stage('roi_edit'):
+                if op == 'interpolate':
+                    box, before = interpolate_slices(mask, axis, slice_index, to_slice, value)
+                else:
+                    box, before = paint_pixels(mask, axis, slice_index, rows, cols, value)
+            
+            changed = 0
+            if box is not None:
+                info, changed = commit_roi_edit(user_id, session, roi_index, info, stored, mask, box, before)
+        
+        return jsonify({
+            "status": "success",
+            "roi_index": roi_index,
+            "digest": info['digest'],
+            "changed": changed,
+            "voxels": info['voxels'],
+            "touched": touched_slices(box) if changed else {},
+            "undo_depth": get_redis().llen(f"roi_undo:{user_id}:{info['edit']['id']}")
+        }), 200
+        
+    except (MemoryBudgetExceeded, SessionDataLost, SessionBusy):
+        raise
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error editing ROI: {str(e)}")
+        return jsonify({"error": "Failed to edit ROI"}), 500
+
+@roi_bp.route('/undo', methods=['POST'])
+@jwt_required()
+def undo_roi_edit():
+    """Undo the last edit of an ROI."""
+    current_user = get_jwt_identity()
+    user_id = current_user.get('user_id')
+    
+    data = request.get_json() or {}
+    try:
+        roi_index = int(data.get('roi_index', 0))
+    except (TypeError, ValueError):
+        return jsonify({"error": "roi_index must be an integer"}), 400
+    
+    session = get_session(user_id)
+    roi_info = session.get('roi_masks')
+    if not roi_info:
+        return jsonify({"error": "No ROI data loaded"}), 400
+    if roi_index < 0 or roi_index >= len(roi_info):
+        return jsonify({"error": "ROI index out of range"}), 400
+    
+    try:
+        with session.locked('roi_masks'):
+            edit = session.get('roi_masks')[roi_index].get('edit')
+            key = f"roi_undo:{user_id}:{edit['id']}" if edit else None
+            record = get_redis().lindex(key, 0) if key else None
+            if record is None:
+                return jsonify({"error": "Nothing to undo"}), 400
+            
+            info, stored, mask = open_roi_for_edit(user_id, session, roi_index)
+            box, before = decode_delta(record)
+            with stage('roi_edit'):
+                replaced = restore_box(mask, box, before)
+            try:
+                info, changed = commit_roi_edit(
+                    user_id, session, roi_index, info, stored, mask, box, replaced, record=False
+                )
+            except Exception:
+                restore_box(mask, box, replaced)
+                raise
+            
+            # Only drop the record once the mask and session both reflect the undo
+            get_redis().lpop(key)
+        
+        return jsonify({
+            "status": "success",
+            "roi_index": roi_index,
+            "digest": info['digest'],
+            "changed": changed,
+            "voxels": info['voxels'],
+            "touched": touched_slices(box),
+            "undo_depth": get_redis().llen(key)
+        }), 200
+        
+    except (SessionDataLost, SessionBusy):
+        raise
+    except Exception as e:
+        logger.error(f"Error undoing ROI edit: {str(e)}")
+        return jsonify({"error": "Failed to undo ROI edit"}), 500
+
+@roi_bp.route('/export_nifti', methods=['GET'])
+@jwt_required()
+def export_roi_nifti():
+    """Export an ROI (with its edits) as NIfTI on the grid and affine of its source file."""
+    current_user = get_jwt_identity()
+    user_id = current_user.get('user_id')
+    
+    try:
+        roi_index = int(request.args.get('roi_index', 0))
+    except ValueError:
+        return jsonify({"error": "roi_index must be an integer"}), 400
+    
+    session = get_session(user_id)
+    roi_info = session.get('roi_masks')
+    if not roi_info:
+        return jsonify({"error": "No ROI data loaded"}), 400
+    if roi_index < 0 or roi_index >= len(roi_info):
+        return jsonify({"error": "ROI index out of range"}), 400
+    
+    info = roi_info[roi_index]
+    source_path = os.path.join(get_user_upload_dir(user_id), 'nifti', info['filename'] or '')
+    if not info['filename'] or not os.path.isfile(source_path):
+        return jsonify({"error": "The ROI has no source NIfTI file"}), 400
+    
+    # Binary masks hold 1s; write the source's label value back
+    label_value = None
+    nonzero = [v for v in info['unique_values'] if v]
+    if not info.get('labels') and len(nonzero) == 1 and float(nonzero[0]).is_integer() and 0 < nonzero[0] < 256:
+        label_value = int(nonzero[0])
+    
+    try:
+        mask = session.get_roi_masks([roi_index])[0]['mask']
+        data = encode_roi_nifti(mask, source_path, label_value)
+        
+        gzipped = info['filename'].lower().endswith('.gz')
+        response = send_file(
+            BytesIO(data), mimetype='application/gzip' if gzipped else 'application/octet-stream',
+            as_attachment=True, download_name=info['filename']
+        )
+        response.headers['X-ROI-Digest'] = str(info.get('digest'))
+        return response
+        
+    except SessionDataLost:
+        raise
+    except Exception as e:
+        logger.error(f"Error exporting ROI as NIfTI: {str(e)}")
+        return jsonify({"error": "Failed to export ROI as NIfTI"}), 500
+
+@roi_bp.route('/combine', methods=['POST'])
+@jwt_required()
+def combine_rois():
+    """Derive a new ROI from loaded ones (union, intersection, difference, dilate or erode)."""
+    current_user = get_jwt_identity()
+    user_id = current_user.get('user_id')
+    
+    data = request.get_json() or {}
+    op = data.get('op')
+    if op not in ALGEBRA_OPS:
+        return jsonify({"error": f"Invalid op. Use one of: {', '.join(ALGEBRA_OPS)}"}), 400
+    min_operands, max_operands, needs_margin = ALGEBRA_OPS[op]
+    
+    # Operands are ROI indices, or {"roi": index, "value": label} for one label of a multi-label ROI
+    try:
+        operands = [
+            (int(item['roi']), int(item['value'])) if isinstance(item, dict) else (int(item), None)
+            for item in data.get('rois') or []
+        ]
+        margin = float(data['margin_mm']) if needs_margin else None
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "rois must be ROI indices (or {roi, value}) and margin_mm a number"}), 400
+    if len(operands) < min_operands or (max_operands is not None and len(operands) > max_operands):
+        return jsonify({"error": f"{op} takes {min_operands}{'' if max_operands == min_operands else ' or more'} ROIs"}), 400
+    if needs_margin and not 0 < margin <= 100:
+        return jsonify({"error": "margin_mm must be in (0, 100]"}), 400
+    
+    session = get_session(user_id)
+    fields = session.get_many('dicom_metadata', 'dicom_resampling', 'dicom_series_id', 'dicom_shape', 'roi_masks')
+    roi_info = fields['roi_masks']
+    if not roi_info:
+        return jsonify({"error": "No ROI data loaded"}), 400
+    if any(not 0 <= i < len(roi_info) for i, _ in operands):
+        return jsonify({"error": "ROI index out of range"}), 400
+    
+    if fields['dicom_resampling']:
+        spacing = tuple(fields['dicom_resampling']['spacing'])
+    else:
+        spacing = get_volume_spacing(fields['dicom_metadata'] or {})
+    
+    names = [
+        roi_info[i]['label'] if value is None else
+        next((str(name) for v, name in roi_info[i].get('labels') or [] if v == value), f"{roi_info[i]['label']} = {value}")
+        for i, value in operands
+    ]
+    symbol = {'union': ' + ', 'intersection': ' & ', 'difference': ' - '}.get(op)
+    label = data.get('label') or (symbol.join(names) if symbol else f"{names[0]} {op}d {margin:g} mm")
+    
+    admission = None
+    try:
+        # The result is a full mask like any other ROI
+        nbytes = int(np.prod(fields['dicom_shape']))
+        derived_bytes = sum(nbytes for info in roi_info if info.get('kind') == 'derived') + nbytes
+        admission = admit_load(user_id, 'derived', derived_bytes)
+        
+        # Operands are packed to their bounding boxes, 64 voxels per word
+        indices = sorted({i for i, _ in operands})
+        masks = dict(zip(indices, session.get_roi_masks(indices)))
+        packed = [PackedMask.from_mask(masks[i]['mask'], value) for i, value in operands]
+        result = evaluate(op, packed, margin, spacing)
+        voxels = result.count()
+        with stage('roi_unpack'):
+            mask = result.to_mask()
+        
+        # Register the result as a new ROI, next to the ones it came from
+        series_id = fields['dicom_series_id'] or 'unknown'
+        digest = array_digest(mask)
+        with session.locked('roi_masks'):
+            roi_info = session.get('roi_masks', [])
+            stored = session.get_many(*[f"roi_mask:{i}" for i in range(len(roi_info))])
+            roi_masks = [dict(info, mask=stored[f"roi_mask:{i}"]) for i, info in enumerate(roi_info)]
+            roi_masks.append({
+                'filename': None,
+                'label': label,
+                'kind': 'derived',
+                'unique_values': [0, 1] if voxels else [0],
+                'expression': {'op': op, 'rois': [[i, value] for i, value in operands], 'margin_mm': margin},
+                'digest': digest,
+                'mask': share_array(user_id, f"{series_id}:roi:{digest}", mask)
+            })
+            admission.commit(derived_bytes)
+            session.set_roi_masks(roi_masks)
+        
+        # Cache keys carry the ROI digests, so views of all ROIs miss now;
+        # this only frees this worker's stale copies early
+        get_image_cache().invalidate_user(user_id)
+        get_prefetcher().reset(user_id)
+        
+        box = result.extent()
+        return jsonify({
+            "status": "success",
+            "roi_index": len(roi_masks) - 1,
+            "label": label,
+            "voxels": voxels,
+            "volume_ml": voxels * float(np.prod(spacing)) / 1000,
+            "bounding_box": {"start": box[0], "stop": box[1]} if box else None
+        }), 200
+        
+    except (MemoryBudgetExceeded, SessionDataLost, SessionBusy):
+        if admission is not None:
+            admission.cancel()
+        raise
+    except Exception as e:
+        if admission is not None:
+            admission.cancel()
+        logger.error(f"Error combining ROIs: {str(e)}")
+        return jsonify({"error": "Failed to combine ROIs"}), 500
+
+@roi_bp.route('/cache', methods=['GET'])
+@admin_required()
+def get_mask_cache_stats():
+    """Get statistics of the processed ROI mask cache."""
+    cache = get_mask_cache()
+    if cache is None:
+        return jsonify({"error": "The ROI mask cache is disabled"}), 400
+    return jsonify({"status": "success", "mask_cache": cache.stats()}), 200
+
+@roi_bp.route('/cache', methods=['DELETE'])
+@admin_required()
+def invalidate_mask_cache():
+    """Remove processed ROI masks from the cache (all, or by NIfTI digest and/or grid)."""
+    cache = get_mask_cache()
+    if cache is None:
+        return jsonify({"error": "The ROI mask cache is disabled"}), 400
+    
+    digest = request.args.get('digest')
+    shape = request.args.get('shape')
+    try:
+        shape = [int(n) for n in shape.split('x')] if shape else None
+    except ValueError:
+        return jsonify({"error": "shape must look like 120x512x512"}), 400
+    if digest is not None and not re.fullmatch(r'[0-9a-f]{8,64}', digest):
+        return jsonify({"error": "digest must be a hex SHA-256 (or a prefix of it)"}), 400
+    
+    try:
+        removed = cache.invalidate(digest, shape)
+        return jsonify({"status": "success", "removed": removed}), 200
+    except Exception as e:
+        logger.error(f"Error invalidating ROI mask cache: {str(e)}")
+        return jsonify({"error": "Failed to invalidate ROI mask cache"}), 500
@@ -1,12 +1,27 @@
 import os
+import time
+import shutil
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from werkzeug.utils import secure_filename
 import logging
 
-from app.utils.file_utils import allowed_file, save_uploaded_file, get_user_upload_dir
-from app.utils.dicom_utils import load_dicom_series, extract_dicom_metadata
-from app.api.auth import jwt_required_with_error_handling
+from app.utils.file_utils import (
+    allowed_file,
+    save_uploaded_file,
+    get_user_upload_dir,
+    get_files_in_directory,
+    get_blob_root,
+    get_series_cache_dir,
+    read_series_index,
+    SERIES_CACHE_DIR,
+    STUDIES_DIR
+)
+from app.utils.ingest import ingest_series, get_brick_options
+from app.utils.blob_store import collect_garbage
+from app.utils.brick_store import close_bricks
+from app.utils.dicom_utils import extract_dicom_metadata, get_series_id
+from app.api.auth import jwt_required_with_error_handling, admin_required
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +41,10 @@ def upload_dicom():
     if not files or files[0].filename == '':
         return jsonify({"error": "No files selected"}), 400
     
+    # Files added to a series already ingested only need their own slices decoded
+    dicom_dir = os.path.join(get_user_upload_dir(user_id), 'dicom')
+    previous_series_id = get_series_id(dicom_dir) if get_files_in_directory(dicom_dir) else None
+    
     saved_files = []
     for file in files:
         if not allowed_file(file.filename):
@@ -40,16 +59,22 @@ def upload_dicom():
     
     # Try to load the DICOM series to validate it
     try:
-        user_dir = get_user_upload_dir(user_id)
-        dicom_dir = os.path.join(user_dir, 'dicom')
-        
         # Only try loading if we have enough files (arbitrary threshold)
         if len(saved_files) > 3:
-            volume, metadata = load_dicom_series(dicom_dir)
-            series_info = {
-                "shape": volume.shape,
-                "metadata": metadata
-            }
+            # A series uploaded before (by anyone) is not decoded again
+            cache_dir = get_series_cache_dir(get_series_id(dicom_dir))
+            series_info = read_series_index(cache_dir)
+            if series_info is None:
+                config = current_app.config
+                volume, metadata = ingest_series(
+                    dicom_dir, cache_dir, bricks=config['BRICKS_ENABLED'],
+                    base_dir=get_series_cache_dir(previous_series_id, create=False) if previous_series_id else None,
+                    **get_brick_options(config)
+                )
+                series_info = {
+                    "shape": volume.shape,
+                    "metadata": metadata
+                }
         else:
             # For single files, just read the metadata
             dcm_path = os.path.join(dicom_dir, saved_files[0]['saved_filename'])
@@ -64,6 +89,7 @@ def upload_dicom():
             "status": "success",
             "files": saved_files,
             "count": len(saved_files),
+            "duplicates": sum(1 for f in saved_files if f['deduplicated']),
             "series_info": series_info
         }), 201
     except Exception as e:
@@ -151,4 +177,78 @@ def list_uploads():
         
     except Exception as e:
         logger.error(f"Error listing uploads: {str(e)}")
-        return jsonify({"error": "Internal server error"}), 500
\ No newline at end of file
+        return jsonify({"error": "Internal server error"}), 500
+
+@upload_bp.route('/<kind>', methods=['DELETE'])
+@jwt_required()
+def delete_uploads(kind):
+    """Delete the current user's DICOM or NIfTI files (all, or one by filename)."""
+    if kind not in ('dicom', 'nifti'):
+        return jsonify({"error": "Invalid upload type. Use 'dicom' or 'nifti'"}), 400
+    
+    current_user = get_jwt_identity()
+    user_id = current_user.get('user_id')
+    directory = os.path.join(get_user_upload_dir(user_id), kind)
+    
+    filename = request.args.get('filename')
+    if filename is not None:
+        filename = secure_filename(filename)
+        if not os.path.isfile(os.path.join(directory, filename)):
+            return jsonify({"error": "File not found"}), 404
+        names = [filename]
+    else:
+        names = [f['filename'] for f in get_files_in_directory(directory)]
+    
+    # Only the user's links are removed; the stored content is shared and
+    # reclaimed by garbage collection once nothing references it
+    for name in names:
+        os.remove(os.path.join(directory, name))
+    
+    return jsonify({
+        "status": "success",
+        "deleted": names
+    }), 200
+
+@upload_bp.route('/gc', methods=['POST'])
+@admin_required()
+def collect_upload_garbage():
+    """Remove stored files and series caches that no upload references."""
+    grace_period = current_app.config['BLOB_GC_GRACE_SECONDS']
+    try:
+        blobs = collect_garbage(get_blob_root(), grace_period)
+        
+        # Series ids are derived from the files, so a cache whose series is
+        # no longer in any user's DICOM directory can never be hit again
+        upload_folder = current_app.config['UPLOAD_FOLDER']
+        dicom_dirs = [
+            os.path.join(upload_folder, name, 'dicom')
+            for name in os.listdir(upload_folder) if not name.startswith('_')
+        ]
+        # Studies prepared by preprocess.py stay ready until their directory is removed
+        studies_root = os.path.join(upload_folder, STUDIES_DIR)
+        if os.path.isdir(studies_root):
+            dicom_dirs += [os.path.join(studies_root, name, 'dicom') for name in os.listdir(studies_root)]
+        live_series = set()
+        for dicom_dir in dicom_dirs:
+            if get_files_in_directory(dicom_dir):
+                live_series.add(get_series_id(dicom_dir))
+        
+        series_root = os.path.join(upload_folder, SERIES_CACHE_DIR)
+        removed_series = []
+        cutoff = time.time() - grace_period
+        for series_id in (os.listdir(series_root) if os.path.isdir(series_root) else []):
+            path = os.path.join(series_root, series_id)
+            if series_id not in live_series and os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+                close_bricks(path)
+                removed_series.append(series_id)
+        
+        return jsonify({
+            "status": "success",
+            "blobs": blobs,
+            "series_caches_removed": removed_series
+        }), 200
+    
+    except Exception as e:
+        logger.error(f"Error collecting upload garbage: {str(e)}")
+        return jsonify({"error": "Failed to collect garbage"}), 500
@@ -1,46 +1,191 @@
 import os
+import functools
 import numpy as np
-from flask import Blueprint, request, jsonify, current_app, send_file
+from flask import (
+    Blueprint, Response, request, jsonify, current_app, stream_with_context, copy_current_request_context
+)
 from flask_jwt_extended import jwt_required, get_jwt_identity
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from io import BytesIO
+from time import perf_counter
 import logging
-import json
-from redis import Redis
-from app.config import Config
 
-from app.utils.file_utils import get_user_upload_dir
+from app.utils.file_utils import (
+    get_user_upload_dir,
+    get_series_cache_dir,
+    read_series_index
+)
+from app.utils.ingest import (
+    ingest_series,
+    read_ingested_volume,
+    ensure_bricks,
+    get_bricks_dir,
+    get_brick_options,
+    get_volume_stats
+)
+from app.utils.brick_store import open_bricks
 from app.utils.dicom_utils import (
-    load_dicom_series, 
+    load_isotropic_volume,
+    get_isotropic_info,
+    get_window_presets,
+    get_series_id, 
+    read_series_header,
     get_dicom_slice, 
     create_slice_image, 
     apply_windowing
 )
 from app.utils.nifti_utils import (
     load_nifti_file, 
-    get_roi_slice, 
-    create_roi_overlay_image
+    get_roi_overlay_layers,
+    create_roi_overlay_image,
+    ROI_COLORS
 )
+from app.utils.roi_edit import roi_slice_version
+from app.utils.overlay_kernel import get_overlay_kernel
+from app.utils.tiles import pyramid_levels, tile_bounds, read_tile, read_tile_layers, render_tile
+from app.utils.render_pool import render_image, get_render_pool, RenderQueueFull, RenderTimeout
+from app.utils.cine import stream_cine, CINE_FORMATS
+from app.utils.image_cache import get_image_cache
+from app.utils.prefetch import get_prefetcher
+from app.utils.session_store import get_session
+from app.utils.shared_volumes import get_shared_volumes, share_array, release_array, SessionDataLost
+from app.utils.memory_governor import admit_load, estimate_volume_bytes, MemoryBudgetExceeded
+from app.utils.timing import stage
+from app.utils.metrics import get_metrics, SLICE_COUNT_BUCKETS
 
 logger = logging.getLogger(__name__)
 
-redis_client = Redis.from_url(Config.REDIS_URL)
+viewer_bp = Blueprint('viewer', __name__)
+
+WINDOWED_RANGE = (0.0, 1.0)  # Value range of a slice after apply_windowing
 
-def get_session_data(user_id):
-    """Redisからセッションデータを取得"""
-    data = redis_client.get(f"session:{user_id}")
-    return json.loads(data) if data else {}
+def get_request_window(session):
+    """
+    Window center and width for a request: ``window_center`` and
+    ``window_width`` if given, else the ``window_preset`` (or the default
+    preset) of the loaded volume.
+    
+    Raises:
+        ValueError: If the preset is unknown.
+    """
+    window_center = request.args.get('window_center')
+    window_width = request.args.get('window_width')
+    
+    if window_center is None or window_width is None:
+        fields = session.get_many('dicom_metadata', 'dicom_stats')
+        presets, default = get_window_presets(fields['dicom_metadata'] or {}, fields['dicom_stats'])
+        name = request.args.get('window_preset') or default
+        if name not in presets:
+            raise ValueError(f"Unknown window preset: {name}. Use one of: {', '.join(presets)}")
+        preset = presets[name]
+        if window_center is None:
+            window_center = preset['window_center']
+        if window_width is None:
+            window_width = preset['window_width']
+    
+    return float(window_center), float(window_width)
 
-def set_session_data(user_id, data):
-    """Redisにセッションデータを保存"""
-    redis_client.setex(
-        f"session:{user_id}",
-        Config.SESSION_TIMEOUT,
-        json.dumps(data)
+def image_version_for(session, axis, roi_indices=None):
+    """
+    Map a slice index to the version of what its image shows, for cache keys.
+    
+    The image cache is per process, so invalidating it only reaches the
+    worker that changed the session. Keys carry the series id and, for
+    overlays, the label and slice version (see ``roi_slice_version``) of
+    every visible ROI instead, so no worker serves an image of a volume or
+    ROI slice that has since changed, while an ROI edit leaves the images
+    of the slices it did not touch valid.
+    
+    Args:
+        session (UserSession): The user's session.
+        axis (int): The axis of the view.
+        roi_indices (list, optional): Indices of the overlaid ROIs (empty
+            for all of them); None for images without overlays.
+    """
+    series_id = session.get('dicom_series_id')
+    if roi_indices is None:
+        return lambda index: (series_id,)
+    roi_info = session.get('roi_masks', [])
+    visible = [roi_info[i] for i in (roi_indices or range(len(roi_info))) if 0 <= i < len(roi_info)]
+    return lambda index: (series_id,) + tuple(
+        (info.get('label'), roi_slice_version(info, axis, index)) for info in visible
     )
 
-viewer_bp = Blueprint('viewer', __name__)
+def combined_view_job(session, axis, window_center, window_width, roi_indices=None):
+    """
+    Map a slice index to the render job of a combined (DICOM + ROI overlay) view.
+    
+    The volume and masks are resolved by the first job, so requests served
+    from the image cache never decode or attach them.
+    """
+    kernel = get_overlay_kernel()
+    dicom_volume = functools.cache(lambda: session.get_array('dicom_volume'))
+    roi_masks = functools.cache(lambda: session.get_roi_masks(roi_indices or None))
+    
+    def job_for(index):
+        # Prepare ROI slices if available
+        roi_slices, roi_names = get_roi_overlay_layers(roi_masks(), index, axis)
+        
+        # The fused kernel windows the raw slice itself
+        if roi_slices and kernel is not None:
+            dicom_slice = get_dicom_slice(dicom_volume(), index, axis)
+            return create_roi_overlay_image, (
+                dicom_slice, roi_slices, roi_names, None, 0.5, None, (window_center, window_width), kernel
+            )
+        
+        # Get DICOM slice
+        dicom_slice = get_dicom_slice(dicom_volume(), index, axis, window_center, window_width)
+        
+        # Create combined view
+        if roi_slices:
+            return create_roi_overlay_image, (dicom_slice, roi_slices, roi_names, None, 0.5, WINDOWED_RANGE)
+        return create_slice_image, (dicom_slice, None, None, 'gray', WINDOWED_RANGE)
+    return job_for
+
+def image_key_for(user_id, kind, view, settings, version_for):
+    """Map a slice index to its image cache key."""
+    return lambda index: (user_id, kind, view, index) + settings + version_for(index)
+
+def send_rendered_slice(user_id, kind, view, slice_index, num_slices, settings, version_for, job_for, prefetch=True):
+    """
+    Serve a rendered slice from the image cache, rendering it on a miss,
+    and let the prefetcher render the slices ahead of the cursor once the
+    response has been sent.
+    
+    Args:
+        user_id (str): The user id.
+        kind (str): The kind of image (used to namespace cache keys).
+        view (str): The view name.
+        slice_index (int): The requested slice index.
+        num_slices (int): Number of slices along the view's axis.
+        settings (tuple): Hashable window/ROI settings of the request.
+        version_for (callable): Maps a slice index to the version of its
+            contents (see ``image_version_for``).
+        job_for (callable): Maps a slice index to ``(fn, args)`` for the render pool.
+        prefetch (bool, optional): Track navigation and prefetch ahead.
+    """
+    cache = get_image_cache()
+    prefetcher = get_prefetcher()
+    key_for = image_key_for(user_id, kind, view, settings, version_for)
+    
+    with stage('cache'):
+        image_data, prefetched = cache.get(key_for(slice_index))
+    if image_data is None:
+        fn, args = job_for(slice_index)
+        image_data = render_image(fn, *args)
+        cache.put(key_for(slice_index), image_data)
+    
+    # A plain response rather than send_file, whose passthrough body would
+    # skip the close callbacks
+    response = Response(image_data, mimetype='image/png')
+    if prefetch:
+        prefetcher.observe(user_id, view, slice_index, settings, prefetch_hit=prefetched)
+        if prefetcher.enabled:
+            # Preparing the jobs slices (and may decode) the volume, so it
+            # waits until the response has been sent
+            response.call_on_close(copy_current_request_context(
+                functools.partial(prefetcher.schedule, user_id, num_slices, key_for, job_for)
+            ))
+    
+    return response
 
 @viewer_bp.route('/load_dicom', methods=['POST'])
 @jwt_required()
@@ -57,25 +202,135 @@ def load_dicom():
     if not os.path.exists(dicom_dir) or not os.listdir(dicom_dir):
         return jsonify({"error": "No DICOM files found"}), 400
     
+    config = current_app.config
+    storage = data.get('storage', config['VOLUME_STORAGE'])
+    if storage not in ('memory', 'bricks'):
+        return jsonify({"error": "Invalid storage. Use 'memory' or 'bricks'"}), 400
+    
+    admission = None
     try:
-        # Load DICOM volume
-        dicom_volume, dicom_metadata = load_dicom_series(dicom_dir)
-        
-        # セッションデータを保存
-        session_data = get_session_data(user_id)
-        session_data.update({
-            'dicom_volume': dicom_volume.tolist(),  # numpy arrayをリストに変換
-            'dicom_metadata': dicom_metadata
+        series_id = get_series_id(dicom_dir)
+        cache_dir = get_series_cache_dir(series_id)
+        isotropic = data.get('isotropic', config['RESAMPLE_ISOTROPIC'])
+        spacing = data.get('spacing') or config['RESAMPLE_SPACING']
+        
+        # Identical uploads share the series id, so a series already decoded
+        # by any user is served from its index and the shared volume or bricks
+        dicom_volume = None
+        resampling = None
+        index = read_series_index(cache_dir)
+        registry = get_shared_volumes()
+        
+        # Reserve memory for the load before decoding anything (estimated from the headers)
+        if index is not None:
+            header_shape, header_metadata = index['shape'], index['metadata']
+        else:
+            header_shape, header_metadata = read_series_header(dicom_dir)
+        peak_bytes, resident_bytes = estimate_volume_bytes(
+            header_shape, header_metadata, isotropic, spacing, storage
+        )
+        admission = admit_load(user_id, 'volume', peak_bytes)
+        
+        if index is not None:
+            dicom_metadata = index['metadata']
+            variant = ''
+            if isotropic:
+                resampling = get_isotropic_info(index['shape'], dicom_metadata, spacing)
+                variant = f"-iso{resampling['spacing'][0]:g}"
+            if storage == 'bricks':
+                dicom_volume = open_bricks(get_bricks_dir(cache_dir, variant), config['BRICK_CACHE_BYTES'])
+            elif registry is not None:
+                dicom_volume = registry.attach(f"{series_id}{variant}:volume")
+        
+        if dicom_volume is None:
+            raw_volume = read_ingested_volume(cache_dir) if index is not None else None
+            if raw_volume is None:
+                # Slices added to the series already loaded are decoded on their own
+                base_dir = base_volume = None
+                previous_series_id = (get_session(user_id).get('dicom_series_id') or '').split('-')[0]
+                if previous_series_id and previous_series_id != series_id:
+                    base_dir = get_series_cache_dir(previous_series_id, create=False)
+                    if registry is not None:
+                        base_volume = registry.attach(f"{previous_series_id}:volume")
+                
+                # Load DICOM volume
+                load_start = perf_counter()
+                raw_volume, dicom_metadata = ingest_series(
+                    dicom_dir, cache_dir, bricks=config['BRICKS_ENABLED'],
+                    base_dir=base_dir, base_volume=base_volume, **get_brick_options(config)
+                )
+                
+                metrics = get_metrics()
+                if metrics is not None:
+                    pipe = metrics.redis.pipeline(transaction=False)
+                    metrics.observe('dicom_load_duration_seconds', perf_counter() - load_start, pipe=pipe)
+                    metrics.observe('dicom_load_slices', raw_volume.shape[0], buckets=SLICE_COUNT_BUCKETS, pipe=pipe)
+                    pipe.execute()
+            
+            dicom_volume = raw_volume
+            variant = ''
+            # Optionally resample to isotropic voxels so MPR views keep their aspect ratio
+            if isotropic:
+                dicom_volume, resampling = load_isotropic_volume(
+                    raw_volume, dicom_metadata, cache_dir, series_id,
+                    spacing=spacing,
+                    order=config['RESAMPLE_ORDER'],
+                    slab_size=config['RESAMPLE_SLAB_SIZE'],
+                    workers=config['RESAMPLE_WORKERS']
+                )
+                variant = f"-iso{resampling['spacing'][0]:g}"
+            
+            if storage == 'bricks':
+                bricks_dir = get_bricks_dir(cache_dir, variant)
+                ensure_bricks(dicom_volume, bricks_dir, **get_brick_options(config))
+                dicom_volume = open_bricks(bricks_dir, config['BRICK_CACHE_BYTES'])
+        
+        # Histogram, percentiles and per-slice ranges, computed once per volume
+        stats = get_volume_stats(dicom_volume, cache_dir, variant)
+        histogram = stats.pop('histogram')
+        window_presets, default_preset = get_window_presets(dicom_metadata, stats)
+        
+        # Everything derived from the volume (masks, labels) lives on its grid
+        series_id = f"{series_id}{variant}"
+        
+        # Publish the volume to the other workers (or point them at its bricks) and save the session
+        if storage == 'bricks':
+            volume_ref = {'bricks': dicom_volume.directory}
+        else:
+            volume_ref = share_array(user_id, f"{series_id}:volume", dicom_volume)
+        session = get_session(user_id)
+        release_array(user_id, session.get('dicom_volume'))
+        admission.commit(resident_bytes)
+        session.update({
+            'dicom_volume': volume_ref,
+            'dicom_series_id': series_id,
+            'dicom_shape': list(dicom_volume.shape),
+            'dicom_metadata': dicom_metadata,
+            'dicom_resampling': resampling,
+            'dicom_stats': stats,
+            'dicom_histogram': histogram
         })
-        set_session_data(user_id, session_data)
+        
+        # Cache keys carry the series id, so no worker serves images of the
+        # previous volume; this only frees this worker's copies early
+        get_image_cache().invalidate_user(user_id)
+        get_prefetcher().reset(user_id)
         
         return jsonify({
             "status": "success",
             "dicom_shape": dicom_volume.shape,
-            "dicom_metadata": dicom_metadata
+            "dicom_metadata": dicom_metadata,
+            "resampling": resampling,
+            "storage": storage,
+            "window_presets": window_presets,
+            "default_window_preset": default_preset
         }), 200
         
+    except MemoryBudgetExceeded:
+        raise
     except Exception as e:
+        if admission is not None:
+            admission.cancel()
         logger.error(f"Error loading DICOM data: {str(e)}")
         return jsonify({"error": "Failed to load DICOM data"}), 500
 
@@ -86,42 +341,42 @@ def get_slice():
     current_user = get_jwt_identity()
     user_id = current_user.get('user_id')
     
-    if user_id not in SESSION_DATA or 'dicom_volume' not in SESSION_DATA[user_id]:
+    session = get_session(user_id)
+    dicom_shape = session.get('dicom_shape')
+    if dicom_shape is None:
         return jsonify({"error": "No DICOM data loaded. Please load DICOM data first."}), 400
     
     view = request.args.get('view', 'axial')
-    slice_index = int(request.args.get('slice_index', 0))
-    window_center = request.args.get('window_center')
-    window_width = request.args.get('window_width')
-    
-    # Convert window parameters to float if provided
-    if window_center is not None:
-        window_center = float(window_center)
-    else:
-        # Use default from metadata if available
-        window_center = SESSION_DATA[user_id]['dicom_metadata'].get('WindowCenter', 40)
-    
-    if window_width is not None:
-        window_width = float(window_width)
-    else:
-        # Use default from metadata if available
-        window_width = SESSION_DATA[user_id]['dicom_metadata'].get('WindowWidth', 400)
     
     # Map view to axis
     axis_map = {'axial': 0, 'coronal': 1, 'sagittal': 2}
     axis = axis_map.get(view, 0)
     
-    dicom_volume = SESSION_DATA[user_id]['dicom_volume']
-    
     try:
+        slice_index = int(request.args.get('slice_index', 0))
+        window_center, window_width = get_request_window(session)
+        if not 0 <= slice_index < dicom_shape[axis]:
+            raise ValueError(f"slice_index must be in [0, {dicom_shape[axis] - 1}]")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # Resolved by the first render job only, so cache hits never decode the volume
+    dicom_volume = functools.cache(lambda: session.get_array('dicom_volume'))
+    
+    def job_for(index):
         # Get dicom slice
-        dicom_slice = get_dicom_slice(dicom_volume, slice_index, axis, window_center, window_width)
-        
+        dicom_slice = get_dicom_slice(dicom_volume(), index, axis, window_center, window_width)
+        return create_slice_image, (dicom_slice, None, None, 'gray', WINDOWED_RANGE)
+    
+    try:
         # Create and return the image
-        image_data = create_slice_image(dicom_slice, window_center, window_width)
-        
-        return send_file(BytesIO(image_data), mimetype='image/png')
+        return send_rendered_slice(
+            user_id, 'slice', view, slice_index, dicom_shape[axis],
+            (window_center, window_width), image_version_for(session, axis), job_for
+        )
         
+    except (RenderQueueFull, RenderTimeout, SessionDataLost):
+        raise
     except Exception as e:
         logger.error(f"Error creating slice image: {str(e)}")
         return jsonify({"error": f"Error creating slice image: {str(e)}"}), 500
@@ -133,25 +388,55 @@ def get_metadata():
     current_user = get_jwt_identity()
     user_id = current_user.get('user_id')
     
-    if user_id not in SESSION_DATA:
+    session = get_session(user_id)
+    fields = session.get_many('dicom_metadata', 'dicom_shape', 'dicom_resampling', 'dicom_stats', 'roi_masks')
+    
+    if all(value is None for value in fields.values()):
         return jsonify({"error": "No data loaded. Please load data first."}), 400
     
     result = {"status": "success"}
     
-    if 'dicom_metadata' in SESSION_DATA[user_id]:
-        result["dicom_metadata"] = SESSION_DATA[user_id]["dicom_metadata"]
+    if fields['dicom_metadata'] is not None:
+        result["dicom_metadata"] = fields["dicom_metadata"]
+    
+    if fields['dicom_shape'] is not None:
+        result["dicom_shape"] = fields["dicom_shape"]
+    
+    if fields['dicom_resampling'] is not None:
+        result["resampling"] = fields["dicom_resampling"]
     
-    if 'dicom_volume' in SESSION_DATA[user_id]:
-        result["dicom_shape"] = SESSION_DATA[user_id]["dicom_volume"].shape
+    if fields['dicom_metadata'] is not None:
+        stats = fields['dicom_stats']
+        result["window_presets"], result["default_window_preset"] = \
+            get_window_presets(fields['dicom_metadata'], stats)
+        if stats is not None:
+            result["statistics"] = {key: stats[key] for key in ('min', 'max', 'mean', 'std', 'percentiles')}
+            if request.args.get('histogram', 'false').lower() == 'true':
+                result["statistics"]["histogram"] = {
+                    "range": stats['histogram_range'],
+                    "counts": session.get('dicom_histogram').tolist()
+                }
     
-    if 'roi_masks' in SESSION_DATA[user_id]:
+    if fields['roi_masks'] is not None:
         roi_info = []
-        for mask in SESSION_DATA[user_id]["roi_masks"]:
-            roi_info.append({
+        for mask in fields["roi_masks"]:
+            info = {
                 'filename': mask['filename'],
                 'label': mask['label'],
                 'unique_values': mask['unique_values']
-            })
+            }
+            if mask.get('labels'):
+                # Multi-label ROI (e.g. tissue classification): [value, name] pairs
+                info['kind'] = mask.get('kind')
+                info['labels'] = mask['labels']
+            if mask.get('expression'):
+                # Derived by POST /api/roi/combine
+                info['kind'] = mask.get('kind')
+                info['expression'] = mask['expression']
+            if mask.get('voxels') is not None:
+                # Edited ROI: voxel count per label value
+                info['voxels'] = mask['voxels']
+            roi_info.append(info)
         result["roi_info"] = roi_info
     
     return jsonify(result), 200
@@ -163,30 +448,25 @@ def get_combined_view():
     current_user = get_jwt_identity()
     user_id = current_user.get('user_id')
     
-    if user_id not in SESSION_DATA:
-        return jsonify({"error": "No data loaded"}), 400
-    
-    if 'dicom_volume' not in SESSION_DATA[user_id]:
+    session = get_session(user_id)
+    dicom_shape = session.get('dicom_shape')
+    if dicom_shape is None:
         return jsonify({"error": "No DICOM data loaded"}), 400
     
     view = request.args.get('view', 'axial')
-    slice_index = int(request.args.get('slice_index', 0))
-    window_center = request.args.get('window_center')
-    window_width = request.args.get('window_width')
     visible_rois = request.args.get('visible_rois')
     
-    # Convert window parameters to float if provided
-    if window_center is not None:
-        window_center = float(window_center)
-    else:
-        # Use default from metadata if available
-        window_center = SESSION_DATA[user_id]['dicom_metadata'].get('WindowCenter', 40)
+    # Map view to axis
+    axis_map = {'axial': 0, 'coronal': 1, 'sagittal': 2}
+    axis = axis_map.get(view, 0)
     
-    if window_width is not None:
-        window_width = float(window_width)
-    else:
-        # Use default from metadata if available
-        window_width = SESSION_DATA[user_id]['dicom_metadata'].get('WindowWidth', 400)
+    try:
+        slice_index = int(request.args.get('slice_index', 0))
+        window_center, window_width = get_request_window(session)
+        if not 0 <= slice_index < dicom_shape[axis]:
+            raise ValueError(f"slice_index must be in [0, {dicom_shape[axis] - 1}]")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     # Parse visible ROIs list if provided
     visible_roi_indices = []
@@ -196,43 +476,220 @@ def get_combined_view():
         except ValueError:
             pass
     
+    # Filter by visible ROIs if specified
+    job_for = combined_view_job(session, axis, window_center, window_width, visible_roi_indices)
+    
+    try:
+        return send_rendered_slice(
+            user_id, 'combined', view, slice_index, dicom_shape[axis],
+            (window_center, window_width, tuple(visible_roi_indices)),
+            image_version_for(session, axis, visible_roi_indices), job_for
+        )
+        
+    except (RenderQueueFull, RenderTimeout, SessionDataLost):
+        raise
+    except Exception as e:
+        logger.error(f"Error creating combined view: {str(e)}")
+        return jsonify({"error": f"Error creating combined view: {str(e)}"}), 500
+
+@viewer_bp.route('/tile_info', methods=['GET'])
+@jwt_required()
+def get_tile_info():
+    """Get the tile pyramid of a view."""
+    current_user = get_jwt_identity()
+    user_id = current_user.get('user_id')
+    
+    session = get_session(user_id)
+    dicom_shape = session.get('dicom_shape')
+    if dicom_shape is None:
+        return jsonify({"error": "No DICOM data loaded"}), 400
+    
+    view = request.args.get('view', 'axial')
+    
     # Map view to axis
     axis_map = {'axial': 0, 'coronal': 1, 'sagittal': 2}
     axis = axis_map.get(view, 0)
+    plane_shape = [n for i, n in enumerate(dicom_shape) if i != axis]
+    tile_size = current_app.config['TILE_SIZE']
+    
+    return jsonify({
+        "view": view,
+        "num_slices": dicom_shape[axis],
+        "width": plane_shape[1],
+        "height": plane_shape[0],
+        "tile_size": tile_size,
+        "levels": pyramid_levels(plane_shape, tile_size)
+    }), 200
+
+@viewer_bp.route('/get_tile', methods=['GET'])
+@jwt_required()
+def get_tile():
+    """Get one tile of a slice at a pyramid level, optionally with ROI overlays."""
+    current_user = get_jwt_identity()
+    user_id = current_user.get('user_id')
     
-    dicom_volume = SESSION_DATA[user_id]['dicom_volume']
+    session = get_session(user_id)
+    dicom_shape = session.get('dicom_shape')
+    if dicom_shape is None:
+        return jsonify({"error": "No DICOM data loaded"}), 400
+    
+    view = request.args.get('view', 'axial')
+    overlay = request.args.get('overlay', 'false').lower() == 'true'
+    visible_rois = request.args.get('visible_rois')
+    
+    # Map view to axis
+    axis_map = {'axial': 0, 'coronal': 1, 'sagittal': 2}
+    axis = axis_map.get(view, 0)
+    num_slices = dicom_shape[axis]
+    plane_shape = [n for i, n in enumerate(dicom_shape) if i != axis]
+    tile_size = current_app.config['TILE_SIZE']
     
     try:
-        # Get DICOM slice
-        dicom_slice = get_dicom_slice(dicom_volume, slice_index, axis, window_center, window_width)
-        
-        # Prepare ROI slices if available
-        roi_slices = []
-        roi_names = []
-        
-        if 'roi_masks' in SESSION_DATA[user_id]:
-            roi_masks = SESSION_DATA[user_id]['roi_masks']
-            
-            # Filter by visible ROIs if specified
-            if visible_roi_indices:
-                filtered_masks = [roi_masks[idx] for idx in visible_roi_indices if idx < len(roi_masks)]
-            else:
-                filtered_masks = roi_masks
-            
-            for roi_mask in filtered_masks:
-                roi_data = roi_mask['mask']
-                roi_slice = get_roi_slice(roi_data, slice_index, axis)
-                roi_slices.append(roi_slice)
-                roi_names.append(roi_mask['label'])
-        
-        # Create combined view
-        if roi_slices:
-            image_data = create_roi_overlay_image(dicom_slice, roi_slices, roi_names)
-        else:
-            image_data = create_slice_image(dicom_slice, window_center, window_width)
-        
-        return send_file(BytesIO(image_data), mimetype='image/png')
+        slice_index = int(request.args.get('slice_index', 0))
+        level = int(request.args.get('level', 0))
+        tx = int(request.args.get('tx', 0))
+        ty = int(request.args.get('ty', 0))
+        visible_roi_indices = [int(idx) for idx in visible_rois.split(',')] if visible_rois else []
+        window_center, window_width = get_request_window(session)
+        if not 0 <= slice_index < num_slices:
+            raise ValueError(f"slice_index must be in [0, {num_slices - 1}]")
+        bounds = tile_bounds(plane_shape, tile_size, level, tx, ty)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid tile parameters: {str(e)}"}), 400
+    factor = 2 ** level
+    
+    # Resolved by the first render job only, so cache hits never decode the volume
+    dicom_volume = functools.cache(lambda: session.get_array('dicom_volume'))
+    roi_masks = functools.cache(lambda: session.get_roi_masks(visible_roi_indices or None) if overlay else [])
+    kernel = get_overlay_kernel() or 'numpy'
+    
+    def job_for(index):
+        image = read_tile(dicom_volume(), axis, index, bounds, factor)
+        layers, _ = read_tile_layers(roi_masks(), axis, index, bounds, factor)
+        return render_tile, (image, layers, (window_center, window_width), ROI_COLORS, 0.5, kernel)
+    
+    # Tiles of one viewport arrive together, so they skip the slice prefetcher
+    # (each would reset the navigation state of the others)
+    kind = 'combined_tile' if overlay else 'tile'
+    settings = (level, tx, ty, window_center, window_width)
+    if overlay:
+        settings += (tuple(visible_roi_indices),)
+    version_for = image_version_for(session, axis, visible_roi_indices if overlay else None)
+    
+    try:
+        return send_rendered_slice(
+            user_id, kind, view, slice_index, num_slices, settings, version_for, job_for, prefetch=False
+        )
         
+    except (RenderQueueFull, RenderTimeout, SessionDataLost):
+        raise
     except Exception as e:
-        logger.error(f"Error creating combined view: {str(e)}")
-        return jsonify({"error": f"Error creating combined view: {str(e)}"}), 500
\ No newline at end of file
+        logger.error(f"Error creating tile: {str(e)}")
+        return jsonify({"error": f"Error creating tile: {str(e)}"}), 500
+
+@viewer_bp.route('/cine', methods=['GET'])
+@jwt_required()
+def export_cine():
+    """Stream a range of combined views as an animation (APNG or GIF)."""
+    current_user = get_jwt_identity()
+    user_id = current_user.get('user_id')
+    
+    session = get_session(user_id)
+    dicom_shape = session.get('dicom_shape')
+    if dicom_shape is None:
+        return jsonify({"error": "No DICOM data loaded"}), 400
+    
+    view = request.args.get('view', 'axial')
+    fmt = request.args.get('format', 'apng')
+    visible_rois = request.args.get('visible_rois')
+    if fmt not in CINE_FORMATS:
+        return jsonify({"error": f"Invalid format. Use one of: {', '.join(CINE_FORMATS)}"}), 400
+    
+    # Map view to axis
+    axis_map = {'axial': 0, 'coronal': 1, 'sagittal': 2}
+    axis = axis_map.get(view, 0)
+    num_slices = dicom_shape[axis]
+    
+    try:
+        start = int(request.args.get('start', 0))
+        stop = int(request.args.get('stop', num_slices - 1))  # Inclusive
+        step = int(request.args.get('step', 1))
+        fps = float(request.args.get('fps', 10))
+        loop = int(request.args.get('loop', 0))
+        max_size = int(request.args.get('max_size', 0)) or None
+        visible_roi_indices = [int(idx) for idx in visible_rois.split(',')] if visible_rois else []
+        window_center, window_width = get_request_window(session)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid cine parameters: {str(e)}"}), 400
+    
+    if not (0 <= start < num_slices and 0 <= stop < num_slices and step != 0):
+        return jsonify({"error": "start and stop must be slice indices and step non-zero"}), 400
+    if not 0 < fps <= 60 or loop < 0:
+        return jsonify({"error": "fps must be in (0, 60] and loop non-negative"}), 400
+    
+    indices = list(range(start, stop + (1 if step > 0 else -1), step))
+    if not indices:
+        return jsonify({"error": "The slice range is empty"}), 400
+    if len(indices) > current_app.config['CINE_MAX_FRAMES']:
+        return jsonify({"error": f"At most {current_app.config['CINE_MAX_FRAMES']} frames per export"}), 400
+    
+    job_for = combined_view_job(session, axis, window_center, window_width, visible_roi_indices)
+    
+    # Frames already rendered for the combined view are reused; the rest are
+    # rendered in parallel, in order, a bounded number ahead of the encoder
+    cache = get_image_cache()
+    settings = (window_center, window_width, tuple(visible_roi_indices))
+    key_for = image_key_for(
+        user_id, 'combined', view, settings, image_version_for(session, axis, visible_roi_indices)
+    )
+    cached = {}
+    for index in indices:
+        image_data, _ = cache.get(key_for(index))
+        if image_data is not None:
+            cached[index] = image_data
+    
+    pool = get_render_pool()
+    rendered = pool.imap(
+        (job_for(index) for index in indices if index not in cached),
+        window=pool.max_workers + 1
+    )
+    
+    def frames():
+        for index in indices:
+            yield cached.pop(index) if index in cached else next(rendered)
+    
+    mimetype, extension = CINE_FORMATS[fmt]
+    stream = stream_cine(fmt, frames(), len(indices), fps, loop, max_size)
+    try:
+        # Render the first frame now so errors (and a full render queue) still get a status code
+        first = next(stream)
+    except (RenderQueueFull, RenderTimeout, SessionDataLost):
+        raise
+    except Exception as e:
+        logger.error(f"Error exporting cine: {str(e)}")
+        return jsonify({"error": f"Error exporting cine: {str(e)}"}), 500
+    
+    def body():
+        yield first
+        try:
+            yield from stream
+        except Exception as e:
+            # The status line is gone; the client sees a truncated file
+            logger.error(f"Error streaming cine: {str(e)}")
+    
+    response = Response(stream_with_context(body()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = (
+        f'attachment; filename="{view}_{indices[0]}-{indices[-1]}.{extension}"'
+    )
+    response.headers['X-Cine-Frames'] = str(len(indices))
+    return response
+
+@viewer_bp.route('/prefetch_stats', methods=['GET'])
+@jwt_required()
+def get_prefetch_stats():
+    """Get prefetch and rendered-image cache statistics of this worker."""
+    return jsonify({
+        "status": "success",
+        "prefetch": get_prefetcher().stats(),
+        "image_cache": get_image_cache().stats()
+    }), 200
\ No newline at end of file
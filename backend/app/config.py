@@ -11,10 +11,97 @@ class Config:
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
     MAX_CONTENT_LENGTH = 1024 * 1024 * 1024  # 1GB max upload size
     ALLOWED_EXTENSIONS = {'dcm', 'nii', 'nii.gz'}
+    # Unreferenced uploads and series caches younger than this survive garbage collection
+    BLOB_GC_GRACE_SECONDS = int(os.getenv('BLOB_GC_GRACE_SECONDS', 3600))
     
     # Redis設定を追加
     REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
     SESSION_TIMEOUT = 3600  # セッションの有効期限（秒）
+    REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 32))  # Per worker process
+    
+    # Volumes and masks shared between worker processes
+    SHARED_VOLUMES_ENABLED = os.getenv('SHARED_VOLUMES_ENABLED', 'true').lower() == 'true'
+    SHARED_VOLUME_BUDGET_BYTES = int(os.getenv('SHARED_VOLUME_BUDGET_BYTES', 4 * 1024 ** 3))
+    SHARED_VOLUME_SWEEP_INTERVAL = 60  # Seconds between checks for expired sessions
+    
+    # Memory admission control for volume and ROI loads, estimated from the file headers.
+    # Over budget, sessions idle this long are evicted (LRU), then loads wait, then get a 503.
+    MEMORY_ADMISSION_ENABLED = os.getenv('MEMORY_ADMISSION_ENABLED', 'true').lower() == 'true'
+    MEMORY_BUDGET_BYTES = int(os.getenv('MEMORY_BUDGET_BYTES', 8 * 1024 ** 3))  # All sessions; 0 = unlimited
+    MEMORY_USER_BUDGET_BYTES = int(os.getenv('MEMORY_USER_BUDGET_BYTES', 2 * 1024 ** 3))  # Per user; 0 = unlimited
+    MEMORY_EVICT_IDLE_SECONDS = int(os.getenv('MEMORY_EVICT_IDLE_SECONDS', 600))
+    MEMORY_QUEUE_TIMEOUT = float(os.getenv('MEMORY_QUEUE_TIMEOUT', 10))  # Seconds a load may wait for memory
+    
+    # Rendering pool (per gunicorn worker). 0 workers renders inline.
+    # By default the cores are shared out between the GUNICORN_WORKERS pools.
+    RENDER_POOL_SIZE = int(os.getenv(
+        'RENDER_POOL_SIZE', max((os.cpu_count() or 1) // int(os.getenv('GUNICORN_WORKERS', 1)), 1)
+    ))
+    RENDER_QUEUE_DEPTH = int(os.getenv('RENDER_QUEUE_DEPTH', 16))  # Jobs waiting beyond the pool size before 429
+    RENDER_POOL_START_METHOD = os.getenv('RENDER_POOL_START_METHOD', 'spawn')
+    RENDER_TIMEOUT = 30  # Seconds to wait for a single render job
+    # ROI overlays: fused window + colorize + blend kernel, 'numba' (numpy if numba is
+    # not installed), 'numpy', or 'off' for the step-by-step apply_roi_overlay path
+    OVERLAY_KERNEL = os.getenv('OVERLAY_KERNEL', 'numba')
+    # Compiled numba kernels, shared by all workers and restarts (empty compiles in every process)
+    NUMBA_CACHE_DIR = os.getenv('NUMBA_CACHE_DIR', os.path.join(os.path.dirname(basedir), 'logs', 'numba'))
+    
+    # Share of requests that get per-stage timings (Server-Timing header + timing log)
+    TIMING_SAMPLE_RATE = float(os.getenv('TIMING_SAMPLE_RATE', 1.0))
+    
+    # Optional isotropic resampling at load time (also per request: {"isotropic": true})
+    RESAMPLE_ISOTROPIC = os.getenv('RESAMPLE_ISOTROPIC', 'false').lower() == 'true'
+    RESAMPLE_SPACING = float(os.getenv('RESAMPLE_SPACING', 0)) or None  # mm; None = finest spacing of the series
+    RESAMPLE_ORDER = 1  # Linear interpolation for intensities (masks always use nearest)
+    RESAMPLE_SLAB_SIZE = 32  # Output slices resampled at once
+    RESAMPLE_WORKERS = int(os.getenv('RESAMPLE_WORKERS', min(4, os.cpu_count() or 1)))
+    
+    # Chunked, compressed brick storage written when a series is ingested.
+    # VOLUME_STORAGE 'bricks' serves slices from it instead of holding the volume in memory.
+    BRICKS_ENABLED = os.getenv('BRICKS_ENABLED', 'true').lower() == 'true'
+    BRICK_SIZE = int(os.getenv('BRICK_SIZE', 64))
+    BRICK_CODEC = os.getenv('BRICK_CODEC', 'zlib')  # none, zlib or lz4 (if installed)
+    BRICK_LEVEL = int(os.getenv('BRICK_LEVEL', 1))
+    # Decompressed bricks, per open store; a worker keeps brick_store.MAX_OPEN_READERS stores open
+    BRICK_CACHE_BYTES = int(os.getenv('BRICK_CACHE_BYTES', 128 * 1024 * 1024))
+    VOLUME_STORAGE = os.getenv('VOLUME_STORAGE', 'memory')  # memory or bricks (also per request: {"storage": ...})
+    
+    # ROI masks processed from NIfTI files, kept on disk by file content and target grid
+    MASK_CACHE_ENABLED = os.getenv('MASK_CACHE_ENABLED', 'true').lower() == 'true'
+    MASK_CACHE_MAX_BYTES = int(os.getenv('MASK_CACHE_MAX_BYTES', 2 * 1024 ** 3))  # 0 = unbounded
+    
+    # Vector ROI outlines (GET /api/roi/contours), cached in Redis per ROI, axis and slice
+    CONTOUR_TOLERANCE = 0.5  # Default simplification tolerance in pixels
+    CONTOUR_CACHE_TTL = int(os.getenv('CONTOUR_CACHE_TTL', 3600))
+    
+    # ROI surface meshes (GET /api/roi/mesh), built on the render pool and cached on disk
+    MESH_TIMEOUT = 120  # Seconds to wait for one ROI mesh
+    
+    # Server-side ROI editing (POST /api/roi/edit); undo records are kept in Redis per edited ROI
+    ROI_UNDO_DEPTH = int(os.getenv('ROI_UNDO_DEPTH', 50))
+    
+    # Animated slice-range export (GET /api/viewer/cine)
+    CINE_MAX_FRAMES = int(os.getenv('CINE_MAX_FRAMES', 1000))
+    
+    # Tiled viewport rendering (GET /api/viewer/tile_info, /api/viewer/get_tile)
+    TILE_SIZE = int(os.getenv('TILE_SIZE', 256))  # Tile side in pixels, at every pyramid level
+    
+    # Rendered-image cache and speculative slice prefetch
+    IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+    PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', 'true').lower() == 'true'
+    PREFETCH_LOOKAHEAD = int(os.getenv('PREFETCH_LOOKAHEAD', 2))  # Slices ahead at rest
+    PREFETCH_MAX_LOOKAHEAD = int(os.getenv('PREFETCH_MAX_LOOKAHEAD', 8))
+    PREFETCH_LEAD_TIME = 0.5  # Seconds of navigation at the current velocity to render ahead
+    
+    # Prometheus metrics (GET /metrics). Set a token to require "Authorization: Bearer <token>".
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+    METRICS_SNAPSHOT_INTERVAL = 5  # Seconds between per-worker gauge snapshots
+    
+    # On-demand request profiling (armed by admins through /api/profiling)
+    PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(os.path.dirname(basedir), 'logs', 'profiles'))
+    PROFILE_MAX_CAPTURES = int(os.getenv('PROFILE_MAX_CAPTURES', 50))  # Oldest captures are deleted beyond this
+    PROFILE_MAX_TOKEN_TTL = 3600  # Longest lifetime of a profiling header token (seconds)
 
 class DevelopmentConfig(Config):
     """Development config."""
@@ -27,12 +114,14 @@ class TestingConfig(Config):
     DEBUG = True
     TESTING = True
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'test_uploads')
+    RENDER_POOL_SIZE = 0
 
 class ProductionConfig(Config):
     """Production config."""
     DEBUG = False
     TESTING = False
     UPLOAD_FOLDER = os.path.join(basedir, "..", "uploads", "production")
+    TIMING_SAMPLE_RATE = float(os.getenv('TIMING_SAMPLE_RATE', 0.01))
 
 config_by_name = {
     'development': DevelopmentConfig,
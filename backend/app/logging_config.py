@@ -31,6 +31,18 @@ def configure_logging(app):
     app.logger.addHandler(stream_handler)
     app.logger.setLevel(logging.INFO)
     
+    # Per-request stage timings, one JSON object per line
+    timing_handler = RotatingFileHandler(
+        os.path.join(logs_dir, 'timing.log'),
+        maxBytes=10 * 1024 * 1024,  # 10 MB
+        backupCount=5
+    )
+    timing_handler.setFormatter(logging.Formatter('{"time": "%(asctime)s", "timing": %(message)s}'))
+    timing_logger = logging.getLogger('app.timing')
+    timing_logger.addHandler(timing_handler)
+    timing_logger.setLevel(logging.INFO)
+    timing_logger.propagate = False
+    
     # Set level for specific loggers
     logging.getLogger('werkzeug').setLevel(logging.INFO)
     logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
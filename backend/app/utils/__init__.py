@@ -1,3 +1,14 @@
 from .file_utils import allowed_file, save_uploaded_file, get_user_upload_dir
-from .dicom_utils import load_dicom_series
-from .nifti_utils import load_nifti_file
\ No newline at end of file
+
+# DICOM/NIfTI helpers pull in pydicom, nibabel and scipy; import them on first use
+_LAZY_EXPORTS = {
+    'load_dicom_series': 'dicom_utils',
+    'load_nifti_file': 'nifti_utils'
+}
+
+def __getattr__(name):
+    if name in _LAZY_EXPORTS:
+        import importlib
+        module = importlib.import_module(f".{_LAZY_EXPORTS[name]}", __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
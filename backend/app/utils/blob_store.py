@@ -0,0 +1,144 @@
+import os
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+def blob_path(blob_root, digest):
+    """Location of a blob in the store (two-level fan-out by digest)."""
+    return os.path.join(blob_root, digest[:2], digest)
+
+def store_stream(stream, blob_root):
+    """
+    Copy a stream into the blob store, hashing it on the way.
+
+    The data is written once to a temporary file in the store; it becomes the
+    blob unless identical content is already stored.
+
+    Args:
+        stream: A binary file-like object.
+        blob_root (str): Root directory of the blob store.
+
+    Returns:
+        str: SHA-256 hex digest of the content.
+        str: Path of the temporary copy (the caller must pass it to
+            ``link_blob`` or delete it).
+        bool: Whether the content was already stored.
+    """
+    tmp_dir = os.path.join(blob_root, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+
+    digest = hashlib.sha256()
+    with open(tmp_path, 'wb') as f:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+
+    digest = digest.hexdigest()
+    return digest, tmp_path, os.path.exists(blob_path(blob_root, digest))
+
+def file_digest(path):
+    """SHA-256 hex digest of a file's content (the key it has in the store)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def link_blob(blob_root, digest, tmp_path, target_path):
+    """
+    Make ``target_path`` a reference to a blob, creating the blob if needed.
+
+    References are hard links, so readers see ordinary files and a blob's
+    reference count is its link count. Falls back to a plain copy where hard
+    links are not supported (no deduplication in that case).
+
+    Args:
+        blob_root (str): Root directory of the blob store.
+        digest (str): Digest returned by ``store_stream``.
+        tmp_path (str): Temporary copy returned by ``store_stream``.
+        target_path (str): Path in the user's namespace.
+
+    Returns:
+        bool: False if ``target_path`` already referenced this blob.
+    """
+    path = blob_path(blob_root, digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        if os.path.exists(target_path) and os.path.samefile(target_path, path):
+            return False
+
+        for _ in range(2):
+            if not os.path.exists(path):
+                # Link rather than move: the temporary copy keeps the data (and
+                # a second link, so garbage collection skips it) until we are done
+                try:
+                    os.link(tmp_path, path)
+                except FileExistsError:
+                    pass
+                except OSError:
+                    shutil.copyfile(tmp_path, path)
+            link_tmp = f"{target_path}.{uuid.uuid4().hex}.tmp"
+            try:
+                os.link(path, link_tmp)
+            except FileNotFoundError:
+                # Garbage collection removed the blob between the checks; store it again
+                continue
+            except OSError:
+                shutil.copyfile(path, link_tmp)
+            os.replace(link_tmp, target_path)
+            return True
+        raise RuntimeError(f"Could not reference blob {digest}")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def collect_garbage(blob_root, grace_period=3600):
+    """
+    Delete blobs that no user namespace references any more.
+
+    A blob whose only link is the store's own is unreferenced. Blobs and
+    temporary files younger than the grace period are kept so in-progress
+    uploads are never collected.
+
+    Args:
+        blob_root (str): Root directory of the blob store.
+        grace_period (float, optional): Minimum age in seconds.
+
+    Returns:
+        dict: ``blobs`` and ``bytes`` removed, ``kept`` blobs.
+    """
+    removed = freed = kept = 0
+    cutoff = time.time() - grace_period
+    if not os.path.isdir(blob_root):
+        return {'blobs': 0, 'bytes': 0, 'kept': 0}
+
+    for fanout in os.listdir(blob_root):
+        directory = os.path.join(blob_root, fanout)
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            unreferenced = fanout == 'tmp' or stat.st_nlink <= 1
+            if unreferenced and stat.st_mtime < cutoff:
+                os.remove(path)
+                removed += 1
+                freed += stat.st_size
+            else:
+                kept += 1
+
+    logger.info(f"Blob garbage collection removed {removed} blobs ({freed} bytes)")
+    return {'blobs': removed, 'bytes': freed, 'kept': kept}
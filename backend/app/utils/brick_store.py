@@ -0,0 +1,398 @@
+import os
+import json
+import mmap
+import uuid
+import zlib
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+try:
+    import lz4.frame as _lz4
+except ImportError:
+    _lz4 = None
+
+INDEX_FILE = 'index.json'
+DATA_FILE = 'data.bin'
+FORMAT_VERSION = 1
+
+# name -> (compress(data, level), decompress(data))
+CODECS = {
+    'none': (lambda data, level: data, lambda data: data),
+    'zlib': (lambda data, level: zlib.compress(data, level), zlib.decompress),
+}
+if _lz4 is not None:
+    CODECS['lz4'] = (lambda data, level: _lz4.compress(data, compression_level=level), _lz4.decompress)
+
+def _storage_dtype(volume):
+    """Smallest lossless integer dtype for a float volume of whole numbers (HU), else its own dtype."""
+    if volume.dtype.kind != 'f' or volume.size == 0:
+        return volume.dtype
+    for start in range(0, volume.shape[0], 64):
+        slab = volume[start:start + 64]
+        if not np.array_equal(slab, np.round(slab)):
+            return volume.dtype
+    low, high = float(np.min(volume)), float(np.max(volume))
+    for dtype in (np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return np.dtype(dtype)
+    return volume.dtype
+
+def _shuffle(data, itemsize):
+    # Group the n-th byte of every value together: the high bytes of HU values
+    # are nearly constant, which roughly halves the compressed size
+    if itemsize == 1:
+        return data
+    return np.frombuffer(data, np.uint8).reshape(-1, itemsize).T.tobytes()
+
+def _unshuffle(data, itemsize):
+    if itemsize == 1:
+        return data
+    return np.frombuffer(data, np.uint8).reshape(itemsize, -1).T.tobytes()
+
+def _reusable_slabs(volume, storage_dtype, brick_size, codec, base, reused):
+    """Map slabs of bricks to identical slabs of a base store: ``{z: base_z}``."""
+    if base is None or reused is None:
+        return {}
+    if (base.brick_size != brick_size or base.index['codec'] != codec or base.dtype != volume.dtype
+            or base._storage_dtype != storage_dtype or base.shape[1:] != volume.shape[1:]):
+        return {}
+    slabs = {}
+    for z in range(-(-volume.shape[0] // brick_size)):
+        mapping = reused[z * brick_size:(z + 1) * brick_size]
+        first = mapping[0]
+        if first is None or first % brick_size:
+            continue
+        base_z = first // brick_size
+        if mapping == list(range(first, first + len(mapping))) and \
+                base._brick_shape((base_z, 0, 0))[0] == len(mapping):
+            slabs[z] = base_z
+    return slabs
+
+def write_bricks(volume, directory, brick_size=64, codec='zlib', level=1, base=None, reused=None):
+    """
+    Convert a volume to chunked, compressed brick storage.
+
+    The volume is cut into ``brick_size``³ bricks (smaller at the edges),
+    each compressed on its own and appended to one data file, with their
+    offsets in an index. Float volumes holding whole numbers (HU) are stored
+    as int16 and read back in their original dtype.
+
+    The directory is written under a temporary name and renamed, so readers
+    never see a partial store.
+
+    Args:
+        volume (numpy.ndarray): The 3D volume.
+        directory (str): Destination directory (must not exist yet).
+        brick_size (int, optional): Edge length of a brick in voxels.
+        codec (str, optional): One of ``CODECS``.
+        level (int, optional): Compression level.
+        base (BrickVolume, optional): Store of an earlier version of the
+            volume. Slabs of bricks whose slices it holds unchanged, at the
+            same brick offsets, are copied without recompressing.
+        reused (list, optional): For each slice, the base slice it equals
+            (None for new slices).
+
+    Returns:
+        dict: The index of the written store.
+    """
+    if codec not in CODECS:
+        raise ValueError(f"Unknown brick codec: {codec}")
+    if volume.ndim != 3:
+        raise ValueError("Brick storage needs a 3D volume")
+
+    compress = CODECS[codec][0]
+    storage_dtype = _storage_dtype(volume)
+    grid = [-(-n // brick_size) for n in volume.shape]
+
+    reusable = _reusable_slabs(volume, storage_dtype, brick_size, codec, base, reused)
+
+    tmp_dir = f"{directory}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(tmp_dir)
+    offsets = [0]
+    try:
+        with open(os.path.join(tmp_dir, DATA_FILE), 'wb') as f:
+            # One slab of bricks at a time keeps the converted copy small
+            for z in range(grid[0]):
+                if z in reusable:
+                    for y in range(grid[1]):
+                        for x in range(grid[2]):
+                            data = base.read_raw((reusable[z], y, x))
+                            f.write(data)
+                            offsets.append(offsets[-1] + len(data))
+                    continue
+                slab = np.asarray(volume[z * brick_size:(z + 1) * brick_size]).astype(storage_dtype, copy=False)
+                for y in range(grid[1]):
+                    for x in range(grid[2]):
+                        brick = np.ascontiguousarray(
+                            slab[:, y * brick_size:(y + 1) * brick_size, x * brick_size:(x + 1) * brick_size]
+                        )
+                        data = compress(_shuffle(brick.tobytes(), brick.itemsize), level)
+                        f.write(data)
+                        offsets.append(offsets[-1] + len(data))
+
+        index = {
+            'version': FORMAT_VERSION,
+            'shape': list(volume.shape),
+            'dtype': volume.dtype.str,
+            'storage_dtype': storage_dtype.str,
+            'brick_size': brick_size,
+            'grid': grid,
+            'codec': codec,
+            'offsets': offsets
+        }
+        with open(os.path.join(tmp_dir, INDEX_FILE), 'w') as f:
+            json.dump(index, f)
+
+        try:
+            os.rename(tmp_dir, directory)
+        except OSError:
+            # Another worker converted the same volume first
+            if not os.path.exists(os.path.join(directory, INDEX_FILE)):
+                raise
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    logger.info(
+        f"Wrote {np.prod(grid)} bricks to {directory} ({offsets[-1]} of {volume.nbytes} bytes, "
+        f"{len(reusable)} of {grid[0]} slabs reused)"
+    )
+    return index
+
+def _normalize_key(key, shape):
+    """Turn a basic index into per-axis ``(start, stop, step, squeeze)``."""
+    if not isinstance(key, tuple):
+        key = (key,)
+    if any(k is Ellipsis for k in key):
+        position = key.index(Ellipsis)
+        key = key[:position] + (slice(None),) * (len(shape) - len(key) + 1) + key[position + 1:]
+    if len(key) > len(shape):
+        raise IndexError("Too many indices for brick volume")
+    key = key + (slice(None),) * (len(shape) - len(key))
+
+    axes = []
+    for k, n in zip(key, shape):
+        if isinstance(k, slice):
+            start, stop, step = k.indices(n)
+            if step < 0:
+                raise IndexError("Brick volumes do not support negative steps")
+            axes.append((start, max(start, stop), step, False))
+        elif isinstance(k, (int, np.integer)):
+            index = int(k) + n if k < 0 else int(k)
+            if not 0 <= index < n:
+                raise IndexError(f"Index {int(k)} is out of bounds for axis with size {n}")
+            axes.append((index, index + 1, 1, True))
+        else:
+            raise TypeError("Brick volumes support integer and slice indexing only")
+    return axes
+
+class BrickVolume:
+    """
+    Read-only, array-like view of a brick store.
+
+    Basic indexing (integers and slices) decompresses only the bricks the
+    selection intersects, so an axial, coronal or sagittal plane costs
+    about the same. Decompressed bricks are kept in a small LRU cache shared
+    by all threads, since neighbouring planes read the same bricks.
+    ``numpy.asarray`` reads the whole volume.
+    """
+
+    def __init__(self, directory, cache_bytes=128 * 1024 * 1024):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        if self.index.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported brick store version in {directory}")
+
+        self.shape = tuple(self.index['shape'])
+        self.dtype = np.dtype(self.index['dtype'])
+        self.ndim = len(self.shape)
+        self.size = int(np.prod(self.shape))
+        self.nbytes = self.size * self.dtype.itemsize
+        self.brick_size = self.index['brick_size']
+        self._grid = tuple(self.index['grid'])
+        self._offsets = self.index['offsets']
+        self._storage_dtype = np.dtype(self.index['storage_dtype'])
+        self._decompress = CODECS[self.index['codec']][1]
+
+        self._data = None
+        self._map()
+
+        self.cache_bytes = cache_bytes
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return f"BrickVolume({self.directory!r}, shape={self.shape}, dtype={self.dtype})"
+
+    @property
+    def compressed_bytes(self):
+        return self._offsets[-1]
+
+    def _map(self):
+        if self._data is None:
+            with open(os.path.join(self.directory, DATA_FILE), 'rb') as f:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self._offsets[-1] else b''
+        return self._data
+
+    def _read_compressed(self, number):
+        with self._lock:
+            # A request may still hold a reader that was closed meanwhile
+            return bytes(self._map()[self._offsets[number]:self._offsets[number + 1]])
+
+    def close(self):
+        """Unmap the data file and drop the cached bricks (reads map it again)."""
+        with self._lock:
+            if isinstance(self._data, mmap.mmap):
+                self._data.close()
+            self._data = None
+            self._cache.clear()
+            self._cached_bytes = 0
+
+    def _brick_shape(self, brick):
+        return tuple(min(self.brick_size, n - b * self.brick_size) for b, n in zip(brick, self.shape))
+
+    def read_raw(self, brick):
+        """Compressed bytes of one brick given its grid position ``(z, y, x)``."""
+        number = (brick[0] * self._grid[1] + brick[1]) * self._grid[2] + brick[2]
+        return self._read_compressed(number)
+
+    def read_brick(self, brick):
+        """Decompress one brick given its grid position ``(z, y, x)``."""
+        with self._lock:
+            cached = self._cache.get(brick)
+            if cached is not None:
+                self._cache.move_to_end(brick)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        number = (brick[0] * self._grid[1] + brick[1]) * self._grid[2] + brick[2]
+        raw = self._decompress(self._read_compressed(number))
+        array = np.frombuffer(_unshuffle(raw, self._storage_dtype.itemsize), self._storage_dtype)
+        array = array.reshape(self._brick_shape(brick)).astype(self.dtype, copy=False)
+        array.flags.writeable = False
+
+        with self._lock:
+            if brick not in self._cache and array.nbytes <= self.cache_bytes:
+                self._cache[brick] = array
+                self._cached_bytes += array.nbytes
+                while self._cached_bytes > self.cache_bytes:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cached_bytes -= evicted.nbytes
+        return array
+
+    def read(self, start, stop):
+        """
+        Read the sub-volume ``[start, stop)``.
+
+        Args:
+            start (tuple): First voxel per axis.
+            stop (tuple): One past the last voxel per axis.
+
+        Returns:
+            numpy.ndarray: A new array.
+        """
+        out = np.empty([max(b - a, 0) for a, b in zip(start, stop)], dtype=self.dtype)
+        if out.size == 0:
+            return out
+
+        size = self.brick_size
+        ranges = [range(a // size, (b - 1) // size + 1) for a, b in zip(start, stop)]
+        for bz in ranges[0]:
+            for by in ranges[1]:
+                for bx in ranges[2]:
+                    brick = self.read_brick((bz, by, bx))
+                    origin = (bz * size, by * size, bx * size)
+                    # Overlap of the brick and the request, in volume coordinates
+                    low = [max(a, o) for a, o in zip(start, origin)]
+                    high = [min(b, o + n) for b, o, n in zip(stop, origin, brick.shape)]
+                    out[tuple(slice(l - a, h - a) for l, h, a in zip(low, high, start))] = \
+                        brick[tuple(slice(l - o, h - o) for l, h, o in zip(low, high, origin))]
+        return out
+
+    def __getitem__(self, key):
+        axes = _normalize_key(key, self.shape)
+        region = self.read([a[0] for a in axes], [a[1] for a in axes])
+        region = region[tuple(slice(None, None, a[2]) for a in axes)]
+        return region[tuple(0 if a[3] else slice(None) for a in axes)]
+
+    def __array__(self, dtype=None, copy=None):
+        volume = self.read((0,) * self.ndim, self.shape)
+        return volume if dtype is None else volume.astype(dtype, copy=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._cache),
+                'bytes': self._cached_bytes
+            }
+
+# Readers kept open per process, least recently used first. Each holds a
+# mapping of its data file and up to ``cache_bytes`` of decompressed bricks.
+MAX_OPEN_READERS = 8
+
+_readers = OrderedDict()  # directory -> (index mtime, reader)
+_readers_lock = threading.Lock()
+
+def open_bricks(directory, cache_bytes=128 * 1024 * 1024):
+    """
+    Open a brick store, reusing this process's reader (and its brick cache).
+
+    At most ``MAX_OPEN_READERS`` readers stay open; opening another closes
+    the least recently used one.
+
+    Returns:
+        BrickVolume: The reader, or None if the store does not exist.
+    """
+    try:
+        mtime = os.stat(os.path.join(directory, INDEX_FILE)).st_mtime_ns
+    except FileNotFoundError:
+        close_bricks(directory)
+        return None
+
+    with _readers_lock:
+        cached = _readers.get(directory)
+        if cached is not None and cached[0] == mtime:
+            _readers.move_to_end(directory)
+            return cached[1]
+
+    reader = BrickVolume(directory, cache_bytes=cache_bytes)
+    closed = []
+    with _readers_lock:
+        previous = _readers.pop(directory, None)
+        if previous is not None:
+            closed.append(previous[1])
+        _readers[directory] = (mtime, reader)
+        while len(_readers) > MAX_OPEN_READERS:
+            closed.append(_readers.popitem(last=False)[1][1])
+    for stale in closed:
+        stale.close()
+    return reader
+
+def close_bricks(root):
+    """
+    Close this process's readers of the brick store at ``root`` and of any
+    store below it (e.g. every variant in a removed series cache).
+    """
+    root = os.path.join(root, '')
+    with _readers_lock:
+        directories = [d for d in _readers if os.path.join(d, '').startswith(root)]
+        closed = [_readers.pop(d)[1] for d in directories]
+    for reader in closed:
+        reader.close()
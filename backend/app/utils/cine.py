@@ -0,0 +1,165 @@
+import zlib
+import struct
+import logging
+from io import BytesIO
+
+logger = logging.getLogger(__name__)
+
+# format -> (mimetype, file extension)
+CINE_FORMATS = {
+    'apng': ('image/apng', 'png'),
+    'gif': ('image/gif', 'gif')
+}
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# PNG color type of an 8-bit IHDR -> PIL mode that saves with it
+PNG_MODES = {0: 'L', 2: 'RGB', 4: 'LA', 6: 'RGBA'}
+
+def _chunk(chunk_type, body):
+    crc = zlib.crc32(chunk_type + body) & 0xffffffff
+    return struct.pack('>I', len(body)) + chunk_type + body + struct.pack('>I', crc)
+
+def _read_chunks(data):
+    """Split PNG bytes into ``(type, body)`` chunks."""
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("Frame is not a PNG image")
+    position = len(PNG_SIGNATURE)
+    chunks = []
+    while position < len(data):
+        length, chunk_type = struct.unpack('>I4s', data[position:position + 8])
+        chunks.append((chunk_type, data[position + 8:position + 8 + length]))
+        position += 12 + length
+    return chunks
+
+def _ihdr(chunks):
+    return next(body for chunk_type, body in chunks if chunk_type == b'IHDR')
+
+def _scaled_size(size, max_size):
+    if not max_size or max(size) <= max_size:
+        return size
+    scale = max_size / max(size)
+    return (max(int(size[0] * scale), 1), max(int(size[1] * scale), 1))
+
+def _decode_frame(data, size=None, max_size=None, mode='RGBA'):
+    """
+    Decode a PNG frame in ``mode``, scaled to ``max_size`` and fitted (padded
+    or cropped) to ``size``; frames of one view normally match already.
+
+    Returns:
+        PIL.Image.Image: The frame.
+        tuple: Its size (the animation size for the first frame).
+    """
+    from PIL import Image
+
+    image = Image.open(BytesIO(data)).convert(mode)
+    scaled = _scaled_size(image.size, max_size)
+    if scaled != image.size:
+        image = image.resize(scaled, Image.LANCZOS)
+    if size is None:
+        return image, image.size
+    if image.size != size:
+        canvas = Image.new(mode, size, (0, 0, 0, 255) if mode == 'RGBA' else 0)
+        canvas.paste(image, (0, 0))
+        image = canvas
+    return image, size
+
+def stream_apng(frames, num_frames, fps=10, loop=0, max_size=None):
+    """
+    Encode PNG frames as an animated PNG, one frame at a time.
+
+    Frames matching the first frame's header are copied without
+    re-encoding (their IDAT data becomes the frame data); others are decoded,
+    fitted to the first frame's size and re-encoded.
+
+    Args:
+        frames (iterable): PNG bytes of each frame, in order.
+        num_frames (int): Number of frames (written in the header).
+        fps (float, optional): Frames per second.
+        loop (int, optional): Number of plays, 0 for infinite.
+        max_size (int, optional): Downscale frames to this longest edge.
+
+    Yields:
+        bytes: Pieces of the APNG file.
+    """
+    delay = struct.pack('>HH', max(int(round(1000 / fps)), 1), 1000)
+    header = None
+    size = None
+    sequence = 0
+    for number, data in enumerate(frames):
+        chunks = None
+        if not max_size:
+            chunks = _read_chunks(data)
+            if header is not None and _ihdr(chunks) != header:
+                chunks = None
+        if chunks is None:
+            # Later frames take the pixel format of the first (the header is already out)
+            mode = 'RGBA' if header is None or header[8] != 8 else PNG_MODES.get(header[9], 'RGBA')
+            image, size = _decode_frame(data, size, max_size, mode)
+            buf = BytesIO()
+            image.save(buf, format='PNG', compress_level=1)
+            chunks = _read_chunks(buf.getvalue())
+
+        if header is None:
+            header = _ihdr(chunks)
+            size = struct.unpack('>II', header[:8])
+            yield PNG_SIGNATURE + _chunk(b'IHDR', header) + _chunk(b'acTL', struct.pack('>II', num_frames, loop))
+        elif _ihdr(chunks) != header:
+            raise ValueError("Frame does not match the animation's pixel format")
+
+        # fcTL: sequence, size, offset, delay, dispose (none), blend (source)
+        out = [_chunk(b'fcTL', struct.pack('>IIIII', sequence, size[0], size[1], 0, 0) + delay + b'\x00\x00')]
+        sequence += 1
+        for chunk_type, body in chunks:
+            if chunk_type != b'IDAT':
+                continue
+            if number == 0:
+                # The first frame doubles as the default image
+                out.append(_chunk(b'IDAT', body))
+            else:
+                out.append(_chunk(b'fdAT', struct.pack('>I', sequence) + body))
+                sequence += 1
+        yield b''.join(out)
+
+    if header is not None:
+        yield _chunk(b'IEND', b'')
+
+def stream_gif(frames, fps=10, loop=0, max_size=None):
+    """
+    Encode PNG frames as an animated GIF, one frame at a time.
+
+    Each frame is quantized to its own 256-color palette, stored as a
+    local color table.
+
+    Args:
+        frames (iterable): PNG bytes of each frame, in order.
+        fps (float, optional): Frames per second.
+        loop (int, optional): Number of plays, 0 for infinite.
+        max_size (int, optional): Downscale frames to this longest edge.
+
+    Yields:
+        bytes: Pieces of the GIF file.
+    """
+    from PIL.GifImagePlugin import getheader, getdata
+
+    # GIF delays are in hundredths of a second
+    duration = max(int(round(100 / fps)), 2) * 10
+    size = None
+    for data in frames:
+        first = size is None
+        image, size = _decode_frame(data, size, max_size)
+        frame = image.convert('RGB').quantize(256)
+        if first:
+            yield b''.join(getheader(frame, info={'loop': loop})[0])
+        yield b''.join(getdata(frame, include_color_table=True, duration=duration))
+
+    if size is not None:
+        yield b';'
+
+def stream_cine(fmt, frames, num_frames, fps=10, loop=0, max_size=None):
+    """Encode PNG frames in a ``CINE_FORMATS`` format, one frame at a time."""
+    if fmt == 'apng':
+        return stream_apng(frames, num_frames, fps, loop, max_size)
+    if fmt == 'gif':
+        return stream_gif(frames, fps, loop, max_size)
+    raise ValueError(f"Unknown cine format: {fmt}")
@@ -1,13 +1,14 @@
 import os
+import hashlib
+from collections.abc import Sequence
+from functools import lru_cache
 import numpy as np
-import pydicom
-from pydicom.errors import InvalidDicomError
-from scipy.ndimage import zoom
-import matplotlib.pyplot as plt
 from io import BytesIO
 import json
 import logging
 
+from app.utils.timing import stage, timed
+
 logger = logging.getLogger(__name__)
 
 def load_dicom_series(directory):
@@ -21,45 +22,92 @@ def load_dicom_series(directory):
         numpy.ndarray: The 3D volume data.
         dict: Metadata extracted from the DICOM files.
     """
-    dicom_files = [os.path.join(directory, f) for f in os.listdir(directory)
-                 if f.lower().endswith('.dcm')]
+    volume, metadata, _instances, _reused = load_dicom_instances(directory)
+    return volume, metadata
+
+def load_dicom_instances(directory, base=None):
+    """
+    Load a DICOM series like ``load_dicom_series``, reusing an earlier load
+    of the same directory.
+    
+    Files whose name, size and modification time match an instance of the
+    base are not read again; their slices are copied from the base volume.
+    Only new or changed files are decoded, and every slice lands at its
+    sorted position.
+    
+    Args:
+        directory (str): The directory containing the DICOM files.
+        base (tuple, optional): ``(volume, instances)`` of an earlier load.
+        
+    Returns:
+        numpy.ndarray: The 3D volume data.
+        dict: Metadata extracted from the DICOM files.
+        dict: The instance manifest (file signatures and sort keys in slice
+            order), to pass back as part of ``base``.
+        list: For each slice, the base slice it was copied from (None if decoded).
+    """
+    import pydicom
+    from pydicom.errors import InvalidDicomError
     
-    if not dicom_files:
+    names = sorted(f for f in os.listdir(directory) if f.lower().endswith('.dcm'))
+    if not names:
         raise ValueError("No DICOM files found in the specified directory.")
     
-    # Sort files by instance number or slice location
+    base_volume, base_instances = base if base is not None else (None, None)
+    known = {}
+    if base_instances is not None:
+        known = {
+            (record['name'], record['size'], record['mtime_ns']): i
+            for i, record in enumerate(base_instances['instances'])
+        }
+    
+    # (instance record, base slice or None, decoded dataset or None)
     slices = []
-    for file_path in dicom_files:
+    for name in names:
+        file_path = os.path.join(directory, name)
+        stat = os.stat(file_path)
+        base_index = known.get((name, stat.st_size, stat.st_mtime_ns))
+        if base_index is not None:
+            slices.append((base_instances['instances'][base_index], base_index, None))
+            continue
         try:
             dcm = pydicom.dcmread(file_path)
-            slices.append(dcm)
         except InvalidDicomError:
             logger.warning(f"Skipping invalid DICOM file: {file_path}")
             continue
+        slices.append((_instance_record(name, stat, dcm), None, dcm))
     
     if not slices:
         raise ValueError("No valid DICOM files found in the specified directory.")
     
     # Sort by ImagePositionPatient's z-coordinate or instance number
-    try:
-        slices.sort(key=lambda x: float(x.ImagePositionPatient[2]))
-    except (AttributeError, IndexError):
-        try:
-            slices.sort(key=lambda x: int(x.InstanceNumber))
-        except (AttributeError, ValueError):
-            logger.warning("Unable to determine proper order based on standard attributes, using filename order")
-            slices.sort(key=lambda x: x.filename)
+    if all(record['position'] is not None for record, _, _ in slices):
+        slices.sort(key=lambda x: x[0]['position'])
+    elif all(record['instance_number'] is not None for record, _, _ in slices):
+        slices.sort(key=lambda x: x[0]['instance_number'])
+    else:
+        logger.warning("Unable to determine proper order based on standard attributes, using filename order")
     
     # Extract metadata from the first slice
-    metadata = extract_dicom_metadata(slices[0])
+    first, first_base_index, first_dcm = slices[0]
+    if first_dcm is None and first_base_index == 0:
+        metadata = dict(base_instances['metadata'])
+    else:
+        if first_dcm is None:
+            first_dcm = pydicom.dcmread(os.path.join(directory, first['name']), stop_before_pixels=True)
+        metadata = extract_dicom_metadata(first_dcm)
     metadata['NumSlices'] = len(slices)
+    metadata['SliceSpacing'] = _position_spacing([record['position'] for record, _, _ in slices])
     
     # Create 3D array
-    img_shape = (len(slices), int(slices[0].Rows), int(slices[0].Columns))
+    img_shape = (len(slices), int(metadata['Rows']), int(metadata['Columns']))
     volume = np.zeros(img_shape, dtype=np.float32)
     
     # Fill the array with pixel data and convert to HU if possible
-    for i, slice in enumerate(slices):
+    for i, (_, base_index, slice) in enumerate(slices):
+        if slice is None:
+            volume[i, :, :] = base_volume[base_index]
+            continue
         pixel_array = slice.pixel_array.astype(np.float32)
         
         # Convert to HU if possible
@@ -68,7 +116,105 @@ def load_dicom_series(directory):
         else:
             volume[i, :, :] = pixel_array
     
-    return volume, metadata
+    instances = {
+        'metadata': metadata,
+        'instances': [record for record, _, _ in slices]
+    }
+    return volume, metadata, instances, [base_index for _, base_index, _ in slices]
+
+def _instance_record(name, stat, dcm):
+    """File signature and sort keys of one DICOM instance."""
+    try:
+        position = float(dcm.ImagePositionPatient[2])
+    except (AttributeError, IndexError, TypeError, ValueError):
+        position = None
+    try:
+        instance_number = int(dcm.InstanceNumber)
+    except (AttributeError, TypeError, ValueError):
+        instance_number = None
+    return {
+        'name': name,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'position': position,
+        'instance_number': instance_number
+    }
+
+def _position_spacing(positions):
+    """Distance between consecutive slice positions (None if unknown)."""
+    if not positions or any(p is None for p in positions):
+        return None
+    steps = np.abs(np.diff(np.array(positions, dtype=np.float64)))
+    steps = steps[steps > 0]
+    return float(np.median(steps)) if len(steps) else None
+
+def get_volume_spacing(metadata):
+    """
+    Voxel spacing of a loaded volume in millimetres.
+    
+    The slice spacing comes from the slice positions when available and
+    falls back to ``SliceThickness``.
+    
+    Args:
+        metadata (dict): Metadata returned by ``load_dicom_series``.
+        
+    Returns:
+        tuple: ``(slice, row, column)`` spacing.
+    """
+    row_spacing, column_spacing = (float(v) for v in (metadata.get('PixelSpacing') or [1, 1])[:2])
+    slice_spacing = metadata.get('SliceSpacing') or float(metadata.get('SliceThickness') or 0) or 1.0
+    return (float(slice_spacing), row_spacing or 1.0, column_spacing or 1.0)
+
+def read_series_header(directory):
+    """
+    Estimate the shape of a series from one file header, without decoding pixels.
+    
+    Args:
+        directory (str): The directory containing the DICOM files.
+        
+    Returns:
+        tuple: ``(slices, rows, columns)`` (slices counts files, or frames
+        of a multi-frame file).
+        dict: ``PixelSpacing`` and ``SliceThickness`` of the header.
+    """
+    import pydicom
+    
+    names = sorted(f for f in os.listdir(directory) if f.lower().endswith('.dcm'))
+    if not names:
+        raise ValueError("No DICOM files found in the specified directory.")
+    
+    dcm = pydicom.dcmread(
+        os.path.join(directory, names[0]), stop_before_pixels=True,
+        specific_tags=['Rows', 'Columns', 'NumberOfFrames', 'PixelSpacing', 'SliceThickness']
+    )
+    frames = int(getattr(dcm, 'NumberOfFrames', 1) or 1)
+    shape = (len(names) * frames, int(dcm.Rows), int(dcm.Columns))
+    metadata = {
+        'PixelSpacing': [float(v) for v in getattr(dcm, 'PixelSpacing', [1, 1])],
+        'SliceThickness': float(getattr(dcm, 'SliceThickness', 0) or 0)
+    }
+    return shape, metadata
+
+def get_series_id(directory):
+    """
+    Compute a stable id for the DICOM series stored in a directory.
+    
+    The id changes whenever a file is added, removed or rewritten, so it can
+    key anything derived from the loaded volume.
+    
+    Args:
+        directory (str): The directory containing the DICOM files.
+        
+    Returns:
+        str: A hex digest identifying the directory contents.
+    """
+    digest = hashlib.sha1()
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith('.dcm'):
+            continue
+        stat = os.stat(os.path.join(directory, name))
+        digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns};".encode('utf-8'))
+    return digest.hexdigest()[:20]
 
 def extract_dicom_metadata(dcm):
     """
@@ -96,6 +242,10 @@ def extract_dicom_metadata(dcm):
         'WindowWidth': getattr(dcm, 'WindowWidth', 400),
     }
     
+    # pydicom value types (DSfloat, IS, MultiValue) are not JSON serializable
+    for key, value in metadata.items():
+        metadata[key] = _to_json_value(value)
+    
     # Anonymize patient information for security
     metadata['PatientID'] = 'ANON' + metadata['PatientID'][-4:] if len(metadata['PatientID']) > 4 else 'ANON'
     metadata['PatientName'] = 'Anonymous'
@@ -103,6 +253,17 @@ def extract_dicom_metadata(dcm):
     
     return metadata
 
+def _to_json_value(value):
+    """Convert a pydicom element value to a plain JSON-serializable value."""
+    if isinstance(value, str):
+        return str(value)
+    if isinstance(value, Sequence):
+        return [_to_json_value(v) for v in value]
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value) if isinstance(value, int) else float(value)
+    return value
+
+@timed('window')
 def apply_windowing(image, window_center, window_width):
     """
     Apply windowing to adjust contrast and brightness of the image.
@@ -128,7 +289,280 @@ def apply_windowing(image, window_center, window_width):
     
     return windowed
 
-def resample_volume(volume, original_spacing, target_spacing=(1.0, 1.0, 1.0)):
+STATS_PERCENTILES = (0.5, 1, 2, 5, 25, 50, 75, 95, 98, 99, 99.5)
+MAX_HISTOGRAM_BINS = 4096
+
+# Standard CT display windows (center, width) in HU
+CT_WINDOW_PRESETS = {
+    'brain': (40, 80),
+    'subdural': (75, 215),
+    'soft_tissue': (40, 400),
+    'mediastinum': (50, 350),
+    'liver': (60, 160),
+    'lung': (-600, 1500),
+    'bone': (400, 1800),
+}
+
+def compute_volume_stats(volume, bins=MAX_HISTOGRAM_BINS, slab_size=64):
+    """
+    Compute intensity statistics of a volume in two slab-wise passes.
+    
+    The first pass collects the global and per-slice (every axis) minimum
+    and maximum, the mean and the standard deviation; the second builds a
+    histogram over the full range, from which the percentiles are read.
+    Volumes of whole numbers (HU) get one bin per value when the range
+    allows, so their percentiles are exact. Works on anything that supports
+    slab slicing (arrays, brick volumes).
+    
+    Args:
+        volume (numpy.ndarray): The 3D volume.
+        bins (int, optional): Maximum number of histogram bins.
+        slab_size (int, optional): Slices processed at once.
+        
+    Returns:
+        dict: ``min``, ``max``, ``mean``, ``std``, ``percentiles``
+        (``{"p<q>": value}``), ``slice_min``/``slice_max`` (one list per
+        axis), ``histogram_range`` and ``histogram`` (counts).
+    """
+    shape = volume.shape
+    slice_min = [np.empty(shape[0]), np.full(shape[1], np.inf), np.full(shape[2], np.inf)]
+    slice_max = [np.empty(shape[0]), np.full(shape[1], -np.inf), np.full(shape[2], -np.inf)]
+    total = total_sq = 0.0
+    integral = True
+    
+    for start in range(0, shape[0], slab_size):
+        slab = np.asarray(volume[start:start + slab_size], dtype=np.float64)
+        stop = start + slab.shape[0]
+        slice_min[0][start:stop] = slab.min(axis=(1, 2))
+        slice_max[0][start:stop] = slab.max(axis=(1, 2))
+        np.minimum(slice_min[1], slab.min(axis=(0, 2)), out=slice_min[1])
+        np.maximum(slice_max[1], slab.max(axis=(0, 2)), out=slice_max[1])
+        np.minimum(slice_min[2], slab.min(axis=(0, 1)), out=slice_min[2])
+        np.maximum(slice_max[2], slab.max(axis=(0, 1)), out=slice_max[2])
+        total += slab.sum()
+        total_sq += np.square(slab).sum()
+        integral = integral and bool(np.array_equal(slab, np.round(slab)))
+    
+    count = int(np.prod(shape))
+    low, high = float(slice_min[0].min()), float(slice_max[0].max())
+    mean = total / count
+    std = float(np.sqrt(max(total_sq / count - mean * mean, 0.0)))
+    
+    if integral and high - low + 1 <= bins:
+        # One bin per integer value, centred on it
+        bins = int(high - low) + 1
+        hist_range = (low - 0.5, high + 0.5)
+    else:
+        hist_range = (low, high) if high > low else (low - 0.5, high + 0.5)
+    counts = np.zeros(bins, dtype=np.int64)
+    for start in range(0, shape[0], slab_size):
+        slab = np.asarray(volume[start:start + slab_size])
+        counts += np.histogram(slab, bins=bins, range=hist_range)[0]
+    
+    return {
+        'min': low,
+        'max': high,
+        'mean': float(mean),
+        'std': std,
+        'percentiles': _histogram_percentiles(counts, hist_range),
+        'slice_min': [m.tolist() for m in slice_min],
+        'slice_max': [m.tolist() for m in slice_max],
+        'histogram_range': list(hist_range),
+        'histogram': counts
+    }
+
+def _histogram_percentiles(counts, hist_range):
+    """Percentiles from the cumulative histogram (bin centres)."""
+    bins = len(counts)
+    centers = hist_range[0] + (np.arange(bins) + 0.5) * (hist_range[1] - hist_range[0]) / bins
+    cumulative = np.cumsum(counts)
+    percentiles = {}
+    for q in STATS_PERCENTILES:
+        position = min(int(np.searchsorted(cumulative, q / 100.0 * cumulative[-1])), bins - 1)
+        percentiles[f"p{q:g}"] = float(centers[position])
+    return percentiles
+
+def update_volume_stats(stats, volume, reused):
+    """
+    Update the statistics of a volume for slices inserted into it, reading
+    only the new slices.
+    
+    The result equals ``compute_volume_stats`` of the new volume (up to
+    rounding of the mean and standard deviation) as long as the new slices
+    stay within the histogram range.
+    
+    Args:
+        stats (dict): ``compute_volume_stats`` of the base volume.
+        volume (numpy.ndarray): The new volume.
+        reused (list): For each slice, the base slice it was copied from,
+            None for new slices (see ``load_dicom_instances``).
+        
+    Returns:
+        dict: The statistics, or None if the update is not an insertion
+        (base slices removed, changed or reordered) or moves the range.
+    """
+    base_slices = len(stats['slice_min'][0])
+    if [i for i in reused if i is not None] != list(range(base_slices)):
+        return None
+    if [len(m) for m in stats['slice_min'][1:]] != list(volume.shape[1:]):
+        return None
+    inserted = [i for i, base_index in enumerate(reused) if base_index is None]
+    if not inserted:
+        return dict(stats)
+    
+    slab = np.stack([np.asarray(volume[i], dtype=np.float64) for i in inserted])
+    hist_range = tuple(stats['histogram_range'])
+    counts = np.asarray(stats['histogram'], dtype=np.int64)
+    per_value = len(counts) == round(hist_range[1] - hist_range[0]) and hist_range[0] == stats['min'] - 0.5
+    if slab.min() < stats['min'] or slab.max() > stats['max']:
+        return None
+    if per_value and not np.array_equal(slab, np.round(slab)):
+        return None
+    
+    base_count = base_slices * volume.shape[1] * volume.shape[2]
+    count = int(np.prod(volume.shape))
+    total = stats['mean'] * base_count + slab.sum()
+    total_sq = (stats['std'] ** 2 + stats['mean'] ** 2) * base_count + np.square(slab).sum()
+    mean = total / count
+    counts = counts + np.histogram(slab, bins=len(counts), range=hist_range)[0]
+    
+    kept = [i for i, base_index in enumerate(reused) if base_index is not None]
+    slice_min, slice_max = [], []
+    for axis, (base_min, base_max) in enumerate(zip(stats['slice_min'], stats['slice_max'])):
+        if axis == 0:
+            new_min, new_max = np.empty(volume.shape[0]), np.empty(volume.shape[0])
+            new_min[kept], new_max[kept] = base_min, base_max
+            new_min[inserted], new_max[inserted] = slab.min(axis=(1, 2)), slab.max(axis=(1, 2))
+        else:
+            other = (0, 2) if axis == 1 else (0, 1)
+            new_min = np.minimum(base_min, slab.min(axis=other))
+            new_max = np.maximum(base_max, slab.max(axis=other))
+        slice_min.append(new_min.tolist())
+        slice_max.append(new_max.tolist())
+    
+    return dict(
+        stats,
+        mean=float(mean),
+        std=float(np.sqrt(max(total_sq / count - mean * mean, 0.0))),
+        percentiles=_histogram_percentiles(counts, hist_range),
+        slice_min=slice_min,
+        slice_max=slice_max,
+        histogram=counts
+    )
+
+def first_window_value(value, default=None):
+    """
+    First value of a WindowCenter/WindowWidth attribute.
+    
+    The attributes are often multi-valued (one window per display preset),
+    and may come back from JSON as a list or a backslash-separated string.
+    """
+    if isinstance(value, (list, tuple)):
+        value = value[0] if value else None
+    if isinstance(value, str):
+        value = value.split('\\')[0].strip()
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return default
+    return value if np.isfinite(value) else default
+
+def get_window_presets(metadata, stats=None):
+    """
+    Display window presets for a volume.
+    
+    Args:
+        metadata (dict): Metadata returned by ``load_dicom_series``.
+        stats (dict, optional): Statistics from ``compute_volume_stats``.
+        
+    Returns:
+        dict: ``{name: {"window_center": c, "window_width": w}}`` with
+        ``header`` (first window in the DICOM header), ``auto`` (1st-99th
+        percentile), ``full`` (whole range) and, for CT, the standard HU
+        windows.
+        str: Name of the preset to use by default.
+    """
+    presets = {}
+    
+    center = first_window_value(metadata.get('WindowCenter'))
+    width = first_window_value(metadata.get('WindowWidth'))
+    if center is not None and width is not None and width > 0:
+        presets['header'] = (center, width)
+    
+    if stats is not None:
+        low, high = stats['percentiles']['p1'], stats['percentiles']['p99']
+        if high > low:
+            presets['auto'] = ((low + high) / 2, high - low)
+        if stats['max'] > stats['min']:
+            presets['full'] = ((stats['min'] + stats['max']) / 2, stats['max'] - stats['min'])
+    
+    if metadata.get('Modality') == 'CT':
+        presets.update(CT_WINDOW_PRESETS)
+    
+    default = next((name for name in ('header', 'auto', 'soft_tissue', 'full') if name in presets), None)
+    presets = {
+        name: {'window_center': float(c), 'window_width': float(w)}
+        for name, (c, w) in presets.items()
+    }
+    return presets, default
+
+def resample_to_shape(volume, output_shape, order=1, slab_size=32, workers=1):
+    """
+    Resample a 3D volume to a given shape, one slab of slices at a time.
+    
+    Uses the same grid as ``scipy.ndimage.zoom`` (corner voxels stay
+    aligned), so results match ``zoom`` while only a slab of the input plus
+    a few overlapping slices is processed at once. Slabs are independent and
+    scipy releases the GIL, so they can run on several threads.
+    
+    Args:
+        volume (numpy.ndarray): The input 3D volume.
+        output_shape (tuple): The target shape.
+        order (int, optional): Spline order (0 = nearest, 1 = linear).
+        slab_size (int, optional): Output slices per slab.
+        workers (int, optional): Threads resampling slabs in parallel.
+        
+    Returns:
+        numpy.ndarray: The resampled volume (same dtype as the input).
+    """
+    from scipy.ndimage import affine_transform
+    
+    output_shape = tuple(int(n) for n in output_shape)
+    if tuple(volume.shape) == output_shape:
+        return volume
+    
+    scale = [(n_in - 1) / (n_out - 1) if n_out > 1 else 0.0 for n_in, n_out in zip(volume.shape, output_shape)]
+    # Input slices beyond the interpolation footprint that a slab needs
+    # (splines above order 1 are prefiltered per slab, so give them room)
+    margin = order + 1 if order <= 1 else order + 6
+    resampled = np.empty(output_shape, dtype=volume.dtype)
+    
+    def resample_slab(start):
+        stop = min(start + slab_size, output_shape[0])
+        first = max(int(np.floor(start * scale[0])) - margin, 0)
+        last = min(int(np.ceil((stop - 1) * scale[0])) + margin + 1, volume.shape[0])
+        affine_transform(
+            volume[first:last],
+            scale,
+            offset=(start * scale[0] - first,) + (0.0,) * (volume.ndim - 1),
+            output_shape=(stop - start,) + output_shape[1:],
+            output=resampled[start:stop],
+            order=order,
+            mode='nearest'
+        )
+    
+    starts = range(0, output_shape[0], slab_size)
+    if workers > 1 and len(starts) > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(resample_slab, starts))
+    else:
+        for start in starts:
+            resample_slab(start)
+    
+    return resampled
+
+def resample_volume(volume, original_spacing, target_spacing=(1.0, 1.0, 1.0), order=1, slab_size=32, workers=1):
     """
     Resample a 3D volume to a target spacing.
     
@@ -136,21 +570,88 @@ def resample_volume(volume, original_spacing, target_spacing=(1.0, 1.0, 1.0)):
         volume (numpy.ndarray): The input 3D volume.
         original_spacing (tuple or list): The original spacing (z, y, x).
         target_spacing (tuple or list, optional): The target spacing (z, y, x).
+        order (int, optional): Spline order (0 = nearest, 1 = linear).
+        slab_size (int, optional): Output slices per slab.
+        workers (int, optional): Threads resampling slabs in parallel.
         
     Returns:
         numpy.ndarray: The resampled volume.
     """
-    if original_spacing == target_spacing:
+    if tuple(original_spacing) == tuple(target_spacing):
         return volume
     
-    # Calculate resize factors
-    resize_factors = [orig / target for orig, target in zip(original_spacing, target_spacing)]
+    # Calculate the output shape like scipy's zoom does
+    output_shape = [
+        max(int(round(n * orig / target)), 1)
+        for n, orig, target in zip(volume.shape, original_spacing, target_spacing)
+    ]
     
-    # Perform resampling using scipy's zoom
-    resampled = zoom(volume, resize_factors, order=1, mode='nearest')
+    with stage('resample'):
+        return resample_to_shape(volume, output_shape, order=order, slab_size=slab_size, workers=workers)
+
+def get_isotropic_info(shape, metadata, spacing=None):
+    """
+    Describe the isotropic resampling of a volume without computing it.
     
-    return resampled
+    Args:
+        shape (tuple): Shape of the original volume.
+        metadata (dict): Its metadata.
+        spacing (float, optional): Target spacing in mm; defaults to the
+            finest spacing of the volume.
+        
+    Returns:
+        dict: ``original_shape``, ``original_spacing`` and ``spacing``.
+    """
+    original_spacing = get_volume_spacing(metadata)
+    spacing = float(spacing or min(original_spacing))
+    return {
+        'original_shape': list(shape),
+        'original_spacing': list(original_spacing),
+        'spacing': [spacing] * 3
+    }
+
+def load_isotropic_volume(volume, metadata, cache_dir, series_id, spacing=None, **resample_options):
+    """
+    Get an isotropic version of a volume, from the cache next to the
+    original when it was already computed.
+    
+    Args:
+        volume (numpy.ndarray): The volume from ``load_dicom_series``.
+        metadata (dict): Its metadata.
+        cache_dir (str): Directory holding resampled volumes.
+        series_id (str): Id of the series (see ``get_series_id``).
+        spacing (float, optional): Target spacing in mm; defaults to the
+            finest spacing of the volume.
+        **resample_options: ``order``, ``slab_size`` and ``workers`` for
+            ``resample_volume``.
+        
+    Returns:
+        numpy.ndarray: The isotropic volume.
+        dict: ``original_shape``, ``original_spacing`` and ``spacing``.
+    """
+    info = get_isotropic_info(volume.shape, metadata, spacing)
+    original_spacing = tuple(info['original_spacing'])
+    spacing = info['spacing'][0]
+    
+    cache_path = os.path.join(cache_dir, f"{series_id}_iso{spacing:g}mm.npy")
+    if os.path.exists(cache_path):
+        try:
+            return np.load(cache_path), info
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable resampled volume {cache_path}: {e}")
+    
+    resampled = resample_volume(volume, original_spacing, (spacing,) * 3, **resample_options)
+    
+    # Write atomically so a concurrent load never sees a partial file
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, resampled)
+    os.replace(tmp_path, cache_path)
+    
+    return resampled, info
 
+@timed('slice')
 def get_dicom_slice(volume, slice_index, axis=0, window_center=None, window_width=None):
     """
     Extract a 2D slice from a 3D volume along a specified axis.
@@ -180,7 +681,7 @@ def get_dicom_slice(volume, slice_index, axis=0, window_center=None, window_widt
     
     return slice_data
 
-def create_slice_image(slice_data, window_center=None, window_width=None, colormap='gray'):
+def create_slice_image(slice_data, window_center=None, window_width=None, colormap='gray', value_range=None):
     """
     Create a displayable image from a 2D slice.
     
@@ -189,70 +690,157 @@ def create_slice_image(slice_data, window_center=None, window_width=None, colorm
         window_center (float, optional): Window center for contrast adjustment.
         window_width (float, optional): Window width for contrast adjustment.
         colormap (str, optional): The colormap to use.
+        value_range (tuple, optional): Known ``(min, max)`` of the slice
+            (e.g. ``(0, 1)`` once windowed, or from the volume statistics),
+            so the pixels are not scanned again.
         
     Returns:
         bytes: PNG image data as bytes.
     """
     # Apply windowing if specified and not already done
-    if window_center is not None and window_width is not None and slice_data.max() > 1.0:
-        slice_data = apply_windowing(slice_data, window_center, window_width)
-    
-    fig, ax = plt.subplots(figsize=(10, 10))
-    im = ax.imshow(slice_data, cmap=colormap)
-    ax.axis('off')
-    plt.tight_layout()
-    
-    # Convert plot to PNG image
-    buf = BytesIO()
-    plt.savefig(buf, format='png', dpi=100, bbox_inches='tight', pad_inches=0)
-    plt.close(fig)
-    buf.seek(0)
+    if window_center is not None and window_width is not None:
+        already_windowed = (value_range[1] if value_range is not None else slice_data.max()) <= 1.0
+        if not already_windowed:
+            slice_data = apply_windowing(slice_data, window_center, window_width)
+            value_range = (0.0, 1.0)
+    vmin, vmax = value_range if value_range is not None else (None, None)
+    
+    import matplotlib.pyplot as plt
+    
+    with stage('render'):
+        fig, ax = plt.subplots(figsize=(10, 10))
+        im = ax.imshow(slice_data, cmap=colormap, vmin=vmin, vmax=vmax)
+        ax.axis('off')
+        plt.tight_layout()
+    
+    # Convert plot to PNG image (savefig also rasterizes the figure)
+    with stage('encode'):
+        buf = BytesIO()
+        plt.savefig(buf, format='png', dpi=100, bbox_inches='tight', pad_inches=0)
+        plt.close(fig)
+        buf.seek(0)
     
     return buf.getvalue()
 
-def load_hounsfield_ranges(file_path='app/data/hounsfield_ranges.json'):
+HOUNSFIELD_RANGES_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'hounsfield_ranges.json')
+
+DEFAULT_HOUNSFIELD_RANGES = (
+    (-1000, -100, 1),   # Air
+    (-100, -50, 2),     # Fat
+    (-50, 40, 3),       # Soft Tissue
+    (40, 400, 4),       # Bone
+    (400, 3000, 5)      # Dense Bone/Metal
+)
+
+@lru_cache(maxsize=8)
+def _read_hounsfield_ranges(file_path):
+    try:
+        with open(file_path, 'r') as f:
+            data = json.load(f)
+        return tuple(tuple(r) for r in data['hu_ranges'])
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        logger.error(f"Error loading Hounsfield ranges: {e}")
+        # Default Hounsfield ranges if file not found
+        return DEFAULT_HOUNSFIELD_RANGES
+
+def load_hounsfield_ranges(file_path=HOUNSFIELD_RANGES_PATH):
     """
     Load Hounsfield Unit ranges from a JSON file.
     
+    The file is read once per path and cached for the life of the process.
+    
     Args:
         file_path (str): Path to the JSON file.
         
     Returns:
         list: A list of [min_hu, max_hu, value] lists.
     """
-    try:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-        return data['hu_ranges']
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        logger.error(f"Error loading Hounsfield ranges: {e}")
-        # Default Hounsfield ranges if file not found
-        return [
-            [-1000, -100, 1],   # Air
-            [-100, -50, 2],     # Fat
-            [-50, 40, 3],       # Soft Tissue
-            [40, 400, 4],       # Bone
-            [400, 3000, 5]      # Dense Bone/Metal
-        ]
+    return [list(r) for r in _read_hounsfield_ranges(file_path)]
 
-def apply_hounsfield_segmentation(volume, ranges=None):
+def build_hounsfield_lookup(ranges):
+    """
+    Turn HU ranges into sorted boundaries and a label per interval.
+    
+    Ranges are half-open ``[min_hu, max_hu)``. Where ranges overlap the later
+    one wins, and values outside every range get label 0, which matches
+    applying the ranges one after another.
+    
+    Args:
+        ranges (list): A list of [min_hu, max_hu, value] lists.
+        
+    Returns:
+        numpy.ndarray: Sorted unique boundaries (float64).
+        numpy.ndarray: uint8 labels; ``labels[np.searchsorted(bounds, v, side='right')]``
+            is the label of ``v``.
+    """
+    for min_hu, max_hu, value in ranges:
+        if not min_hu < max_hu:
+            raise ValueError(f"Invalid HU range [{min_hu}, {max_hu})")
+        if not 0 < int(value) <= 255 or int(value) != value:
+            raise ValueError(f"HU range label must be an integer in 1..255, got {value}")
+    
+    bounds = np.unique(np.array([b for r in ranges for b in r[:2]], dtype=np.float64))
+    labels = np.zeros(len(bounds) + 1, dtype=np.uint8)
+    
+    # labels[i] covers [bounds[i - 1], bounds[i]); paint the ranges in order
+    for min_hu, max_hu, value in ranges:
+        first = np.searchsorted(bounds, min_hu) + 1
+        last = np.searchsorted(bounds, max_hu)
+        labels[first:last + 1] = value
+    
+    return bounds, labels
+
+MAX_HOUNSFIELD_TABLE_SIZE = 1 << 20
+
+def apply_hounsfield_segmentation(volume, ranges=None, slab_voxels=1 << 22):
     """
     Segment a volume based on Hounsfield Unit ranges.
     
+    Every voxel is classified in one pass by looking its value up in the
+    sorted range boundaries. With integer boundaries (the usual case) the
+    lookup is precomputed for every integer HU so a voxel costs one floor
+    and one table read. The volume is processed a slab of slices at a time
+    so temporary memory stays bounded regardless of volume size.
+    
     Args:
         volume (numpy.ndarray): The input volume.
         ranges (list, optional): A list of [min_hu, max_hu, value] lists.
+        slab_voxels (int, optional): Approximate number of voxels per slab.
         
     Returns:
-        numpy.ndarray: The segmented volume.
+        numpy.ndarray: The segmented volume (uint8 labels).
     """
     if ranges is None:
         ranges = load_hounsfield_ranges()
     
-    segmented = np.zeros_like(volume, dtype=np.uint8)
-    
-    for min_hu, max_hu, value in ranges:
-        mask = (volume >= min_hu) & (volume < max_hu)
-        segmented[mask] = value
-    
-    return segmented
\ No newline at end of file
+    bounds, labels = build_hounsfield_lookup(ranges)
+    table = None
+    if np.all(bounds == np.floor(bounds)) and bounds[-1] - bounds[0] < MAX_HOUNSFIELD_TABLE_SIZE:
+        low, high = int(bounds[0]), int(bounds[-1])
+        # Label of every integer from low - 1 (below all ranges) to high (at or above all)
+        grid = np.arange(low - 1, high + 1)
+        table = labels[np.searchsorted(bounds, grid, side='right')]
+    
+    def classify(values, out):
+        if table is None:
+            np.take(labels, np.searchsorted(bounds, values, side='right'), out=out)
+            return
+        # fmax/fmin also send NaN to the "below all ranges" entry
+        index = np.floor(values) if values.dtype.kind == 'f' else values.astype(np.int64)
+        np.fmax(index, low - 1, out=index)
+        np.fmin(index, high, out=index)
+        index -= low - 1
+        np.take(table, index.astype(np.intp), out=out)
+    
+    segmented = np.empty(volume.shape, dtype=np.uint8)
+    if volume.ndim < 2 or volume.size == 0:
+        classify(volume, segmented)
+        return segmented
+    
+    slice_voxels = max(int(np.prod(volume.shape[1:])), 1)
+    slab = max(slab_voxels // slice_voxels, 1)
+    for start in range(0, volume.shape[0], slab):
+        stop = min(start + slab, volume.shape[0])
+        classify(volume[start:stop], segmented[start:stop])
+    
+    return segmented
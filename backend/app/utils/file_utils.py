@@ -1,8 +1,17 @@
 import os
+import re
+import json
 import uuid
 from flask import current_app
 from werkzeug.utils import secure_filename
 
+from app.utils.blob_store import store_stream, link_blob
+
+BLOB_DIR = '_blobs'  # Content-addressed file store shared by all users
+SERIES_CACHE_DIR = '_series'  # Artifacts derived from a series, keyed by series id
+STUDIES_DIR = '_studies'  # Series prepared ahead of time by preprocess.py
+UID_PATTERN = re.compile(r'^[0-9]+(\.[0-9]+)*$')
+
 def allowed_file(filename):
     """Check if the file extension is allowed."""
     return '.' in filename and \
@@ -14,8 +23,50 @@ def get_user_upload_dir(user_id):
     os.makedirs(user_dir, exist_ok=True)
     return user_dir
 
+def get_blob_root():
+    """Get the root of the content-addressed file store."""
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], BLOB_DIR)
+
+def get_series_cache_dir(series_id, create=True):
+    """Get the directory for cached artifacts of a series (shared by all users)."""
+    cache_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], SERIES_CACHE_DIR, series_id)
+    if create:
+        os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+def read_series_index(cache_dir):
+    """Read the shape and metadata recorded for a series, or None."""
+    try:
+        with open(os.path.join(cache_dir, 'index.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_series_index(cache_dir, shape, metadata):
+    """Record the shape and metadata of a decoded series."""
+    tmp_path = os.path.join(cache_dir, f"index.json.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump({'shape': list(shape), 'metadata': metadata}, f)
+    os.replace(tmp_path, os.path.join(cache_dir, 'index.json'))
+
+def _dicom_instance_uid(path):
+    import pydicom
+    try:
+        dcm = pydicom.dcmread(path, stop_before_pixels=True, specific_tags=['SOPInstanceUID'])
+        uid = str(getattr(dcm, 'SOPInstanceUID', ''))
+    except Exception:
+        return None
+    return uid if UID_PATTERN.match(uid) else None
+
 def save_uploaded_file(file, user_id, subdir=None):
-    """Save an uploaded file to the user's upload directory."""
+    """
+    Save an uploaded file to the user's upload directory.
+    
+    Files are stored once in a content-addressed store and hard-linked into
+    the user's directory. DICOM files are named after their SOPInstanceUID,
+    so uploading an instance again replaces it instead of adding a duplicate
+    slice; other files are named after their content hash.
+    """
     if not file or not allowed_file(file.filename):
         return None
     
@@ -27,16 +78,60 @@ def save_uploaded_file(file, user_id, subdir=None):
     else:
         target_dir = user_dir
     
-    # Generate a unique filename
-    original_filename = secure_filename(file.filename)
-    file_extension = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else ''
-    unique_filename = f"{uuid.uuid4()}.{file_extension}" if file_extension else str(uuid.uuid4())
+    return store_file(file.stream, file.filename, target_dir)
+
+def store_file(stream, filename, target_dir):
+    """
+    Store a file in the content-addressed store and link it into a directory,
+    named the way ``save_uploaded_file`` names uploads.
+    
+    Args:
+        stream: A binary file-like object with the content.
+        filename (str): The original file name (for the extension).
+        target_dir (str): Existing directory to link the file into.
+        
+    Returns:
+        dict: ``original_filename``, ``saved_filename``, ``path``, ``sha256``,
+        ``deduplicated`` and ``unchanged``.
+    """
+    original_filename = secure_filename(filename)
+    lower_name = original_filename.lower()
+    file_extension = 'nii.gz' if lower_name.endswith('.nii.gz') else \
+        (lower_name.rsplit('.', 1)[1] if '.' in lower_name else '')
     
-    file_path = os.path.join(target_dir, unique_filename)
-    file.save(file_path)
+    blob_root = get_blob_root()
+    digest, tmp_path, existed = store_stream(stream, blob_root)
+    
+    # Name the file by what it is, so the same content always gets the same name
+    stem = _dicom_instance_uid(tmp_path) if file_extension == 'dcm' else None
+    stem = stem or digest[:32]
+    saved_filename = f"{stem}.{file_extension}" if file_extension else stem
+    
+    file_path = os.path.join(target_dir, saved_filename)
+    changed = link_blob(blob_root, digest, tmp_path, file_path)
     
     return {
         "original_filename": original_filename,
-        "saved_filename": unique_filename,
-        "path": file_path
-    }
\ No newline at end of file
+        "saved_filename": saved_filename,
+        "path": file_path,
+        "sha256": digest,
+        "deduplicated": existed,
+        "unchanged": not changed
+    }
+
+def get_files_in_directory(directory):
+    """List the files of an upload directory."""
+    if not os.path.isdir(directory):
+        return []
+    
+    files = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and not name.endswith('.tmp'):
+            stat = os.stat(path)
+            files.append({
+                "filename": name,
+                "size": stat.st_size,
+                "modified": stat.st_mtime
+            })
+    return files
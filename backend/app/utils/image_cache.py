@@ -0,0 +1,96 @@
+import threading
+import logging
+from collections import OrderedDict
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+class RenderedImageCache:
+    """
+    Thread-safe LRU cache of encoded images, bounded by total size in bytes.
+
+    Keys are tuples whose first element is the user id so that a user's
+    entries can be dropped when their session data changes. Each entry
+    remembers whether it was produced speculatively so prefetch hits can be
+    told apart from ordinary repeat requests.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Look up an image.
+
+        Returns:
+            tuple: ``(data, prefetched)`` or ``(None, False)`` on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, False
+            self._entries.move_to_end(key)
+            self.hits += 1
+            data, prefetched = entry
+            if prefetched:
+                # Only the first hit on a speculative entry counts as a prefetch hit
+                self._entries[key] = (data, False)
+            return data, prefetched
+
+    def contains(self, key):
+        """Check for an entry without touching LRU order or counters."""
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key, data, prefetched=False):
+        """Store an image, evicting least recently used entries as needed."""
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[0])
+            self._entries[key] = (data, prefetched)
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id):
+        """Drop every cached image belonging to a user."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == user_id]:
+                data, _ = self._entries.pop(key)
+                self._size -= len(data)
+
+    def stats(self):
+        """Return cache counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+def init_image_cache(app):
+    """Create the rendered-image cache for an app."""
+    cache = RenderedImageCache(app.config['IMAGE_CACHE_MAX_BYTES'])
+    app.extensions['image_cache'] = cache
+    return cache
+
+def get_image_cache():
+    """Get the rendered-image cache of the current app."""
+    return current_app.extensions['image_cache']
@@ -0,0 +1,238 @@
+import os
+import json
+import uuid
+import logging
+import numpy as np
+
+from app.utils.brick_store import write_bricks, BrickVolume, INDEX_FILE
+from app.utils.dicom_utils import load_dicom_instances, compute_volume_stats, update_volume_stats
+from app.utils.file_utils import write_series_index
+from app.utils.nifti_utils import create_roi_masks, get_nifti_label
+
+logger = logging.getLogger(__name__)
+
+INSTANCES_FILE = 'instances.json'  # File signatures and sort keys of the ingested instances
+
+def get_bricks_dir(cache_dir, variant=''):
+    """
+    Directory of the brick store of a series.
+
+    Args:
+        cache_dir (str): The series cache directory.
+        variant (str, optional): Suffix of a derived volume (e.g. ``"-iso0.7"``).
+    """
+    return os.path.join(cache_dir, f"bricks{variant}")
+
+def get_brick_options(config):
+    """Brick storage options for ``write_bricks`` from the app config."""
+    return {
+        'brick_size': config['BRICK_SIZE'],
+        'codec': config['BRICK_CODEC'],
+        'level': config['BRICK_LEVEL']
+    }
+
+def ensure_bricks(volume, directory, **brick_options):
+    """Write a volume's brick store unless it exists; returns True if it was written."""
+    if os.path.exists(directory):
+        return False
+    write_bricks(volume, directory, **brick_options)
+    return True
+
+def ingest_series(dicom_dir, cache_dir, bricks=True, base_dir=None, base_volume=None, **brick_options):
+    """
+    Decode a DICOM series and store what later loads reuse.
+    
+    Writes the series index (shape and metadata), the instance manifest,
+    the volume statistics and, if requested, the brick store of the volume
+    into the series cache directory.
+    
+    Given the cache directory of an earlier version of the series (e.g.
+    before more slices were uploaded), only new or changed files are
+    decoded; the statistics are updated for the inserted slices and bricks
+    of unchanged slabs are copied. Anything that cannot be updated in place
+    is computed from scratch.
+    
+    Args:
+        dicom_dir (str): Directory holding the DICOM files.
+        cache_dir (str): The series cache directory.
+        bricks (bool, optional): Whether to write the brick store.
+        base_dir (str, optional): Cache directory of the earlier version.
+        base_volume (numpy.ndarray, optional): Its volume, if already in
+            memory (otherwise read from its brick store).
+        **brick_options: ``brick_size``, ``codec`` and ``level``.
+    
+    Returns:
+        numpy.ndarray: The volume.
+        dict: Its metadata.
+    """
+    base = read_base_series(base_dir, dicom_dir, base_volume) if base_dir else None
+    volume, metadata, instances, reused = load_dicom_instances(
+        dicom_dir, (base['volume'], base['instances']) if base else None
+    )
+    
+    stats = None
+    if base is not None:
+        decoded = sum(1 for base_index in reused if base_index is None)
+        logger.info(f"Updated series from {base_dir}: decoded {decoded} of {len(reused)} instances")
+        if base['stats'] is not None:
+            stats = update_volume_stats(base['stats'], volume, reused)
+    if stats is not None:
+        _write_stats(os.path.join(cache_dir, 'stats.json'), stats)
+    else:
+        get_volume_stats(volume, cache_dir)
+    
+    if bricks:
+        try:
+            ensure_bricks(
+                volume, get_bricks_dir(cache_dir),
+                base=base['bricks'] if base else None, reused=reused, **brick_options
+            )
+        except Exception as e:
+            # The index and the volume are still good without bricks
+            logger.warning(f"Could not write brick store for {dicom_dir}: {str(e)}")
+    _write_json(os.path.join(cache_dir, INSTANCES_FILE), instances)
+    write_series_index(cache_dir, volume.shape, metadata)
+    return volume, metadata
+
+def read_base_series(base_dir, dicom_dir, volume=None):
+    """
+    Read what ``ingest_series`` needs from an earlier version of a series.
+    
+    Args:
+        base_dir (str): Cache directory of the earlier version.
+        dicom_dir (str): Directory holding the DICOM files now.
+        volume (numpy.ndarray, optional): The earlier volume, if in memory.
+    
+    Returns:
+        dict: ``volume``, ``instances``, ``stats`` (None if missing) and
+        ``bricks`` (a reader, None if missing), or None if the earlier
+        version cannot serve as a base (e.g. shares no files).
+    """
+    try:
+        with open(os.path.join(base_dir, INSTANCES_FILE)) as f:
+            instances = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    unchanged = 0
+    for record in instances['instances']:
+        try:
+            stat = os.stat(os.path.join(dicom_dir, record['name']))
+        except FileNotFoundError:
+            continue
+        unchanged += stat.st_size == record['size'] and stat.st_mtime_ns == record['mtime_ns']
+    if not unchanged:
+        return None
+    
+    bricks_dir = get_bricks_dir(base_dir)
+    reader = BrickVolume(bricks_dir, cache_bytes=0) if os.path.exists(os.path.join(bricks_dir, INDEX_FILE)) else None
+    if volume is None:
+        if reader is None:
+            return None
+        volume = np.asarray(reader)
+    if len(volume) != len(instances['instances']):
+        return None
+    return {
+        'volume': volume,
+        'instances': instances,
+        'stats': _read_stats(os.path.join(base_dir, 'stats.json'), volume.shape),
+        'bricks': reader
+    }
+
+def read_ingested_volume(cache_dir):
+    """
+    Read a series volume back from its brick store (much cheaper than
+    decoding the DICOM files again).
+
+    Returns:
+        numpy.ndarray: The volume, or None if the series has no brick store.
+    """
+    directory = get_bricks_dir(cache_dir)
+    if not os.path.exists(os.path.join(directory, INDEX_FILE)):
+        return None
+    # A private reader without a cache: every brick is read exactly once
+    return np.asarray(BrickVolume(directory, cache_bytes=0))
+
+def get_volume_stats(volume, cache_dir, variant=''):
+    """
+    Statistics of a series volume (see ``compute_volume_stats``), computed
+    once and kept in the series cache directory.
+
+    Args:
+        volume: The volume (array or brick volume).
+        cache_dir (str): The series cache directory.
+        variant (str, optional): Suffix of a derived volume (e.g. ``"-iso0.7"``).
+
+    Returns:
+        dict: The statistics, with the histogram counts as an array.
+    """
+    path = os.path.join(cache_dir, f"stats{variant}.json")
+    stats = _read_stats(path, volume.shape)
+    if stats is None:
+        stats = compute_volume_stats(volume)
+        _write_stats(path, stats)
+    return stats
+
+def _read_stats(path, shape):
+    try:
+        with open(path) as f:
+            stats = json.load(f)
+        if [len(m) for m in stats['slice_min']] == list(shape):
+            stats['histogram'] = np.asarray(stats['histogram'], dtype=np.int64)
+            return stats
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+def _write_stats(path, stats):
+    _write_json(path, dict(stats, histogram=np.asarray(stats['histogram']).tolist()))
+
+def _write_json(path, value):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+def load_roi_masks(nifti_files, dicom_shape, cache=None, refresh=False):
+    """
+    ``create_roi_masks`` through the processed mask cache: files already
+    processed for this grid (by anyone, e.g. before a session expired or by
+    preprocess.py) are a lookup instead of a decode and resample.
+
+    Args:
+        nifti_files (list): Dictionaries with ``filename`` and ``path``.
+        dicom_shape (tuple): Shape of the DICOM volume.
+        cache (MaskCache, optional): The cache (None processes every file).
+        refresh (bool, optional): Process the files again and replace
+            their cached entries.
+
+    Returns:
+        list: Dictionaries with ``filename``, ``label``, ``mask``,
+        ``metadata`` and ``unique_values`` (see ``create_roi_masks``).
+    """
+    roi_masks = []
+    for nifti_info in nifti_files:
+        digest = cache.digest(nifti_info['path']) if cache is not None else None
+        entry = cache.get(digest, dicom_shape) if digest is not None and not refresh else None
+        if entry is not None:
+            # The file name and label depend on the upload, not the content
+            filename = os.path.basename(nifti_info['path'])
+            label = get_nifti_label(nifti_info['path'])
+            roi_masks.append({
+                'filename': filename,
+                'label': label,
+                'mask': entry['mask'],
+                'metadata': dict(entry['metadata'], Filename=filename, Label=label),
+                'unique_values': entry['unique_values']
+            })
+            continue
+
+        masks = create_roi_masks([nifti_info], dicom_shape)
+        if not masks:
+            continue
+        mask = masks[0]
+        if digest is not None:
+            metadata = {k: v for k, v in mask['metadata'].items() if k not in ('Filename', 'Label')}
+            cache.put(digest, dicom_shape, mask['mask'], mask['unique_values'], metadata)
+        roi_masks.append(mask)
+    return roi_masks
@@ -0,0 +1,209 @@
+import os
+import json
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from flask import current_app
+
+from app.utils.blob_store import file_digest
+
+logger = logging.getLogger(__name__)
+
+MASK_CACHE_DIR = '_masks'  # Processed ROI masks, keyed by NIfTI content and target grid
+DIGEST_MEMO_SIZE = 4096
+
+def grid_key(shape):
+    """Name of a target grid in cache keys (e.g. ``"120x512x512"``)."""
+    return 'x'.join(str(int(n)) for n in shape)
+
+def _json_value(value):
+    # NIfTI header values are numpy scalars
+    return value.item() if hasattr(value, 'item') else str(value)
+
+class MaskCache:
+    """
+    Disk cache of ROI masks processed from NIfTI files.
+
+    An entry holds what ``create_roi_masks`` computes from one file for one
+    target grid (the resampled mask, the label values of the file and its
+    header metadata) and is keyed by the SHA-256 of the file content plus
+    the grid, so it is shared by every user, series and upload of the same
+    file, and survives session expiry and restarts.
+
+    Entries are compressed ``.npz`` files in one directory. A hit refreshes
+    the entry's modification time; when the directory grows past
+    ``max_bytes``, the least recently used entries are removed. Content
+    digests are memoized per inode, size and modification time, so repeat
+    lookups of an unchanged file do not hash it again.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path(self, digest, shape):
+        """Location of the entry for a NIfTI digest and a target grid."""
+        return os.path.join(self.directory, f"{digest[:32]}-{grid_key(shape)}.npz")
+
+    def digest(self, file_path):
+        """Content digest of a NIfTI file, memoized while the file is unchanged."""
+        stat = os.stat(file_path)
+        key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(key)
+            if digest is not None:
+                self._digests.move_to_end(key)
+                return digest
+        digest = file_digest(file_path)
+        with self._lock:
+            self._digests[key] = digest
+            while len(self._digests) > DIGEST_MEMO_SIZE:
+                self._digests.popitem(last=False)
+        return digest
+
+    def get(self, digest, shape):
+        """
+        Look up a processed mask.
+
+        Returns:
+            dict: ``mask``, ``unique_values`` and ``metadata``, or None on a miss.
+        """
+        path = self.path(digest, shape)
+        try:
+            with np.load(path) as entry:
+                result = {
+                    'mask': entry['mask'],
+                    'unique_values': entry['unique_values'].tolist(),
+                    'metadata': json.loads(str(entry['metadata'])) if 'metadata' in entry else {}
+                }
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        if tuple(result['mask'].shape) != tuple(int(n) for n in shape):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return result
+
+    def put(self, digest, shape, mask, unique_values, metadata=None):
+        """Store a processed mask, then evict old entries beyond the size bound."""
+        path = self.path(digest, shape)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(
+                    f, mask=mask, unique_values=np.asarray(unique_values),
+                    metadata=np.asarray(json.dumps(metadata or {}, default=_json_value))
+                )
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not cache ROI mask {path}: {str(e)}")
+            return
+        self.evict()
+
+    def _entries(self):
+        """``(mtime, size, path)`` of every entry, oldest first."""
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            if not name.endswith('.npz'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        return entries
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits ``max_bytes``."""
+        if not self.max_bytes:
+            return 0
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        if removed:
+            self.evictions += removed
+            logger.info(f"Evicted {removed} cached ROI masks")
+        return removed
+
+    def invalidate(self, digest=None, shape=None):
+        """
+        Remove entries.
+
+        Args:
+            digest (str, optional): Only entries of this NIfTI content (a
+                digest prefix matches every digest it starts).
+            shape (tuple, optional): Only entries for this target grid.
+
+        Returns:
+            int: Number of entries removed.
+        """
+        prefix = digest[:32] if digest else None
+        suffix = f"-{grid_key(shape)}.npz" if shape else '.npz'
+        removed = 0
+        for _, _, path in self._entries():
+            name = os.path.basename(path)
+            if (prefix is None or name.split('-', 1)[0].startswith(prefix)) and name.endswith(suffix):
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def stats(self):
+        """Return cache totals and this worker's counters."""
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+def init_mask_cache(app):
+    """Create the processed ROI mask cache for an app (None if disabled)."""
+    if not app.config['MASK_CACHE_ENABLED']:
+        app.extensions['mask_cache'] = None
+        return None
+    cache = MaskCache(
+        os.path.join(app.config['UPLOAD_FOLDER'], MASK_CACHE_DIR),
+        app.config['MASK_CACHE_MAX_BYTES']
+    )
+    app.extensions['mask_cache'] = cache
+    return cache
+
+def get_mask_cache():
+    """Get the processed ROI mask cache of the current app (None if disabled)."""
+    return current_app.extensions.get('mask_cache')
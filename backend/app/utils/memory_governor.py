@@ -0,0 +1,368 @@
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+import numpy as np
+from flask import current_app, jsonify
+
+from app.utils.session_store import release_lock
+
+logger = logging.getLogger(__name__)
+
+USAGE_KEY = 'memgov:usage'
+LOCK_KEY = 'memgov:lock'
+LOADING_TTL = 600  # Seconds a reservation survives without a session (a first load)
+
+# Bytes per voxel of a decoded volume (float32) and of an ROI mask (uint8)
+VOLUME_ITEMSIZE = np.dtype(np.float32).itemsize
+MASK_ITEMSIZE = np.dtype(np.uint8).itemsize
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when a load does not fit in the memory budget."""
+
+    def __init__(self, message, required, available, retry=True):
+        super().__init__(message)
+        self.required = required
+        self.available = available
+        self.retry = retry  # Whether waiting can help (False: over the limits on its own)
+
+def estimate_volume_bytes(shape, metadata=None, isotropic=False, spacing=None, storage='memory'):
+    """
+    Estimate the memory a volume load takes.
+
+    Args:
+        shape (tuple): Shape of the series (from its index or header).
+        metadata (dict, optional): Metadata with the voxel spacing (needed
+            for isotropic resampling).
+        isotropic (bool, optional): Whether the volume is resampled.
+        spacing (float, optional): Target spacing of the resampling in mm.
+        storage (str, optional): ``memory`` or ``bricks``.
+
+    Returns:
+        int: Peak bytes while loading (decoded and resampled copies).
+        int: Bytes held by the session afterwards (0 for brick storage,
+            whose caches are bounded separately).
+    """
+    from app.utils.dicom_utils import get_isotropic_info
+
+    volume_bytes = int(np.prod(shape)) * VOLUME_ITEMSIZE
+    peak = volume_bytes
+    if isotropic:
+        info = get_isotropic_info(shape, metadata or {}, spacing)
+        resampled_shape = [
+            max(int(round(n * s / t)), 1)
+            for n, s, t in zip(shape, info['original_spacing'], info['spacing'])
+        ]
+        volume_bytes = int(np.prod(resampled_shape)) * VOLUME_ITEMSIZE
+        peak += volume_bytes
+    return peak, (0 if storage == 'bricks' else volume_bytes)
+
+def estimate_mask_bytes(nifti_paths, dicom_shape):
+    """
+    Estimate the memory of loading ROI masks from NIfTI files (headers only).
+
+    Returns:
+        int: Peak bytes while loading (masks so far plus one decoded file).
+        int: Bytes held by the session afterwards.
+    """
+    import nibabel as nib
+
+    mask_bytes = int(np.prod(dicom_shape)) * MASK_ITEMSIZE
+    largest = 0
+    for path in nifti_paths:
+        try:
+            voxels = int(np.prod(nib.load(path).shape))
+        except Exception:
+            voxels = int(np.prod(dicom_shape))
+        # get_fdata() decodes as float64, plus the binary mask
+        largest = max(largest, voxels * (np.dtype(np.float64).itemsize + MASK_ITEMSIZE))
+    resident = mask_bytes * len(nifti_paths)
+    return resident + largest, resident
+
+def _loading_key(user_id, part):
+    return f"memgov:loading:{user_id}|{part}"
+
+class Admission:
+    """
+    A memory reservation for one load, held while it runs.
+
+    ``commit`` replaces the reservation with what the session keeps;
+    ``cancel`` (or leaving a ``with`` block without committing) restores the
+    previous charge.
+    """
+
+    def __init__(self, governor, user_id, part, previous):
+        self.governor = governor
+        self.user_id = user_id
+        self.part = part
+        self.previous = previous
+        self.committed = False
+
+    def commit(self, nbytes):
+        """Charge the session what it keeps after the load."""
+        self.governor.set_usage(self.user_id, self.part, nbytes)
+        self.governor.redis.delete(_loading_key(self.user_id, self.part))
+        self.committed = True
+
+    def cancel(self):
+        """Give the reservation back (the load failed)."""
+        if not self.committed:
+            self.governor.set_usage(self.user_id, self.part, self.previous)
+            self.governor.redis.delete(_loading_key(self.user_id, self.part))
+            self.committed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cancel()
+        return False
+
+class MemoryGovernor:
+    """
+    Admission control for loads that allocate volumes and masks.
+
+    Every session is charged for what it holds, per part (``volume``,
+    ``rois``, ``tissue``), in a Redis hash shared by all workers. A load
+    first reserves its estimated peak: over the per-user budget it is
+    rejected outright; over the global budget, sessions idle for at least
+    ``evict_idle_seconds`` are evicted, least recently used first (their
+    shared volumes are then released by the registry sweep), and if that is
+    not enough the load waits up to ``queue_timeout`` seconds for memory to
+    free before it is rejected. A budget of 0 disables that limit.
+
+    Volumes shared by several sessions are charged to each of them, so the
+    global total is an upper bound of the memory in use.
+    """
+
+    def __init__(self, redis_client, budget_bytes, user_budget_bytes, session_timeout,
+                 evict_idle_seconds=600, queue_timeout=10.0, poll_interval=0.25, registry=None):
+        self.redis = redis_client
+        self.budget_bytes = budget_bytes
+        self.user_budget_bytes = user_budget_bytes
+        self.session_timeout = session_timeout
+        self.evict_idle_seconds = evict_idle_seconds
+        self.queue_timeout = queue_timeout
+        self.poll_interval = poll_interval
+        self.registry = registry
+        self.evictions = 0
+        self.rejections = 0
+
+    def set_usage(self, user_id, part, nbytes):
+        """Set (or with None, clear) a session's charge for one part."""
+        if nbytes is None:
+            self.redis.hdel(USAGE_KEY, f"{user_id}|{part}")
+        else:
+            self.redis.hset(USAGE_KEY, f"{user_id}|{part}", int(nbytes))
+
+    def release(self, user_id, *parts):
+        """Clear a session's charges (all parts if none are given)."""
+        if parts:
+            self.redis.hdel(USAGE_KEY, *[f"{user_id}|{part}" for part in parts])
+            return
+        fields = [field for field in self.redis.hkeys(USAGE_KEY) if field.decode().split('|', 1)[0] == user_id]
+        if fields:
+            self.redis.hdel(USAGE_KEY, *fields)
+
+    def usage(self):
+        """
+        Current charges, without those of expired sessions.
+
+        Returns:
+            dict: ``{user_id: {part: bytes}}``.
+        """
+        usage = {}
+        for field, nbytes in self.redis.hgetall(USAGE_KEY).items():
+            user_id, part = field.decode().split('|', 1)
+            usage.setdefault(user_id, {})[part] = int(nbytes)
+
+        # Sessions time out silently; so do their charges, except for loads
+        # still in flight (a first load has no session yet)
+        charges = [(user_id, part) for user_id, parts in usage.items() for part in parts]
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id, part in charges:
+            pipe.exists(f"session:{user_id}", _loading_key(user_id, part))
+        expired = [charge for charge, alive in zip(charges, pipe.execute()) if not alive]
+        for user_id, part in expired:
+            self.redis.hdel(USAGE_KEY, f"{user_id}|{part}")
+            del usage[user_id][part]
+            if not usage[user_id]:
+                del usage[user_id]
+        return usage
+
+    @contextmanager
+    def _locked(self, timeout=30):
+        # Admission decisions of all workers are serialized (SET NX and a WATCH
+        # transaction rather than redis-py's Lock, which needs Lua scripting)
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        while not self.redis.set(LOCK_KEY, token, nx=True, ex=timeout):
+            if time.monotonic() >= deadline:
+                raise MemoryBudgetExceeded("Timed out waiting for memory admission", 0, 0, retry=True)
+            time.sleep(0.01)
+        try:
+            yield
+        finally:
+            release_lock(self.redis, LOCK_KEY, token)
+
+    def admit(self, user_id, part, nbytes):
+        """
+        Reserve memory for a load, evicting idle sessions or waiting if needed.
+
+        Args:
+            user_id (str): The loading user.
+            part (str): Which part of the session the load replaces.
+            nbytes (int): Estimated peak bytes of the load.
+
+        Returns:
+            Admission: The reservation (a context manager).
+
+        Raises:
+            MemoryBudgetExceeded: If the load does not fit.
+        """
+        nbytes = int(nbytes)
+        deadline = time.monotonic() + self.queue_timeout
+        while True:
+            with self._locked():
+                usage = self.usage()
+                mine = usage.get(user_id, {})
+                previous = mine.get(part)
+
+                # The load replaces this part of the session, so its current charge does not count
+                user_other = sum(v for p, v in mine.items() if p != part)
+                if self.user_budget_bytes and user_other + nbytes > self.user_budget_bytes:
+                    self.rejections += 1
+                    raise MemoryBudgetExceeded(
+                        f"Load needs {nbytes} bytes, over the per-user memory budget",
+                        nbytes, max(self.user_budget_bytes - user_other, 0), retry=False
+                    )
+                if self.budget_bytes and nbytes > self.budget_bytes:
+                    self.rejections += 1
+                    raise MemoryBudgetExceeded(
+                        f"Load needs {nbytes} bytes, over the server memory budget",
+                        nbytes, self.budget_bytes, retry=False
+                    )
+
+                total = sum(sum(parts.values()) for parts in usage.values()) - (previous or 0)
+                if self.budget_bytes and total + nbytes > self.budget_bytes:
+                    total -= self._evict_idle(usage, user_id, total + nbytes - self.budget_bytes)
+                if not self.budget_bytes or total + nbytes <= self.budget_bytes:
+                    self.set_usage(user_id, part, nbytes)
+                    self.redis.set(_loading_key(user_id, part), 1, ex=LOADING_TTL)
+                    return Admission(self, user_id, part, previous)
+
+            if time.monotonic() >= deadline:
+                self.rejections += 1
+                raise MemoryBudgetExceeded(
+                    f"Load needs {nbytes} bytes and the server memory budget is in use",
+                    nbytes, max(self.budget_bytes - total, 0), retry=True
+                )
+            time.sleep(self.poll_interval)
+
+    def _evict_idle(self, usage, requester, needed):
+        """Evict idle sessions, least recently used first, until ``needed`` bytes are freed."""
+        users = [user_id for user_id in usage if user_id != requester]
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id in users:
+            pipe.ttl(f"session:{user_id}")
+        # Every request refreshes the session TTL, so the TTL used up is the idle time
+        idle = {
+            user_id: self.session_timeout - ttl
+            for user_id, ttl in zip(users, pipe.execute()) if ttl >= 0
+        }
+        candidates = sorted(
+            (user_id for user_id, seconds in idle.items() if seconds >= self.evict_idle_seconds),
+            key=lambda user_id: idle[user_id], reverse=True
+        )
+
+        freed = 0
+        for user_id in candidates:
+            if freed >= needed:
+                break
+            freed += sum(usage[user_id].values())
+            self.evict_session(user_id)
+            logger.warning(f"Evicted idle session of {user_id} ({idle[user_id]}s idle) to admit a load")
+        if freed and self.registry is not None:
+            self.registry.sweep(force=True)
+        return freed
+
+    def evict_session(self, user_id):
+        """Drop a user's session and its charges (the user has to load again)."""
+        self.redis.delete(f"session:{user_id}")
+        self.release(user_id)
+        self.evictions += 1
+
+    def stats(self):
+        """Return totals of the current charges."""
+        usage = self.usage()
+        return {
+            'sessions': len(usage),
+            'bytes': sum(sum(parts.values()) for parts in usage.values()),
+            'budget_bytes': self.budget_bytes,
+            'user_budget_bytes': self.user_budget_bytes,
+            'evictions': self.evictions,
+            'rejections': self.rejections
+        }
+
+def _handle_budget_exceeded(error):
+    logger.warning(f"Rejecting load: {str(error)}")
+    response = jsonify({
+        "error": f"Not enough memory: {str(error)}",
+        "required_bytes": error.required,
+        "available_bytes": error.available
+    })
+    if error.retry:
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+    else:
+        response.status_code = 413
+    return response
+
+def init_memory_governor(app):
+    """Create the memory governor for an app and register its error handler."""
+    app.register_error_handler(MemoryBudgetExceeded, _handle_budget_exceeded)
+    if not app.config['MEMORY_ADMISSION_ENABLED']:
+        app.extensions['memory_governor'] = None
+        return None
+
+    governor = MemoryGovernor(
+        app.extensions['redis'],
+        app.config['MEMORY_BUDGET_BYTES'],
+        app.config['MEMORY_USER_BUDGET_BYTES'],
+        app.config['SESSION_TIMEOUT'],
+        evict_idle_seconds=app.config['MEMORY_EVICT_IDLE_SECONDS'],
+        queue_timeout=app.config['MEMORY_QUEUE_TIMEOUT'],
+        registry=app.extensions.get('shared_volumes')
+    )
+    app.extensions['memory_governor'] = governor
+    return governor
+
+def get_memory_governor():
+    """Get the memory governor of the current app (None if disabled)."""
+    return current_app.extensions.get('memory_governor')
+
+class _Unlimited:
+    def commit(self, nbytes):
+        pass
+
+    def cancel(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+def admit_load(user_id, part, nbytes):
+    """Reserve memory for a load with the app's governor (no-op if disabled)."""
+    governor = get_memory_governor()
+    if governor is None:
+        return _Unlimited()
+    return governor.admit(user_id, part, nbytes)
+
+def release_load(user_id, *parts):
+    """Clear a session's charges for parts it no longer holds (no-op if disabled)."""
+    governor = get_memory_governor()
+    if governor is not None:
+        governor.release(user_id, *parts)
@@ -0,0 +1,154 @@
+import struct
+import logging
+import numpy as np
+
+from app.utils.timing import stage
+
+logger = logging.getLogger(__name__)
+
+MESH_FORMATS = {
+    'ply': 'application/octet-stream',
+    'stl': 'model/stl',
+    'npz': 'application/octet-stream'
+}
+
+def roi_bounding_box(mask, value=None):
+    """
+    Bounding box of an ROI, padded by one voxel so surfaces close.
+
+    Args:
+        mask (numpy.ndarray): The 3D ROI mask.
+        value (int, optional): Only voxels with this label (default: any non-zero).
+
+    Returns:
+        tuple: ``(start, stop)`` voxel corners of the padded box, or None
+        if the ROI is empty.
+    """
+    selected = mask == value if value is not None else mask != 0
+    start, stop = [], []
+    for axis in range(mask.ndim):
+        others = tuple(a for a in range(mask.ndim) if a != axis)
+        present = np.flatnonzero(selected.any(axis=others))
+        if present.size == 0:
+            return None
+        start.append(int(present[0]) - 1)
+        stop.append(int(present[-1]) + 2)
+    return tuple(start), tuple(stop)
+
+def crop_roi(mask, value=None):
+    """
+    Cut an ROI out of its mask as a binary volume.
+
+    Args:
+        mask (numpy.ndarray): The 3D ROI mask.
+        value (int, optional): Only voxels with this label (default: any non-zero).
+
+    Returns:
+        numpy.ndarray: ``uint8`` crop of the padded bounding box (zeros
+        outside the mask), or None if the ROI is empty.
+        tuple: Voxel position of the crop's first corner.
+    """
+    box = roi_bounding_box(mask, value)
+    if box is None:
+        return None, None
+    start, stop = box
+
+    crop = np.zeros([b - a for a, b in zip(start, stop)], dtype=np.uint8)
+    # The padding may reach outside the volume
+    source = tuple(slice(max(a, 0), min(b, n)) for a, b, n in zip(start, stop, mask.shape))
+    target = tuple(slice(s.start - a, s.stop - a) for s, a in zip(source, start))
+    region = mask[source]
+    crop[target] = (region == value) if value is not None else (region != 0)
+    return crop, start
+
+def build_mesh(crop, origin, spacing, step_size=1, smoothing=0.0):
+    """
+    Triangulate the surface of a binary ROI crop.
+
+    Args:
+        crop (numpy.ndarray): Binary volume from ``crop_roi``.
+        origin (tuple): Voxel position of the crop in the full volume.
+        spacing (tuple): ``(slice, row, column)`` voxel spacing in mm.
+        step_size (int, optional): Marching cubes step in voxels; larger
+            steps decimate the mesh (roughly ``1 / step_size²`` the faces).
+        smoothing (float, optional): Gaussian sigma in voxels applied to the
+            mask before meshing (0 keeps the voxel staircase).
+
+    Returns:
+        numpy.ndarray: ``(n, 3)`` float32 vertices as ``(x, y, z)`` in mm.
+        numpy.ndarray: ``(m, 3)`` uint32 triangle vertex indices.
+    """
+    from skimage.measure import marching_cubes
+
+    volume = crop.astype(np.float32)
+    if smoothing > 0:
+        from scipy.ndimage import gaussian_filter
+        with stage('mesh_smooth'):
+            volume = gaussian_filter(volume, sigma=smoothing)
+
+    with stage('marching_cubes'):
+        verts, faces, _normals, _values = marching_cubes(
+            volume, level=0.5, spacing=tuple(float(s) for s in spacing),
+            step_size=max(int(step_size), 1), allow_degenerate=False
+        )
+
+    verts += np.asarray(origin, dtype=np.float64) * np.asarray(spacing, dtype=np.float64)
+    # (slice, row, column) -> (x, y, z)
+    return verts[:, ::-1].astype(np.float32), faces.astype(np.uint32)
+
+def encode_binary_stl(verts, faces, name='roi'):
+    """Encode a mesh as binary STL (per-triangle normals, no shared vertices)."""
+    triangles = verts[faces]
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    normals = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+
+    records = np.zeros(len(faces), dtype=[('normal', '<f4', 3), ('vertices', '<f4', (3, 3)), ('attributes', '<u2')])
+    records['normal'] = normals
+    records['vertices'] = triangles
+    header = name.encode('ascii', 'replace')[:80].ljust(80, b' ')
+    return header + struct.pack('<I', len(faces)) + records.tobytes()
+
+def encode_binary_ply(verts, faces, name='roi'):
+    """Encode a mesh as indexed binary little-endian PLY."""
+    header = (
+        "ply\n"
+        "format binary_little_endian 1.0\n"
+        f"comment {name}\n"
+        f"element vertex {len(verts)}\n"
+        "property float x\nproperty float y\nproperty float z\n"
+        f"element face {len(faces)}\n"
+        "property list uchar uint vertex_indices\n"
+        "end_header\n"
+    ).encode('ascii', 'replace')
+    records = np.empty(len(faces), dtype=[('count', 'u1'), ('indices', '<u4', 3)])
+    records['count'] = 3
+    records['indices'] = faces
+    return header + verts.astype('<f4').tobytes() + records.tobytes()
+
+def encode_npz(verts, faces, name='roi'):
+    """Encode a mesh as a compressed ``.npz`` with ``vertices`` and ``faces`` arrays."""
+    from io import BytesIO
+    buf = BytesIO()
+    np.savez_compressed(buf, vertices=verts, faces=faces)
+    return buf.getvalue()
+
+ENCODERS = {
+    'ply': encode_binary_ply,
+    'stl': encode_binary_stl,
+    'npz': encode_npz
+}
+
+def mesh_roi_crop(crop, origin, spacing, step_size=1, smoothing=0.0, fmt='ply', name='roi'):
+    """
+    Build and encode the mesh of one ROI crop (a picklable render-pool job).
+
+    Returns:
+        bytes: The encoded mesh.
+        int: Number of vertices.
+        int: Number of faces.
+    """
+    verts, faces = build_mesh(crop, origin, spacing, step_size, smoothing)
+    with stage('encode'):
+        data = ENCODERS[fmt](verts, faces, name)
+    return data, len(verts), len(faces)
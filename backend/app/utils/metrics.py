@@ -0,0 +1,303 @@
+import os
+import time
+import logging
+from time import perf_counter
+from flask import current_app, g, request
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SLICE_COUNT_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048)
+
+# name -> (type, help)
+METRICS = {
+    'http_requests_total': ('counter', 'Requests by route, method and status.'),
+    'http_request_duration_seconds': ('histogram', 'Request latency by route.'),
+    'http_response_bytes_total': ('counter', 'Response body bytes served by route.'),
+    'http_requests_in_flight': ('gauge', 'Requests currently being handled, per worker.'),
+    'dicom_load_duration_seconds': ('histogram', 'Time to load a DICOM series.'),
+    'dicom_load_slices': ('histogram', 'Number of slices per loaded DICOM series.'),
+    'process_resident_memory_bytes': ('gauge', 'Resident memory of each worker process.'),
+    'render_pool_jobs_in_flight': ('gauge', 'Render jobs running or queued, per worker.'),
+    'cache_hits_total': ('counter', 'Cache hits, per cache and worker.'),
+    'cache_misses_total': ('counter', 'Cache misses, per cache and worker.'),
+    'cache_evictions_total': ('counter', 'Cache evictions, per cache and worker.'),
+    'cache_entries': ('gauge', 'Entries held, per cache and worker.'),
+    'cache_bytes': ('gauge', 'Bytes held, per cache and worker.'),
+    'shared_volumes_loaded': ('gauge', 'Arrays published in shared memory, by kind.'),
+    'shared_volumes_bytes': ('gauge', 'Bytes published in shared memory, by kind.'),
+    'shared_volumes_budget_bytes': ('gauge', 'Shared memory budget for published arrays.'),
+}
+
+WORKER_TTL = 300  # Seconds a silent worker's gauges are kept
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+def format_labels(labels):
+    """Render labels in Prometheus exposition syntax (sorted for stable keys)."""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items())) + '}'
+
+def resident_memory_bytes():
+    """Current resident set size of this process."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        # ru_maxrss is the peak, in kilobytes on Linux; the best we can do elsewhere
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class MetricsRegistry:
+    """
+    Prometheus-style metrics aggregated across worker processes through Redis.
+
+    Counters and histograms are incremented directly in shared Redis hashes,
+    so every worker contributes to the same series. Per-worker gauges and
+    in-process cache counters are published as snapshots under a per-worker
+    key that expires when the worker stops reporting. Any worker can render
+    the full exposition.
+    """
+
+    def __init__(self, redis_client, prefix='metrics', snapshot_interval=5.0):
+        self.redis = redis_client
+        self.prefix = prefix
+        self.snapshot_interval = snapshot_interval
+        self.worker = str(os.getpid())
+        self._last_snapshot = 0.0
+        self._cache_providers = {}
+        self._gauge_providers = []
+
+    def _key(self, kind, name):
+        return f"{self.prefix}:{kind}:{name}"
+
+    def inc(self, name, labels=None, amount=1, pipe=None):
+        """Increment a counter."""
+        (pipe or self.redis).hincrbyfloat(self._key('counter', name), format_labels(labels), amount)
+
+    def observe(self, name, value, labels=None, buckets=LATENCY_BUCKETS, pipe=None):
+        """Record one observation in a histogram."""
+        target = pipe or self.redis.pipeline(transaction=False)
+        key = self._key('histogram', name)
+        label_str = format_labels(labels)
+        bucket = next((b for b in buckets if value <= b), '+Inf')
+        target.hincrby(key, f"{label_str}|{bucket}", 1)
+        target.hincrbyfloat(key, f"{label_str}|sum", value)
+        target.hincrby(key, f"{label_str}|count", 1)
+        if pipe is None:
+            target.execute()
+
+    def register_cache(self, name, stats_fn):
+        """
+        Report an in-process cache.
+
+        Args:
+            name (str): Cache label.
+            stats_fn (callable): Returns a dict with ``hits`` and ``misses``
+                and optionally ``evictions``, ``entries`` and ``bytes``.
+        """
+        self._cache_providers[name] = stats_fn
+
+    def register_gauges(self, gauges_fn):
+        """Report per-worker gauges; ``gauges_fn`` returns ``{metric_name: value}``."""
+        self._gauge_providers.append(gauges_fn)
+
+    def worker_started(self, pipe):
+        self._sync_pid()
+        pipe.hincrby(self._key('worker', self.worker), 'http_requests_in_flight', 1)
+
+    def worker_finished(self, pipe):
+        pipe.hincrby(self._key('worker', self.worker), 'http_requests_in_flight', -1)
+        pipe.expire(self._key('worker', self.worker), WORKER_TTL)
+
+    def _sync_pid(self):
+        # Workers forked from a preloaded app inherit the parent's pid
+        pid = str(os.getpid())
+        if pid != self.worker:
+            self.worker = pid
+            self._last_snapshot = 0.0
+
+    def snapshot(self, force=False, pipe=None):
+        """Publish this worker's gauges and cache counters (throttled)."""
+        now = time.monotonic()
+        if not force and now - self._last_snapshot < self.snapshot_interval:
+            return
+        self._last_snapshot = now
+
+        values = {'process_resident_memory_bytes': resident_memory_bytes()}
+        for provider in self._gauge_providers:
+            values.update(provider())
+        for cache, stats_fn in self._cache_providers.items():
+            stats = stats_fn()
+            for stat in ('hits', 'misses', 'evictions'):
+                if stat in stats:
+                    values[f"cache_{stat}_total|{cache}"] = stats[stat]
+            for stat in ('entries', 'bytes'):
+                if stat in stats:
+                    values[f"cache_{stat}|{cache}"] = stats[stat]
+
+        target = pipe or self.redis.pipeline(transaction=False)
+        key = self._key('worker', self.worker)
+        target.hset(key, mapping=values)
+        target.expire(key, WORKER_TTL)
+        if pipe is None:
+            target.execute()
+
+    def _header(self, lines, name):
+        metric_type, help_text = METRICS.get(name, ('untyped', ''))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+
+    def render(self, extra_gauges=None):
+        """
+        Render every metric in Prometheus text exposition format.
+
+        Args:
+            extra_gauges (dict, optional): ``{name: [(labels, value), ...]}``
+                computed at scrape time.
+        """
+        lines = []
+
+        for name, (metric_type, _) in METRICS.items():
+            if metric_type == 'counter':
+                values = self.redis.hgetall(self._key('counter', name))
+                if values:
+                    self._header(lines, name)
+                    for labels, value in sorted(values.items()):
+                        lines.append(f"{name}{labels.decode()} {_format_value(value)}")
+            elif metric_type == 'histogram':
+                values = self.redis.hgetall(self._key('histogram', name))
+                if values:
+                    self._header(lines, name)
+                    lines.extend(self._render_histogram(name, values))
+
+        # Per-worker snapshots
+        per_metric = {}
+        for key in self.redis.scan_iter(match=self._key('worker', '*')):
+            worker = key.decode().rsplit(':', 1)[1]
+            for field, value in self.redis.hgetall(key).items():
+                metric, _, cache = field.decode().partition('|')
+                labels = {'worker': worker}
+                if cache:
+                    labels['cache'] = cache
+                per_metric.setdefault(metric, []).append((labels, float(value)))
+
+        for name, samples in list(per_metric.items()) + list((extra_gauges or {}).items()):
+            self._header(lines, name)
+            for labels, value in sorted(samples, key=lambda s: format_labels(s[0])):
+                lines.append(f"{name}{format_labels(labels)} {_format_value(value)}")
+
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _render_histogram(name, values):
+        series = {}
+        for field, value in values.items():
+            labels, _, part = field.decode().rpartition('|')
+            series.setdefault(labels, {})[part] = float(value)
+
+        lines = []
+        for labels, parts in sorted(series.items()):
+            inner = labels[1:-1] + ',' if labels else ''
+            count = parts.pop('count', 0.0)
+            total = parts.pop('sum', 0.0)
+            parts.pop('+Inf', None)
+
+            cumulative = 0.0
+            for bound in sorted(parts, key=float):
+                cumulative += parts[bound]
+                lines.append(f'{name}_bucket{{{inner}le="{float(bound):g}"}} {_format_value(cumulative)}')
+            lines.append(f'{name}_bucket{{{inner}le="+Inf"}} {_format_value(count)}')
+            lines.append(f"{name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{name}_count{labels} {_format_value(count)}")
+        return lines
+
+def _route_label():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def _before_request_metrics():
+    metrics = current_app.extensions['metrics']
+    g.metrics_start = perf_counter()
+    try:
+        pipe = metrics.redis.pipeline(transaction=False)
+        metrics.worker_started(pipe)
+        pipe.execute()
+        g.metrics_in_flight = True
+    except Exception as e:
+        logger.warning(f"Failed to record request start metrics: {str(e)}")
+
+def _after_request_metrics(response):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return response
+
+    metrics = current_app.extensions['metrics']
+    route = _route_label()
+    try:
+        pipe = metrics.redis.pipeline(transaction=False)
+        metrics.observe('http_request_duration_seconds', perf_counter() - start,
+                        {'route': route, 'method': request.method}, pipe=pipe)
+        metrics.inc('http_requests_total',
+                    {'route': route, 'method': request.method, 'status': response.status_code}, pipe=pipe)
+        if not response.is_streamed and response.content_length:
+            metrics.inc('http_response_bytes_total', {'route': route}, response.content_length, pipe=pipe)
+        if g.pop('metrics_in_flight', False):
+            metrics.worker_finished(pipe)
+        metrics.snapshot(pipe=pipe)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to record request metrics: {str(e)}")
+    return response
+
+def _teardown_request_metrics(_exc=None):
+    # after_request does not run when a request fails with an unhandled error
+    if g.pop('metrics_in_flight', False):
+        metrics = current_app.extensions['metrics']
+        try:
+            pipe = metrics.redis.pipeline(transaction=False)
+            metrics.worker_finished(pipe)
+            pipe.execute()
+        except Exception:
+            pass
+
+def init_metrics(app):
+    """Create the metrics registry for an app and record request metrics."""
+    if not app.config['METRICS_ENABLED']:
+        app.extensions['metrics'] = None
+        return None
+
+    metrics = MetricsRegistry(
+        app.extensions['redis'],
+        snapshot_interval=app.config['METRICS_SNAPSHOT_INTERVAL']
+    )
+    app.extensions['metrics'] = metrics
+
+    image_cache = app.extensions.get('image_cache')
+    if image_cache is not None:
+        metrics.register_cache('rendered_image', image_cache.stats)
+
+    prefetcher = app.extensions.get('prefetcher')
+    if prefetcher is not None:
+        def prefetch_stats():
+            stats = prefetcher.stats()
+            return {'hits': stats['prefetch_hits'], 'misses': stats['requests'] - stats['prefetch_hits']}
+        metrics.register_cache('prefetch', prefetch_stats)
+
+    render_pool = app.extensions.get('render_pool')
+    if render_pool is not None:
+        metrics.register_gauges(lambda: {'render_pool_jobs_in_flight': render_pool.in_flight})
+
+    app.before_request(_before_request_metrics)
+    app.after_request(_after_request_metrics)
+    app.teardown_request(_teardown_request_metrics)
+    return metrics
+
+def get_metrics():
+    """Get the metrics registry of the current app (None if disabled)."""
+    return current_app.extensions.get('metrics')
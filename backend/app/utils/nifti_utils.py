@@ -1,14 +1,23 @@
 import os
 import numpy as np
-import nibabel as nib
-from scipy.ndimage import zoom
 import logging
-import matplotlib.pyplot as plt
-from matplotlib.colors import LinearSegmentedColormap
 from io import BytesIO
 
+from app.utils.timing import stage, timed
+from app.utils.dicom_utils import resample_to_shape, apply_windowing
+from app.utils.overlay_kernel import fused_overlay
+
 logger = logging.getLogger(__name__)
 
+def get_nifti_label(file_path):
+    """ROI label of a NIfTI file: its name without ``.nii`` / ``.nii.gz``."""
+    label = os.path.splitext(os.path.basename(file_path))[0]
+    
+    # Handle .nii.gz case for label
+    if label.endswith('.nii'):
+        label = os.path.splitext(label)[0]
+    return label
+
 def load_nifti_file(file_path):
     """
     Load a NIfTI file and extract the volume data and metadata.
@@ -20,6 +29,8 @@ def load_nifti_file(file_path):
         numpy.ndarray: The 3D volume data.
         dict: Metadata extracted from the NIfTI file.
     """
+    import nibabel as nib
+    
     try:
         img = nib.load(file_path)
         data = img.get_fdata()
@@ -31,13 +42,9 @@ def load_nifti_file(file_path):
             'Data Type': str(img.header.get_data_dtype()),
             'Affine': img.affine.tolist(),
             'Filename': os.path.basename(file_path),
-            'Label': os.path.splitext(os.path.basename(file_path))[0]
+            'Label': get_nifti_label(file_path)
         }
         
-        # Handle .nii.gz case for label
-        if metadata['Label'].endswith('.nii'):
-            metadata['Label'] = os.path.splitext(metadata['Label'])[0]
-        
         return data, metadata
     except Exception as e:
         logger.error(f"Error loading NIfTI file: {str(e)}")
@@ -58,27 +65,46 @@ def resample_nifti(nifti_data, original_shape, target_shape):
     if original_shape == target_shape:
         return nifti_data
     
-    # Calculate resize factors
-    resize_factors = [t / o for t, o in zip(target_shape, original_shape)]
-    
-    # Perform resampling
-    # Use order=0 (nearest neighbor) to preserve label values
-    resampled = zoom(nifti_data, resize_factors, order=0, mode='nearest')
-    
-    # Ensure the output shape matches exactly
-    if resampled.shape != target_shape:
-        logger.warning(f"Resampling didn't produce exact target shape. Got {resampled.shape}, expected {target_shape}")
-        
-        # Pad or crop if necessary
-        pad_width = [(0, max(0, target_shape[i] - resampled.shape[i])) for i in range(len(target_shape))]
-        resampled = np.pad(resampled, pad_width)
-        
-        # Crop if larger
-        if any(resampled.shape[i] > target_shape[i] for i in range(len(target_shape))):
-            slices = tuple(slice(0, target_shape[i]) for i in range(len(target_shape)))
-            resampled = resampled[slices]
-    
-    return resampled
+    # Use order=0 (nearest neighbor) to preserve label values; same grid as
+    # the volume resampling so masks line up with resampled volumes
+    return resample_to_shape(nifti_data, target_shape, order=0)
+
+def encode_roi_nifti(mask, source_path, label_value=None):
+    """
+    Encode an ROI mask as NIfTI on the grid of the file it was loaded from.
+
+    The mask is resampled back to the source shape (nearest neighbor, the
+    inverse of ``resample_nifti``) and written with the source affine and
+    header, so the result overlays the original image like the source did.
+
+    Args:
+        mask (numpy.ndarray): The ROI mask on the DICOM grid.
+        source_path (str): Path to the NIfTI file the ROI came from.
+        label_value (int, optional): Write this value for the voxels of a
+            binary mask (e.g. the source's label value) instead of 1.
+
+    Returns:
+        bytes: The NIfTI file (gzipped if the source is ``.nii.gz``).
+    """
+    import gzip
+    import nibabel as nib
+
+    source = nib.load(source_path)
+    with stage('roi_resample'):
+        data = resample_nifti(np.asarray(mask), mask.shape, source.shape[:3])
+    if label_value is not None and label_value != 1:
+        data = np.where(data != 0, np.uint8(label_value), np.uint8(0))
+
+    header = source.header.copy()
+    header.set_data_dtype(np.uint8)
+    header.set_slope_inter(1, 0)
+    image_class = type(source) if isinstance(source, (nib.Nifti1Image, nib.Nifti2Image)) else nib.Nifti1Image
+    with stage('encode'):
+        image = image_class(np.ascontiguousarray(data, dtype=np.uint8), source.affine, header)
+        data = image.to_bytes()
+    if source_path.lower().endswith('.gz'):
+        data = gzip.compress(data, compresslevel=1)
+    return data
 
 def create_roi_masks(nifti_files, dicom_shape):
     """
@@ -126,7 +152,20 @@ def create_roi_masks(nifti_files, dicom_shape):
     
     return roi_masks
 
-def apply_roi_overlay(dicom_slice, roi_slices, alpha=0.5, colormap=None):
+ROI_COLORS = [
+    [1.0, 0.0, 0.0],  # Red
+    [0.0, 1.0, 0.0],  # Green
+    [0.0, 0.0, 1.0],  # Blue
+    [1.0, 1.0, 0.0],  # Yellow
+    [1.0, 0.0, 1.0],  # Magenta
+    [0.0, 1.0, 1.0],  # Cyan
+    [1.0, 0.5, 0.0],  # Orange
+    [0.5, 0.0, 1.0],  # Purple
+    [0.0, 0.5, 0.0],  # Dark Green
+]
+
+@timed('overlay')
+def apply_roi_overlay(dicom_slice, roi_slices, alpha=0.5, colormap=None, value_range=None):
     """
     Apply ROI overlays to a DICOM slice.
     
@@ -135,30 +174,23 @@ def apply_roi_overlay(dicom_slice, roi_slices, alpha=0.5, colormap=None):
         roi_slices (list): List of ROI slices to overlay.
         alpha (float, optional): Transparency of the overlay.
         colormap (list, optional): List of colors for each ROI.
+        value_range (tuple, optional): Known ``(min, max)`` of the slice
+            (from the volume statistics), so the pixels are not scanned.
         
     Returns:
         numpy.ndarray: The overlaid image.
     """
     # Normalize DICOM slice to [0, 1] if not already
-    if dicom_slice.max() > 1.0:
-        dicom_slice = (dicom_slice - dicom_slice.min()) / (dicom_slice.max() - dicom_slice.min())
+    low, high = value_range if value_range is not None else (dicom_slice.min(), dicom_slice.max())
+    if high > 1.0:
+        dicom_slice = (dicom_slice - low) / (high - low)
     
     # Create RGB image from grayscale DICOM
     rgb_image = np.stack([dicom_slice] * 3, axis=-1)
     
     # Default colormap if none provided
     if colormap is None:
-        colormap = [
-            [1.0, 0.0, 0.0],  # Red
-            [0.0, 1.0, 0.0],  # Green
-            [0.0, 0.0, 1.0],  # Blue
-            [1.0, 1.0, 0.0],  # Yellow
-            [1.0, 0.0, 1.0],  # Magenta
-            [0.0, 1.0, 1.0],  # Cyan
-            [1.0, 0.5, 0.0],  # Orange
-            [0.5, 0.0, 1.0],  # Purple
-            [0.0, 0.5, 0.0],  # Dark Green
-        ]
+        colormap = ROI_COLORS
     
     # Apply each ROI overlay
     for i, roi_slice in enumerate(roi_slices):
@@ -184,6 +216,7 @@ def apply_roi_overlay(dicom_slice, roi_slices, alpha=0.5, colormap=None):
     
     return np.clip(rgb_image, 0, 1)
 
+@timed('roi_slice')
 def get_roi_slice(roi_data, slice_index, axis=0):
     """
     Extract a 2D slice from a 3D ROI volume along a specified axis.
@@ -207,6 +240,153 @@ def get_roi_slice(roi_data, slice_index, axis=0):
     
     return slice_data
 
+def get_roi_overlay_layers(roi_masks, slice_index, axis=0):
+    """
+    Slice ROI masks into overlay layers.
+    
+    A multi-label ROI (one with a ``labels`` list of ``[value, name]`` pairs,
+    such as a tissue classification) becomes one layer per label so every
+    label gets its own color and legend entry.
+    
+    Args:
+        roi_masks (list): ROI dicts with ``'mask'`` and ``'label'``.
+        slice_index (int): The index of the slice to extract.
+        axis (int, optional): The axis along which to extract the slice.
+        
+    Returns:
+        list: ROI slices.
+        list: Layer names.
+    """
+    roi_slices = []
+    roi_names = []
+    for roi_mask in roi_masks:
+        roi_slice = get_roi_slice(roi_mask['mask'], slice_index, axis)
+        labels = roi_mask.get('labels')
+        if labels:
+            for value, name in labels:
+                roi_slices.append((roi_slice == value).astype(np.uint8))
+                roi_names.append(name)
+        else:
+            roi_slices.append(roi_slice)
+            roi_names.append(roi_mask['label'])
+    return roi_slices, roi_names
+
+CONTOUR_SCALE = 2  # Marching-squares vertices lie on a half-pixel grid
+
+def extract_contours(mask_slice, tolerance=0.5):
+    """
+    Trace the outlines of a binary mask slice as polylines.
+    
+    Uses marching squares on the mask's bounding box (padded so outlines
+    touching the border close), then Douglas-Peucker simplification.
+    
+    Args:
+        mask_slice (numpy.ndarray): 2D mask; non-zero pixels are inside.
+        tolerance (float, optional): Maximum deviation of the simplified
+            outline in pixels (0 keeps every vertex).
+        
+    Returns:
+        list: Closed polylines, each an ``(n, 2)`` array of ``(x, y)``
+        pixel coordinates with the first point repeated at the end.
+    """
+    from skimage.measure import find_contours, approximate_polygon
+    
+    rows = np.flatnonzero(mask_slice.any(axis=1))
+    if rows.size == 0:
+        return []
+    cols = np.flatnonzero(mask_slice.any(axis=0))
+    top, left = rows[0], cols[0]
+    crop = np.pad(mask_slice[top:rows[-1] + 1, left:cols[-1] + 1] != 0, 1).astype(np.uint8)
+    
+    contours = []
+    for contour in find_contours(crop, 0.5):
+        if tolerance > 0:
+            contour = approximate_polygon(contour, tolerance)
+        # (row, col) in the padded crop -> (x, y) in the slice
+        contours.append(np.column_stack((contour[:, 1] + left - 1, contour[:, 0] + top - 1)))
+    return contours
+
+def get_roi_contours(roi_mask, slice_index, axis=0, tolerance=0.5):
+    """
+    Vector outlines of one ROI on one slice.
+    
+    A multi-label ROI gets one entry per label present on the slice, a
+    plain ROI a single entry for all its non-zero voxels.
+    
+    Args:
+        roi_mask (dict): ROI dict with ``'mask'``, ``'label'`` and
+            optionally ``'labels'``.
+        slice_index (int): The index of the slice.
+        axis (int, optional): The axis of the slice.
+        tolerance (float, optional): Simplification tolerance in pixels.
+        
+    Returns:
+        list: ``{"value", "name", "paths"}`` dicts, paths as returned by
+        ``extract_contours``.
+    """
+    roi_slice = get_roi_slice(roi_mask['mask'], slice_index, axis)
+    labels = roi_mask.get('labels')
+    if not labels:
+        paths = extract_contours(roi_slice, tolerance)
+        return [{'value': 1, 'name': roi_mask['label'], 'paths': paths}] if paths else []
+    
+    layers = []
+    present = set(np.unique(roi_slice).tolist())
+    for value, name in labels:
+        if value in present:
+            layers.append({'value': value, 'name': name, 'paths': extract_contours(roi_slice == value, tolerance)})
+    return layers
+
+def encode_contour_path(path, encoding='delta'):
+    """
+    Encode a polyline for transfer.
+    
+    Args:
+        path (numpy.ndarray): ``(n, 2)`` pixel coordinates.
+        encoding (str, optional): ``'delta'`` for a flat list of integers
+            in 1/``CONTOUR_SCALE`` pixel units (first point absolute, then
+            differences), ``'none'`` for ``[[x, y], ...]`` in pixels.
+        
+    Returns:
+        list: The encoded path.
+    """
+    if encoding == 'none':
+        return path.tolist()
+    points = np.rint(path * CONTOUR_SCALE).astype(np.int64)
+    points[1:] -= points[:-1].copy()
+    return points.ravel().tolist()
+
+def create_roi_mask_image(slice_data):
+    """
+    Create a transparent PNG of a single ROI mask slice.
+    
+    Args:
+        slice_data (numpy.ndarray): The 2D ROI mask slice.
+        
+    Returns:
+        bytes: PNG image data as bytes.
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LinearSegmentedColormap
+    
+    # Create a custom colormap with transparency for zero values
+    colors = [(0, 0, 0, 0), (1, 0, 0, 1)]  # Transparent to red
+    cmap = LinearSegmentedColormap.from_list('custom_cmap', colors, N=2)
+    
+    with stage('render'):
+        fig, ax = plt.subplots(figsize=(10, 10))
+        ax.imshow(slice_data, cmap=cmap, interpolation='nearest')
+        ax.axis('off')
+        plt.tight_layout()
+    
+    with stage('encode'):
+        buf = BytesIO()
+        plt.savefig(buf, format='png', dpi=100, bbox_inches='tight', pad_inches=0, transparent=True)
+        plt.close(fig)
+        buf.seek(0)
+    
+    return buf.getvalue()
+
 def create_roi_colormap(n_colors=10):
     """
     Create a colormap for ROI visualization.
@@ -239,9 +419,11 @@ def create_roi_colormap(n_colors=10):
     colors = colors[:n_colors]
     
     # Create colormap
+    from matplotlib.colors import LinearSegmentedColormap
     return LinearSegmentedColormap.from_list('roi_colormap', colors, N=n_colors)
 
-def create_roi_overlay_image(dicom_slice, roi_slices, roi_names=None, colormap=None, alpha=0.5):
+def create_roi_overlay_image(dicom_slice, roi_slices, roi_names=None, colormap=None, alpha=0.5, value_range=None,
+                             window=None, kernel=None):
     """
     Create an image with ROI overlays.
     
@@ -251,38 +433,52 @@ def create_roi_overlay_image(dicom_slice, roi_slices, roi_names=None, colormap=N
         roi_names (list, optional): List of ROI names for the legend.
         colormap (list, optional): List of colors for each ROI.
         alpha (float, optional): Transparency of the overlay.
+        value_range (tuple, optional): Known ``(min, max)`` of the slice.
+        window (tuple, optional): ``(center, width)`` to apply to a raw slice.
+        kernel (str, optional): Fused overlay kernel (``'numba'`` or
+            ``'numpy'``, see ``fused_overlay``); None uses ``apply_roi_overlay``.
         
     Returns:
         bytes: PNG image data as bytes.
     """
+    import matplotlib.pyplot as plt
+    
     # Apply ROI overlay
-    overlaid_image = apply_roi_overlay(dicom_slice, roi_slices, alpha, colormap)
-    
-    # Create figure
-    fig, ax = plt.subplots(figsize=(10, 10))
-    ax.imshow(overlaid_image)
-    ax.axis('off')
-    
-    # Add legend if ROI names are provided
-    if roi_names is not None and len(roi_slices) > 0:
-        legend_elements = []
-        for i, name in enumerate(roi_names):
-            if i < len(roi_slices) and not np.all(roi_slices[i] == 0):
-                color_idx = i % len(colormap) if colormap else i
-                color = colormap[color_idx] if colormap else plt.cm.tab10(i / 10)
-                legend_elements.append(plt.Line2D([0], [0], marker='s', color='w',
-                                       markerfacecolor=color, markersize=10, label=name))
-        
-        if legend_elements:
-            ax.legend(handles=legend_elements, loc='upper right', fontsize='small', 
-                      framealpha=0.7, facecolor='white')
+    if kernel is not None:
+        overlaid_image = fused_overlay(dicom_slice, roi_slices, colormap or ROI_COLORS, alpha, value_range, window, kernel)
+    else:
+        if window is not None:
+            dicom_slice = apply_windowing(dicom_slice, *window)
+            value_range = (0.0, 1.0)
+        overlaid_image = apply_roi_overlay(dicom_slice, roi_slices, alpha, colormap, value_range)
     
-    plt.tight_layout()
+    with stage('render'):
+        # Create figure
+        fig, ax = plt.subplots(figsize=(10, 10))
+        ax.imshow(overlaid_image)
+        ax.axis('off')
+        
+        # Add legend if ROI names are provided
+        if roi_names is not None and len(roi_slices) > 0:
+            legend_elements = []
+            for i, name in enumerate(roi_names):
+                if i < len(roi_slices) and not np.all(roi_slices[i] == 0):
+                    color_idx = i % len(colormap) if colormap else i
+                    color = colormap[color_idx] if colormap else plt.cm.tab10(i / 10)
+                    legend_elements.append(plt.Line2D([0], [0], marker='s', color='w',
+                                           markerfacecolor=color, markersize=10, label=name))
+            
+            if legend_elements:
+                ax.legend(handles=legend_elements, loc='upper right', fontsize='small', 
+                          framealpha=0.7, facecolor='white')
+        
+        plt.tight_layout()
     
-    # Convert plot to PNG image
-    buf = BytesIO()
-    plt.savefig(buf, format='png', dpi=100, bbox_inches='tight', pad_inches=0)
-    plt.close(fig)
-    buf.seek(0)
+    # Convert plot to PNG image (savefig also rasterizes the figure)
+    with stage('encode'):
+        buf = BytesIO()
+        plt.savefig(buf, format='png', dpi=100, bbox_inches='tight', pad_inches=0)
+        plt.close(fig)
+        buf.seek(0)
     
     return buf.getvalue()
\ No newline at end of file
@@ -0,0 +1,169 @@
+import os
+import logging
+import threading
+import importlib.util
+import numpy as np
+from flask import current_app
+
+from app.utils.timing import timed
+
+logger = logging.getLogger(__name__)
+
+OVERLAY_KERNELS = ('numba', 'numpy')
+
+# numba takes longer to import than the rest of the app, so it is only
+# imported when the numba kernel first runs (or by warm-up)
+NUMBA_INSTALLED = importlib.util.find_spec('numba') is not None
+_numba = None
+_blend_numba = None
+_numba_lock = threading.Lock()
+
+def init_overlay_kernel(app):
+    """
+    Point numba's cache of compiled kernels at ``NUMBA_CACHE_DIR``.
+
+    numba otherwise writes its cache next to this module, which need not be
+    writable. The setting goes through the environment, which numba reads
+    when it is imported and render workers inherit.
+    """
+    cache_dir = app.config['NUMBA_CACHE_DIR']
+    if cache_dir:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+        except OSError as e:
+            logger.warning(f"Not caching compiled overlay kernels, {cache_dir} is not writable: {str(e)}")
+            cache_dir = ''
+    os.environ['NUMBA_CACHE_DIR'] = cache_dir
+
+def kernel_available(kernel):
+    """Whether an overlay kernel can run in this process."""
+    return kernel == 'numpy' or (kernel == 'numba' and NUMBA_INSTALLED)
+
+def resolve_kernel(kernel):
+    """The kernel to run for a requested one (numba falls back to numpy when not installed)."""
+    if kernel not in OVERLAY_KERNELS:
+        raise ValueError(f"Unknown overlay kernel: {kernel}")
+    return kernel if kernel_available(kernel) else 'numpy'
+
+def get_overlay_kernel():
+    """The overlay kernel configured for the current app, or None when it is off."""
+    kernel = current_app.config['OVERLAY_KERNEL']
+    return None if kernel == 'off' else resolve_kernel(kernel)
+
+def gray_scale(value_range=None, window=None):
+    """
+    Linear map of raw pixel values onto [0, 1] gray levels.
+
+    Args:
+        value_range (tuple, optional): Known ``(min, max)`` of the slice,
+            stretched to [0, 1] when it is not already within it.
+        window (tuple, optional): ``(center, width)``, with the bounds
+            ``apply_windowing`` uses; takes precedence over ``value_range``.
+
+    Returns:
+        float: The value mapped to 0.
+        float: The factor from value to gray level (0 for an empty window).
+    """
+    if window is not None:
+        center, width = window
+        low, high = center - width // 2, center + width // 2
+    elif value_range is not None and value_range[1] > 1.0:
+        low, high = value_range
+    else:
+        low, high = 0.0, 1.0
+    return float(low), (1.0 / (high - low) if high != low else 0.0)
+
+def _blend_numpy(image, low, scale, masks, colors, alpha, out):
+    gray = np.clip(np.subtract(image, low, dtype=np.float64) * scale, 0.0, 1.0)
+    rgb = np.repeat(gray[:, :, None], 3, axis=2)
+    for mask, color in zip(masks, colors):
+        inside = mask != 0
+        if not inside.any():
+            continue
+        weight = mask[inside].astype(np.float64)[:, None]
+        rgb[inside] = rgb[inside] * (1 - alpha) + weight * color * alpha
+    out[:, :, :3] = np.clip(rgb, 0.0, 1.0) * 255 + 0.5
+    out[:, :, 3] = 255
+
+def _blend_rows(image, low, scale, masks, colors, alpha, out):
+    # Compiled by _numba_kernel (prange is numba's parallel range)
+    rows, cols = image.shape
+    for row in _numba.prange(rows):
+        for col in range(cols):
+            gray = min(max((image[row, col] - low) * scale, 0.0), 1.0)
+            red, green, blue = gray, gray, gray
+            for layer in range(masks.shape[0]):
+                weight = masks[layer, row, col]
+                if weight != 0:
+                    red = red * (1 - alpha) + weight * colors[layer, 0] * alpha
+                    green = green * (1 - alpha) + weight * colors[layer, 1] * alpha
+                    blue = blue * (1 - alpha) + weight * colors[layer, 2] * alpha
+            out[row, col, 0] = np.uint8(min(max(red, 0.0), 1.0) * 255 + 0.5)
+            out[row, col, 1] = np.uint8(min(max(green, 0.0), 1.0) * 255 + 0.5)
+            out[row, col, 2] = np.uint8(min(max(blue, 0.0), 1.0) * 255 + 0.5)
+            out[row, col, 3] = 255
+
+def _numba_kernel():
+    """Import numba and wrap the numba kernel on first use."""
+    global _numba, _blend_numba
+    if _blend_numba is None:
+        with _numba_lock:
+            if _blend_numba is None:
+                import numba
+                _numba = numba
+                # Only cache to disk where init_overlay_kernel pointed numba
+                cache = bool(os.environ.get('NUMBA_CACHE_DIR'))
+                _blend_numba = numba.njit(parallel=True, cache=cache)(_blend_rows)
+    return _blend_numba
+
+@timed('overlay')
+def fused_overlay(dicom_slice, roi_slices, colors, alpha=0.5, value_range=None, window=None, kernel='numba'):
+    """
+    Window a raw slice, turn it to RGB and blend ROI layers over it in one pass.
+
+    Produces what windowing followed by ``apply_roi_overlay`` does, as
+    ``uint8`` RGBA: the slice and the masks are read once and each output
+    pixel is written once, instead of one full-image pass per step, ROI and
+    channel. The numba kernel runs the rows in parallel; the NumPy kernel is
+    the fallback when numba is not installed.
+
+    Args:
+        dicom_slice (numpy.ndarray): The raw 2D slice.
+        roi_slices (list): ROI slices to overlay, bottom layer first.
+        colors (list): ``[r, g, b]`` colors in [0, 1], cycled over the layers.
+        alpha (float, optional): Opacity of the ROI colors.
+        value_range (tuple, optional): Known ``(min, max)`` of the slice.
+        window (tuple, optional): ``(center, width)`` to apply.
+        kernel (str, optional): One of ``OVERLAY_KERNELS``.
+
+    Returns:
+        numpy.ndarray: ``(rows, cols, 4)`` uint8 image.
+    """
+    image = np.asarray(dicom_slice)
+    low, scale = gray_scale(value_range, window)
+    empty = np.zeros(image.shape, dtype=np.uint8)
+    layers = [empty if roi_slice is None else roi_slice for roi_slice in roi_slices]
+    masks = np.stack(layers) if layers else empty[None][:0]
+    palette = np.asarray(colors, dtype=np.float64)
+    palette = palette[np.arange(len(layers)) % len(palette)]
+
+    out = np.empty(image.shape + (4,), dtype=np.uint8)
+    if resolve_kernel(kernel) == 'numba':
+        _numba_kernel()(image, low, scale, masks, palette, float(alpha), out)
+    else:
+        _blend_numpy(image, low, scale, masks, palette, float(alpha), out)
+    return out
+
+def warm_overlay_kernel():
+    """
+    Compile (or load from numba's cache) the kernel for the slices it
+    usually gets: float32 volume slices in either layout, and float64
+    downsampled tiles.
+    """
+    if not NUMBA_INSTALLED:
+        return
+    mask = np.zeros((2, 2), dtype=np.uint8)
+    for dtype in (np.float32, np.float64):
+        volume = np.zeros((2, 2, 2), dtype=dtype)
+        for image in (volume[0], volume[:, :, 0]):
+            fused_overlay(image, [mask], [[1.0, 0.0, 0.0]], window=(0, 2))
@@ -0,0 +1,214 @@
+import time
+import threading
+import logging
+from functools import partial
+from flask import current_app
+
+from app.utils.render_pool import RenderQueueFull
+
+logger = logging.getLogger(__name__)
+
+class NavigationState:
+    """Recent navigation of one user within one view and window setting."""
+
+    def __init__(self, view, settings):
+        self.view = view
+        self.settings = settings
+        self.last_index = None
+        self.last_time = None
+        self.direction = 0
+        self.velocity = 0.0  # Slices per second, smoothed
+        self.pending = {}    # slice index -> Future
+
+class Prefetcher:
+    """
+    Speculatively renders slices ahead of each user's cursor.
+
+    Every served slice updates the user's navigation state (view, direction
+    and a smoothed velocity). Slices ahead of the cursor are then submitted
+    to the render pool, but only while it has idle workers, and the results
+    are stored in the rendered-image cache. Switching view, window settings
+    or visible ROIs cancels outstanding prefetches and discards late results.
+    """
+
+    def __init__(self, pool, cache, lookahead=2, max_lookahead=8, lead_time=0.5, smoothing=0.5):
+        self.pool = pool
+        self.cache = cache
+        self.lookahead = lookahead
+        self.max_lookahead = max_lookahead
+        self.lead_time = lead_time
+        self.smoothing = smoothing
+        self._states = {}
+        self._lock = threading.RLock()
+        self._counters = {
+            'requests': 0,
+            'prefetch_hits': 0,
+            'scheduled': 0,
+            'completed': 0,
+            'cancelled': 0,
+            'discarded': 0,
+            'failed': 0
+        }
+
+    @property
+    def enabled(self):
+        # Inline rendering has no idle workers to prefetch on
+        return self.pool.max_workers > 0 and self.max_lookahead > 0
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _cancel(self, state):
+        for future in state.pending.values():
+            if future.cancel():
+                self._counters['cancelled'] += 1
+        state.pending.clear()
+
+    def reset(self, user_id):
+        """Forget a user's navigation and cancel their pending prefetches."""
+        with self._lock:
+            state = self._states.pop(user_id, None)
+            if state is not None:
+                self._cancel(state)
+
+    def observe(self, user_id, view, slice_index, settings, prefetch_hit=False):
+        """
+        Record that a slice was served to a user.
+
+        Args:
+            user_id (str): The user id.
+            view (str): The view name (axial, coronal, sagittal).
+            slice_index (int): The served slice index.
+            settings (tuple): Hashable window/ROI settings of the request.
+            prefetch_hit (bool): Whether the image came from a prefetch.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._counters['requests'] += 1
+            if prefetch_hit:
+                self._counters['prefetch_hits'] += 1
+
+            state = self._states.get(user_id)
+            if state is None or state.view != view or state.settings != settings:
+                if state is not None:
+                    self._cancel(state)
+                state = NavigationState(view, settings)
+                self._states[user_id] = state
+            elif state.last_index is not None and slice_index != state.last_index:
+                step = slice_index - state.last_index
+                direction = 1 if step > 0 else -1
+                speed = abs(step) / max(now - state.last_time, 1e-3)
+                if direction != state.direction:
+                    # Reversal: the previous velocity says nothing about the new heading
+                    state.velocity = speed
+                    self._cancel(state)
+                else:
+                    state.velocity = self.smoothing * speed + (1 - self.smoothing) * state.velocity
+                state.direction = direction
+
+            state.last_index = slice_index
+            state.last_time = now
+            return state
+
+    def lookahead_depth(self, state):
+        """Number of slices to render ahead for the given navigation state."""
+        if state.direction == 0:
+            return 0
+        depth = self.lookahead + int(state.velocity * self.lead_time)
+        return min(depth, self.max_lookahead)
+
+    def schedule(self, user_id, num_slices, key_for, job_for):
+        """
+        Submit prefetch jobs for the slices ahead of a user's cursor.
+
+        Args:
+            user_id (str): The user id.
+            num_slices (int): Number of slices along the current view.
+            key_for (callable): Maps a slice index to its image cache key.
+            job_for (callable): Maps a slice index to ``(fn, args)`` for the render pool.
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            state = self._states.get(user_id)
+            if state is None:
+                return
+            origin, direction = state.last_index, state.direction
+            depth = self.lookahead_depth(state)
+
+        for step in range(1, depth + 1):
+            index = origin + direction * step
+            if index < 0 or index >= num_slices:
+                break
+            key = key_for(index)
+            with self._lock:
+                if index in state.pending:
+                    continue
+            if self.cache.contains(key):
+                continue
+            # Never queue speculative work behind real requests
+            if self.pool.in_flight >= self.pool.max_workers:
+                break
+
+            fn, args = job_for(index)
+            try:
+                future = self.pool.submit(fn, *args)
+            except RenderQueueFull:
+                break
+
+            with self._lock:
+                state.pending[index] = future
+                self._counters['scheduled'] += 1
+            future.add_done_callback(partial(self._store, user_id, state, index, key))
+
+    def _store(self, user_id, state, index, key, future):
+        with self._lock:
+            if state.pending.get(index) is future:
+                del state.pending[index]
+            current = self._states.get(user_id) is state
+
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.warning(f"Prefetch of slice {index} failed: {str(future.exception())}")
+            self._count('failed')
+            return
+        if not current:
+            self._count('discarded')
+            return
+
+        self.cache.put(key, future.result(), prefetched=True)
+        self._count('completed')
+
+    def stats(self):
+        """Return prefetch counters and derived hit rates."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['tracked_sessions'] = len(self._states)
+            stats['pending'] = sum(len(s.pending) for s in self._states.values())
+
+        stats['lookahead'] = self.lookahead
+        stats['max_lookahead'] = self.max_lookahead
+        # Share of served slices that a prefetch had already rendered
+        stats['hit_rate'] = stats['prefetch_hits'] / stats['requests'] if stats['requests'] else 0.0
+        # Share of completed prefetches that were actually requested
+        stats['useful_rate'] = stats['prefetch_hits'] / stats['completed'] if stats['completed'] else 0.0
+        return stats
+
+def init_prefetcher(app):
+    """Create the slice prefetcher for an app."""
+    prefetcher = Prefetcher(
+        app.extensions['render_pool'],
+        app.extensions['image_cache'],
+        lookahead=app.config['PREFETCH_LOOKAHEAD'],
+        max_lookahead=app.config['PREFETCH_MAX_LOOKAHEAD'] if app.config['PREFETCH_ENABLED'] else 0,
+        lead_time=app.config['PREFETCH_LEAD_TIME']
+    )
+    app.extensions['prefetcher'] = prefetcher
+    return prefetcher
+
+def get_prefetcher():
+    """Get the slice prefetcher of the current app."""
+    return current_app.extensions['prefetcher']
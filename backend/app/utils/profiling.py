@@ -0,0 +1,349 @@
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import shutil
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from time import perf_counter
+from flask import current_app, g, request
+
+logger = logging.getLogger(__name__)
+
+ROUTES_KEY = 'profiling:routes'  # route -> capture options
+LEFT_KEY = 'profiling:routes:left'  # route -> requests left to capture
+TOKEN_PREFIX = 'profiling:token:'  # header token -> capture options (expires)
+PROFILE_HEADER = 'X-Profile-Token'
+MODES = ('cprofile', 'sampling')
+
+CAPTURE_FILES = {
+    'profile.pstats': 'application/octet-stream',
+    'profile.txt': 'text/plain',
+    'stacks.txt': 'text/plain',
+    'tracemalloc.snapshot': 'application/octet-stream',
+    'tracemalloc.txt': 'text/plain',
+    'meta.json': 'application/json'
+}
+
+class StackSampler:
+    """
+    Statistical profiler for one thread.
+
+    A background thread records the target thread's stack at a fixed
+    interval. The result is written in collapsed-stack format (one
+    ``frame;frame;frame count`` line per distinct stack), which flame graph
+    tools read directly. Unlike cProfile it adds no per-call overhead, so
+    timings of call-heavy code such as pydicom parsing stay realistic.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+class RequestProfiler:
+    """
+    Admin-triggered profiling of live requests.
+
+    Captures are armed in Redis so every worker sees them: either for the
+    next N requests to a route, or for any request carrying a valid
+    ``X-Profile-Token`` header. A captured request gets a cProfile or
+    sampling profile plus an optional tracemalloc snapshot, written to its
+    own directory under the output directory.
+
+    Only one request per process is profiled at a time (the profilers and
+    tracemalloc are process-wide); requests arriving meanwhile run normally
+    and are not counted against the armed route.
+    """
+
+    def __init__(self, redis_client, output_dir, max_captures=50, poll_interval=1.0, top_n=50):
+        self.redis = redis_client
+        self.output_dir = output_dir
+        self.max_captures = max_captures
+        self.poll_interval = poll_interval
+        self.top_n = top_n
+        self._busy = threading.Lock()
+        self._armed = {}
+        self._armed_at = 0.0
+
+    # Arming
+
+    def arm_route(self, route, count, mode='cprofile', trace_memory=True):
+        """Profile the next ``count`` requests to a route rule (e.g. ``/api/viewer/load_dicom``)."""
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(ROUTES_KEY, route, json.dumps({'mode': mode, 'tracemalloc': trace_memory}))
+        pipe.hset(LEFT_KEY, route, count)
+        pipe.execute()
+        self._armed_at = 0.0
+
+    def create_token(self, ttl, mode='cprofile', trace_memory=True):
+        """Issue a header token that profiles every request carrying it until it expires."""
+        token = uuid.uuid4().hex
+        self.redis.set(TOKEN_PREFIX + token, json.dumps({'mode': mode, 'tracemalloc': trace_memory}), ex=ttl)
+        return token
+
+    def disarm(self):
+        """Cancel every armed route and header token."""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.delete(ROUTES_KEY, LEFT_KEY)
+        for key in self.redis.scan_iter(match=TOKEN_PREFIX + '*'):
+            pipe.delete(key)
+        pipe.execute()
+        self._armed = {}
+        self._armed_at = 0.0
+
+    def status(self):
+        """Return the armed routes with their remaining counts and the live tokens."""
+        options = {k.decode(): json.loads(v) for k, v in self.redis.hgetall(ROUTES_KEY).items()}
+        left = {k.decode(): int(v) for k, v in self.redis.hgetall(LEFT_KEY).items()}
+        routes = {route: dict(opts, remaining=max(left.get(route, 0), 0)) for route, opts in options.items()}
+        tokens = []
+        for key in self.redis.scan_iter(match=TOKEN_PREFIX + '*'):
+            tokens.append({'token': key.decode()[len(TOKEN_PREFIX):], 'expires_in': self.redis.ttl(key)})
+        return {'routes': routes, 'tokens': tokens}
+
+    def _armed_routes(self):
+        # Polled at most once per interval so unarmed traffic costs no Redis round trip
+        now = time.monotonic()
+        if now - self._armed_at >= self.poll_interval:
+            self._armed = {k.decode(): json.loads(v) for k, v in self.redis.hgetall(ROUTES_KEY).items()}
+            self._armed_at = now
+        return self._armed
+
+    def claim(self, route, token=None):
+        """
+        Decide whether the current request is captured.
+
+        Returns:
+            dict: Capture options (``mode``, ``tracemalloc``) or None.
+        """
+        if self._busy.locked():
+            return None
+
+        if token:
+            options = self.redis.get(TOKEN_PREFIX + token)
+            if options is not None:
+                return json.loads(options)
+
+        options = self._armed_routes().get(route)
+        if options is None:
+            return None
+        left = self.redis.hincrby(LEFT_KEY, route, -1)
+        if left <= 0:
+            # Last capture (or raced past it): disarm the route for every worker
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hdel(ROUTES_KEY, route)
+            pipe.hdel(LEFT_KEY, route)
+            pipe.execute()
+            self._armed.pop(route, None)
+        return options if left >= 0 else None
+
+    # Capturing
+
+    def start(self, options):
+        """Start profiling the current thread. Returns a capture state, or None if busy."""
+        if not self._busy.acquire(blocking=False):
+            return None
+
+        state = {'options': options, 'started_tracemalloc': False}
+        try:
+            if options.get('tracemalloc') and not tracemalloc.is_tracing():
+                tracemalloc.start(25)
+                state['started_tracemalloc'] = True
+
+            if options.get('mode') == 'sampling':
+                state['sampler'] = StackSampler(threading.get_ident())
+                state['sampler'].start()
+            else:
+                state['profile'] = cProfile.Profile()
+                state['profile'].enable()
+        except Exception as e:
+            logger.warning(f"Could not start profiling: {str(e)}")
+            self._release(state)
+            return None
+
+        state['start'] = perf_counter()
+        return state
+
+    def _release(self, state):
+        if state.get('started_tracemalloc'):
+            tracemalloc.stop()
+        self._busy.release()
+
+    def finish(self, state, meta):
+        """Stop profiling and write the capture. Returns the capture id."""
+        try:
+            duration = perf_counter() - state['start']
+            profile = state.get('profile')
+            sampler = state.get('sampler')
+            if profile is not None:
+                profile.disable()
+            if sampler is not None:
+                sampler.stop()
+            snapshot = peak = None
+            if state['options'].get('tracemalloc') and tracemalloc.is_tracing():
+                snapshot = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            self._release(state)
+
+        capture_id = f"{time.strftime('%Y%m%dT%H%M%S')}_{os.getpid()}_{uuid.uuid4().hex[:6]}"
+        capture_dir = os.path.join(self.output_dir, capture_id)
+        os.makedirs(capture_dir, exist_ok=True)
+
+        if profile is not None:
+            profile.dump_stats(os.path.join(capture_dir, 'profile.pstats'))
+            text = io.StringIO()
+            pstats.Stats(profile, stream=text).sort_stats('cumulative').print_stats(self.top_n)
+            with open(os.path.join(capture_dir, 'profile.txt'), 'w') as f:
+                f.write(text.getvalue())
+        if sampler is not None:
+            sampler.dump(os.path.join(capture_dir, 'stacks.txt'))
+        if snapshot is not None:
+            snapshot = snapshot.filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                tracemalloc.Filter(False, __file__),
+            ))
+            snapshot.dump(os.path.join(capture_dir, 'tracemalloc.snapshot'))
+            with open(os.path.join(capture_dir, 'tracemalloc.txt'), 'w') as f:
+                for line in snapshot.statistics('lineno')[:self.top_n]:
+                    f.write(f"{line}\n")
+
+        meta = dict(meta, id=capture_id, pid=os.getpid(), duration_ms=round(duration * 1000, 3),
+                    mode=state['options'].get('mode', 'cprofile'), captured_at=time.time(),
+                    traced_peak_bytes=peak)
+        with open(os.path.join(capture_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+        self._prune()
+        logger.info(f"Saved profile {capture_id} for {meta.get('method')} {meta.get('path')}")
+        return capture_id
+
+    # Stored captures
+
+    def captures(self):
+        """List stored captures, newest first."""
+        result = []
+        if not os.path.isdir(self.output_dir):
+            return result
+        for capture_id in os.listdir(self.output_dir):
+            meta_path = os.path.join(self.output_dir, capture_id, 'meta.json')
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            meta['files'] = sorted(
+                name for name in os.listdir(os.path.join(self.output_dir, capture_id)) if name in CAPTURE_FILES
+            )
+            result.append(meta)
+        return sorted(result, key=lambda m: m.get('captured_at', 0), reverse=True)
+
+    def capture_path(self, capture_id, filename):
+        """Path of a stored capture file, or None if it does not exist."""
+        if filename not in CAPTURE_FILES or os.path.basename(capture_id) != capture_id or capture_id.startswith('.'):
+            return None
+        path = os.path.join(self.output_dir, capture_id, filename)
+        return path if os.path.isfile(path) else None
+
+    def delete(self, capture_id):
+        """Delete a stored capture. Returns False if it does not exist."""
+        if self.capture_path(capture_id, 'meta.json') is None:
+            return False
+        shutil.rmtree(os.path.join(self.output_dir, capture_id), ignore_errors=True)
+        return True
+
+    def _prune(self):
+        for meta in self.captures()[self.max_captures:]:
+            shutil.rmtree(os.path.join(self.output_dir, meta['id']), ignore_errors=True)
+
+def _start_request_profile():
+    profiler = current_app.extensions['profiler']
+    if request.url_rule is None:
+        return
+    try:
+        options = profiler.claim(request.url_rule.rule, request.headers.get(PROFILE_HEADER))
+    except Exception as e:
+        logger.warning(f"Failed to check profiling triggers: {str(e)}")
+        return
+    if options is not None:
+        g.profile_state = profiler.start(options)
+
+def _finish_request_profile(response):
+    state = g.pop('profile_state', None)
+    if state is None:
+        return response
+    try:
+        capture_id = current_app.extensions['profiler'].finish(state, {
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'route': request.url_rule.rule,
+            'status': response.status_code
+        })
+        response.headers['X-Profile-Id'] = capture_id
+    except Exception as e:
+        logger.error(f"Failed to save profile: {str(e)}")
+    return response
+
+def _teardown_request_profile(_exc=None):
+    # A request that failed before after_request still has to stop its profiler
+    state = g.pop('profile_state', None)
+    if state is not None:
+        try:
+            current_app.extensions['profiler'].finish(state, {
+                'method': request.method,
+                'path': request.full_path.rstrip('?'),
+                'route': request.url_rule.rule,
+                'status': 500
+            })
+        except Exception as e:
+            logger.error(f"Failed to save profile: {str(e)}")
+
+def init_profiler(app):
+    """Create the request profiler for an app."""
+    profiler = RequestProfiler(
+        app.extensions['redis'],
+        app.config['PROFILE_DIR'],
+        max_captures=app.config['PROFILE_MAX_CAPTURES']
+    )
+    app.extensions['profiler'] = profiler
+    app.before_request(_start_request_profile)
+    app.after_request(_finish_request_profile)
+    app.teardown_request(_teardown_request_profile)
+    return profiler
+
+def get_profiler():
+    """Get the request profiler of the current app."""
+    return current_app.extensions['profiler']
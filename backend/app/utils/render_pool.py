@@ -0,0 +1,236 @@
+import os
+import threading
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from time import perf_counter
+from flask import current_app, jsonify
+
+from app.utils.timing import is_collecting, run_collected, record
+
+logger = logging.getLogger(__name__)
+
+class RenderQueueFull(Exception):
+    """Raised when the render pool cannot accept another job."""
+
+class RenderTimeout(Exception):
+    """Raised when a render job does not finish within the pool's timeout."""
+
+def _result(future, timeout):
+    """Wait for a render job, as ``RenderTimeout`` if it takes too long."""
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        future.cancel()
+        raise RenderTimeout(f"Render job did not finish within {timeout} seconds")
+
+def _init_render_worker():
+    """Prepare a render worker process (headless matplotlib backend, compiled overlay kernel)."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot  # noqa: F401  (pay the import before the first job)
+    from app.utils.overlay_kernel import warm_overlay_kernel
+    warm_overlay_kernel()
+
+class RenderPool:
+    """
+    Bounded process pool for CPU-bound image rendering and encoding.
+
+    Rendering runs in separate processes so it neither holds the request
+    worker's GIL nor shares matplotlib's global figure state. At most
+    ``max_workers + queue_depth`` jobs can be in flight; further submissions
+    raise ``RenderQueueFull`` so the caller can shed load instead of queueing
+    without bound. A pool size of 0 renders inline on the calling thread.
+    """
+
+    def __init__(self, max_workers=None, queue_depth=0, start_method='spawn', timeout=None):
+        self.max_workers = (os.cpu_count() or 1) if max_workers is None else max_workers
+        self.queue_depth = queue_depth
+        self.start_method = start_method
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._slots = None
+        self._in_flight = 0
+
+    @property
+    def capacity(self):
+        """Maximum number of jobs that may be running or queued at once."""
+        return self.max_workers + self.queue_depth
+
+    @property
+    def in_flight(self):
+        """Number of jobs currently running or queued."""
+        return self._in_flight
+
+    def _ensure_process_state(self):
+        # Executors and semaphores do not survive a fork (e.g. gunicorn
+        # preload), so rebuild them the first time a new process uses the pool.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._executor = None
+            self._in_flight = 0
+            self._slots = threading.BoundedSemaphore(max(self.capacity, 1))
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context(self.start_method),
+                initializer=_init_render_worker
+            )
+        return self._executor
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Submit a render job without blocking.
+
+        Args:
+            fn (callable): A picklable top-level function.
+            *args: Positional arguments for ``fn``.
+            **kwargs: Keyword arguments for ``fn``.
+
+        Returns:
+            concurrent.futures.Future: The pending result.
+
+        Raises:
+            RenderQueueFull: If the pool is saturated.
+        """
+        with self._lock:
+            self._ensure_process_state()
+
+        if not self._slots.acquire(blocking=False):
+            raise RenderQueueFull(
+                f"Render queue is full ({self.capacity} jobs in flight)"
+            )
+        with self._lock:
+            self._in_flight += 1
+
+        if self.max_workers == 0:
+            future = Future()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self._release()
+            return future
+
+        try:
+            with self._lock:
+                future = self._get_executor().submit(fn, *args, **kwargs)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def imap(self, jobs, window=None, timeout=None):
+        """
+        Run jobs in parallel and yield their results in submission order.
+
+        At most ``window`` jobs are in flight, so a long job list holds
+        bounded memory. When the pool is saturated by other requests the
+        oldest pending job is awaited before submitting more; only a pool
+        with none of our jobs pending raises ``RenderQueueFull``.
+
+        Args:
+            jobs (iterable): ``(fn, args)`` pairs.
+            window (int, optional): Jobs in flight at once (default: the
+                number of workers, at least 1).
+            timeout (float, optional): Seconds to wait for each result
+                (default: the pool's timeout).
+
+        Yields:
+            The results of the jobs, in order.
+        """
+        window = max(window or self.max_workers, 1)
+        timeout = self.timeout if timeout is None else timeout
+        pending = deque()
+        for fn, args in jobs:
+            while True:
+                if len(pending) >= window:
+                    yield _result(pending.popleft(), timeout)
+                try:
+                    pending.append(self.submit(fn, *args))
+                    break
+                except RenderQueueFull:
+                    if not pending:
+                        raise
+                    yield _result(pending.popleft(), timeout)
+        while pending:
+            yield _result(pending.popleft(), timeout)
+
+    def warm(self):
+        """Start every worker process now instead of on the first render jobs."""
+        if self.max_workers == 0:
+            return
+        with self._lock:
+            self._ensure_process_state()
+            executor = self._get_executor()
+        # The executor spawns a new worker per job while none is idle
+        futures = [executor.submit(os.getpid) for _ in range(self.max_workers)]
+        for future in futures:
+            future.result(timeout=self.timeout)
+
+    def run(self, fn, *args, **kwargs):
+        """Submit a render job and wait for its result."""
+        return _result(self.submit(fn, *args, **kwargs), self.timeout)
+
+    def shutdown(self, wait=True):
+        """Stop the worker processes owned by this process."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        # Outside the lock: cancelled jobs release their slots through it
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+def _handle_queue_full(error):
+    logger.warning(f"Rejecting render request: {str(error)}")
+    response = jsonify({"error": "Server is busy rendering, please retry shortly"})
+    response.status_code = 429
+    response.headers['Retry-After'] = '1'
+    return response
+
+def _handle_timeout(error):
+    logger.warning(f"Render request timed out: {str(error)}")
+    response = jsonify({"error": "Rendering took too long, please retry shortly"})
+    response.status_code = 504
+    response.headers['Retry-After'] = '1'
+    return response
+
+def init_render_pool(app):
+    """Create the render pool for an app and register its 429 and 504 handlers."""
+    pool = RenderPool(
+        max_workers=app.config['RENDER_POOL_SIZE'],
+        queue_depth=app.config['RENDER_QUEUE_DEPTH'],
+        start_method=app.config['RENDER_POOL_START_METHOD'],
+        timeout=app.config['RENDER_TIMEOUT']
+    )
+    app.extensions['render_pool'] = pool
+    app.register_error_handler(RenderQueueFull, _handle_queue_full)
+    app.register_error_handler(RenderTimeout, _handle_timeout)
+    return pool
+
+def get_render_pool():
+    """Get the render pool of the current app."""
+    return current_app.extensions['render_pool']
+
+def render_image(fn, *args, **kwargs):
+    """Run an image-producing function on the current app's render pool."""
+    if not is_collecting():
+        return get_render_pool().run(fn, *args, **kwargs)
+    
+    # Bring the worker's stage timings back and account for queueing/IPC separately
+    start = perf_counter()
+    result, timings = get_render_pool().run(run_collected, fn, *args, **kwargs)
+    record(timings)
+    record({'render_pool': perf_counter() - start - sum(timings.values())})
+    return result
@@ -0,0 +1,299 @@
+import math
+import logging
+import numpy as np
+
+from app.utils.timing import stage, timed
+
+logger = logging.getLogger(__name__)
+
+WORD_BITS = 64
+
+ALGEBRA_OPS = {
+    # op -> (minimum operands, maximum operands, needs a margin)
+    'union': (2, None, False),
+    'intersection': (2, None, False),
+    'difference': (2, None, False),
+    'dilate': (1, 1, True),
+    'erode': (1, 1, True)
+}
+
+class PackedMask:
+    """
+    Binary mask cut to its bounding box and bit-packed into 64-bit words.
+
+    Rows run along the last axis, 64 voxels per word; the box starts and
+    ends on a word boundary along that axis, so masks with different boxes
+    line up word for word and boolean operations never shift bits. A
+    typical ROI covers a small part of the volume, so the packed form is a
+    fraction of a byte per voxel of its box instead of a byte per voxel of
+    the volume.
+    """
+
+    def __init__(self, shape, start, words):
+        """
+        Args:
+            shape (tuple): Shape of the full volume.
+            start (tuple): Voxel position of the box; the last coordinate is
+                a multiple of ``WORD_BITS``.
+            words (numpy.ndarray): ``uint64`` words of the box, shape
+                ``(depth, height, words per row)``.
+        """
+        self.shape = tuple(int(n) for n in shape)
+        self.start = tuple(int(n) for n in start)
+        self.words = words
+
+    @classmethod
+    def empty(cls, shape):
+        return cls(shape, (0, 0, 0), np.zeros((0, 0, 0), dtype=np.uint64))
+
+    @classmethod
+    @timed('roi_pack')
+    def from_mask(cls, mask, value=None):
+        """
+        Pack an ROI mask.
+
+        Args:
+            mask (numpy.ndarray): The 3D ROI mask.
+            value (int, optional): Only voxels with this label (default: any non-zero).
+        """
+        selected = np.asarray(mask == value if value is not None else mask != 0)
+        start, stop = [], []
+        for axis in range(3):
+            others = tuple(a for a in range(3) if a != axis)
+            present = np.flatnonzero(selected.any(axis=others))
+            if present.size == 0:
+                return cls.empty(mask.shape)
+            start.append(int(present[0]))
+            stop.append(int(present[-1]) + 1)
+        start[2] -= start[2] % WORD_BITS
+        return cls._pack(mask.shape, start, selected[start[0]:stop[0], start[1]:stop[1], start[2]:stop[2]])
+
+    @classmethod
+    def _pack(cls, shape, start, bits):
+        """Pack a boolean box whose first corner is ``start`` (word-aligned)."""
+        width = -(-bits.shape[2] // WORD_BITS) * WORD_BITS
+        if width != bits.shape[2]:
+            bits = np.pad(bits, ((0, 0), (0, 0), (0, width - bits.shape[2])))
+        packed = np.packbits(bits, axis=2, bitorder='little')
+        return cls(shape, start, np.ascontiguousarray(packed).view('<u8'))
+
+    @property
+    def stop(self):
+        """Voxel position just past the box (may run past the volume along the rows)."""
+        depth, height, row_words = self.words.shape
+        return (self.start[0] + depth, self.start[1] + height, self.start[2] + row_words * WORD_BITS)
+
+    def is_empty(self):
+        return self.words.size == 0 or not self.words.any()
+
+    def count(self):
+        """Number of voxels in the mask."""
+        return int(np.unpackbits(self.words.view(np.uint8)).sum()) if self.words.size else 0
+
+    def bounding_box(self):
+        """``(start, stop)`` voxel corners of the box, clipped to the volume."""
+        return self.start, tuple(min(b, n) for b, n in zip(self.stop, self.shape))
+
+    def extent(self):
+        """Tight ``(start, stop)`` voxel box of the mask, or None if it is empty."""
+        if self.is_empty():
+            return None
+        bits = self.unpack()
+        start, stop = [], []
+        for axis in range(3):
+            others = tuple(a for a in range(3) if a != axis)
+            present = np.flatnonzero(bits.any(axis=others))
+            start.append(self.start[axis] + int(present[0]))
+            stop.append(self.start[axis] + int(present[-1]) + 1)
+        return tuple(start), tuple(stop)
+
+    def unpack(self, start=None, stop=None):
+        """
+        Unpack a box of the mask (default: its own box, clipped to the volume).
+
+        Returns:
+            numpy.ndarray: Boolean array of the box.
+        """
+        if start is None:
+            start, stop = self.bounding_box()
+        aligned = (start[0], start[1], start[2] - start[2] % WORD_BITS)
+        words = self._aligned(aligned, (stop[0], stop[1], stop[2]))
+        bits = np.unpackbits(words.view(np.uint8), axis=2, bitorder='little').astype(bool)
+        offset = start[2] - aligned[2]
+        return bits[:, :, offset:offset + stop[2] - start[2]]
+
+    def to_mask(self):
+        """The full ``uint8`` mask (1 inside)."""
+        mask = np.zeros(self.shape, dtype=np.uint8)
+        if self.is_empty():
+            return mask
+        start, stop = self.bounding_box()
+        mask[start[0]:stop[0], start[1]:stop[1], start[2]:stop[2]] = self.unpack(start, stop)
+        return mask
+
+    def _aligned(self, start, stop):
+        """Words of the mask over another word-aligned box (zeros outside its own box)."""
+        row_words = -(-(stop[2] - start[2]) // WORD_BITS)
+        out = np.zeros((stop[0] - start[0], stop[1] - start[1], row_words), dtype=np.uint64)
+        if self.words.size == 0:
+            return out
+        own_stop = self.stop
+        lo = [max(a, b) for a, b in zip(start, self.start)]
+        hi = [min(a, b) for a, b in zip((stop[0], stop[1], start[2] + row_words * WORD_BITS), own_stop)]
+        if any(l >= h for l, h in zip(lo, hi)):
+            return out
+        out[
+            lo[0] - start[0]:hi[0] - start[0],
+            lo[1] - start[1]:hi[1] - start[1],
+            (lo[2] - start[2]) // WORD_BITS:(hi[2] - start[2]) // WORD_BITS
+        ] = self.words[
+            lo[0] - self.start[0]:hi[0] - self.start[0],
+            lo[1] - self.start[1]:hi[1] - self.start[1],
+            (lo[2] - self.start[2]) // WORD_BITS:(hi[2] - self.start[2]) // WORD_BITS
+        ]
+        return out
+
+    def _trimmed(self):
+        """The same mask with its box shrunk to the voxels still set."""
+        if self.is_empty():
+            return PackedMask.empty(self.shape)
+        nonzero = self.words != 0
+        start, stop = [], []
+        for axis in range(3):
+            others = tuple(a for a in range(3) if a != axis)
+            present = np.flatnonzero(nonzero.any(axis=others))
+            start.append(int(present[0]))
+            stop.append(int(present[-1]) + 1)
+        words = self.words[start[0]:stop[0], start[1]:stop[1], start[2]:stop[2]]
+        origin = (self.start[0] + start[0], self.start[1] + start[1], self.start[2] + start[2] * WORD_BITS)
+        return PackedMask(self.shape, origin, np.ascontiguousarray(words))
+
+    def _check(self, other):
+        if self.shape != other.shape:
+            raise ValueError(f"ROI grids differ: {self.shape} and {other.shape}")
+
+    def __or__(self, other):
+        self._check(other)
+        if self.is_empty():
+            return other
+        if other.is_empty():
+            return self
+        start = tuple(min(a, b) for a, b in zip(self.start, other.start))
+        stop = tuple(max(a, b) for a, b in zip(self.stop, other.stop))
+        return PackedMask(self.shape, start, self._aligned(start, stop) | other._aligned(start, stop))
+
+    def __and__(self, other):
+        self._check(other)
+        start = tuple(max(a, b) for a, b in zip(self.start, other.start))
+        stop = tuple(min(a, b) for a, b in zip(self.stop, other.stop))
+        if self.is_empty() or other.is_empty() or any(a >= b for a, b in zip(start, stop)):
+            return PackedMask.empty(self.shape)
+        return PackedMask(self.shape, start, self._aligned(start, stop) & other._aligned(start, stop))._trimmed()
+
+    def __sub__(self, other):
+        self._check(other)
+        if self.is_empty() or other.is_empty():
+            return self
+        return PackedMask(
+            self.shape, self.start, self.words & ~other._aligned(self.start, self.stop)
+        )._trimmed()
+
+def _margin_voxels(margin, spacing):
+    return [int(math.ceil(margin / s)) for s in spacing]
+
+@timed('roi_morphology')
+def dilate(packed, margin, spacing):
+    """
+    Grow a mask by a physical margin.
+
+    A voxel joins the mask if its center lies within ``margin`` mm of the
+    center of a mask voxel (a ball in physical space, an ellipsoid in voxels
+    on anisotropic grids). Only the bounding box grown by the margin is
+    processed, with scipy's Euclidean distance transform, which runs one
+    axis at a time (separable) instead of sliding a structuring element.
+
+    Args:
+        packed (PackedMask): The mask.
+        margin (float): The margin in mm.
+        spacing (tuple): ``(slice, row, column)`` voxel spacing in mm.
+
+    Returns:
+        PackedMask: The grown mask.
+    """
+    from scipy.ndimage import distance_transform_edt
+
+    if packed.is_empty():
+        return packed
+    pad = _margin_voxels(margin, spacing)
+    box_start, box_stop = packed.bounding_box()
+    start = [max(a - p, 0) for a, p in zip(box_start, pad)]
+    stop = [min(b + p, n) for b, p, n in zip(box_stop, pad, packed.shape)]
+    start[2] -= start[2] % WORD_BITS
+
+    region = packed.unpack(start, stop)
+    with stage('roi_distance'):
+        distance = distance_transform_edt(~region, sampling=spacing)
+    return PackedMask._pack(packed.shape, start, distance <= margin)._trimmed()
+
+@timed('roi_morphology')
+def erode(packed, margin, spacing):
+    """
+    Shrink a mask by a physical margin.
+
+    A voxel stays in the mask if no voxel outside the mask (or outside the
+    volume) lies within ``margin`` mm of it; see ``dilate``.
+
+    Args:
+        packed (PackedMask): The mask.
+        margin (float): The margin in mm.
+        spacing (tuple): ``(slice, row, column)`` voxel spacing in mm.
+
+    Returns:
+        PackedMask: The shrunk mask.
+    """
+    from scipy.ndimage import distance_transform_edt
+
+    if packed.is_empty():
+        return packed
+    start, stop = packed.bounding_box()
+    # One voxel of background all around, so the box edge counts as outside
+    region = np.pad(packed.unpack(start, stop), 1)
+    with stage('roi_distance'):
+        distance = distance_transform_edt(region, sampling=spacing)[1:-1, 1:-1, 1:-1]
+    return PackedMask._pack(packed.shape, start, distance > margin)._trimmed()
+
+def evaluate(op, operands, margin=None, spacing=None):
+    """
+    Apply an ROI algebra operation.
+
+    Args:
+        op (str): One of ``ALGEBRA_OPS``. ``difference`` removes every
+            other operand from the first.
+        operands (list): ``PackedMask`` operands.
+        margin (float, optional): Margin in mm (``dilate`` and ``erode``).
+        spacing (tuple, optional): Voxel spacing in mm (``dilate`` and ``erode``).
+
+    Returns:
+        PackedMask: The result.
+    """
+    with stage('roi_algebra'):
+        if op == 'union':
+            result = operands[0]
+            for operand in operands[1:]:
+                result = result | operand
+            return result
+        if op == 'intersection':
+            result = operands[0]
+            for operand in operands[1:]:
+                result = result & operand
+            return result
+        if op == 'difference':
+            result = operands[0]
+            for operand in operands[1:]:
+                result = result - operand
+            return result
+    if op == 'dilate':
+        return dilate(operands[0], margin, spacing)
+    if op == 'erode':
+        return erode(operands[0], margin, spacing)
+    raise ValueError(f"Unknown ROI operation: {op}")
@@ -0,0 +1,244 @@
+import logging
+from io import BytesIO
+import numpy as np
+
+from app.utils.timing import stage
+
+logger = logging.getLogger(__name__)
+
+VIEW_NAMES = ('axial', 'coronal', 'sagittal')  # By axis
+
+def slice_box(axis, slice_index, rows, cols):
+    """
+    3D box of a rectangle on one slice.
+
+    Args:
+        axis (int): The axis of the slice.
+        slice_index (int): The index of the slice.
+        rows (tuple): ``(start, stop)`` of the rectangle along the slice's first axis.
+        cols (tuple): ``(start, stop)`` along the slice's second axis.
+
+    Returns:
+        tuple: ``(start, stop)`` voxel corners of the box.
+    """
+    start, stop = [rows[0], cols[0]], [rows[1], cols[1]]
+    start.insert(axis, slice_index)
+    stop.insert(axis, slice_index + 1)
+    return tuple(start), tuple(stop)
+
+def box_index(box):
+    """Index tuple of a ``(start, stop)`` box."""
+    return tuple(slice(a, b) for a, b in zip(*box))
+
+def touched_slices(box):
+    """
+    Slices an edit of a box changes, per view.
+
+    Returns:
+        dict: ``{view: (start, stop)}`` slice index ranges.
+    """
+    return {view: (box[0][axis], box[1][axis]) for axis, view in enumerate(VIEW_NAMES)}
+
+def roi_slice_version(info, axis, slice_index):
+    """
+    Version of one slice of an ROI, which slice caches (contours, overlay
+    images) are keyed on.
+
+    Edits bump the version of the slices they touch only, so the cached
+    outlines and images of every other slice stay valid.
+
+    Args:
+        info (dict): ROI info from the session's ``roi_masks``.
+        axis (int): The axis of the slice.
+        slice_index (int): The index of the slice.
+
+    Returns:
+        str: The slice version (None for an ROI without a digest).
+    """
+    edit = info.get('edit')
+    if edit is None:
+        return info.get('digest')
+    return edit['slices'][axis].get(str(slice_index), edit['base'][axis])
+
+def rasterize_runs(runs, slice_shape):
+    """
+    Pixels covered by run-length encoded brush strokes on a slice.
+
+    Args:
+        runs (list): ``[row, col, length]`` runs along the slice rows;
+            parts outside the slice are clipped.
+        slice_shape (tuple): Shape of the slice.
+
+    Returns:
+        numpy.ndarray: Row indices of the covered pixels.
+        numpy.ndarray: Column indices.
+
+    Raises:
+        ValueError: If the runs are not triples of integers.
+    """
+    runs = np.asarray(runs, dtype=np.int64).reshape(-1, 3)
+    rows, cols, lengths = runs.T
+    stops = np.minimum(cols + lengths, slice_shape[1])
+    cols = np.maximum(cols, 0)
+    keep = (rows >= 0) & (rows < slice_shape[0]) & (stops > cols)
+    rows, cols, lengths = rows[keep], cols[keep], (stops - cols)[keep]
+    if rows.size == 0:
+        return rows, cols
+
+    # Expand the runs without a Python loop over pixels
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(rows, lengths), np.repeat(cols, lengths) + offsets
+
+def rasterize_polygon(points, slice_shape):
+    """
+    Pixels inside a polygon on a slice.
+
+    Args:
+        points (list): ``[x, y]`` vertices in slice pixel coordinates (the
+            convention of ``extract_contours``).
+        slice_shape (tuple): Shape of the slice.
+
+    Returns:
+        numpy.ndarray: Row indices of the covered pixels.
+        numpy.ndarray: Column indices.
+
+    Raises:
+        ValueError: If there are fewer than three vertices.
+    """
+    from skimage.draw import polygon
+
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) < 3:
+        raise ValueError("A polygon needs at least 3 points")
+    return polygon(points[:, 1], points[:, 0], shape=slice_shape)
+
+def paint_pixels(mask, axis, slice_index, rows, cols, value):
+    """
+    Write a value into pixels of one slice of a mask, in place.
+
+    Args:
+        mask (numpy.ndarray): The 3D mask (writable).
+        axis (int): The axis of the slice.
+        slice_index (int): The index of the slice.
+        rows (numpy.ndarray): Row indices of the pixels on the slice.
+        cols (numpy.ndarray): Column indices.
+        value (int): The value to write (0 erases).
+
+    Returns:
+        tuple: The ``(start, stop)`` box that was edited, or None if no
+        pixel was given.
+        numpy.ndarray: The previous contents of the box.
+    """
+    if len(rows) == 0:
+        return None, None
+    top, left = int(rows.min()), int(cols.min())
+    box = slice_box(axis, slice_index, (top, int(rows.max()) + 1), (left, int(cols.max()) + 1))
+    index = box_index(box)
+    before = mask[index].copy()
+    region = before.copy()
+    plane = region.reshape([b - a for n, (a, b) in enumerate(zip(*box)) if n != axis])
+    plane[rows - top, cols - left] = value
+    mask[index] = region
+    return box, before
+
+def _signed_distance(inside):
+    """Signed distance to the outline of a 2D region (negative inside)."""
+    from scipy.ndimage import distance_transform_edt
+
+    return distance_transform_edt(~inside) - distance_transform_edt(inside)
+
+def interpolate_slices(mask, axis, first, last, value):
+    """
+    Fill the slices between two drawn slices by shape-based interpolation,
+    in place.
+
+    The outlines of ``value`` on the two key slices are blended through
+    their signed distance maps, so the shape morphs smoothly from one to
+    the other. Interpolated pixels are painted; nothing is erased.
+
+    Args:
+        mask (numpy.ndarray): The 3D mask (writable).
+        axis (int): The axis of the slices.
+        first (int): Index of one key slice.
+        last (int): Index of the other key slice.
+        value (int): The label to interpolate.
+
+    Returns:
+        tuple: The ``(start, stop)`` box that was edited, or None if there
+        is no slice in between.
+        numpy.ndarray: The previous contents of the box.
+
+    Raises:
+        ValueError: If a key slice does not contain the label.
+    """
+    first, last = sorted((first, last))
+    if last - first < 2:
+        return None, None
+
+    keys = [np.take(mask, index, axis=axis) == value for index in (first, last)]
+    if not keys[0].any() or not keys[1].any():
+        raise ValueError("Both key slices must contain the label")
+
+    # Only the bounding rectangle of both outlines (plus a margin so the
+    # distance maps see background around them) can change
+    either = keys[0] | keys[1]
+    rows, cols = np.flatnonzero(either.any(axis=1)), np.flatnonzero(either.any(axis=0))
+    top, bottom = max(int(rows[0]) - 1, 0), min(int(rows[-1]) + 2, either.shape[0])
+    left, right = max(int(cols[0]) - 1, 0), min(int(cols[-1]) + 2, either.shape[1])
+
+    with stage('roi_interpolate'):
+        distances = [_signed_distance(key[top:bottom, left:right]) for key in keys]
+        box = slice_box(axis, first + 1, (top, bottom), (left, right))
+        start, stop = list(box[0]), list(box[1])
+        stop[axis] = last
+        box = (tuple(start), tuple(stop))
+        index = box_index(box)
+
+        before = mask[index].copy()
+        region = np.moveaxis(before.copy(), axis, 0)
+        for n in range(last - first - 1):
+            t = (n + 1) / (last - first)
+            inside = (1 - t) * distances[0] + t * distances[1] <= 0
+            region[n][inside] = value
+        mask[index] = np.moveaxis(region, 0, axis)
+    return box, before
+
+def count_values(region):
+    """Voxel counts of every uint8 value in a region."""
+    return np.bincount(np.asarray(region, dtype=np.uint8).ravel(), minlength=256)
+
+def encode_delta(box, before):
+    """
+    Encode an undo record: the previous contents of an edited box.
+
+    Returns:
+        bytes: Compressed ``.npz`` with ``start`` and ``before``.
+    """
+    buf = BytesIO()
+    np.savez_compressed(buf, start=np.asarray(box[0], dtype=np.int64), before=before)
+    return buf.getvalue()
+
+def decode_delta(data):
+    """
+    Decode an undo record written by ``encode_delta``.
+
+    Returns:
+        tuple: The ``(start, stop)`` box.
+        numpy.ndarray: Its contents before the edit.
+    """
+    with np.load(BytesIO(data), allow_pickle=False) as record:
+        start = tuple(int(n) for n in record['start'])
+        before = record['before']
+    return (start, tuple(a + n for a, n in zip(start, before.shape))), before
+
+def restore_box(mask, box, contents):
+    """
+    Write the contents of a box back into a mask, in place.
+
+    Returns:
+        numpy.ndarray: The contents it replaced.
+    """
+    index = box_index(box)
+    replaced = mask[index].copy()
+    mask[index] = contents
+    return replaced
@@ -0,0 +1,263 @@
+import json
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+from io import BytesIO
+import numpy as np
+from flask import current_app, g, jsonify
+from flask_jwt_extended import get_jwt_identity
+from redis import Redis, ConnectionPool
+from redis.exceptions import ResponseError, WatchError
+
+from app.utils.shared_volumes import resolve_array
+from app.utils.timing import stage
+
+logger = logging.getLogger(__name__)
+
+_NPY_MAGIC = b'\x93NUMPY'
+LOCK_TIMEOUT = 30  # Seconds to wait for (and to hold at most) a session lock
+
+class SessionBusy(Exception):
+    """Raised when a session lock is held by another request for too long."""
+    pass
+
+def encode_field(value):
+    """Encode a session field value (numpy arrays as .npy bytes, everything else as JSON)."""
+    if isinstance(value, np.ndarray):
+        buf = BytesIO()
+        np.save(buf, value, allow_pickle=False)
+        return buf.getvalue()
+    return json.dumps(value)
+
+def decode_field(raw):
+    """Decode a session field value stored by ``encode_field``."""
+    if raw is None:
+        return None
+    if raw.startswith(_NPY_MAGIC):
+        return np.load(BytesIO(raw), allow_pickle=False)
+    return json.loads(raw)
+
+def release_lock(redis_client, key, token):
+    """
+    Delete a lock taken with SET NX only if it still holds ``token``, as
+    one transaction.
+
+    Args:
+        redis_client: The Redis client.
+        key (str): The lock key.
+        token (str): The value the lock was taken with.
+    """
+    with redis_client.pipeline() as pipe:
+        try:
+            pipe.watch(key)
+            if pipe.get(key) != token.encode():
+                # Expired, and possibly taken by another worker since
+                return
+            pipe.multi()
+            pipe.delete(key)
+            pipe.execute()
+        except WatchError:
+            # Changed after the check, so it is no longer ours
+            pass
+
+class UserSession:
+    """
+    Field-level access to one user's session hash in Redis.
+
+    The session is stored as the hash ``session:<user_id>`` with one field
+    per item, so endpoints fetch only the fields they use. Fetched fields are
+    memoized for the lifetime of the object (one request), the first fetch
+    refreshes the TTL in the same round trip, and writes are pipelined
+    together with the TTL refresh instead of rewriting the whole payload.
+    """
+
+    def __init__(self, redis_client, user_id, timeout):
+        self.redis = redis_client
+        self.user_id = user_id
+        self.key = f"session:{user_id}"
+        self.timeout = timeout
+        self._cache = {}
+        self._touched = False
+
+    def _fetch(self, fields):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hmget(self.key, fields)
+        if not self._touched:
+            pipe.expire(self.key, self.timeout)
+        try:
+            with stage('session_fetch'):
+                values = pipe.execute()[0]
+        except ResponseError:
+            # Sessions written before the hash layout were a single JSON string
+            logger.warning(f"Dropping legacy session format for {self.user_id}")
+            self.redis.delete(self.key)
+            values = [None] * len(fields)
+        self._touched = True
+        with stage('session_decode'):
+            for field, raw in zip(fields, values):
+                self._cache[field] = decode_field(raw)
+
+    def get_many(self, *fields):
+        """Fetch several fields in one round trip, returning them as a dict."""
+        missing = [f for f in fields if f not in self._cache]
+        if missing:
+            self._fetch(missing)
+        return {f: self._cache[f] for f in fields}
+
+    def get(self, field, default=None):
+        """Fetch a single field."""
+        value = self.get_many(field)[field]
+        return default if value is None else value
+
+    def get_array(self, field):
+        """Fetch an array field, attaching to shared memory if it was shared."""
+        value = self.get(field)
+        with stage('volume_attach'):
+            return resolve_array(value)
+
+    def __contains__(self, field):
+        return self.get(field) is not None
+
+    def update(self, mapping, delete=()):
+        """
+        Write fields (and optionally delete others) in one pipelined round trip.
+
+        Args:
+            mapping (dict): Fields to set.
+            delete (iterable, optional): Fields to remove.
+        """
+        delete = [f for f in delete if f not in mapping]
+        pipe = self.redis.pipeline(transaction=True)
+        if mapping:
+            pipe.hset(self.key, mapping={f: encode_field(v) for f, v in mapping.items()})
+        if delete:
+            pipe.hdel(self.key, *delete)
+        pipe.expire(self.key, self.timeout)
+        pipe.execute()
+        self._touched = True
+        self._cache.update(mapping)
+        for field in delete:
+            self._cache[field] = None
+
+    def touch(self):
+        """Refresh the session TTL without reading or rewriting any fields."""
+        self.redis.expire(self.key, self.timeout)
+        self._touched = True
+
+    @contextmanager
+    def locked(self, name, timeout=LOCK_TIMEOUT):
+        """
+        Serialize a read-modify-write of session fields across workers.
+
+        Fields fetched before the lock was taken may have been changed by
+        another worker since, so the memoized fields are dropped on entry
+        and re-read under the lock.
+
+        Args:
+            name (str): What the lock guards (e.g. ``'roi_masks'``).
+            timeout (int, optional): Seconds to wait for the lock, which
+                also expires after that long if its holder dies.
+
+        Raises:
+            SessionBusy: If the lock is not free within ``timeout``.
+        """
+        # SET NX and a WATCH transaction rather than redis-py's Lock, which
+        # needs Lua scripting
+        key = f"lock:{self.key}:{name}"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        with stage('session_lock'):
+            while not self.redis.set(key, token, nx=True, ex=timeout):
+                if time.monotonic() >= deadline:
+                    raise SessionBusy(f"Timed out waiting for {key}")
+                time.sleep(0.01)
+        self._cache.clear()
+        try:
+            yield self
+        finally:
+            release_lock(self.redis, key, token)
+
+    def clear(self):
+        """Delete the whole session."""
+        self.redis.delete(self.key)
+        self._cache.clear()
+
+    def get_roi_masks(self, indices=None):
+        """
+        Fetch ROI info together with the mask arrays.
+
+        Args:
+            indices (list, optional): Only fetch these ROI indices.
+
+        Returns:
+            list: ROI info dicts with an added ``'mask'`` array.
+        """
+        roi_info = self.get('roi_masks', [])
+        if indices is None:
+            indices = range(len(roi_info))
+        indices = [i for i in indices if 0 <= i < len(roi_info)]
+        if not indices:
+            return []
+
+        masks = self.get_many(*[f"roi_mask:{i}" for i in indices])
+        with stage('volume_attach'):
+            return [dict(roi_info[i], mask=resolve_array(masks[f"roi_mask:{i}"])) for i in indices]
+
+    def set_roi_masks(self, roi_masks, extra=None):
+        """
+        Replace the session's ROI masks.
+
+        Args:
+            roi_masks (list): Dicts with ``'mask'`` arrays (or shared references)
+                plus JSON-serializable info.
+            extra (dict, optional): Other fields to write in the same round trip.
+        """
+        previous = len(self.get('roi_masks', []))
+        mapping = dict(extra or {})
+        mapping['roi_masks'] = [{k: v for k, v in m.items() if k != 'mask'} for m in roi_masks]
+        for i, mask in enumerate(roi_masks):
+            mapping[f"roi_mask:{i}"] = mask['mask']
+        stale = [f"roi_mask:{i}" for i in range(len(roi_masks), previous)]
+        self.update(mapping, delete=stale)
+
+def _handle_session_busy(error):
+    logger.warning(f"Rejecting request on a busy session: {str(error)}")
+    response = jsonify({"error": "Another request is changing this session, please retry shortly"})
+    response.status_code = 409
+    response.headers['Retry-After'] = '1'
+    return response
+
+def init_session_store(app):
+    """Create the shared Redis connection pool for an app and register its 409 handler."""
+    pool = ConnectionPool.from_url(
+        app.config['REDIS_URL'],
+        max_connections=app.config['REDIS_MAX_CONNECTIONS']
+    )
+    app.extensions['redis'] = Redis(connection_pool=pool)
+    app.register_error_handler(SessionBusy, _handle_session_busy)
+    return app.extensions['redis']
+
+def get_redis():
+    """Get the shared Redis client of the current app."""
+    return current_app.extensions['redis']
+
+def get_session(user_id=None):
+    """
+    Get the session accessor for a user, memoized for the current request.
+
+    Args:
+        user_id (str, optional): Defaults to the user id of the JWT identity.
+
+    Returns:
+        UserSession: The session accessor.
+    """
+    if user_id is None:
+        user_id = get_jwt_identity().get('user_id')
+
+    sessions = g.setdefault('user_sessions', {})
+    if user_id not in sessions:
+        sessions[user_id] = UserSession(
+            get_redis(), user_id, current_app.config['SESSION_TIMEOUT']
+        )
+    return sessions[user_id]
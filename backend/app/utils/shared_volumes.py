@@ -0,0 +1,376 @@
+import time
+import hashlib
+import logging
+import threading
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from flask import current_app, jsonify
+
+from app.utils.brick_store import open_bricks
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = 'drv_'
+INDEX_KEY = 'shmvol:index'
+TOTAL_KEY = 'shmvol:total_bytes'
+
+class SessionDataLost(Exception):
+    """Raised when a session refers to a volume that is no longer available."""
+    pass
+
+def _untrack(shm):
+    # Segment lifetime is managed by the registry, not by whichever process
+    # happened to create or attach it (the resource tracker would unlink the
+    # segment when that process exits).
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+def segment_name(name):
+    """Get the OS shared memory segment name for a registry name."""
+    return SEGMENT_PREFIX + hashlib.sha1(name.encode('utf-8')).hexdigest()[:24]
+
+def array_digest(array):
+    """Content hash of an array, used to name derived volumes such as masks."""
+    digest = hashlib.sha1(np.ascontiguousarray(array).data)
+    digest.update(f"{array.dtype.str}{array.shape}".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+class SharedVolumeRegistry:
+    """
+    Registry of volumes published in shared memory for all worker processes.
+
+    The first worker to load a series copies it into a named shared memory
+    segment and records it in Redis; other workers attach to the segment
+    read-only by name instead of loading their own copy. Each segment keeps
+    the set of users whose sessions reference it. Segments are unlinked once
+    no live session references them, and unreferenced segments are evicted
+    in LRU order when a new volume would exceed the global memory budget.
+    """
+
+    def __init__(self, redis_client, budget_bytes, sweep_interval=60, grace_period=60):
+        self.redis = redis_client
+        self.budget_bytes = budget_bytes
+        self.sweep_interval = sweep_interval
+        self.grace_period = grace_period
+        self._handles = {}  # name -> (SharedMemory, read-only ndarray)
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    @staticmethod
+    def _meta_key(name):
+        return f"shmvol:{name}"
+
+    @staticmethod
+    def _refs_key(name):
+        return f"shmvol:{name}:refs"
+
+    def publish(self, name, array):
+        """
+        Publish an array under a name, or attach to it if already published.
+
+        Args:
+            name (str): Registry name (e.g. ``"<series_id>:volume"``).
+            array (numpy.ndarray): The data to share.
+
+        Returns:
+            numpy.ndarray: A read-only view of the shared copy, or None if it
+            does not fit in the memory budget.
+        """
+        existing = self.attach(name)
+        if existing is not None:
+            return existing
+
+        nbytes = int(array.nbytes)
+        if not self._reserve(nbytes):
+            logger.warning(f"Shared volume budget exhausted, not sharing {name} ({nbytes} bytes)")
+            return None
+
+        try:
+            shm = shared_memory.SharedMemory(name=segment_name(name), create=True, size=max(nbytes, 1))
+        except FileExistsError:
+            # Another worker is publishing the same series right now
+            self.redis.decrby(TOTAL_KEY, nbytes)
+            return self.attach(name)
+        _untrack(shm)
+
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+        view[...] = array
+        view.flags.writeable = False
+
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(self._meta_key(name), mapping={
+            'segment': shm.name,
+            'shape': ','.join(str(d) for d in array.shape),
+            'dtype': array.dtype.str,
+            'nbytes': nbytes,
+            'created': now
+        })
+        pipe.zadd(INDEX_KEY, {name: now})
+        pipe.execute()
+
+        with self._lock:
+            self._handles[name] = (shm, view)
+        logger.info(f"Published shared volume {name} ({nbytes} bytes)")
+        return view
+
+    def attach(self, name):
+        """
+        Attach to a published array.
+
+        Returns:
+            numpy.ndarray: A read-only view, or None if the name is not published.
+        """
+        with self._lock:
+            handle = self._handles.get(name)
+        if handle is not None:
+            return handle[1]
+
+        meta = self.redis.hgetall(self._meta_key(name))
+        if not meta:
+            return None
+        meta = {k.decode(): v.decode() for k, v in meta.items()}
+
+        try:
+            shm = shared_memory.SharedMemory(name=meta['segment'])
+        except FileNotFoundError:
+            # The registry outlived the segment (e.g. host restart)
+            logger.warning(f"Shared volume {name} is registered but its segment is gone")
+            self._forget(name, int(meta['nbytes']))
+            return None
+        _untrack(shm)
+
+        shape = tuple(int(d) for d in meta['shape'].split(',') if d)
+        view = np.ndarray(shape, dtype=np.dtype(meta['dtype']), buffer=shm.buf)
+        view.flags.writeable = False
+        with self._lock:
+            self._handles[name] = (shm, view)
+        return view
+
+    def attach_writable(self, name):
+        """
+        Attach to a published array for editing in place.
+
+        Only arrays private to one session (e.g. an edited ROI mask) may be
+        written; other workers see the changes immediately.
+
+        Returns:
+            numpy.ndarray: A writable view, or None if the name is not published.
+        """
+        view = self.attach(name)
+        if view is None:
+            return None
+        with self._lock:
+            handle = self._handles.get(name)
+        if handle is None:
+            return None
+        return np.ndarray(view.shape, dtype=view.dtype, buffer=handle[0].buf)
+
+    def acquire(self, name, user_id):
+        """Record that a user's session references a published array."""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.sadd(self._refs_key(name), user_id)
+        pipe.zadd(INDEX_KEY, {name: time.time()})
+        pipe.execute()
+
+    def release(self, name, user_id):
+        """Drop a user's reference to a published array."""
+        self.redis.srem(self._refs_key(name), user_id)
+
+    def _reserve(self, nbytes):
+        self.sweep(force=True)
+        total = self.redis.incrby(TOTAL_KEY, nbytes)
+        if total <= self.budget_bytes:
+            return True
+
+        # Evict unreferenced segments, least recently used first
+        for raw in self.redis.zrange(INDEX_KEY, 0, -1):
+            name = raw.decode()
+            if self.redis.scard(self._refs_key(name)):
+                continue
+            total -= self._unlink(name)
+            if total <= self.budget_bytes:
+                return True
+
+        self.redis.decrby(TOTAL_KEY, nbytes)
+        return False
+
+    def _forget(self, name, nbytes):
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(self._meta_key(name))
+        pipe.delete(self._refs_key(name))
+        pipe.zrem(INDEX_KEY, name)
+        if not pipe.execute()[0]:
+            # Another worker already removed it and released its bytes
+            return 0
+        self.redis.decrby(TOTAL_KEY, nbytes)
+        return nbytes
+
+    def _unlink(self, name):
+        meta = self.redis.hmget(self._meta_key(name), 'segment', 'nbytes')
+        if meta[0] is None:
+            self.redis.zrem(INDEX_KEY, name)
+            return 0
+        freed = self._forget(name, int(meta[1]))
+        if not freed:
+            # Another worker unlinked it first
+            return 0
+        try:
+            # unlink() also drops the resource tracker entry made by attaching here
+            shm = shared_memory.SharedMemory(name=meta[0].decode())
+            shm.close()
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+        self._close_local(name)
+        logger.info(f"Unlinked shared volume {name} ({freed} bytes)")
+        return freed
+
+    def _close_local(self, name):
+        with self._lock:
+            handle = self._handles.pop(name, None)
+        if handle is None:
+            return
+        try:
+            handle[0].close()
+        except BufferError:
+            # Still referenced by an in-flight request; keep the mapping alive
+            with self._lock:
+                self._handles.setdefault(name, handle)
+
+    def sweep(self, force=False):
+        """
+        Drop references from expired sessions and unlink unreferenced segments.
+
+        Args:
+            force (bool): Sweep even if the sweep interval has not elapsed.
+        """
+        now = time.time()
+        if not force and now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+
+        for raw_name, created in self.redis.zrange(INDEX_KEY, 0, -1, withscores=True):
+            name = raw_name.decode()
+            users = [u.decode() for u in self.redis.smembers(self._refs_key(name))]
+            if users:
+                pipe = self.redis.pipeline(transaction=False)
+                for user_id in users:
+                    pipe.exists(f"session:{user_id}")
+                expired = [u for u, alive in zip(users, pipe.execute()) if not alive]
+                if expired:
+                    self.redis.srem(self._refs_key(name), *expired)
+                if len(expired) < len(users):
+                    continue
+            if now - created < self.grace_period:
+                # Published but not yet acquired by the loading session
+                continue
+            self._unlink(name)
+
+        # Close local mappings of segments other workers have unlinked
+        with self._lock:
+            local = list(self._handles)
+        for name in local:
+            if not self.redis.exists(self._meta_key(name)):
+                self._close_local(name)
+
+    def purge(self):
+        """Unlink every registered segment regardless of references."""
+        for raw in self.redis.zrange(INDEX_KEY, 0, -1):
+            self._unlink(raw.decode())
+
+    def stats(self):
+        """Return registry totals."""
+        return {
+            'segments': self.redis.zcard(INDEX_KEY),
+            'bytes': int(self.redis.get(TOTAL_KEY) or 0),
+            'budget_bytes': self.budget_bytes,
+            'attached_locally': len(self._handles)
+        }
+
+    def usage_by_kind(self):
+        """Return ``{kind: (count, bytes)}`` of published arrays (volume, mask, other)."""
+        names = [raw.decode() for raw in self.redis.zrange(INDEX_KEY, 0, -1)]
+        pipe = self.redis.pipeline(transaction=False)
+        for name in names:
+            pipe.hget(self._meta_key(name), 'nbytes')
+        usage = {}
+        for name, nbytes in zip(names, pipe.execute()):
+            if nbytes is None:
+                continue
+            kind = 'volume' if name.endswith(':volume') else 'mask' if ':roi:' in name else 'other'
+            count, total = usage.get(kind, (0, 0))
+            usage[kind] = (count + 1, total + int(nbytes))
+        return usage
+
+def _handle_data_lost(error):
+    logger.warning(f"Session data is gone: {str(error)}")
+    return jsonify({"error": "The loaded data is no longer available, please load the series again"}), 409
+
+def init_shared_volumes(app):
+    """Create the shared volume registry for an app and register its 409 handler."""
+    app.register_error_handler(SessionDataLost, _handle_data_lost)
+    if not app.config['SHARED_VOLUMES_ENABLED']:
+        app.extensions['shared_volumes'] = None
+        return None
+
+    registry = SharedVolumeRegistry(
+        app.extensions['redis'],
+        app.config['SHARED_VOLUME_BUDGET_BYTES'],
+        sweep_interval=app.config['SHARED_VOLUME_SWEEP_INTERVAL']
+    )
+    app.extensions['shared_volumes'] = registry
+    app.before_request(registry.sweep)
+    return registry
+
+def get_shared_volumes():
+    """Get the shared volume registry of the current app (None if disabled)."""
+    return current_app.extensions.get('shared_volumes')
+
+def share_array(user_id, name, array):
+    """
+    Publish an array for a user's session.
+
+    Returns:
+        The value to store in the session: a ``{'shared': name}`` reference,
+        or the array itself when sharing is disabled or over budget.
+    """
+    registry = get_shared_volumes()
+    if registry is None or registry.publish(name, array) is None:
+        return array
+    registry.acquire(name, user_id)
+    return {'shared': name}
+
+def release_array(user_id, value):
+    """Release a session value stored by ``share_array`` (no-op for plain arrays)."""
+    registry = get_shared_volumes()
+    if registry is not None and isinstance(value, dict) and 'shared' in value:
+        registry.release(value['shared'], user_id)
+
+def resolve_array(value, writable=False):
+    """
+    Turn a session value stored by ``share_array`` back into an array.
+
+    ``{'bricks': directory}`` references resolve to a ``BrickVolume`` reader.
+    With ``writable``, shared arrays are attached for editing in place.
+
+    Raises:
+        SessionDataLost: If the referenced volume is gone (evicted, swept,
+            lost in a restart, or sharing has since been disabled).
+    """
+    if isinstance(value, dict) and 'shared' in value:
+        registry = get_shared_volumes()
+        if registry is None:
+            raise SessionDataLost(f"Shared volumes are disabled, cannot attach {value['shared']}")
+        array = registry.attach_writable(value['shared']) if writable else registry.attach(value['shared'])
+        if array is None:
+            raise SessionDataLost(f"Shared volume {value['shared']} is gone")
+        return array
+    if isinstance(value, dict) and 'bricks' in value:
+        volume = open_bricks(value['bricks'], cache_bytes=current_app.config['BRICK_CACHE_BYTES'])
+        if volume is None:
+            raise SessionDataLost(f"Brick store {value['bricks']} is gone")
+        return volume
+    return value
@@ -0,0 +1,183 @@
+import logging
+from io import BytesIO
+import numpy as np
+
+from app.utils.overlay_kernel import fused_overlay, gray_scale
+from app.utils.timing import stage, timed
+
+logger = logging.getLogger(__name__)
+
+DOWNSAMPLE_BAND = 16  # Output rows summed at once
+
+def pyramid_levels(plane_shape, tile_size):
+    """
+    Levels of the tile pyramid of a slice plane.
+
+    Level 0 is the full resolution; each further level halves both sides,
+    down to the first level that fits in a single tile.
+
+    Args:
+        plane_shape (tuple): ``(rows, cols)`` of the slice plane.
+        tile_size (int): Side of a tile in pixels.
+
+    Returns:
+        list: Per level, ``level``, ``factor`` (source pixels per tile
+        pixel along each side), ``width``, ``height``, ``columns`` and
+        ``rows`` (number of tiles).
+    """
+    height, width = (int(n) for n in plane_shape)
+    levels = []
+    level = 0
+    while True:
+        factor = 2 ** level
+        level_height, level_width = -(-height // factor), -(-width // factor)
+        levels.append({
+            'level': level,
+            'factor': factor,
+            'width': level_width,
+            'height': level_height,
+            'columns': -(-level_width // tile_size),
+            'rows': -(-level_height // tile_size)
+        })
+        if level_height <= tile_size and level_width <= tile_size:
+            return levels
+        level += 1
+
+def tile_bounds(plane_shape, tile_size, level, tx, ty):
+    """
+    Source pixels covered by a tile.
+
+    Tiles on the right and bottom edges are cut to the plane, so they can
+    be smaller than ``tile_size``.
+
+    Args:
+        plane_shape (tuple): ``(rows, cols)`` of the slice plane.
+        tile_size (int): Side of a tile in pixels.
+        level (int): Pyramid level (0 is the full resolution).
+        tx (int): Tile column.
+        ty (int): Tile row.
+
+    Returns:
+        tuple: ``(rows, cols)`` ``(start, stop)`` ranges in the plane.
+
+    Raises:
+        ValueError: If the level or tile does not exist.
+    """
+    levels = pyramid_levels(plane_shape, tile_size)
+    if not 0 <= level < len(levels):
+        raise ValueError(f"level must be in [0, {len(levels) - 1}]")
+    info = levels[level]
+    if not (0 <= tx < info['columns'] and 0 <= ty < info['rows']):
+        raise ValueError(f"Level {level} has {info['columns']}x{info['rows']} tiles")
+    span = tile_size * info['factor']
+    rows = (ty * span, min((ty + 1) * span, plane_shape[0]))
+    cols = (tx * span, min((tx + 1) * span, plane_shape[1]))
+    return rows, cols
+
+def read_region(volume, axis, slice_index, rows, cols):
+    """
+    Read a rectangle of one slice, without reading the rest of the plane
+    (brick volumes only decompress the bricks it touches).
+
+    Returns:
+        numpy.ndarray: The 2D region.
+    """
+    key = [slice(*rows), slice(*cols)]
+    key.insert(axis, slice_index)
+    return np.asarray(volume[tuple(key)])
+
+def downsample(region, factor, reduce='mean'):
+    """
+    Shrink a region by an integer factor per side.
+
+    Each output pixel covers a ``factor`` x ``factor`` block; blocks cut by
+    the region edge only use the pixels they have.
+
+    Args:
+        region (numpy.ndarray): The 2D region.
+        factor (int): Source pixels per output pixel along each side.
+        reduce (str, optional): ``'mean'`` for intensities, ``'max'`` for
+            masks (so thin structures do not vanish at coarse levels).
+
+    Returns:
+        numpy.ndarray: The downsampled region.
+    """
+    if factor == 1:
+        return region
+    starts = [np.arange(0, n, factor) for n in region.shape]
+    if reduce == 'max':
+        return np.maximum.reduceat(np.maximum.reduceat(region, starts[0], axis=0), starts[1], axis=1)
+    
+    # Sum in float64 a band of block rows at a time, so coarse levels never
+    # hold a float64 copy of the whole plane
+    sums = np.empty((len(starts[0]), len(starts[1])), dtype=np.float64)
+    for band in range(0, len(starts[0]), DOWNSAMPLE_BAND):
+        rows = starts[0][band:band + DOWNSAMPLE_BAND]
+        block = region[rows[0]:rows[-1] + factor]
+        sums[band:band + len(rows)] = np.add.reduceat(
+            np.add.reduceat(block, rows - rows[0], axis=0, dtype=np.float64), starts[1], axis=1
+        )
+    counts = np.outer(*(np.diff(np.append(s, n)) for s, n in zip(starts, region.shape)))
+    return sums / counts
+
+@timed('tile_read')
+def read_tile(volume, axis, slice_index, bounds, factor):
+    """Source pixels of a tile, downsampled to its level."""
+    return downsample(read_region(volume, axis, slice_index, *bounds), factor)
+
+@timed('roi_slice')
+def read_tile_layers(roi_masks, axis, slice_index, bounds, factor):
+    """
+    ROI overlay layers of a tile (see ``get_roi_overlay_layers``).
+
+    Returns:
+        list: ROI layers, downsampled to the tile's level.
+        list: Layer names.
+    """
+    layers = []
+    names = []
+    for roi_mask in roi_masks:
+        region = read_region(roi_mask['mask'], axis, slice_index, *bounds)
+        labels = roi_mask.get('labels')
+        if labels:
+            for value, name in labels:
+                layers.append(downsample((region == value).astype(np.uint8), factor, 'max'))
+                names.append(name)
+        else:
+            layers.append(downsample(region, factor, 'max'))
+            names.append(roi_mask['label'])
+    return layers, names
+
+def render_tile(image, layers, window, colors, alpha=0.5, kernel='numpy'):
+    """
+    Render a tile at its own pixel size.
+
+    Tiles are drawn pixel for pixel (no figure, axes or legend): grayscale
+    without ROI layers, RGBA with them, blended by ``fused_overlay``.
+
+    Args:
+        image (numpy.ndarray): Raw pixels of the tile.
+        layers (list): ROI layers of the tile (may be empty).
+        window (tuple): ``(center, width)`` to apply.
+        colors (list): ``[r, g, b]`` ROI colors in [0, 1].
+        alpha (float, optional): Opacity of the ROI colors.
+        kernel (str, optional): Overlay kernel (``'numba'`` or ``'numpy'``).
+
+    Returns:
+        bytes: PNG image data as bytes.
+    """
+    from PIL import Image
+
+    if any(np.any(layer) for layer in layers):
+        rgba = fused_overlay(image, layers, colors, alpha, window=window, kernel=kernel)
+        tile = Image.fromarray(rgba, 'RGBA')
+    else:
+        with stage('window'):
+            low, scale = gray_scale(window=window)
+            gray = np.clip(np.subtract(image, low, dtype=np.float64) * scale, 0.0, 1.0) * 255 + 0.5
+        tile = Image.fromarray(gray.astype(np.uint8), 'L')
+
+    with stage('encode'):
+        buf = BytesIO()
+        tile.save(buf, format='PNG')
+    return buf.getvalue()
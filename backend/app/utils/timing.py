@@ -0,0 +1,109 @@
+import json
+import random
+import logging
+import contextvars
+from time import perf_counter
+from functools import wraps
+from contextlib import contextmanager
+from flask import current_app, g, request
+
+logger = logging.getLogger(__name__)
+timing_logger = logging.getLogger('app.timing')
+
+# Stage name -> accumulated seconds for the sampled request (None when not sampled)
+_timings = contextvars.ContextVar('stage_timings', default=None)
+
+def is_collecting():
+    """Whether stage timings are being collected in the current context."""
+    return _timings.get() is not None
+
+@contextmanager
+def stage(name):
+    """Time a block as a named stage of the current request (no-op when not sampled)."""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + perf_counter() - start
+
+def timed(name):
+    """Decorator that times every call of a function as a named stage."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _timings.get() is None:
+                return fn(*args, **kwargs)
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record(timings):
+    """Add timings measured elsewhere (e.g. in a render worker) to the current request."""
+    current = _timings.get()
+    if current is None:
+        return
+    for name, seconds in timings.items():
+        current[name] = current.get(name, 0.0) + seconds
+
+def run_collected(fn, *args, **kwargs):
+    """
+    Call a function while collecting its stage timings.
+
+    Used as the entry point of render jobs so timings measured in a worker
+    process can be returned alongside the result.
+
+    Returns:
+        tuple: ``(result, timings)``.
+    """
+    token = _timings.set({})
+    try:
+        result = fn(*args, **kwargs)
+        return result, _timings.get()
+    finally:
+        _timings.reset(token)
+
+def _start_request_timing():
+    rate = current_app.config['TIMING_SAMPLE_RATE']
+    if rate > 0 and (rate >= 1.0 or random.random() < rate):
+        g.timing_token = _timings.set({})
+        g.timing_start = perf_counter()
+
+def _finish_request_timing(response):
+    token = g.pop('timing_token', None)
+    if token is None:
+        return response
+
+    timings = _timings.get()
+    _timings.reset(token)
+    total = perf_counter() - g.pop('timing_start')
+
+    entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    response.headers['Server-Timing'] = ', '.join(entries)
+
+    timing_logger.info(json.dumps({
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'total_ms': round(total * 1000, 3),
+        'stages_ms': {name: round(seconds * 1000, 3) for name, seconds in timings.items()}
+    }))
+    return response
+
+def _teardown_request_timing(_exc=None):
+    # Make sure a failed request does not leave its collector active
+    token = g.pop('timing_token', None)
+    if token is not None:
+        _timings.reset(token)
+
+def init_timing(app):
+    """Enable sampled per-stage request timing for an app."""
+    app.before_request(_start_request_timing)
+    app.after_request(_finish_request_timing)
+    app.teardown_request(_teardown_request_timing)
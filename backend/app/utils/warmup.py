@@ -0,0 +1,70 @@
+import gc
+import logging
+import importlib
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+# Imported on first use by the request path; see warm_up()
+HEAVY_MODULES = (
+    'numpy',
+    'scipy.ndimage',
+    'pydicom',
+    'nibabel',
+    'matplotlib.pyplot',
+    'matplotlib.colors',
+    'skimage.measure',
+    'numba'  # Imported only: running a parallel kernel starts threads, which must not precede a fork
+)
+
+def warm_up(app, render_pool=False):
+    """
+    Pay the one-time costs of the first request ahead of time.
+
+    Heavy modules are only imported on first use so that tools, tests and
+    single requests start fast. A server calls this before accepting
+    traffic: in a preloading gunicorn master it runs once and the forked
+    workers share the imported modules copy-on-write.
+
+    Args:
+        app (flask.Flask): The application.
+        render_pool (bool, optional): Also start the render worker processes.
+            Must only be done in the process that serves requests (never in
+            a master that forks afterwards).
+
+    Returns:
+        dict: Seconds spent per warm-up step.
+    """
+    timings = {}
+
+    import matplotlib
+    matplotlib.use('Agg')
+    for module in HEAVY_MODULES:
+        start = perf_counter()
+        importlib.import_module(module)
+        timings[f"import {module}"] = perf_counter() - start
+
+    # The first figure loads fonts and builds matplotlib's caches
+    import numpy as np
+    from app.utils.dicom_utils import create_slice_image
+    start = perf_counter()
+    create_slice_image(np.zeros((8, 8), dtype=np.float32))
+    timings['first render'] = perf_counter() - start
+
+    if render_pool:
+        start = perf_counter()
+        app.extensions['render_pool'].warm()
+        timings['render pool'] = perf_counter() - start
+
+    logger.info(f"Warm-up finished in {sum(timings.values()):.2f}s")
+    return timings
+
+def freeze_for_fork():
+    """
+    Keep the objects created so far out of garbage collection.
+
+    Called in a preloading master right before it forks, so that collections
+    in the workers do not write to (and thereby un-share) inherited pages.
+    """
+    gc.collect()
+    gc.freeze()
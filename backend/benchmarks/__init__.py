@@ -0,0 +1 @@
+"""Benchmark suite for the DICOM/ROI processing pipeline and API endpoints."""
@@ -0,0 +1,114 @@
+"""Benchmarks of the HTTP endpoints through the Flask test client."""
+import os
+import shutil
+
+import fakeredis
+
+from app import create_app
+from app.utils.image_cache import get_image_cache
+from benchmarks.harness import benchmark
+
+USER_ID = 'user_admin'
+
+class EndpointClient:
+    """A testing app wired to an in-memory Redis with the context's data uploaded."""
+
+    def __init__(self, ctx):
+        self.app = create_app('testing')
+        self.upload_dir = os.path.join(ctx.root, 'uploads')
+        self.app.config['UPLOAD_FOLDER'] = self.upload_dir
+
+        # Local Redis stand-in shared by every component of this app
+        redis_client = fakeredis.FakeRedis()
+        self.app.extensions['redis'] = redis_client
+        for extension in self.app.extensions.values():
+            if hasattr(extension, 'redis'):
+                extension.redis = redis_client
+
+        user_dir = os.path.join(self.upload_dir, USER_ID)
+        shutil.copytree(ctx.dicom_dir, os.path.join(user_dir, 'dicom'))
+        shutil.copytree(ctx.nifti_dir, os.path.join(user_dir, 'nifti'))
+        self.nifti_files = [f['filename'] for f in ctx.nifti_files]
+        self.shape = list(ctx.shape)
+
+        self.client = self.app.test_client()
+        response = self.client.post('/api/auth/login', json={'username': 'admin', 'password': 'password123'})
+        self.headers = {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+    def request(self, method, url, **kwargs):
+        response = self.client.open(url, method=method, headers=self.headers, **kwargs)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {url} failed with {response.status_code}: {response.data[:200]!r}")
+        return response
+
+    def load(self):
+        self.request('POST', '/api/viewer/load_dicom', json={})
+
+    def process_rois(self):
+        self.request('POST', '/api/roi/process', json={
+            'nifti_files': self.nifti_files,
+            'dicom_shape': self.shape
+        })
+
+    def clear_image_cache(self):
+        with self.app.app_context():
+            get_image_cache().invalidate_user(USER_ID)
+
+    def close(self):
+        registry = self.app.extensions.get('shared_volumes')
+        if registry is not None:
+            registry.purge()
+        self.app.extensions['render_pool'].shutdown()
+
+def _loaded_client(ctx):
+    def build():
+        client = EndpointClient(ctx)
+        client.load()
+        client.process_rois()
+        return client
+    return ctx.cached('endpoint_client', build)
+
+@benchmark('endpoint_load_dicom', group='endpoints')
+def bench_endpoint_load_dicom(ctx):
+    return _loaded_client(ctx).load
+
+@benchmark('endpoint_roi_process', group='endpoints')
+def bench_endpoint_roi_process(ctx):
+    return _loaded_client(ctx).process_rois
+
+@benchmark('endpoint_get_metadata', group='endpoints')
+def bench_endpoint_get_metadata(ctx):
+    client = _loaded_client(ctx)
+    return lambda: client.request('GET', '/api/viewer/get_metadata')
+
+@benchmark('endpoint_get_slice', group='endpoints')
+def bench_endpoint_get_slice(ctx):
+    client = _loaded_client(ctx)
+    url = f"/api/viewer/get_slice?view=axial&slice_index={ctx.shape[0] // 2}"
+
+    def run():
+        client.clear_image_cache()
+        client.request('GET', url)
+    return run
+
+@benchmark('endpoint_get_slice_cached', group='endpoints')
+def bench_endpoint_get_slice_cached(ctx):
+    client = _loaded_client(ctx)
+    url = f"/api/viewer/get_slice?view=axial&slice_index={ctx.shape[0] // 2}"
+    return lambda: client.request('GET', url)
+
+@benchmark('endpoint_get_combined_view', group='endpoints')
+def bench_endpoint_get_combined_view(ctx):
+    client = _loaded_client(ctx)
+    url = f"/api/viewer/get_combined_view?view=coronal&slice_index={ctx.shape[1] // 2}"
+
+    def run():
+        client.clear_image_cache()
+        client.request('GET', url)
+    return run
+
+@benchmark('endpoint_roi_get_overlay', group='endpoints')
+def bench_endpoint_roi_get_overlay(ctx):
+    client = _loaded_client(ctx)
+    url = f"/api/roi/get_overlay?view=axial&slice_index={ctx.shape[0] // 2}"
+    return lambda: client.request('GET', url)
@@ -0,0 +1,194 @@
+"""Benchmarks of the individual processing stages."""
+import os
+import shutil
+import numpy as np
+
+from app.utils.dicom_utils import (
+    load_dicom_series,
+    get_dicom_slice,
+    apply_windowing,
+    create_slice_image,
+    load_hounsfield_ranges,
+    apply_hounsfield_segmentation,
+    get_volume_spacing,
+    compute_volume_stats,
+    resample_volume
+)
+from app.utils.brick_store import write_bricks, BrickVolume
+from app.utils.mesh_utils import crop_roi, mesh_roi_crop
+from app.utils.roi_algebra import PackedMask, evaluate
+from app.utils.nifti_utils import (
+    create_roi_masks,
+    get_roi_slice,
+    apply_roi_overlay,
+    create_roi_overlay_image,
+    ROI_COLORS
+)
+from app.utils.overlay_kernel import fused_overlay
+from app.utils.tiles import pyramid_levels, tile_bounds, read_tile, render_tile
+from benchmarks.harness import benchmark
+
+def _volume(ctx):
+    return ctx.cached('volume', lambda: load_dicom_series(ctx.dicom_dir)[0])
+
+def _masks(ctx):
+    return ctx.cached('masks', lambda: [m['mask'] for m in create_roi_masks(ctx.nifti_files, ctx.shape)])
+
+def _middle(ctx, axis):
+    return ctx.shape[axis] // 2
+
+@benchmark('load_dicom_series', group='stages')
+def bench_load_dicom_series(ctx):
+    return lambda: load_dicom_series(ctx.dicom_dir)
+
+@benchmark('create_roi_masks', group='stages')
+def bench_create_roi_masks(ctx):
+    return lambda: create_roi_masks(ctx.nifti_files, ctx.shape)
+
+@benchmark('create_roi_masks_resampled', group='stages')
+def bench_create_roi_masks_resampled(ctx):
+    # Labels at half the in-plane resolution force the resampling path
+    target = (ctx.shape[0], ctx.shape[1] * 2, ctx.shape[2] * 2)
+    return lambda: create_roi_masks(ctx.nifti_files, target)
+
+@benchmark('hounsfield_segmentation', group='stages')
+def bench_hounsfield_segmentation(ctx):
+    volume = _volume(ctx)
+    ranges = load_hounsfield_ranges()
+    return lambda: apply_hounsfield_segmentation(volume, ranges)
+
+@benchmark('compute_volume_stats', group='stages')
+def bench_compute_volume_stats(ctx):
+    volume = _volume(ctx)
+    return lambda: compute_volume_stats(volume)
+
+@benchmark('resample_isotropic', group='stages')
+def bench_resample_isotropic(ctx):
+    volume, metadata = ctx.cached('volume_with_metadata', lambda: load_dicom_series(ctx.dicom_dir))
+    spacing = get_volume_spacing(metadata)
+    return lambda: resample_volume(volume, spacing, (min(spacing),) * 3)
+
+@benchmark('mesh_roi', group='stages')
+def bench_mesh_roi(ctx):
+    crop, origin = crop_roi(_masks(ctx)[0])
+    return lambda: mesh_roi_crop(crop, origin, (2.5, 0.7, 0.7), fmt='ply')
+
+@benchmark('roi_pack', group='stages')
+def bench_roi_pack(ctx):
+    mask = _masks(ctx)[0]
+    return lambda: PackedMask.from_mask(mask)
+
+@benchmark('roi_union', group='stages')
+def bench_roi_union(ctx):
+    packed = [PackedMask.from_mask(mask) for mask in _masks(ctx)]
+    return lambda: evaluate('union', packed)
+
+@benchmark('roi_dilate', group='stages')
+def bench_roi_dilate(ctx):
+    packed = PackedMask.from_mask(_masks(ctx)[0])
+    return lambda: evaluate('dilate', [packed], 5.0, (2.5, 0.7, 0.7))
+
+@benchmark('get_dicom_slice_axial', group='stages')
+def bench_get_dicom_slice_axial(ctx):
+    volume = _volume(ctx)
+    return lambda: get_dicom_slice(volume, _middle(ctx, 0), 0, 40, 400)
+
+@benchmark('get_dicom_slice_sagittal', group='stages')
+def bench_get_dicom_slice_sagittal(ctx):
+    volume = _volume(ctx)
+    return lambda: get_dicom_slice(volume, _middle(ctx, 2), 2, 40, 400)
+
+def _bricks(ctx):
+    def build():
+        directory = os.path.join(ctx.root, 'bricks')
+        write_bricks(_volume(ctx), directory)
+        return directory
+    # No brick cache: every read pays for decompression
+    return BrickVolume(ctx.cached('bricks', build), cache_bytes=0)
+
+@benchmark('write_bricks', group='stages')
+def bench_write_bricks(ctx):
+    volume = _volume(ctx)
+    directory = os.path.join(ctx.root, 'bricks_write')
+    def run():
+        shutil.rmtree(directory, ignore_errors=True)
+        write_bricks(volume, directory)
+    return run
+
+@benchmark('get_dicom_slice_bricks_axial', group='stages')
+def bench_get_dicom_slice_bricks_axial(ctx):
+    volume = _bricks(ctx)
+    return lambda: get_dicom_slice(volume, _middle(ctx, 0), 0, 40, 400)
+
+@benchmark('get_dicom_slice_bricks_sagittal', group='stages')
+def bench_get_dicom_slice_bricks_sagittal(ctx):
+    volume = _bricks(ctx)
+    return lambda: get_dicom_slice(volume, _middle(ctx, 2), 2, 40, 400)
+
+@benchmark('apply_windowing', group='stages')
+def bench_apply_windowing(ctx):
+    slice_data = get_dicom_slice(_volume(ctx), _middle(ctx, 0), 0)
+    return lambda: apply_windowing(slice_data, 40, 400)
+
+@benchmark('apply_roi_overlay', group='stages')
+def bench_apply_roi_overlay(ctx):
+    index = _middle(ctx, 0)
+    slice_data = get_dicom_slice(_volume(ctx), index, 0, 40, 400)
+    roi_slices = [get_roi_slice(mask, index, 0) for mask in _masks(ctx)]
+    return lambda: apply_roi_overlay(slice_data, roi_slices)
+
+def _bench_fused_overlay(ctx, kernel):
+    index = _middle(ctx, 0)
+    slice_data = get_dicom_slice(_volume(ctx), index, 0)
+    roi_slices = [get_roi_slice(mask, index, 0) for mask in _masks(ctx)]
+    run = lambda: fused_overlay(slice_data, roi_slices, ROI_COLORS, window=(40, 400), kernel=kernel)
+    # Compile outside the timed rounds
+    run()
+    return run
+
+# Same output as get_dicom_slice(..., 40, 400) + apply_roi_overlay, from the raw slice
+@benchmark('fused_overlay_numba', group='stages')
+def bench_fused_overlay_numba(ctx):
+    return _bench_fused_overlay(ctx, 'numba')
+
+@benchmark('fused_overlay_numpy', group='stages')
+def bench_fused_overlay_numpy(ctx):
+    return _bench_fused_overlay(ctx, 'numpy')
+
+TILE_SIZE = 256
+
+def _large_plane(ctx):
+    # A digital X-ray sized matrix, independent of the profile's volume
+    return ctx.cached('large_plane', lambda: np.random.default_rng(0).integers(
+        -1000, 2000, (1, 3072, 4096)
+    ).astype(np.float32))
+
+def _bench_tile(ctx, level):
+    volume = _large_plane(ctx)
+    levels = pyramid_levels(volume.shape[1:], TILE_SIZE)
+    level = level % len(levels)
+    info = levels[level]
+    bounds = tile_bounds(volume.shape[1:], TILE_SIZE, level, info['columns'] // 2, info['rows'] // 2)
+    return lambda: render_tile(read_tile(volume, 0, 0, bounds, info['factor']), [], (40, 400), ROI_COLORS)
+
+@benchmark('tile_full_resolution', group='stages')
+def bench_tile_full_resolution(ctx):
+    return _bench_tile(ctx, 0)
+
+@benchmark('tile_overview', group='stages')
+def bench_tile_overview(ctx):
+    # The coarsest level reads and downsamples the whole plane
+    return _bench_tile(ctx, -1)
+
+@benchmark('create_slice_image', group='stages')
+def bench_create_slice_image(ctx):
+    slice_data = get_dicom_slice(_volume(ctx), _middle(ctx, 0), 0)
+    return lambda: create_slice_image(slice_data, 40, 400)
+
+@benchmark('create_roi_overlay_image', group='stages')
+def bench_create_roi_overlay_image(ctx):
+    index = _middle(ctx, 0)
+    slice_data = get_dicom_slice(_volume(ctx), index, 0, 40, 400)
+    roi_slices = [get_roi_slice(mask, index, 0) for mask in _masks(ctx)]
+    names = [f"roi_{i}" for i in range(len(roi_slices))]
+    return lambda: create_roi_overlay_image(slice_data, roi_slices, names)
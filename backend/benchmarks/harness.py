@@ -0,0 +1,171 @@
+"""Timing, memory measurement, registration and baseline comparison for benchmarks."""
+import gc
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.synthetic import generate_dicom_series, generate_nifti_labels
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+# Data sizes per profile: (slices, rows, columns, number of ROI files)
+PROFILES = {
+    'quick': {'num_slices': 24, 'rows': 128, 'columns': 128, 'num_rois': 2},
+    'default': {'num_slices': 96, 'rows': 256, 'columns': 256, 'num_rois': 4},
+    'large': {'num_slices': 256, 'rows': 512, 'columns': 512, 'num_rois': 8}
+}
+
+_registry = []
+
+def benchmark(name, group):
+    """
+    Register a benchmark.
+
+    The decorated function receives the ``BenchmarkContext`` and returns a
+    zero-argument callable; only that callable is timed.
+    """
+    def decorator(fn):
+        _registry.append({'name': name, 'group': group, 'factory': fn})
+        return fn
+    return decorator
+
+def registered_benchmarks():
+    """Return all registered benchmarks in registration order."""
+    return list(_registry)
+
+class BenchmarkContext:
+    """Synthetic input data for one profile, written to a temporary directory."""
+
+    def __init__(self, profile='quick', transfer_syntax='explicit', bits_stored=12, seed=0):
+        self.profile = profile
+        self.params = dict(PROFILES[profile])
+        self.root = tempfile.mkdtemp(prefix='dicom_roi_bench_')
+        self.dicom_dir = os.path.join(self.root, 'dicom')
+        self.nifti_dir = os.path.join(self.root, 'nifti')
+        self.shape = (self.params['num_slices'], self.params['rows'], self.params['columns'])
+
+        generate_dicom_series(
+            self.dicom_dir,
+            num_slices=self.params['num_slices'],
+            rows=self.params['rows'],
+            columns=self.params['columns'],
+            bits_stored=bits_stored,
+            transfer_syntax=transfer_syntax,
+            seed=seed
+        )
+        self.nifti_files = generate_nifti_labels(
+            self.nifti_dir, self.shape, num_rois=self.params['num_rois'], seed=seed
+        )
+        self._state = {}
+
+    def cached(self, key, build):
+        """Build a shared intermediate (e.g. the loaded volume) once per context."""
+        if key not in self._state:
+            self._state[key] = build()
+        return self._state[key]
+
+    def close(self):
+        for value in self._state.values():
+            if hasattr(value, 'close'):
+                value.close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+def measure(fn, rounds=5, warmup=1):
+    """
+    Time a callable and record its peak traced allocation.
+
+    Timing rounds run without tracemalloc so tracing overhead does not skew
+    them; one extra round runs under tracemalloc to get the memory peak.
+
+    Returns:
+        dict: ``median_s``, ``min_s``, ``max_s``, ``rounds`` and ``peak_bytes``.
+    """
+    for _ in range(warmup):
+        fn()
+
+    timings = []
+    for _ in range(rounds):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'median_s': statistics.median(timings),
+        'min_s': min(timings),
+        'max_s': max(timings),
+        'rounds': rounds,
+        'peak_bytes': peak
+    }
+
+def load_baselines(path=BASELINES_PATH):
+    """Load stored baselines (``{profile: {benchmark: result}}``)."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_baselines(profile, results, path=BASELINES_PATH):
+    """
+    Store results as the baselines of a profile.
+
+    Only the benchmarks in ``results`` are replaced, so a filtered run
+    keeps the baselines of every other benchmark and profile.
+    """
+    baselines = load_baselines(path)
+    baselines.setdefault(profile, {}).update({
+        name: {'median_s': r['median_s'], 'peak_bytes': r['peak_bytes']}
+        for name, r in results.items()
+    })
+    with open(path, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+def find_regressions(profile, results, threshold=0.25, memory_threshold=None, path=BASELINES_PATH):
+    """
+    Compare results with the stored baselines.
+
+    Args:
+        profile (str): The profile the results were produced with.
+        results (dict): Benchmark name -> ``measure`` result.
+        threshold (float): Allowed relative slowdown of the median time.
+        memory_threshold (float, optional): Allowed relative growth of the
+            memory peak (defaults to ``threshold``).
+
+    Returns:
+        list: Human-readable descriptions of each regression, including
+        every benchmark that has no baseline to compare with.
+    """
+    if memory_threshold is None:
+        memory_threshold = threshold
+    baselines = load_baselines(path).get(profile, {})
+
+    regressions = []
+    for name, result in results.items():
+        base = baselines.get(name)
+        if base is None:
+            regressions.append(f"{name}: no baseline for profile {profile} (run with --save-baseline)")
+            continue
+        if result['median_s'] > base['median_s'] * (1 + threshold):
+            regressions.append(
+                f"{name}: median {result['median_s'] * 1000:.1f} ms vs baseline "
+                f"{base['median_s'] * 1000:.1f} ms (+{(result['median_s'] / base['median_s'] - 1) * 100:.0f}%)"
+            )
+        if base['peak_bytes'] and result['peak_bytes'] > base['peak_bytes'] * (1 + memory_threshold):
+            regressions.append(
+                f"{name}: peak memory {result['peak_bytes'] / 2 ** 20:.1f} MiB vs baseline "
+                f"{base['peak_bytes'] / 2 ** 20:.1f} MiB"
+            )
+    return regressions
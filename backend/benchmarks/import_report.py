@@ -0,0 +1,110 @@
+"""
+Report the import time of the ``create_app`` path.
+
+Each round runs ``create_app`` in a fresh interpreter with ``-X importtime``
+and reports the wall time, the slowest modules (cumulative, median over the
+rounds) and which heavy modules were imported at startup. It then measures
+what ``warm_up`` pays for the imports that were deferred to first use.
+
+Usage (from ``backend/``)::
+
+    python -m benchmarks.import_report
+    python -m benchmarks.import_report --rounds 10 --top 30 --json import_times.json
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+from app.utils.warmup import HEAVY_MODULES
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app({config!r})
+created = time.perf_counter()
+result = {{'import_s': imported - start, 'create_app_s': created - imported,
+          'heavy_loaded': [m for m in {heavy!r} if m in sys.modules]}}
+if {warm!r}:
+    from app.utils.warmup import warm_up
+    result['warm_up'] = warm_up(app)
+print(json.dumps(result))
+"""
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)$')
+
+def run_startup(config, warm=False):
+    """Start the app in a fresh interpreter; returns (result, {module: (self_us, cumulative_us, depth)})."""
+    script = STARTUP_SCRIPT.format(config=config, heavy=list(HEAVY_MODULES), warm=warm)
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', script],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    )
+    modules = {}
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = (int(self_us), int(cumulative_us), (len(indent) - 1) // 2)
+    return json.loads(proc.stdout.strip().splitlines()[-1]), modules
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import-time report for create_app")
+    parser.add_argument('--config', default='testing')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--json', dest='json_path', default=None, help="Also write the report to this file")
+    args = parser.parse_args(argv)
+
+    runs = [run_startup(args.config) for _ in range(args.rounds)]
+    results = [r for r, _ in runs]
+    cumulative = {}
+    for _, modules in runs:
+        for name, (_self_us, cumulative_us, depth) in modules.items():
+            cumulative.setdefault(name, []).append((cumulative_us, depth))
+
+    import_s = statistics.median(r['import_s'] for r in results)
+    create_s = statistics.median(r['create_app_s'] for r in results)
+    slowest = sorted(
+        ((statistics.median(us for us, _ in samples), samples[0][1], name)
+         for name, samples in cumulative.items()),
+        reverse=True
+    )[:args.top]
+
+    print(f"create_app path ({args.config}, median of {args.rounds} fresh interpreters)")
+    print(f"  import app        {import_s * 1000:8.1f} ms")
+    print(f"  create_app()      {create_s * 1000:8.1f} ms")
+    print(f"  heavy modules loaded at startup: {', '.join(results[0]['heavy_loaded']) or 'none'}")
+    print()
+    print(f"{'cumulative ms':>14}  module")
+    for us, depth, name in slowest:
+        print(f"{us / 1000:>14.1f}  {'  ' * depth}{name}")
+
+    warm_result, _ = run_startup(args.config, warm=True)
+    print()
+    print("Deferred to first use (warm_up):")
+    for step, seconds in warm_result['warm_up'].items():
+        print(f"{seconds * 1000:>14.1f}  {step}")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({
+                'config': args.config,
+                'rounds': args.rounds,
+                'import_s': import_s,
+                'create_app_s': create_s,
+                'heavy_loaded': results[0]['heavy_loaded'],
+                'slowest_modules_ms': {name: us / 1000 for us, _, name in slowest},
+                'warm_up_s': warm_result['warm_up']
+            }, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
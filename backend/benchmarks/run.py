@@ -0,0 +1,96 @@
+"""
+Run the benchmark suite.
+
+Usage (from ``backend/``)::
+
+    python -m benchmarks.run                      # quick profile, all benchmarks
+    python -m benchmarks.run --profile default --filter endpoint_
+    python -m benchmarks.run --save-baseline      # store results as the baseline of each benchmark run
+    python -m benchmarks.run --check              # exit 1 on regressions vs the baseline, or none to compare with
+"""
+import argparse
+import importlib
+import json
+import logging
+import sys
+
+from benchmarks.harness import (
+    PROFILES,
+    BenchmarkContext,
+    registered_benchmarks,
+    measure,
+    save_baselines,
+    find_regressions
+)
+from benchmarks.synthetic import TRANSFER_SYNTAXES
+
+BENCHMARK_MODULES = ['benchmarks.bench_stages', 'benchmarks.bench_endpoints']
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="DICOM ROI Viewer benchmarks")
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='quick')
+    parser.add_argument('--filter', default='', help="Only run benchmarks whose name contains this")
+    parser.add_argument('--group', default=None, help="Only run one group (stages, endpoints, ...)")
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--transfer-syntax', choices=sorted(TRANSFER_SYNTAXES), default='explicit')
+    parser.add_argument('--bits-stored', type=int, choices=[8, 12, 16], default=12)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true', help="Fail if slower than the stored baseline")
+    parser.add_argument('--threshold', type=float, default=0.25, help="Allowed relative slowdown")
+    parser.add_argument('--memory-threshold', type=float, default=None, help="Allowed relative memory growth")
+    parser.add_argument('--json', dest='json_path', default=None, help="Also write results to this file")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    for module in BENCHMARK_MODULES:
+        importlib.import_module(module)
+
+    selected = [
+        b for b in registered_benchmarks()
+        if args.filter in b['name'] and (args.group is None or b['group'] == args.group)
+    ]
+    if not selected:
+        print("No benchmarks selected")
+        return 1
+
+    ctx = BenchmarkContext(args.profile, transfer_syntax=args.transfer_syntax, bits_stored=args.bits_stored)
+    results = {}
+    try:
+        print(f"Profile {args.profile}: volume {ctx.shape}, {ctx.params['num_rois']} ROIs, "
+              f"{args.transfer_syntax}, {args.bits_stored}-bit")
+        print(f"{'benchmark':<32}{'median ms':>12}{'min ms':>10}{'peak MiB':>10}")
+        for bench in selected:
+            fn = bench['factory'](ctx)
+            result = measure(fn, rounds=args.rounds)
+            results[bench['name']] = result
+            print(f"{bench['name']:<32}{result['median_s'] * 1000:>12.2f}"
+                  f"{result['min_s'] * 1000:>10.2f}{result['peak_bytes'] / 2 ** 20:>10.2f}")
+    finally:
+        ctx.close()
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'profile': args.profile, 'results': results}, f, indent=2)
+
+    if args.save_baseline:
+        save_baselines(args.profile, results)
+        print(f"Saved baseline for profile {args.profile}")
+
+    if args.check:
+        regressions = find_regressions(
+            args.profile, results, threshold=args.threshold, memory_threshold=args.memory_threshold
+        )
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("No regressions against baseline")
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""Deterministic synthetic DICOM series and NIfTI label volumes for benchmarks."""
+import os
+import numpy as np
+import nibabel as nib
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import (
+    ExplicitVRLittleEndian,
+    ImplicitVRLittleEndian,
+    ExplicitVRBigEndian,
+    RLELossless,
+    generate_uid
+)
+
+CT_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.2'
+
+TRANSFER_SYNTAXES = {
+    'implicit': ImplicitVRLittleEndian,
+    'explicit': ExplicitVRLittleEndian,
+    'big_endian': ExplicitVRBigEndian,
+    'rle': RLELossless
+}
+
+def synthetic_phantom(shape, bits_stored=12, seed=0):
+    """
+    Build a deterministic CT-like phantom volume of stored pixel values.
+
+    Args:
+        shape (tuple): Volume shape (slices, rows, columns).
+        bits_stored (int): Bit depth of the stored values (8, 12 or 16).
+        seed (int): Seed for the noise generator.
+
+    Returns:
+        numpy.ndarray: Unsigned integer volume with air, soft tissue and bone regions.
+    """
+    rng = np.random.default_rng(seed)
+    max_value = (1 << bits_stored) - 1
+    z, y, x = np.ogrid[:shape[0], :shape[1], :shape[2]]
+    cz, cy, cx = [(s - 1) / 2 for s in shape]
+
+    # Ellipsoidal body with a denser core, scaled to the stored bit depth
+    body = ((y - cy) / (0.45 * shape[1])) ** 2 + ((x - cx) / (0.45 * shape[2])) ** 2 <= 1
+    core = ((z - cz) / (0.3 * shape[0] + 1)) ** 2 + ((y - cy) / (0.12 * shape[1])) ** 2 + ((x - cx) / (0.12 * shape[2])) ** 2 <= 1
+    volume = np.where(body, 0.25, 0.0) + np.where(core, 0.5, 0.0)
+    volume = volume + rng.normal(0, 0.02, size=shape)
+
+    dtype = np.uint8 if bits_stored <= 8 else np.uint16
+    return (np.clip(volume, 0, 1) * max_value).astype(dtype)
+
+def generate_dicom_series(directory, num_slices=64, rows=256, columns=256,
+                          bits_stored=12, transfer_syntax='explicit', seed=0):
+    """
+    Write a deterministic single-series CT study.
+
+    Args:
+        directory (str): Output directory (created if needed).
+        num_slices (int): Number of slices.
+        rows (int): Rows per slice.
+        columns (int): Columns per slice.
+        bits_stored (int): 8, 12 or 16.
+        transfer_syntax (str): One of ``TRANSFER_SYNTAXES``.
+        seed (int): Seed controlling pixel data and UIDs.
+
+    Returns:
+        list: Paths of the written files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    syntax = TRANSFER_SYNTAXES[transfer_syntax]
+    bits_allocated = 8 if bits_stored <= 8 else 16
+    volume = synthetic_phantom((num_slices, rows, columns), bits_stored, seed)
+
+    entropy = [str(seed), str(num_slices), str(rows), str(columns), str(bits_stored)]
+    study_uid = generate_uid(entropy_srcs=entropy + ['study'])
+    series_uid = generate_uid(entropy_srcs=entropy + ['series'])
+
+    paths = []
+    for i in range(num_slices):
+        sop_uid = generate_uid(entropy_srcs=entropy + ['instance', str(i)])
+
+        file_meta = FileMetaDataset()
+        file_meta.MediaStorageSOPClassUID = CT_IMAGE_STORAGE
+        file_meta.MediaStorageSOPInstanceUID = sop_uid
+        file_meta.TransferSyntaxUID = ExplicitVRLittleEndian if syntax.is_compressed else syntax
+
+        ds = Dataset()
+        ds.file_meta = file_meta
+        ds.is_little_endian = True
+        ds.is_implicit_VR = False
+        ds.SOPClassUID = CT_IMAGE_STORAGE
+        ds.SOPInstanceUID = sop_uid
+        ds.StudyInstanceUID = study_uid
+        ds.SeriesInstanceUID = series_uid
+        ds.PatientID = f"SYN{seed:04d}"
+        ds.PatientName = "Synthetic^Phantom"
+        ds.Modality = 'CT'
+        ds.StudyDate = '20240101'
+        ds.InstanceNumber = i + 1
+        ds.ImagePositionPatient = [0.0, 0.0, float(i) * 2.5]
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.PixelSpacing = [0.7, 0.7]
+        ds.SliceThickness = 2.5
+        ds.Rows = rows
+        ds.Columns = columns
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = 'MONOCHROME2'
+        ds.BitsAllocated = bits_allocated
+        ds.BitsStored = bits_stored
+        ds.HighBit = bits_stored - 1
+        ds.PixelRepresentation = 0
+        ds.RescaleSlope = 1
+        ds.RescaleIntercept = -1024
+        ds.WindowCenter = 40
+        ds.WindowWidth = 400
+        ds.PixelData = volume[i].tobytes()
+
+        if syntax.is_compressed:
+            ds.compress(syntax)
+        elif syntax != ExplicitVRLittleEndian:
+            ds.file_meta.TransferSyntaxUID = syntax
+            ds.is_implicit_VR = syntax.is_implicit_VR
+            ds.is_little_endian = syntax.is_little_endian
+            if not syntax.is_little_endian:
+                ds.PixelData = volume[i].byteswap().tobytes()
+
+        path = os.path.join(directory, f"IM{i:05d}.dcm")
+        ds.save_as(path, write_like_original=False)
+        paths.append(path)
+
+    return paths
+
+def generate_nifti_labels(directory, shape, num_rois=3, label_values=1, seed=0):
+    """
+    Write deterministic NIfTI label volumes, one file per ROI.
+
+    Args:
+        directory (str): Output directory (created if needed).
+        shape (tuple): Label volume shape.
+        num_rois (int): Number of ROI files to write.
+        label_values (int): Number of distinct non-zero labels per file.
+        seed (int): Seed controlling ROI placement and size.
+
+    Returns:
+        list: Dicts with ``filename`` and ``path`` as expected by ``create_roi_masks``.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    grid = np.ogrid[:shape[0], :shape[1], :shape[2]]
+
+    files = []
+    for r in range(num_rois):
+        data = np.zeros(shape, dtype=np.uint8)
+        for label in range(1, label_values + 1):
+            center = [rng.uniform(0.25, 0.75) * s for s in shape]
+            radii = [rng.uniform(0.05, 0.2) * s + 1 for s in shape]
+            inside = sum(((g - c) / rad) ** 2 for g, c, rad in zip(grid, center, radii)) <= 1
+            data[inside] = label
+
+        filename = f"roi_{r:02d}.nii.gz"
+        path = os.path.join(directory, filename)
+        nib.save(nib.Nifti1Image(data, np.eye(4)), path)
+        files.append({'filename': filename, 'path': path})
+
+    return files
@@ -0,0 +1,36 @@
+"""
+Gunicorn settings for the backend.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+With preloading (the default) the app is imported and warmed up once in the
+master; workers are forked from it and share the loaded modules copy-on-write.
+Set GUNICORN_PRELOAD=false to have every worker import and warm up on its own.
+"""
+import os
+import multiprocessing
+
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+# Read by the app config (imported below) to give each worker's render pool a share of the cores
+os.environ['GUNICORN_WORKERS'] = str(workers)
+
+from app.utils.warmup import warm_up, freeze_for_fork
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+def when_ready(server):
+    # Runs in the master after the app is preloaded and before any worker is forked
+    if preload_app:
+        warm_up(server.app.wsgi())
+        freeze_for_fork()
+
+def post_worker_init(worker):
+    # Render processes cannot be inherited across fork; start this worker's own
+    app = worker.wsgi
+    if not preload_app:
+        warm_up(app, render_pool=True)
+    else:
+        app.extensions['render_pool'].warm()
@@ -0,0 +1,300 @@
+"""
+Prepare study archives for instant viewing, without the HTTP API.
+
+Every directory below the archive root holding ``.dcm`` files is a study.
+Its NIfTI label files are those in the study directory or below it, or in a
+``nifti`` directory next to a ``dicom`` study directory (the upload layout).
+Each study is imported into the shared file store under
+``UPLOAD_FOLDER/_studies/<study>/``, its cached artifacts (series index,
+statistics, brick store) are written to the series cache and its resampled
+ROI masks to the mask cache, exactly as the server would on first load.
+Uploading the same files later yields the same series id, so the server
+finds everything ready.
+
+Finished studies are recorded in ``study.json``; running again skips them
+unless their source files changed, so an interrupted run just resumes.
+
+Usage (from ``backend/``)::
+
+    python preprocess.py /data/archive                    # every study below the directory
+    python preprocess.py /data/archive --jobs 8 --config production
+    python preprocess.py /data/archive --force            # redo finished studies too
+"""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from werkzeug.utils import secure_filename
+
+NIFTI_SUFFIXES = ('.nii', '.nii.gz')
+STUDY_MANIFEST = 'study.json'
+
+_app_context = None
+
+def is_dicom_file(name):
+    return name.lower().endswith('.dcm')
+
+def is_nifti_file(name):
+    return name.lower().endswith(NIFTI_SUFFIXES)
+
+def find_studies(root):
+    """
+    Find the studies below an archive root.
+
+    Returns:
+        list: Dictionaries with ``key`` (unique name), ``dicom_files`` and
+        ``nifti_files`` (absolute paths), sorted by key.
+    """
+    root = os.path.abspath(root)
+    dicom_files = {}
+    nifti_files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        dicom = [os.path.join(dirpath, f) for f in sorted(filenames) if is_dicom_file(f)]
+        if dicom:
+            dicom_files[dirpath] = dicom
+        nifti_files += [os.path.join(dirpath, f) for f in sorted(filenames) if is_nifti_file(f)]
+
+    labels = {directory: [] for directory in dicom_files}
+    for path in nifti_files:
+        directory = os.path.dirname(path)
+        while True:
+            if directory in labels:
+                labels[directory].append(path)
+                break
+            sibling = os.path.join(os.path.dirname(directory), 'dicom')
+            if os.path.basename(directory) == 'nifti' and sibling in labels:
+                labels[sibling].append(path)
+                break
+            if directory == root or os.path.dirname(directory) == directory:
+                logging.getLogger(__name__).warning(f"No study for label file {path}")
+                break
+            directory = os.path.dirname(directory)
+
+    studies = []
+    for directory, files in dicom_files.items():
+        relative = os.path.relpath(directory, root)
+        name = os.path.basename(root) if relative == '.' else relative.replace(os.sep, '-')
+        studies.append({
+            'key': secure_filename(name) or 'study',
+            'source': directory,
+            'dicom_files': files,
+            'nifti_files': labels[directory]
+        })
+    studies.sort(key=lambda study: study['key'])
+
+    # Different paths can sanitize to the same name
+    seen = {}
+    for study in studies:
+        count = seen.get(study['key'], 0)
+        seen[study['key']] = count + 1
+        if count:
+            study['key'] = f"{study['key']}-{count}"
+    return studies
+
+def source_signature(paths):
+    """Digest of the names, sizes and modification times of a study's source files."""
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        stat = os.stat(path)
+        digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns};".encode('utf-8'))
+    return digest.hexdigest()
+
+def import_files(paths, target_dir):
+    """
+    Store files in the shared file store and link them into a directory,
+    removing links to files no longer in the source.
+
+    Returns:
+        list: Paths of the linked files.
+    """
+    from app.utils.file_utils import store_file
+
+    os.makedirs(target_dir, exist_ok=True)
+    linked = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            linked.append(store_file(f, os.path.basename(path), target_dir)['path'])
+
+    keep = {os.path.basename(path) for path in linked}
+    for name in os.listdir(target_dir):
+        if name not in keep:
+            os.remove(os.path.join(target_dir, name))
+    return linked
+
+def _init_worker(config_name):
+    global _app_context
+    logging.basicConfig(level=logging.WARNING)
+    from app import create_app
+    _app_context = create_app(config_name).app_context()
+    _app_context.push()
+
+def preprocess_study(study, force=False):
+    """
+    Import one study and write its cached artifacts (runs in a worker process).
+
+    Returns:
+        dict: ``key``, ``series_id``, ``shape``, ``rois``, ``cached``
+        (nothing to do) and ``timings`` in seconds per step.
+    """
+    from flask import current_app
+    from app.utils.dicom_utils import get_series_id
+    from app.utils.file_utils import get_series_cache_dir, read_series_index, STUDIES_DIR
+    from app.utils.ingest import (
+        ingest_series,
+        load_roi_masks,
+        get_bricks_dir,
+        get_brick_options
+    )
+    from app.utils.mask_cache import get_mask_cache
+
+    study_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], STUDIES_DIR, study['key'])
+    manifest_path = os.path.join(study_dir, STUDY_MANIFEST)
+    signature = source_signature(study['dicom_files'] + study['nifti_files'])
+
+    if not force:
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            cache_dir = get_series_cache_dir(manifest['series_id'])
+            if manifest['signature'] == signature and read_series_index(cache_dir) is not None:
+                return dict(manifest, cached=True)
+        except (OSError, ValueError, KeyError):
+            pass
+
+    timings = {}
+    started = time.perf_counter()
+
+    dicom_dir = os.path.join(study_dir, 'dicom')
+    nifti_dir = os.path.join(study_dir, 'nifti')
+    import_files(study['dicom_files'], dicom_dir)
+    nifti_paths = import_files(study['nifti_files'], nifti_dir)
+    timings['import'] = time.perf_counter() - started
+
+    step = time.perf_counter()
+    series_id = get_series_id(dicom_dir)
+    cache_dir = get_series_cache_dir(series_id)
+    series_info = read_series_index(cache_dir)
+    if series_info is None or not os.path.exists(get_bricks_dir(cache_dir)):
+        volume, _metadata = ingest_series(dicom_dir, cache_dir, bricks=True, **get_brick_options(current_app.config))
+        shape = list(volume.shape)
+        del volume
+    else:
+        shape = series_info['shape']
+    timings['ingest'] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    nifti_files = [{'filename': os.path.basename(path), 'path': path} for path in nifti_paths]
+    roi_masks = load_roi_masks(nifti_files, tuple(shape), get_mask_cache())
+    timings['masks'] = time.perf_counter() - step
+    timings['total'] = time.perf_counter() - started
+
+    manifest = {
+        'key': study['key'],
+        'source': study['source'],
+        'signature': signature,
+        'series_id': series_id,
+        'shape': shape,
+        'rois': [mask['label'] for mask in roi_masks],
+        'timings': timings
+    }
+    tmp_path = f"{manifest_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+    return dict(manifest, cached=False)
+
+def format_result(result):
+    shape = 'x'.join(str(n) for n in result['shape'])
+    if result['cached']:
+        return f"{result['series_id']} {shape}, already prepared"
+    steps = ', '.join(f"{name} {seconds:.1f}s" for name, seconds in result['timings'].items() if name != 'total')
+    return (f"{result['series_id']} {shape}, {len(result['rois'])} ROIs "
+            f"in {result['timings']['total']:.1f}s ({steps})")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Prepare DICOM studies for instant viewing")
+    parser.add_argument('root', help="Directory tree of DICOM series and NIfTI label files")
+    parser.add_argument('--config', default='development', help="App configuration (development, production, ...)")
+    parser.add_argument('--jobs', type=int, default=min(os.cpu_count() or 1, 4),
+                        help="Worker processes (0 runs in this process)")
+    parser.add_argument('--force', action='store_true', help="Redo studies that are already prepared")
+    parser.add_argument('--json', dest='json_path', default=None, help="Also write per-study results to this file")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    studies = find_studies(args.root)
+    if not studies:
+        print(f"No DICOM series found below {args.root}")
+        return 1
+    print(f"{len(studies)} studies, {sum(len(s['dicom_files']) for s in studies)} DICOM files, "
+          f"{sum(len(s['nifti_files']) for s in studies)} label files")
+
+    results = []
+    failed = 0
+    started = time.perf_counter()
+
+    def report(number, study, result=None, error=None):
+        prefix = f"[{number}/{len(studies)}] {study['key']}:"
+        if error is not None:
+            print(f"{prefix} FAILED: {error}", flush=True)
+        else:
+            print(f"{prefix} {format_result(result)}", flush=True)
+
+    try:
+        if args.jobs == 0:
+            _init_worker(args.config)
+            for number, study in enumerate(studies, 1):
+                try:
+                    results.append(preprocess_study(study, args.force))
+                    report(number, study, results[-1])
+                except Exception as e:
+                    failed += 1
+                    report(number, study, error=e)
+        else:
+            # Workers build their own app, so start them clean
+            with ProcessPoolExecutor(
+                max_workers=args.jobs,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(args.config,)
+            ) as executor:
+                futures = {executor.submit(preprocess_study, study, args.force): study for study in studies}
+                try:
+                    for number, future in enumerate(as_completed(futures), 1):
+                        try:
+                            results.append(future.result())
+                            report(number, futures[future], results[-1])
+                        except Exception as e:
+                            failed += 1
+                            report(number, futures[future], error=e)
+                except KeyboardInterrupt:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+    except KeyboardInterrupt:
+        print(f"Interrupted after {len(results)} studies; run again to resume")
+        return 130
+
+    elapsed = time.perf_counter() - started
+    prepared = sum(1 for result in results if not result['cached'])
+    print(f"Prepared {prepared}, already prepared {len(results) - prepared}, failed {failed} "
+          f"in {elapsed:.1f}s")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'elapsed_s': elapsed, 'failed': failed, 'studies': results}, f, indent=2)
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
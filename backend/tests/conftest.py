@@ -0,0 +1,89 @@
+import fakeredis
+import numpy as np
+import pytest
+
+from app import create_app
+from app.utils.mask_cache import init_mask_cache
+
+@pytest.fixture
+def redis_client():
+    """An in-process Redis stand-in."""
+    return fakeredis.FakeRedis()
+
+@pytest.fixture
+def app(tmp_path, redis_client):
+    """A testing app whose extensions all talk to ``redis_client``."""
+    app = create_app('testing')
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'uploads')
+    init_mask_cache(app)
+    app.extensions['redis'] = redis_client
+    for extension in app.extensions.values():
+        if hasattr(extension, 'redis'):
+            extension.redis = redis_client
+    yield app
+    app.extensions['render_pool'].shutdown()
+    if app.extensions['shared_volumes'] is not None:
+        app.extensions['shared_volumes'].purge()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def auth_headers(client):
+    """Bearer token of the built-in ``admin`` user (session ``user_admin``)."""
+    response = client.post('/api/auth/login', json={'username': 'admin', 'password': 'password123'})
+    return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+@pytest.fixture
+def loaded_volume(app):
+    """A small CT volume in the admin user's session, as /load_dicom leaves it."""
+    from app.utils.session_store import get_session
+    volume = np.random.default_rng(0).integers(-1000, 1000, (6, 16, 20)).astype(np.int16)
+    with app.app_context():
+        get_session('user_admin').update({
+            'dicom_volume': volume,
+            'dicom_shape': list(volume.shape),
+            'dicom_series_id': 'series',
+            'dicom_metadata': {'WindowCenter': 40, 'WindowWidth': 400}
+        })
+    return volume
+
+@pytest.fixture
+def dicom_files(tmp_path):
+    """Files of a small synthetic CT series (8 slices of 32x32)."""
+    from pydicom.dataset import Dataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+    
+    directory = tmp_path / 'series'
+    directory.mkdir()
+    rng = np.random.default_rng(0)
+    series_uid = generate_uid()
+    paths = []
+    for i in range(8):
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.2'
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds = Dataset()
+        ds.file_meta = meta
+        ds.is_little_endian, ds.is_implicit_VR = True, False
+        ds.SOPClassUID, ds.SOPInstanceUID = meta.MediaStorageSOPClassUID, meta.MediaStorageSOPInstanceUID
+        ds.SeriesInstanceUID = series_uid
+        ds.Modality = 'CT'
+        ds.Rows = ds.Columns = 32
+        ds.BitsAllocated = ds.BitsStored = 16
+        ds.HighBit = 15
+        ds.PixelRepresentation = 0
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = 'MONOCHROME2'
+        ds.RescaleSlope, ds.RescaleIntercept = 1, -1024
+        ds.PixelSpacing = [0.7, 0.7]
+        ds.SliceThickness = 2.5
+        ds.ImagePositionPatient = [0, 0, i * 2.5]
+        ds.InstanceNumber = i + 1
+        ds.PixelData = rng.integers(0, 2000, (32, 32)).astype(np.uint16).tobytes()
+        path = directory / f"{i:04d}.dcm"
+        ds.save_as(str(path), write_like_original=False)
+        paths.append(str(path))
+    return paths
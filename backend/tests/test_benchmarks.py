@@ -0,0 +1,33 @@
+from benchmarks.harness import load_baselines, save_baselines, find_regressions
+
+def _result(median_s, peak_bytes=1000):
+    return {'median_s': median_s, 'min_s': median_s, 'max_s': median_s, 'rounds': 1, 'peak_bytes': peak_bytes}
+
+def test_save_baselines_merges_per_benchmark(tmp_path):
+    path = str(tmp_path / 'baselines.json')
+    save_baselines('quick', {'a': _result(1.0), 'b': _result(2.0)}, path=path)
+    save_baselines('default', {'a': _result(5.0)}, path=path)
+    save_baselines('quick', {'b': _result(3.0)}, path=path)
+    
+    baselines = load_baselines(path)
+    assert baselines['quick'] == {'a': {'median_s': 1.0, 'peak_bytes': 1000}, 'b': {'median_s': 3.0, 'peak_bytes': 1000}}
+    assert baselines['default'] == {'a': {'median_s': 5.0, 'peak_bytes': 1000}}
+
+def test_find_regressions(tmp_path):
+    path = str(tmp_path / 'baselines.json')
+    save_baselines('quick', {'fast': _result(1.0), 'slow': _result(1.0), 'big': _result(1.0)}, path=path)
+    
+    regressions = find_regressions('quick', {
+        'fast': _result(1.2),
+        'slow': _result(1.3),
+        'big': _result(1.0, peak_bytes=2000),
+        'new': _result(1.0)
+    }, threshold=0.25, path=path)
+    
+    assert len(regressions) == 3
+    assert regressions[0].startswith('slow: median 1300.0 ms vs baseline 1000.0 ms')
+    assert regressions[1].startswith('big: peak memory')
+    assert regressions[2] == 'new: no baseline for profile quick (run with --save-baseline)'
+    assert find_regressions('default', {'fast': _result(1.0)}, path=path) == [
+        'fast: no baseline for profile default (run with --save-baseline)'
+    ]
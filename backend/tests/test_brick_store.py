@@ -0,0 +1,99 @@
+import os
+import numpy as np
+import pytest
+
+from app.utils import brick_store
+from app.utils.brick_store import write_bricks, open_bricks, close_bricks, BrickVolume, INDEX_FILE
+
+@pytest.fixture
+def volume():
+    rng = np.random.default_rng(0)
+    return rng.integers(-1024, 2000, (10, 37, 45)).astype(np.float32)
+
+def test_planes_match_volume(tmp_path, volume):
+    directory = str(tmp_path / 'bricks')
+    index = write_bricks(volume, directory, brick_size=16)
+    assert index['grid'] == [1, 3, 3]
+    # Whole numbers are stored as int16 and read back as float32
+    assert index['storage_dtype'] == np.dtype(np.int16).str
+
+    bricks = BrickVolume(directory)
+    assert bricks.shape == volume.shape and bricks.dtype == volume.dtype
+    np.testing.assert_array_equal(bricks[4], volume[4])
+    np.testing.assert_array_equal(bricks[:, 20], volume[:, 20])
+    np.testing.assert_array_equal(bricks[:, :, 44], volume[:, :, 44])
+    np.testing.assert_array_equal(bricks[2:7, 5:33:3, -10:], volume[2:7, 5:33:3, -10:])
+    np.testing.assert_array_equal(np.asarray(bricks), volume)
+
+def test_fractional_values_keep_their_dtype(tmp_path, volume):
+    volume = volume / 3
+    directory = str(tmp_path / 'bricks')
+    assert write_bricks(volume, directory, brick_size=16, codec='zlib')['storage_dtype'] == volume.dtype.str
+    np.testing.assert_array_equal(np.asarray(BrickVolume(directory)), volume)
+
+def test_brick_cache(tmp_path, volume):
+    directory = str(tmp_path / 'bricks')
+    write_bricks(volume, directory, brick_size=16)
+    bricks = BrickVolume(directory)
+    bricks[3]
+    misses = bricks.stats()['misses']
+    bricks[4]
+    assert bricks.stats()['misses'] == misses
+    assert bricks.stats()['hits'] > 0
+
+def test_open_bricks(tmp_path, volume):
+    directory = str(tmp_path / 'bricks')
+    assert open_bricks(directory) is None
+    write_bricks(volume, directory, brick_size=16)
+    assert os.path.exists(os.path.join(directory, INDEX_FILE))
+    reader = open_bricks(directory)
+    assert open_bricks(directory) is reader
+    
+    # A rewritten store gets a new reader, a removed one none
+    write_bricks(volume + 1, directory, brick_size=16)
+    os.utime(os.path.join(directory, INDEX_FILE), ns=(0, 0))
+    assert open_bricks(directory) is not reader
+    os.remove(os.path.join(directory, INDEX_FILE))
+    assert open_bricks(directory) is None
+    assert directory not in brick_store._readers
+
+def test_open_readers_are_bounded(tmp_path, volume, monkeypatch):
+    monkeypatch.setattr(brick_store, 'MAX_OPEN_READERS', 2)
+    readers = []
+    for name in 'abc':
+        directory = str(tmp_path / 'series' / name)
+        write_bricks(volume, directory, brick_size=16)
+        readers.append(open_bricks(directory))
+        readers[-1][0]
+    
+    assert list(brick_store._readers) == [str(tmp_path / 'series' / n) for n in 'bc']
+    assert readers[0]._data is None and readers[0].stats()['bytes'] == 0
+    # A request still holding a closed reader keeps working
+    np.testing.assert_array_equal(readers[0][5], volume[5])
+    
+    close_bricks(str(tmp_path / 'series'))
+    assert not brick_store._readers
+    assert readers[2]._data is None
+
+def test_invalid_input(tmp_path, volume):
+    with pytest.raises(ValueError):
+        write_bricks(volume, str(tmp_path / 'a'), codec='nope')
+    with pytest.raises(ValueError):
+        write_bricks(volume[0], str(tmp_path / 'b'))
+    assert not os.listdir(tmp_path)
+
+def test_gc_closes_readers_of_removed_series(app, client, auth_headers, dicom_files):
+    files = [(open(path, 'rb'), os.path.basename(path)) for path in dicom_files]
+    client.post('/api/upload/dicom', headers=auth_headers, data={'files': files}, content_type='multipart/form-data')
+    for f, _ in files:
+        f.close()
+    response = client.post('/api/viewer/load_dicom', headers=auth_headers, json={'storage': 'bricks'})
+    assert response.status_code == 200
+    response = client.get('/api/viewer/get_slice?view=sagittal&slice_index=3', headers=auth_headers)
+    assert response.status_code == 200
+    assert any(d.startswith(app.config['UPLOAD_FOLDER']) for d in brick_store._readers)
+    
+    client.delete('/api/upload/dicom', headers=auth_headers)
+    app.config['BLOB_GC_GRACE_SECONDS'] = 0
+    assert client.post('/api/upload/gc', headers=auth_headers).get_json()['series_caches_removed']
+    assert not any(d.startswith(app.config['UPLOAD_FOLDER']) for d in brick_store._readers)
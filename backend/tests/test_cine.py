@@ -0,0 +1,66 @@
+from io import BytesIO
+import numpy as np
+import pytest
+from PIL import Image, ImageSequence
+
+from app.utils.cine import stream_cine, PNG_SIGNATURE
+
+def _png(value, size=(12, 8), mode='L'):
+    buf = BytesIO()
+    Image.new(mode, size, value).save(buf, format='PNG')
+    return buf.getvalue()
+
+def _frames(data):
+    image = Image.open(BytesIO(data))
+    return image, [np.asarray(frame.convert('RGBA')) for frame in ImageSequence.Iterator(image)]
+
+def test_apng_frames():
+    values = [0, 100, 200]
+    data = b''.join(stream_cine('apng', iter(_png(v) for v in values), len(values), fps=5))
+
+    assert data.startswith(PNG_SIGNATURE)
+    image, frames = _frames(data)
+    assert image.n_frames == 3 and image.size == (12, 8)
+    assert image.info['duration'] == 200
+    assert [int(frame[0, 0, 0]) for frame in frames] == values
+
+def test_apng_fits_mismatched_frames():
+    pieces = [_png(50), _png((150, 150, 150), size=(6, 4), mode='RGB')]
+    image, frames = _frames(b''.join(stream_cine('apng', iter(pieces), 2)))
+    assert image.n_frames == 2
+    assert frames[1].shape == (8, 12, 4)
+    assert frames[1][0, 0, 0] == 150 and frames[1][7, 11, 0] == 0
+
+def test_apng_max_size():
+    data = b''.join(stream_cine('apng', iter([_png(10, size=(40, 20))] * 2), 2, max_size=10))
+    assert Image.open(BytesIO(data)).size == (10, 5)
+
+def test_gif_frames():
+    values = [0, 120, 240]
+    data = b''.join(stream_cine('gif', iter(_png(v) for v in values), len(values), fps=10, loop=2))
+
+    image, frames = _frames(data)
+    assert image.format == 'GIF' and image.n_frames == 3
+    assert image.info['loop'] == 2
+    assert [int(frame[0, 0, 0]) for frame in frames] == values
+
+def test_empty_stream():
+    assert b''.join(stream_cine('apng', iter([]), 0)) == b''
+    assert b''.join(stream_cine('gif', iter([]), 0)) == b''
+
+def test_invalid_input():
+    with pytest.raises(ValueError):
+        stream_cine('avi', iter([]), 0)
+    with pytest.raises(ValueError):
+        b''.join(stream_cine('apng', iter([b'not a png']), 1))
+
+def test_cine_endpoint_streams_a_slice_range(client, auth_headers, loaded_volume):
+    response = client.get('/api/viewer/cine?view=coronal&start=2&stop=8&step=3&fps=4', headers=auth_headers)
+    assert response.status_code == 200 and response.mimetype == 'image/apng'
+    assert response.headers['X-Cine-Frames'] == '3'
+    assert 'coronal_2-8.png' in response.headers['Content-Disposition']
+    image = Image.open(BytesIO(response.get_data()))
+    assert image.n_frames == 3
+
+    for query in ('format=avi', 'start=6', 'step=0', 'fps=0', 'stop=x'):
+        assert client.get(f"/api/viewer/cine?{query}", headers=auth_headers).status_code == 400
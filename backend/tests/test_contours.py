@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from app.api import roi
+from app.utils.nifti_utils import extract_contours, get_roi_contours, encode_contour_path, CONTOUR_SCALE
+from app.utils.session_store import get_session
+
+def _decode(values):
+    """Inverse of the delta encoding, in pixels."""
+    return np.cumsum(np.asarray(values).reshape(-1, 2), axis=0) / CONTOUR_SCALE
+
+def test_square_outline_is_closed_and_simplified():
+    mask = np.zeros((10, 12), dtype=np.uint8)
+    mask[2:6, 3:9] = 1
+    exact, = extract_contours(mask, tolerance=0)
+    simple, = extract_contours(mask, tolerance=0.5)
+
+    assert np.array_equal(exact[0], exact[-1]) and np.array_equal(simple[0], simple[-1])
+    assert len(simple) < len(exact)
+    # Outlines run half a pixel outside the boundary pixels
+    assert exact[:, 0].min() == 2.5 and exact[:, 0].max() == 8.5
+    assert exact[:, 1].min() == 1.5 and exact[:, 1].max() == 5.5
+
+def test_outline_touching_the_border_closes():
+    mask = np.zeros((6, 6), dtype=np.uint8)
+    mask[:3, :] = 1
+    path, = extract_contours(mask)
+    assert np.array_equal(path[0], path[-1])
+    assert path[:, 0].min() == -0.5 and path[:, 1].min() == -0.5
+    assert extract_contours(np.zeros((4, 4))) == []
+
+def test_multi_label_roi_has_a_layer_per_label():
+    mask = np.zeros((3, 8, 8), dtype=np.uint8)
+    mask[1, 1:3, 1:3] = 1
+    mask[1, 5:7, 5:7] = 3
+    roi_mask = {'mask': mask, 'label': 'tissue', 'labels': [[1, 'fat'], [2, 'muscle'], [3, 'bone']]}
+    layers = get_roi_contours(roi_mask, 1)
+    assert [(layer['value'], layer['name'], len(layer['paths'])) for layer in layers] == [(1, 'fat', 1), (3, 'bone', 1)]
+
+    plain = get_roi_contours({'mask': mask, 'label': 'roi'}, 1)
+    assert [(layer['name'], len(layer['paths'])) for layer in plain] == [('roi', 2)]
+    assert get_roi_contours({'mask': mask, 'label': 'roi'}, 0) == []
+
+def test_delta_encoding_round_trip():
+    path = np.array([[2.5, 1.5], [8.5, 1.5], [8.5, 5.5], [2.5, 1.5]])
+    values = encode_contour_path(path)
+    assert all(isinstance(value, int) for value in values)
+    np.testing.assert_array_equal(_decode(values), path)
+    assert encode_contour_path(path, 'none') == path.tolist()
+
+def test_contours_endpoint_caches_per_slice(app, client, auth_headers, loaded_volume, monkeypatch):
+    mask = np.zeros(loaded_volume.shape, dtype=np.uint8)
+    mask[2, 4:8, 4:10] = 1
+    with app.app_context():
+        get_session('user_admin').update({
+            'roi_masks': [{'filename': 'roi.nii.gz', 'label': 'roi', 'unique_values': [0, 1], 'digest': 'abc'}],
+            'roi_mask:0': mask
+        })
+
+    response = client.get('/api/roi/contours?slice_index=2', headers=auth_headers)
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result['scale'] == CONTOUR_SCALE
+    layer, = result['rois'][0]['layers']
+    path = _decode(layer['paths'][0])
+    assert path[:, 0].min() == 3.5 and path[:, 1].max() == 7.5
+
+    # Served from the cache the second time
+    monkeypatch.setattr(roi, 'get_roi_contours', lambda *args: pytest.fail('traced again'))
+    assert client.get('/api/roi/contours?slice_index=2', headers=auth_headers).get_json() == result
+
+    for query in ('slice_index=6', 'slice_index=x', 'tolerance=x', 'encoding=svg'):
+        assert client.get(f"/api/roi/contours?{query}", headers=auth_headers).status_code == 400
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from app.utils.dicom_utils import apply_hounsfield_segmentation, build_hounsfield_lookup, load_hounsfield_ranges
+from app.utils.session_store import get_session
+
+def _classify_with_masks(volume, ranges):
+    """The per-range loop the lookup replaced: later ranges win."""
+    labels = np.zeros(volume.shape, dtype=np.uint8)
+    for min_hu, max_hu, value in ranges:
+        labels[(volume >= min_hu) & (volume < max_hu)] = value
+    return labels
+
+@pytest.mark.parametrize('ranges', [
+    load_hounsfield_ranges(),
+    [[-100, 100, 1], [0, 50, 2], [40, 300, 3]],           # Overlapping, later wins
+    [[-99.5, 0.25, 1], [0.25, 80.5, 2], [500, 501, 7]],  # Fractional bounds skip the table
+    [[-2000000, 2000000, 4], [10, 20, 5]]               # Too wide for a table
+])
+@pytest.mark.parametrize('dtype', [np.int16, np.float32])
+def test_matches_per_range_masks(ranges, dtype):
+    rng = np.random.default_rng(0)
+    volume = rng.uniform(-1500, 2500, (7, 13, 11)).astype(dtype)
+    volume.flat[:4] = [-100, 100, 0.25, 501]  # Boundaries themselves
+    expected = _classify_with_masks(volume, ranges)
+    
+    np.testing.assert_array_equal(apply_hounsfield_segmentation(volume, ranges), expected)
+    # Slabs of a few slices give the same labels
+    np.testing.assert_array_equal(apply_hounsfield_segmentation(volume, ranges, slab_voxels=300), expected)
+
+def test_nan_is_unlabelled():
+    volume = np.array([[[np.nan, 10.0]]], dtype=np.float32)
+    assert apply_hounsfield_segmentation(volume, [[0, 20, 3]]).tolist() == [[[0, 3]]]
+
+@pytest.mark.parametrize('ranges', [[[10, 10, 1]], [[0, 10, 0]], [[0, 10, 256]], [[0, 10, 1.5]]])
+def test_invalid_ranges(ranges):
+    with pytest.raises(ValueError):
+        build_hounsfield_lookup(ranges)
+
+def test_classify_tissue_adds_a_multi_label_roi(app, redis_client, client, auth_headers, loaded_volume):
+    ranges = [[-1000, 0, 1], [0, 1000, 2]]
+    for _ in range(2):
+        response = client.post('/api/roi/classify_tissue', headers=auth_headers, json={
+            'ranges': ranges, 'names': {'1': 'low'}
+        })
+        assert response.status_code == 200
+    
+    result = response.get_json()
+    assert result['roi_index'] == 0  # Replaced, not appended
+    assert [(label['value'], label['name']) for label in result['labels']] == [(1, 'low'), (2, 'HU 0 to 1000')]
+    assert sum(label['voxels'] for label in result['labels']) == loaded_volume.size
+    with app.app_context():
+        mask = get_session('user_admin').get_roi_masks()[0]['mask']
+        np.testing.assert_array_equal(mask, _classify_with_masks(loaded_volume, ranges))
+    assert not redis_client.exists('lock:session:user_admin:roi_masks')
+    
+    response = client.post('/api/roi/classify_tissue', headers=auth_headers, json={'ranges': [[5, 1, 1]]})
+    assert response.status_code == 400
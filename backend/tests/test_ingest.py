@@ -0,0 +1,97 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from app.utils.brick_store import write_bricks, BrickVolume
+from app.utils.dicom_utils import load_dicom_series, load_dicom_instances, compute_volume_stats, update_volume_stats
+from app.utils.ingest import ingest_series, get_bricks_dir, get_volume_stats
+
+def _copy(paths, directory):
+    os.makedirs(directory, exist_ok=True)
+    for path in paths:
+        shutil.copy2(path, directory)
+
+def _assert_same_stats(stats, expected):
+    for key in ('min', 'max', 'percentiles', 'slice_min', 'slice_max', 'histogram_range'):
+        assert stats[key] == expected[key], key
+    np.testing.assert_array_equal(stats['histogram'], expected['histogram'])
+    assert stats['mean'] == pytest.approx(expected['mean'])
+    assert stats['std'] == pytest.approx(expected['std'])
+
+def test_update_stats_for_inserted_slices():
+    rng = np.random.default_rng(0)
+    volume = rng.integers(-100, 100, (6, 5, 7)).astype(np.int16)
+    volume[0, 0, :2] = [-500, 500]  # Base range wide enough for the new slices
+    base = np.delete(volume, [2, 5], axis=0)
+    reused = [0, 1, None, 2, 3, None]
+
+    _assert_same_stats(update_volume_stats(compute_volume_stats(base), volume, reused), compute_volume_stats(volume))
+    # Removed or reordered base slices, and values outside the range, need a full pass
+    assert update_volume_stats(compute_volume_stats(base), volume, [0, 1, None, 3, 2, None]) is None
+    assert update_volume_stats(compute_volume_stats(base), volume[1:], [1, None, 2, 3, None]) is None
+    volume[2, 0, 0] = 900
+    assert update_volume_stats(compute_volume_stats(base), volume, reused) is None
+
+def test_load_reuses_unchanged_instances(dicom_files, tmp_path):
+    directory = str(tmp_path / 'study')
+    _copy(dicom_files[:3] + dicom_files[5:], directory)
+    volume, _metadata, instances, reused = load_dicom_instances(directory)
+    assert reused == [None] * 6
+
+    _copy(dicom_files[3:5], directory)
+    full, _metadata, instances, reused = load_dicom_instances(directory, (volume, instances))
+    assert reused == [0, 1, 2, None, None, 3, 4, 5]
+    np.testing.assert_array_equal(full, load_dicom_series(os.path.dirname(dicom_files[0]))[0])
+
+    # A rewritten file is decoded again
+    os.utime(os.path.join(directory, os.path.basename(dicom_files[0])), ns=(0, 0))
+    _volume, _metadata, _instances, again = load_dicom_instances(directory, (full, instances))
+    assert again == [None] + list(range(1, 8))
+
+def test_ingest_series_updates_from_a_base(dicom_files, tmp_path, caplog):
+    directory = str(tmp_path / 'study')
+    base_dir, cache_dir = str(tmp_path / 'base'), str(tmp_path / 'cache')
+    os.makedirs(base_dir)
+    os.makedirs(cache_dir)
+    _copy(dicom_files[:6], directory)
+    ingest_series(directory, base_dir, brick_size=4)
+
+    _copy(dicom_files[6:], directory)
+    with caplog.at_level('INFO'):
+        volume, _metadata = ingest_series(directory, cache_dir, base_dir=base_dir, brick_size=4)
+    assert 'decoded 2 of 8 instances' in caplog.text
+    assert '1 of 2 slabs reused' in caplog.text
+
+    expected = load_dicom_series(os.path.dirname(dicom_files[0]))[0]
+    np.testing.assert_array_equal(volume, expected)
+    np.testing.assert_array_equal(np.asarray(BrickVolume(get_bricks_dir(cache_dir))), expected)
+    _assert_same_stats(get_volume_stats(volume, cache_dir), compute_volume_stats(expected))
+
+def test_ingest_series_ignores_an_unrelated_base(dicom_files, tmp_path, caplog):
+    base_dir, cache_dir = str(tmp_path / 'base'), str(tmp_path / 'cache')
+    os.makedirs(base_dir)
+    os.makedirs(cache_dir)
+    os.makedirs(tmp_path / 'other')
+    for path in dicom_files:
+        shutil.copy(path, tmp_path / 'other')  # New modification times
+    ingest_series(str(tmp_path / 'other'), base_dir)
+
+    directory = os.path.dirname(dicom_files[0])
+    with caplog.at_level('INFO'):
+        volume, _metadata = ingest_series(directory, cache_dir, base_dir=base_dir)
+    assert 'Updated series' not in caplog.text
+    np.testing.assert_array_equal(volume, load_dicom_series(directory)[0])
+
+def test_write_bricks_reuses_unchanged_slabs(tmp_path, caplog):
+    volume = np.random.default_rng(0).integers(-1000, 1000, (10, 9, 11)).astype(np.int16)
+    base_dir = str(tmp_path / 'base')
+    write_bricks(volume, base_dir, brick_size=4)
+    changed = volume.copy()
+    changed[9] += 1
+    directory = str(tmp_path / 'changed')
+    with caplog.at_level('INFO', logger='app.utils.brick_store'):
+        write_bricks(changed, directory, brick_size=4, base=BrickVolume(base_dir), reused=list(range(9)) + [None])
+    assert '2 of 3 slabs reused' in caplog.text
+    np.testing.assert_array_equal(np.asarray(BrickVolume(directory)), changed)
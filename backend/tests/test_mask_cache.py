@@ -0,0 +1,115 @@
+import os
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from app.utils import ingest, mask_cache as mask_cache_module
+from app.utils.ingest import load_roi_masks
+from app.utils.mask_cache import MaskCache, grid_key
+
+SHAPE = (4, 6, 8)
+
+def _mask(value=1):
+    mask = np.zeros(SHAPE, dtype=np.uint8)
+    mask[1:3, 2:4, 2:6] = value
+    return mask
+
+def _age(cache, digest, seconds):
+    path = cache.path(digest, SHAPE)
+    os.utime(path, (os.path.getmtime(path) - seconds,) * 2)
+
+def test_hit_and_miss(tmp_path):
+    cache = MaskCache(str(tmp_path), max_bytes=0)
+    assert cache.get('a' * 64, SHAPE) is None
+
+    cache.put('a' * 64, SHAPE, _mask(), [0, 1], {'Dimensions': np.int64(3), 'Data Type': 'uint8'})
+    entry = cache.get('a' * 64, SHAPE)
+    np.testing.assert_array_equal(entry['mask'], _mask())
+    assert entry['unique_values'] == [0, 1]
+    assert entry['metadata'] == {'Dimensions': 3, 'Data Type': 'uint8'}
+
+    # Entries are per grid
+    assert cache.get('a' * 64, (4, 6, 9)) is None
+    assert os.path.basename(cache.path('a' * 64, SHAPE)) == f"{'a' * 32}-{grid_key(SHAPE)}.npz"
+    assert cache.stats()['entries'] == 1
+    assert (cache.hits, cache.misses) == (1, 2)
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = MaskCache(str(tmp_path), max_bytes=0)
+    for n, digest in enumerate('abc'):
+        cache.put(digest * 64, SHAPE, _mask(n + 1), [0, n + 1])
+        _age(cache, digest * 64, 100 - n)
+    entry_bytes = cache.stats()['bytes'] // 3
+
+    # A hit makes 'a' the most recently used
+    assert cache.get('a' * 64, SHAPE) is not None
+    cache.max_bytes = 2 * entry_bytes + entry_bytes // 2
+    assert cache.evict() == 1
+    assert cache.get('b' * 64, SHAPE) is None
+    assert cache.get('a' * 64, SHAPE) is not None and cache.get('c' * 64, SHAPE) is not None
+
+    # Writes evict too
+    cache.put('d' * 64, SHAPE, _mask(), [0, 1])
+    assert cache.stats()['entries'] == 2 and cache.evictions == 2
+
+def test_invalidate(tmp_path):
+    cache = MaskCache(str(tmp_path), max_bytes=0)
+    for digest in ('ab' * 32, 'ac' * 32):
+        for shape in (SHAPE, (2, 2, 2)):
+            cache.put(digest, shape, np.zeros(shape, dtype=np.uint8), [0])
+
+    assert cache.invalidate('ab' * 32, SHAPE) == 1
+    assert cache.invalidate(shape=(2, 2, 2)) == 2
+    assert cache.invalidate('abab') == 0
+    assert cache.invalidate('a') == 1
+    assert cache.stats()['entries'] == 0
+
+def test_digest_is_memoized_while_unchanged(tmp_path, monkeypatch):
+    path = tmp_path / 'roi.nii.gz'
+    path.write_bytes(b'one')
+    calls = []
+    monkeypatch.setattr(mask_cache_module, 'file_digest', lambda p: calls.append(p) or f"{len(calls):064x}")
+    cache = MaskCache(str(tmp_path / 'cache'), max_bytes=0)
+
+    first = cache.digest(str(path))
+    assert cache.digest(str(path)) == first and len(calls) == 1
+    path.write_bytes(b'other')
+    assert cache.digest(str(path)) != first and len(calls) == 2
+
+def test_load_roi_masks_through_the_cache(tmp_path, monkeypatch):
+    data = np.zeros((8, 12, 16), dtype=np.uint8)
+    data[2:6, 3:9, 4:12] = 2
+    path = str(tmp_path / 'liver.nii.gz')
+    nib.save(nib.Nifti1Image(data, np.eye(4)), path)
+    files = [{'filename': 'liver.nii.gz', 'path': path}]
+    cache = MaskCache(str(tmp_path / 'cache'), max_bytes=0)
+
+    first, = load_roi_masks(files, SHAPE, cache)
+    assert cache.misses == 1 and cache.stats()['entries'] == 1
+
+    # A hit skips processing; the name comes from the file, not the entry
+    copy = str(tmp_path / 'kidney.nii.gz')
+    os.link(path, copy)
+    monkeypatch.setattr(ingest, 'create_roi_masks', lambda *args: pytest.fail('processed again'))
+    second, = load_roi_masks([{'filename': 'kidney.nii.gz', 'path': copy}], SHAPE, cache)
+    assert cache.hits == 1
+    np.testing.assert_array_equal(second['mask'], first['mask'])
+    assert second['label'] == 'kidney' and second['metadata']['Label'] == 'kidney'
+    assert second['unique_values'] == first['unique_values'] == [0, 2]
+
+    monkeypatch.undo()
+    load_roi_masks(files, SHAPE, cache, refresh=True)
+    assert cache.hits == 1
+
+def test_cache_endpoints(app, client, auth_headers):
+    cache = app.extensions['mask_cache']
+    cache.put('ab' * 32, SHAPE, _mask(), [0, 1])
+    assert cache.directory.startswith(app.config['UPLOAD_FOLDER'])
+
+    stats = client.get('/api/roi/cache', headers=auth_headers).get_json()['mask_cache']
+    assert stats['entries'] == 1
+    for query in ('digest=xyz', 'shape=4x6xa'):
+        assert client.delete(f"/api/roi/cache?{query}", headers=auth_headers).status_code == 400
+    response = client.delete(f"/api/roi/cache?digest={'ab' * 4}&shape={grid_key(SHAPE)}", headers=auth_headers)
+    assert response.get_json()['removed'] == 1
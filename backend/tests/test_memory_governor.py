@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from app.utils.memory_governor import (
+    MemoryGovernor,
+    MemoryBudgetExceeded,
+    estimate_volume_bytes,
+    admit_load,
+    USAGE_KEY,
+    LOCK_KEY,
+    VOLUME_ITEMSIZE
+)
+
+@pytest.fixture
+def governor(redis_client):
+    return MemoryGovernor(
+        redis_client, budget_bytes=1000, user_budget_bytes=600, session_timeout=3600,
+        evict_idle_seconds=60, queue_timeout=0.05, poll_interval=0.01
+    )
+
+def _session(redis_client, user_id, idle_seconds=0):
+    redis_client.hset(f"session:{user_id}", 'dicom_shape', '[1, 1, 1]')
+    redis_client.expire(f"session:{user_id}", 3600 - idle_seconds)
+
+def test_estimate_volume_bytes():
+    shape = (10, 20, 30)
+    assert estimate_volume_bytes(shape) == (6000 * VOLUME_ITEMSIZE, 6000 * VOLUME_ITEMSIZE)
+    assert estimate_volume_bytes(shape, storage='bricks') == (6000 * VOLUME_ITEMSIZE, 0)
+
+    # 2 mm slices resampled to 1 mm double the slice count
+    metadata = {'PixelSpacing': [1.0, 1.0], 'SliceThickness': 2.0}
+    peak, resident = estimate_volume_bytes(shape, metadata, isotropic=True, spacing=1.0)
+    assert resident == 2 * 6000 * VOLUME_ITEMSIZE
+    assert peak == 6000 * VOLUME_ITEMSIZE + resident
+
+def test_admit_commit_and_cancel(governor, redis_client):
+    _session(redis_client, 'a')
+    with governor.admit('a', 'volume', 400) as admission:
+        assert governor.usage() == {'a': {'volume': 400}}
+        admission.commit(300)
+    assert governor.usage() == {'a': {'volume': 300}}
+
+    # A failed reload restores the previous charge
+    admission = governor.admit('a', 'volume', 500)
+    assert governor.usage()['a']['volume'] == 500
+    admission.cancel()
+    assert governor.usage() == {'a': {'volume': 300}}
+
+def test_reload_does_not_count_the_part_it_replaces(governor, redis_client):
+    _session(redis_client, 'a')
+    governor.admit('a', 'volume', 500).commit(500)
+    governor.admit('a', 'volume', 550).commit(550)
+    assert governor.stats()['bytes'] == 550
+
+def test_user_budget_is_final(governor, redis_client):
+    _session(redis_client, 'a')
+    governor.admit('a', 'volume', 400).commit(400)
+    with pytest.raises(MemoryBudgetExceeded) as error:
+        governor.admit('a', 'rois', 300)
+    assert error.value.retry is False
+    assert error.value.available == 200
+
+def test_evicts_idle_sessions_first(governor, redis_client):
+    for user_id, idle in (('idle', 300), ('idler', 900), ('busy', 0)):
+        _session(redis_client, user_id, idle)
+        governor.admit(user_id, 'volume', 300).commit(300)
+
+    _session(redis_client, 'new')
+    governor.admit('new', 'volume', 300).commit(300)
+    assert set(governor.usage()) == {'idle', 'busy', 'new'}
+    assert not redis_client.exists('session:idler')
+    assert governor.stats()['evictions'] == 1
+
+def test_waits_then_rejects_when_nothing_is_idle(governor, redis_client):
+    for user_id in ('a', 'b', 'c'):
+        _session(redis_client, user_id)
+        governor.admit(user_id, 'volume', 300).commit(300)
+
+    with pytest.raises(MemoryBudgetExceeded) as error:
+        governor.admit('d', 'volume', 300)
+    assert error.value.retry is True
+    assert governor.stats()['rejections'] == 1
+
+def test_expired_sessions_are_not_charged(governor, redis_client):
+    _session(redis_client, 'a')
+    governor.admit('a', 'volume', 300).commit(300)
+    redis_client.hset(USAGE_KEY, 'gone|volume', 700)
+    assert governor.usage() == {'a': {'volume': 300}}
+    assert not redis_client.hexists(USAGE_KEY, 'gone|volume')
+
+def test_admission_lock_keeps_a_lock_taken_after_it_expired(governor, redis_client):
+    with governor._locked():
+        assert redis_client.exists(LOCK_KEY)
+        redis_client.set(LOCK_KEY, b'other')
+    assert redis_client.get(LOCK_KEY) == b'other'
+
+    redis_client.delete(LOCK_KEY)
+    with governor._locked():
+        pass
+    assert not redis_client.exists(LOCK_KEY)
+
+def test_budget_errors_map_to_http(app, redis_client):
+    app.extensions['memory_governor'] = MemoryGovernor(redis_client, 100, 0, 3600, queue_timeout=0)
+
+    @app.route('/load')
+    def load():
+        admit_load('a', 'volume', int(np.prod((10, 10, 10))))
+        return 'ok'
+
+    response = app.test_client().get('/load')
+    assert response.status_code == 413
+    assert response.get_json()['required_bytes'] == 1000
@@ -0,0 +1,100 @@
+import io
+import struct
+import zipfile
+
+import numpy as np
+import pytest
+
+from app.utils.mesh_utils import crop_roi, build_mesh, encode_binary_stl, encode_binary_ply, encode_npz, mesh_roi_crop
+from app.utils.session_store import get_session
+
+def _cube_mask():
+    mask = np.zeros((8, 10, 12), dtype=np.uint8)
+    mask[2:5, 3:7, 4:10] = 2
+    mask[0, 0, 0] = 1  # Another label, in the corner
+    return mask
+
+def test_crop_roi_pads_and_selects_label():
+    mask = _cube_mask()
+    crop, origin = crop_roi(mask, 2)
+    assert origin == (1, 2, 3) and crop.shape == (5, 6, 8)
+    assert crop.sum() == 3 * 4 * 6 and not crop[0].any() and not crop[-1].any()
+
+    # Padding reaching outside the volume is zeros
+    crop, origin = crop_roi(mask, 1)
+    assert origin == (-1, -1, -1) and crop.shape == (3, 3, 3) and crop.sum() == 1
+    assert crop_roi(mask)[0].sum() == 3 * 4 * 6 + 1
+    assert crop_roi(mask, 5) == (None, None)
+
+def test_mesh_is_closed_and_in_millimetres():
+    crop, origin = crop_roi(_cube_mask(), 2)
+    verts, faces = build_mesh(crop, origin, (2.0, 1.0, 0.5))
+    assert verts.dtype == np.float32 and faces.dtype == np.uint32
+
+    # (x, y, z) = (column, row, slice) in mm, half a voxel outside the cube
+    np.testing.assert_allclose(verts.min(axis=0), [3.5 * 0.5, 2.5, 1.5 * 2], atol=1e-5)
+    np.testing.assert_allclose(verts.max(axis=0), [9.5 * 0.5, 6.5, 4.5 * 2], atol=1e-5)
+    # A closed surface of genus 0: V - E + F = 2, every edge shared by two faces
+    edges = np.sort(faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1)
+    unique, counts = np.unique(edges, axis=0, return_counts=True)
+    assert (counts == 2).all()
+    assert len(verts) - len(unique) + len(faces) == 2
+
+    coarse, _ = build_mesh(crop, origin, (2.0, 1.0, 0.5), step_size=2, smoothing=1.0)
+    assert len(coarse) < len(verts)
+
+def test_encoders():
+    verts = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0]], dtype=np.float32)
+    faces = np.array([[0, 1, 2]], dtype=np.uint32)
+
+    stl = encode_binary_stl(verts, faces, 'tri')
+    assert len(stl) == 84 + 50 and struct.unpack('<I', stl[80:84]) == (1,)
+    assert struct.unpack('<3f', stl[84:96]) == (0.0, 0.0, 1.0)
+
+    ply = encode_binary_ply(verts, faces, 'tri')
+    header, body = ply.split(b'end_header\n')
+    assert b'element vertex 3' in header and b'element face 1' in header
+    assert len(body) == 3 * 12 + 1 + 3 * 4
+
+    with np.load(io.BytesIO(encode_npz(verts, faces))) as arrays:
+        np.testing.assert_array_equal(arrays['faces'], faces)
+
+    data, n_verts, n_faces = mesh_roi_crop(*crop_roi(_cube_mask(), 2), (1, 1, 1), fmt='stl')
+    assert len(data) == 84 + 50 * n_faces and n_verts > 0
+
+def test_mesh_endpoint_caches_meshes(app, client, auth_headers, loaded_volume):
+    mask = np.zeros(loaded_volume.shape, dtype=np.uint8)
+    mask[1:4, 2:8, 3:9] = 1
+    info = {'filename': 'roi.nii.gz', 'label': 'liver', 'unique_values': [0, 1], 'digest': 'abc'}
+    with app.app_context():
+        get_session('user_admin').update({
+            'roi_masks': [info, dict(info, label='empty', digest='def')],
+            'roi_mask:0': mask,
+            'roi_mask:1': np.zeros_like(mask)
+        })
+
+    response = client.get('/api/roi/mesh?format=stl&rois=0', headers=auth_headers)
+    assert response.status_code == 200
+    assert response.headers['X-Mesh-Cached'] == '0'
+    assert 'filename=0_liver.stl' in response.headers['Content-Disposition']
+    first = response.get_data()
+    response = client.get('/api/roi/mesh?format=stl&rois=0', headers=auth_headers)
+    assert response.headers['X-Mesh-Cached'] == '1' and response.get_data() == first
+
+    # Empty ROIs are left out, several meshes come as a zip
+    response = client.get('/api/roi/mesh?format=ply', headers=auth_headers)
+    assert 'filename=0_liver.ply' in response.headers['Content-Disposition']
+    with app.app_context():
+        get_session('user_admin').update({'roi_mask:1': mask})
+    response = client.get('/api/roi/mesh?format=ply', headers=auth_headers)
+    assert response.mimetype == 'application/zip'
+    assert zipfile.ZipFile(io.BytesIO(response.get_data())).namelist() == ['0_liver.ply', '1_empty.ply']
+
+@pytest.mark.parametrize('query', ['format=obj', 'step_size=0', 'smoothing=x', 'rois=7'])
+def test_mesh_endpoint_rejects_bad_requests(app, client, auth_headers, loaded_volume, query):
+    with app.app_context():
+        get_session('user_admin').update({
+            'roi_masks': [{'filename': 'roi.nii.gz', 'label': 'roi', 'unique_values': [0, 1], 'digest': 'abc'}],
+            'roi_mask:0': np.zeros(loaded_volume.shape, dtype=np.uint8)
+        })
+    assert client.get(f"/api/roi/mesh?{query}", headers=auth_headers).status_code == 400
@@ -0,0 +1,34 @@
+from app.utils.metrics import MetricsRegistry, format_labels
+
+def test_format_labels_sorts_and_escapes():
+    assert format_labels(None) == ''
+    assert format_labels({'route': '/a"b', 'method': 'GET'}) == '{method="GET",route="/a\\"b"}'
+
+def test_workers_aggregate_through_redis(redis_client):
+    first = MetricsRegistry(redis_client)
+    second = MetricsRegistry(redis_client)
+    second.worker = 'other'
+    for registry in (first, second):
+        registry.inc('http_requests_total', {'route': '/x', 'status': 200})
+        registry.observe('http_request_duration_seconds', 0.02, {'route': '/x'})
+    second.observe('http_request_duration_seconds', 3.0, {'route': '/x'})
+    first.register_cache('rendered_image', lambda: {'hits': 3, 'misses': 1, 'entries': 2})
+    first.snapshot(force=True)
+    
+    body = first.render(extra_gauges={'shared_volumes_budget_bytes': [({}, 1024)]})
+    assert 'http_requests_total{route="/x",status="200"} 2\n' in body
+    assert 'http_request_duration_seconds_bucket{route="/x",le="0.025"} 2\n' in body
+    assert 'http_request_duration_seconds_bucket{route="/x",le="5"} 3\n' in body
+    assert 'http_request_duration_seconds_count{route="/x"} 3\n' in body
+    assert f'cache_hits_total{{cache="rendered_image",worker="{first.worker}"}} 3\n' in body
+    assert 'shared_volumes_budget_bytes 1024\n' in body
+    assert body.count('# TYPE http_requests_total counter') == 1
+
+def test_metrics_endpoint_counts_requests(app, client):
+    app.config['METRICS_TOKEN'] = 'secret'
+    assert client.get('/metrics').status_code == 401
+    
+    client.get('/api/viewer/get_metadata')
+    body = client.get('/metrics', headers={'Authorization': 'Bearer secret'}).get_data(as_text=True)
+    assert 'http_requests_total{method="GET",route="/api/viewer/get_metadata",status="401"} 1' in body
+    assert 'http_requests_in_flight' in body
@@ -0,0 +1,90 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from app import create_app
+from app.utils.dicom_utils import apply_windowing
+from app.utils.nifti_utils import apply_roi_overlay, ROI_COLORS
+from app.utils.overlay_kernel import fused_overlay, gray_scale, init_overlay_kernel, kernel_available, resolve_kernel
+
+def _slice_and_masks():
+    rng = np.random.default_rng(0)
+    raw = rng.integers(-1000, 1500, (24, 30)).astype(np.float32)
+    first = np.zeros(raw.shape, dtype=np.uint8)
+    first[4:16, 5:20] = 1
+    second = np.zeros(raw.shape, dtype=np.uint8)
+    second[10:22, 12:28] = 1  # Overlaps the first
+    return raw, [first, None, second]
+
+def _as_uint8(rgb):
+    return (rgb * 255 + 0.5).astype(np.uint8)
+
+def test_matches_windowing_and_apply_roi_overlay():
+    raw, masks = _slice_and_masks()
+    out = fused_overlay(raw, masks, ROI_COLORS, alpha=0.4, window=(40, 400), kernel='numpy')
+    expected = apply_roi_overlay(apply_windowing(raw, 40, 400), masks, alpha=0.4)
+
+    assert out.dtype == np.uint8 and out.shape == raw.shape + (4,)
+    assert (out[:, :, 3] == 255).all()
+    assert np.abs(out[:, :, :3].astype(int) - _as_uint8(expected)).max() <= 1
+
+def test_value_range_and_layouts():
+    raw, masks = _slice_and_masks()
+    value_range = (float(raw.min()), float(raw.max()))
+    out = fused_overlay(raw, masks, ROI_COLORS, value_range=value_range, kernel='numpy')
+    expected = apply_roi_overlay(raw, masks, value_range=value_range)
+    assert np.abs(out[:, :, :3].astype(int) - _as_uint8(expected)).max() <= 1
+
+    # A non-contiguous slice (sagittal layout) and no ROIs at all
+    volume = np.repeat(raw[:, None, :], 3, axis=1)
+    np.testing.assert_array_equal(
+        fused_overlay(volume[:, 1, :], [], ROI_COLORS, window=(40, 400), kernel='numpy'),
+        fused_overlay(raw, [], ROI_COLORS, window=(40, 400), kernel='numpy')
+    )
+
+def test_gray_scale_and_kernels():
+    assert gray_scale(window=(40, 400)) == (-160.0, 1 / 400)
+    assert gray_scale(value_range=(0, 0.5)) == (0.0, 1.0)
+    assert gray_scale(value_range=(5, 5), window=(5, 0)) == (5.0, 0.0)
+    assert resolve_kernel('numpy') == 'numpy'
+    with pytest.raises(ValueError):
+        resolve_kernel('cuda')
+
+NUMBA_CHECK = """
+import numpy as np
+from app import create_app
+create_app('testing')
+from app.utils.nifti_utils import ROI_COLORS
+from app.utils.overlay_kernel import fused_overlay
+
+rng = np.random.default_rng(0)
+volume = rng.integers(-1000, 1500, (24, 3, 30)).astype(np.float32)
+masks = [(rng.random((24, 30)) < 0.3).astype(np.uint8), None, (rng.random((24, 30)) < 0.3).astype(np.uint8)]
+for image in (volume[:, 1, :], volume[:, 1, :].astype(np.float64)):
+    for options in ({'window': (40, 400)}, {'value_range': (-1000.0, 1500.0)}):
+        expected = fused_overlay(image, masks, ROI_COLORS, 0.4, kernel='numpy', **options)
+        assert np.array_equal(fused_overlay(image, masks, ROI_COLORS, 0.4, kernel='numba', **options), expected)
+"""
+
+# numba's parallel kernels do not survive a fork, and other tests fork
+# render workers, so the numba kernel only runs in a child process
+@pytest.mark.skipif(not kernel_available('numba'), reason="numba is not installed")
+def test_numba_kernel_matches_and_is_cached_in_the_configured_directory(tmp_path):
+    cache_dir = tmp_path / 'numba'
+    env = dict(os.environ, NUMBA_CACHE_DIR=str(cache_dir))
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, '-c', NUMBA_CHECK], env=env, cwd=backend, check=True)
+    assert any(name.endswith('.nbi') for _, _, names in os.walk(cache_dir) for name in names)
+
+def test_unwritable_cache_directory_disables_caching(tmp_path, monkeypatch):
+    monkeypatch.setenv('NUMBA_CACHE_DIR', 'unchanged')
+    blocker = tmp_path / 'file'
+    blocker.write_text('')
+    app = create_app('testing')
+    app.config['NUMBA_CACHE_DIR'] = str(blocker / 'numba')
+    init_overlay_kernel(app)
+    assert os.environ['NUMBA_CACHE_DIR'] == ''
+    app.extensions['render_pool'].shutdown()
@@ -0,0 +1,70 @@
+from concurrent.futures import Future
+
+from app.utils.image_cache import RenderedImageCache
+from app.utils.prefetch import Prefetcher
+
+class InlinePool:
+    """Runs jobs at submission, but reports an idle worker like a real pool."""
+    max_workers = 1
+    in_flight = 0
+    
+    def __init__(self):
+        self.submitted = []
+    
+    def submit(self, fn, *args):
+        self.submitted.append(args)
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+def test_image_cache_evicts_by_size_and_counts_prefetch_hits():
+    cache = RenderedImageCache(max_bytes=10)
+    cache.put(('a', 1), b'12345', prefetched=True)
+    cache.put(('b', 1), b'1234')
+    assert cache.get(('a', 1)) == (b'12345', True)
+    assert cache.get(('a', 1)) == (b'12345', False)
+    
+    cache.put(('a', 2), b'123')  # Evicts ('b', 1), the least recently used
+    assert cache.get(('b', 1)) == (None, False)
+    assert cache.stats()['evictions'] == 1
+    
+    cache.put(('c', 1), b'x' * 11)  # Larger than the whole cache
+    assert not cache.contains(('c', 1))
+    
+    cache.invalidate_user('a')
+    assert cache.stats()['entries'] == 0 and cache.stats()['bytes'] == 0
+
+def test_prefetcher_renders_ahead_of_the_cursor():
+    pool, cache = InlinePool(), RenderedImageCache(1 << 20)
+    prefetcher = Prefetcher(pool, cache, lookahead=2, max_lookahead=4, lead_time=0)
+    key_for = lambda index: ('user', index)
+    job_for = lambda index: (bytes, (index,))
+    
+    prefetcher.observe('user', 'axial', 3, ())
+    prefetcher.schedule('user', 10, key_for, job_for)
+    assert pool.submitted == []  # No direction yet
+    
+    prefetcher.observe('user', 'axial', 4, ())
+    prefetcher.schedule('user', 6, key_for, job_for)
+    assert pool.submitted == [(5,)]  # Stops at the last slice
+    assert cache.get(('user', 5)) == (bytes(5), True)
+    
+    prefetcher.observe('user', 'axial', 2, ())
+    prefetcher.schedule('user', 10, key_for, job_for)
+    assert pool.submitted[1:] == [(1,), (0,)]
+    
+    # Another view starts over
+    prefetcher.observe('user', 'coronal', 2, ())
+    assert prefetcher.lookahead_depth(prefetcher._states['user']) == 0
+    assert prefetcher.stats()['completed'] == 3
+
+def test_prefetch_is_scheduled_after_the_response(app, client, auth_headers, loaded_volume):
+    pool = InlinePool()
+    app.extensions['prefetcher'] = Prefetcher(pool, app.extensions['image_cache'], lookahead=2, lead_time=0)
+    
+    client.get('/api/viewer/get_slice?slice_index=1', headers=auth_headers).close()
+    response = client.get('/api/viewer/get_slice?slice_index=2', headers=auth_headers)
+    assert response.status_code == 200
+    assert pool.submitted == []
+    response.close()
+    assert [args[0].shape for args in pool.submitted] == [(16, 20), (16, 20)]
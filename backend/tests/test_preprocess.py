@@ -0,0 +1,59 @@
+import json
+import os
+
+import nibabel as nib
+import numpy as np
+
+import preprocess
+from app.utils.file_utils import get_series_cache_dir, read_series_index
+
+def _write_nifti(path, shape=(8, 32, 32)):
+    data = np.zeros(shape, dtype=np.uint8)
+    data[2:5, 10:20, 10:20] = 1
+    nib.save(nib.Nifti1Image(data, np.eye(4)), str(path))
+
+def test_find_studies_pairs_label_files(tmp_path):
+    root = tmp_path / 'archive'
+    for study in ('b/dicom', 'b/nifti', 'a', 'a/labels', 'c d'):
+        (root / study).mkdir(parents=True)
+    for name in ('b/dicom/1.dcm', 'a/1.DCM', 'a/2.dcm', 'c d/1.dcm'):
+        (root / name).write_bytes(b'')
+    for name in ('b/nifti/liver.nii.gz', 'a/labels/kidney.nii', 'orphan.nii'):
+        (root / name).write_bytes(b'')
+
+    studies = preprocess.find_studies(str(root))
+    assert [study['key'] for study in studies] == ['a', 'b-dicom', 'c_d']
+    assert [len(study['dicom_files']) for study in studies] == [2, 1, 1]
+    assert [[os.path.basename(p) for p in study['nifti_files']] for study in studies] == [
+        ['kidney.nii'], ['liver.nii.gz'], []
+    ]
+
+def test_preprocess_study_prepares_and_resumes(app, tmp_path, dicom_files):
+    source = os.path.dirname(dicom_files[0])
+    _write_nifti(os.path.join(source, 'liver.nii.gz'))
+    study, = preprocess.find_studies(source)
+    # Masks are processed with create_roi_masks alone; caching them is the mask cache's job
+    app.extensions['mask_cache'] = None
+
+    with app.app_context():
+        result = preprocess.preprocess_study(study)
+        assert not result['cached']
+        assert result['shape'] == [8, 32, 32] and len(result['rois']) == 1
+        assert set(result['timings']) == {'import', 'ingest', 'masks', 'total'}
+        assert read_series_index(get_series_cache_dir(result['series_id']))['shape'] == [8, 32, 32]
+        manifest_path = os.path.join(app.config['UPLOAD_FOLDER'], '_studies', study['key'], 'study.json')
+        with open(manifest_path) as f:
+            assert json.load(f)['series_id'] == result['series_id']
+        assert not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], '_masks'))
+
+        assert preprocess.preprocess_study(study)['cached']
+        assert not preprocess.preprocess_study(study, force=True)['cached']
+
+        # A changed label file is prepared again, under the same series
+        _write_nifti(os.path.join(source, 'liver.nii.gz'), shape=(4, 16, 16))
+        again = preprocess.preprocess_study(preprocess.find_studies(source)[0])
+        assert not again['cached'] and again['series_id'] == result['series_id']
+
+def test_main_reports_missing_studies(tmp_path, capsys):
+    assert preprocess.main([str(tmp_path)]) == 1
+    assert 'No DICOM series found' in capsys.readouterr().out
@@ -0,0 +1,33 @@
+def test_armed_route_is_captured_once(app, client, auth_headers, tmp_path):
+    app.extensions['profiler'].output_dir = str(tmp_path / 'profiles')
+    response = client.post('/api/profiling/arm', headers=auth_headers, json={
+        'route': '/api/viewer/get_metadata', 'count': 1, 'mode': 'sampling'
+    })
+    assert response.status_code == 200
+    assert client.post('/api/profiling/arm', headers=auth_headers, json={'route': '/nope'}).status_code == 400
+    
+    first = client.get('/api/viewer/get_metadata', headers=auth_headers)
+    second = client.get('/api/viewer/get_metadata', headers=auth_headers)
+    capture_id = first.headers['X-Profile-Id']
+    assert 'X-Profile-Id' not in second.headers
+    
+    captures = client.get('/api/profiling/captures', headers=auth_headers).get_json()['captures']
+    assert [capture['id'] for capture in captures] == [capture_id]
+    response = client.get(f"/api/profiling/captures/{capture_id}/meta.json", headers=auth_headers)
+    assert response.status_code == 200
+    assert client.get(f"/api/profiling/captures/{capture_id}/../x", headers=auth_headers).status_code == 404
+    
+    assert client.delete(f"/api/profiling/captures/{capture_id}", headers=auth_headers).status_code == 200
+    assert client.get('/api/profiling/captures', headers=auth_headers).get_json()['captures'] == []
+
+def test_header_token_profiles_requests(app, client, auth_headers, tmp_path):
+    app.extensions['profiler'].output_dir = str(tmp_path / 'profiles')
+    token = client.post('/api/profiling/arm', headers=auth_headers, json={'ttl': 60}).get_json()['token']
+    
+    response = client.get('/api/viewer/get_metadata', headers=dict(auth_headers, **{'X-Profile-Token': token}))
+    assert 'X-Profile-Id' in response.headers
+    assert 'X-Profile-Id' not in client.get('/api/viewer/get_metadata', headers=auth_headers).headers
+    
+    client.post('/api/profiling/disarm', headers=auth_headers)
+    response = client.get('/api/viewer/get_metadata', headers=dict(auth_headers, **{'X-Profile-Token': token}))
+    assert 'X-Profile-Id' not in response.headers
@@ -0,0 +1,70 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from app.utils.render_pool import RenderPool, RenderQueueFull, RenderTimeout, _result
+
+def test_inline_pool_runs_and_raises():
+    pool = RenderPool(max_workers=0)
+    assert pool.run(sum, [1, 2, 3]) == 6
+    with pytest.raises(ZeroDivisionError):
+        pool.run(divmod, 1, 0)
+    assert pool.in_flight == 0
+
+def test_saturated_pool_rejects_jobs():
+    pool = RenderPool(max_workers=0)
+    started, release = threading.Event(), threading.Event()
+    
+    def block():
+        started.set()
+        release.wait(5)
+    
+    thread = threading.Thread(target=pool.run, args=(block,))
+    thread.start()
+    try:
+        assert started.wait(5)
+        with pytest.raises(RenderQueueFull):
+            pool.submit(sum, [])
+    finally:
+        release.set()
+        thread.join()
+    assert pool.run(sum, []) == 0
+
+def test_result_times_out():
+    with pytest.raises(RenderTimeout):
+        _result(Future(), 0.01)
+
+def test_slice_index_is_validated(client, auth_headers, loaded_volume):
+    for endpoint in ('/api/viewer/get_slice', '/api/viewer/get_combined_view'):
+        for index in ('abc', '-1', '6'):
+            response = client.get(f"{endpoint}?view=axial&slice_index={index}", headers=auth_headers)
+            assert response.status_code == 400, (endpoint, index)
+        response = client.get(f"{endpoint}?view=sagittal&slice_index=19", headers=auth_headers)
+        assert response.status_code == 200
+        assert response.mimetype == 'image/png'
+
+def test_busy_pool_answers_429(app, client, auth_headers, loaded_volume):
+    pool = app.extensions['render_pool']
+    pool.submit(sum, [])  # Sets up the process state
+    held = 0
+    while pool._slots.acquire(blocking=False):
+        held += 1
+    try:
+        response = client.get('/api/viewer/get_slice?slice_index=0', headers=auth_headers)
+    finally:
+        for _ in range(held):
+            pool._slots.release()
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+
+def _sleep(seconds):
+    import time
+    time.sleep(seconds)
+
+def test_shutdown_with_jobs_in_flight():
+    pool = RenderPool(max_workers=1, queue_depth=2, start_method='fork')
+    futures = [pool.submit(_sleep, 0.2) for _ in range(3)]
+    pool.shutdown()
+    assert all(future.done() for future in futures)
+    assert pool.in_flight == 0
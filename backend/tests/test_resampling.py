@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+from scipy.ndimage import zoom
+
+from app.utils.dicom_utils import resample_to_shape, resample_volume, get_volume_spacing
+
+@pytest.mark.parametrize('order', [0, 1, 3])
+@pytest.mark.parametrize('slab_size, workers', [(1, 1), (4, 1), (5, 3), (64, 1)])
+def test_slabs_match_zoom(order, slab_size, workers):
+    volume = np.random.default_rng(0).normal(size=(9, 12, 10)).astype(np.float32)
+    output_shape = (23, 12, 7)
+    expected = zoom(volume, np.divide(output_shape, volume.shape), order=order, mode='nearest', grid_mode=False)
+    
+    resampled = resample_to_shape(volume, output_shape, order=order, slab_size=slab_size, workers=workers)
+    assert resampled.dtype == volume.dtype
+    np.testing.assert_allclose(resampled, expected, atol=1e-4 if order > 1 else 1e-6)
+
+def test_nearest_neighbour_keeps_labels():
+    mask = np.zeros((6, 8, 8), dtype=np.uint8)
+    mask[2:4, 2:6, 2:6] = 3
+    resampled = resample_to_shape(mask, (15, 8, 8), order=0, slab_size=4)
+    assert set(np.unique(resampled)) == {0, 3}
+
+def test_resample_volume_to_isotropic_spacing():
+    volume = np.ones((10, 20, 20), dtype=np.int16)
+    assert resample_volume(volume, (1.0, 1.0, 1.0)) is volume
+    assert resample_volume(volume, (2.5, 0.5, 0.5)).shape == (25, 10, 10)
+
+def test_volume_spacing():
+    assert get_volume_spacing({'PixelSpacing': [0.7, 0.8], 'SliceThickness': 2.5}) == (2.5, 0.7, 0.8)
+    assert get_volume_spacing({'PixelSpacing': [0.7, 0.8], 'SliceThickness': 2.5, 'SliceSpacing': 2.0})[0] == 2.0
+    assert get_volume_spacing({}) == (1.0, 1.0, 1.0)
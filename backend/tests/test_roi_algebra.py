@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+from scipy.ndimage import distance_transform_edt
+
+from app.utils.roi_algebra import PackedMask, evaluate, WORD_BITS
+from app.utils.session_store import get_session
+
+SHAPE = (6, 20, 150)  # Rows span several words, the last one partial
+
+def _box(start, stop):
+    mask = np.zeros(SHAPE, dtype=np.uint8)
+    mask[tuple(slice(a, b) for a, b in zip(start, stop))] = 1
+    return mask
+
+def test_pack_round_trip():
+    rng = np.random.default_rng(0)
+    mask = np.zeros(SHAPE, dtype=np.uint8)
+    mask[1:5, 3:17, 70:140] = rng.integers(0, 2, (4, 14, 70))
+    packed = PackedMask.from_mask(mask)
+
+    assert packed.start[2] % WORD_BITS == 0
+    assert packed.count() == np.count_nonzero(mask)
+    np.testing.assert_array_equal(packed.to_mask(), mask)
+    nonzero = np.argwhere(mask)
+    assert packed.extent() == (tuple(nonzero.min(axis=0)), tuple(nonzero.max(axis=0) + 1))
+
+def test_pack_one_label():
+    mask = _box((0, 0, 0), (2, 2, 2))
+    mask[4, 10, 100] = 3
+    packed = PackedMask.from_mask(mask, 3)
+    assert packed.count() == 1
+    assert packed.extent() == ((4, 10, 100), (5, 11, 101))
+
+def test_empty_mask():
+    packed = PackedMask.from_mask(np.zeros(SHAPE, dtype=np.uint8))
+    assert packed.is_empty() and packed.count() == 0 and packed.extent() is None
+    assert not packed.to_mask().any()
+
+@pytest.mark.parametrize('op, expected', [
+    ('union', np.logical_or),
+    ('intersection', np.logical_and),
+    ('difference', lambda a, b: a & ~b)
+])
+def test_boolean_ops_match_numpy(op, expected):
+    # Boxes with different word offsets along the rows
+    a = _box((0, 2, 10), (4, 12, 90))
+    b = _box((2, 5, 70), (6, 18, 149))
+    result = evaluate(op, [PackedMask.from_mask(a), PackedMask.from_mask(b)])
+    np.testing.assert_array_equal(result.to_mask(), expected(a != 0, b != 0).astype(np.uint8))
+
+def test_ops_on_disjoint_and_empty_masks():
+    a = PackedMask.from_mask(_box((0, 0, 0), (2, 2, 2)))
+    b = PackedMask.from_mask(_box((4, 10, 130), (6, 12, 140)))
+    empty = PackedMask.from_mask(np.zeros(SHAPE, dtype=np.uint8))
+
+    assert evaluate('intersection', [a, b]).is_empty()
+    assert evaluate('union', [a, empty]).count() == a.count()
+    assert evaluate('difference', [a, b]).count() == a.count()
+    assert evaluate('difference', [empty, a]).is_empty()
+
+def _ball_reference(mask, margin, spacing, grow):
+    if grow:
+        return (distance_transform_edt(mask == 0, sampling=spacing) <= margin).astype(np.uint8)
+    inside = np.pad(mask != 0, 1)
+    return (distance_transform_edt(inside, sampling=spacing)[1:-1, 1:-1, 1:-1] > margin).astype(np.uint8)
+
+@pytest.mark.parametrize('op', ['dilate', 'erode'])
+def test_morphology_matches_whole_volume_distance(op):
+    mask = _box((1, 4, 60), (5, 15, 100))
+    mask[3, 8, 120] = 1
+    spacing = (2.5, 0.7, 0.7)
+    result = evaluate(op, [PackedMask.from_mask(mask)], 1.6, spacing)
+    np.testing.assert_array_equal(result.to_mask(), _ball_reference(mask, 1.6, spacing, op == 'dilate'))
+
+def test_unknown_op():
+    with pytest.raises(ValueError):
+        evaluate('xor', [PackedMask.from_mask(_box((0, 0, 0), (1, 1, 1)))])
+
+def test_combine_appends_a_derived_roi_under_the_lock(app, client, auth_headers, loaded_volume, redis_client):
+    a = np.zeros(loaded_volume.shape, dtype=np.uint8)
+    b = np.zeros_like(a)
+    a[1:4, 2:8, 2:8] = 1
+    b[2:5, 5:10, 5:10] = 1
+    info = {'filename': 'a.nii.gz', 'label': 'a', 'unique_values': [0, 1], 'digest': 'a'}
+    with app.app_context():
+        get_session('user_admin').update({
+            'roi_masks': [info, dict(info, filename='b.nii.gz', label='b', digest='b')],
+            'roi_mask:0': a,
+            'roi_mask:1': b
+        })
+
+    response = client.post('/api/roi/combine', headers=auth_headers, json={'op': 'intersection', 'rois': [0, 1]})
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result['roi_index'] == 2 and result['label'] == 'a & b'
+    assert result['voxels'] == np.count_nonzero(a & b)
+    with app.app_context():
+        derived = get_session('user_admin').get_roi_masks()[2]
+        np.testing.assert_array_equal(derived['mask'], a & b)
+    assert not redis_client.exists('lock:session:user_admin:roi_masks')
+
+    response = client.post('/api/roi/combine', headers=auth_headers, json={'op': 'dilate', 'rois': [2], 'margin_mm': 1})
+    assert response.get_json()['roi_index'] == 3 and response.get_json()['label'] == 'a & b dilated 1 mm'
@@ -0,0 +1,166 @@
+import numpy as np
+import pytest
+
+from app.api.roi import commit_roi_edit
+from app.utils.roi_edit import (
+    rasterize_runs,
+    paint_pixels,
+    interpolate_slices,
+    restore_box,
+    box_index,
+    touched_slices,
+    roi_slice_version,
+    encode_delta,
+    decode_delta
+)
+from app.utils.session_store import get_session, SessionBusy
+
+def test_rasterize_runs_expands_and_clips():
+    rows, cols = rasterize_runs([[1, 2, 3], [2, -2, 4], [3, 6, 5], [9, 0, 2]], (8, 8))
+    assert list(zip(rows.tolist(), cols.tolist())) == [
+        (1, 2), (1, 3), (1, 4),
+        (2, 0), (2, 1),
+        (3, 6), (3, 7)
+    ]
+
+def test_rasterize_runs_empty_and_invalid():
+    rows, cols = rasterize_runs([], (8, 8))
+    assert rows.size == 0 and cols.size == 0
+    with pytest.raises(ValueError):
+        rasterize_runs([[1, 2]], (8, 8))
+
+def test_paint_pixels_edits_box_in_place():
+    mask = np.zeros((4, 6, 8), dtype=np.uint8)
+    rows, cols = rasterize_runs([[1, 2, 3], [3, 4, 1]], (6, 8))
+    box, before = paint_pixels(mask, 0, 2, rows, cols, 5)
+
+    assert box == ((2, 1, 2), (3, 4, 5))
+    assert not before.any()
+    assert np.count_nonzero(mask) == 4
+    assert mask[2, 1, 2:5].tolist() == [5, 5, 5] and mask[2, 3, 4] == 5
+    # Pixels inside the box but not painted keep their value
+    assert mask[2, 2, 2] == 0
+
+    restore_box(mask, box, before)
+    assert not mask.any()
+
+def test_paint_pixels_other_axes():
+    mask = np.zeros((4, 6, 8), dtype=np.uint8)
+    rows, cols = rasterize_runs([[0, 1, 2]], (6, 4))
+    box, _ = paint_pixels(mask, 2, 7, rows, cols, 1)
+    assert box == ((0, 1, 7), (1, 3, 8))
+    assert mask[0, 1:3, 7].tolist() == [1, 1]
+    assert touched_slices(box) == {'axial': (0, 1), 'coronal': (1, 3), 'sagittal': (7, 8)}
+
+def test_paint_pixels_without_pixels():
+    mask = np.zeros((2, 2, 2), dtype=np.uint8)
+    assert paint_pixels(mask, 0, 0, np.array([]), np.array([]), 1) == (None, None)
+
+def test_interpolate_slices_morphs_between_keys():
+    mask = np.zeros((6, 16, 16), dtype=np.uint8)
+    mask[0, 4:8, 4:8] = 1
+    mask[4, 4:12, 4:12] = 1
+    mask[2, 0, 0] = 2  # Other labels are left alone
+    box, before = interpolate_slices(mask, 0, 4, 0, 1)
+
+    assert box[0][0] == 1 and box[1][0] == 4
+    areas = [np.count_nonzero(mask[n] == 1) for n in range(5)]
+    assert areas[0] < areas[1] < areas[2] < areas[3] < areas[4]
+    assert mask[2, 0, 0] == 2
+    assert not mask[5].any()
+
+    restore_box(mask, box, before)
+    assert [np.count_nonzero(mask[n] == 1) for n in (1, 2, 3)] == [0, 0, 0]
+
+def test_interpolate_slices_needs_gap_and_label():
+    mask = np.zeros((4, 8, 8), dtype=np.uint8)
+    mask[0, 2:4, 2:4] = 1
+    assert interpolate_slices(mask, 0, 0, 1, 1) == (None, None)
+    with pytest.raises(ValueError):
+        interpolate_slices(mask, 0, 0, 3, 1)
+
+def test_delta_round_trip():
+    rng = np.random.default_rng(0)
+    before = rng.integers(0, 3, (1, 5, 7), dtype=np.uint8)
+    box = ((2, 3, 4), (3, 8, 11))
+    decoded_box, decoded = decode_delta(encode_delta(box, before))
+    assert decoded_box == box
+    assert decoded.dtype == np.uint8
+    np.testing.assert_array_equal(decoded, before)
+
+def test_roi_slice_version():
+    assert roi_slice_version({'digest': 'abc'}, 1, 5) == 'abc'
+    info = {'digest': 'e-2', 'edit': {'base': ['abc', 'abc', 'e-2'], 'slices': [{'3': 'e-1'}, {}, {}]}}
+    assert roi_slice_version(info, 0, 3) == 'e-1'
+    assert roi_slice_version(info, 0, 4) == 'abc'
+    assert roi_slice_version(info, 2, 0) == 'e-2'
+
+def _edited_roi(mask):
+    return {
+        'filename': 'roi.nii.gz',
+        'label': 'roi',
+        'unique_values': [0, 1],
+        'digest': 'base',
+        'edit': {'id': 'e', 'revision': 0, 'base': ['base'] * 3, 'slices': [{}, {}, {}], 'nbytes': mask.nbytes},
+        'voxels': {}
+    }
+
+def test_commit_roi_edit_versions_touched_slices(app, redis_client):
+    mask = np.zeros((4, 8, 8), dtype=np.uint8)
+    with app.test_request_context():
+        session = get_session('user')
+        info = _edited_roi(mask)
+        session.update({'roi_masks': [info], 'roi_mask:0': mask})
+
+        rows, cols = rasterize_runs([[2, 2, 2]], (8, 8))
+        box, before = paint_pixels(mask, 0, 1, rows, cols, 1)
+        info, changed = commit_roi_edit('user', session, 0, info, mask, mask, box, before)
+
+        assert changed == 2
+        assert info['digest'] == 'e-1' and info['edit']['revision'] == 1
+        assert info['voxels'] == {'1': 2}
+        assert roi_slice_version(info, 0, 1) == 'e-1'
+        assert roi_slice_version(info, 0, 2) == 'base'
+        assert roi_slice_version(info, 1, 2) == 'e-1'
+        assert roi_slice_version(info, 2, 4) == 'base'
+        assert redis_client.llen('roi_undo:user:e') == 1
+        assert get_session('user').get('roi_masks')[0]['digest'] == 'e-1'
+
+        # A stroke across most of the sagittal slices starts that axis over only
+        rows, cols = rasterize_runs([[5, 0, 8]], (8, 8))
+        box, before = paint_pixels(mask, 0, 3, rows, cols, 1)
+        info, _ = commit_roi_edit('user', session, 0, info, mask, mask, box, before)
+        assert info['edit']['base'] == ['base', 'base', 'e-2']
+        assert info['edit']['slices'][2] == {}
+        assert roi_slice_version(info, 2, 4) == 'e-2'
+        assert roi_slice_version(info, 0, 1) == 'e-1'
+        assert roi_slice_version(info, 0, 2) == 'base'
+        assert info['voxels'] == {'1': 10}
+
+def test_commit_roi_edit_without_change(app, redis_client):
+    mask = np.zeros((2, 4, 4), dtype=np.uint8)
+    with app.test_request_context():
+        session = get_session('user')
+        info = _edited_roi(mask)
+        box = ((0, 0, 0), (1, 2, 2))
+        result, changed = commit_roi_edit('user', session, 0, info, mask, mask, box, mask[box_index(box)].copy())
+        assert changed == 0 and result is info
+        assert redis_client.llen('roi_undo:user:e') == 0
+
+def test_session_lock_serializes_and_keeps_foreign_lock(app, redis_client):
+    with app.test_request_context():
+        session = get_session('user')
+        key = f"lock:{session.key}:roi_masks"
+        with session.locked('roi_masks'):
+            assert redis_client.exists(key)
+            with pytest.raises(SessionBusy):
+                with get_session('user').locked('roi_masks', timeout=1):
+                    pass
+            # The lock expired and another worker took it
+            redis_client.set(key, b'other')
+        assert redis_client.get(key) == b'other'
+        
+        redis_client.delete(key)
+        with session.locked('roi_masks'):
+            pass
+        assert not redis_client.exists(key)
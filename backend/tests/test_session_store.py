@@ -0,0 +1,66 @@
+import os
+
+import nibabel as nib
+import numpy as np
+
+from app.utils.session_store import UserSession, encode_field, decode_field, get_session
+
+def test_field_round_trip():
+    volume = np.arange(24, dtype=np.int16).reshape(2, 3, 4)
+    decoded = decode_field(encode_field(volume))
+    assert decoded.dtype == np.int16
+    np.testing.assert_array_equal(decoded, volume)
+    assert decode_field(encode_field({'shape': [2, 3, 4]}).encode()) == {'shape': [2, 3, 4]}
+    assert decode_field(None) is None
+
+def test_fields_are_memoized_and_deleted(app, redis_client):
+    with app.app_context():
+        session = get_session('user')
+        session.update({'dicom_shape': [2, 3, 4], 'roi_mask:0': np.zeros(3, np.uint8)})
+        assert redis_client.ttl('session:user') > 0
+        
+        redis_client.hset('session:user', 'dicom_shape', encode_field([9, 9, 9]))
+        assert session.get('dicom_shape') == [2, 3, 4]  # Memoized for the request
+        assert UserSession(redis_client, 'user', 60).get('dicom_shape') == [9, 9, 9]
+        
+        session.update({'dicom_shape': [1, 1, 1]}, delete=['roi_mask:0'])
+        assert 'roi_mask:0' not in session
+        assert redis_client.hkeys('session:user') == [b'dicom_shape']
+
+def test_legacy_session_is_dropped(app, redis_client):
+    redis_client.set('session:user', '{"dicom_shape": [1, 2, 3]}')
+    with app.app_context():
+        assert get_session('user').get('dicom_shape') is None
+    assert not redis_client.exists('session:user')
+
+def test_set_roi_masks_drops_stale_fields(app, redis_client):
+    with app.app_context():
+        session = get_session('user')
+        masks = [{'label': str(i), 'mask': np.full(4, i, np.uint8)} for i in range(3)]
+        session.set_roi_masks(masks)
+        session.set_roi_masks(masks[1:])
+        
+        session = UserSession(redis_client, 'user', 60)
+        assert [info['label'] for info in session.get('roi_masks')] == ['1', '2']
+        assert session.get_roi_masks([1, 5])[0]['mask'].tolist() == [2] * 4
+        assert not redis_client.hexists('session:user', 'roi_mask:2')
+
+def test_process_rois_replaces_the_roi_list(app, redis_client, client, auth_headers, loaded_volume):
+    nifti_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'user_admin', 'nifti')
+    os.makedirs(nifti_dir)
+    label = np.zeros(loaded_volume.shape[::-1], dtype=np.uint8)
+    label[4:8, 4:8, 2:4] = 1
+    nib.save(nib.Nifti1Image(label, np.eye(4)), os.path.join(nifti_dir, 'roi.nii.gz'))
+    
+    for _ in range(2):
+        response = client.post('/api/roi/process', headers=auth_headers, json={
+            'nifti_files': ['roi.nii.gz'], 'dicom_shape': list(loaded_volume.shape)
+        })
+        assert response.status_code == 200
+        assert response.get_json()['roi_info'][0]['shape'] == list(loaded_volume.shape)
+    
+    with app.app_context():
+        session = get_session('user_admin')
+        assert len(session.get('roi_masks')) == 1
+        assert np.count_nonzero(session.get_roi_masks()[0]['mask']) == 32
+    assert not redis_client.exists('lock:session:user_admin:roi_masks')
@@ -0,0 +1,71 @@
+import uuid
+
+import numpy as np
+import pytest
+
+from app.utils.shared_volumes import (
+    SharedVolumeRegistry, SessionDataLost, share_array, release_array, resolve_array
+)
+from app.utils.session_store import get_session
+
+@pytest.fixture
+def registry(redis_client):
+    registry = SharedVolumeRegistry(redis_client, budget_bytes=1000, grace_period=0)
+    yield registry
+    registry.purge()
+
+def _name(kind='volume'):
+    return f"{uuid.uuid4().hex}:{kind}"
+
+def test_publish_and_attach_read_only(registry, redis_client):
+    array = np.arange(12, dtype=np.int16).reshape(3, 4)
+    name = _name()
+    view = registry.publish(name, array)
+    np.testing.assert_array_equal(view, array)
+    assert not view.flags.writeable
+    
+    # Another worker attaches by name
+    other = SharedVolumeRegistry(redis_client, budget_bytes=1000)
+    np.testing.assert_array_equal(other.attach(name), array)
+    other.attach_writable(name)[0, 0] = 7
+    assert view[0, 0] == 7
+    assert registry.usage_by_kind() == {'volume': (1, 24)}
+
+def test_budget_evicts_unreferenced_volumes_first(registry, redis_client):
+    kept, evicted = _name(), _name()
+    registry.publish(kept, np.zeros(400, np.uint8))
+    registry.acquire(kept, 'user')
+    redis_client.set('session:user', 1)
+    registry.publish(evicted, np.zeros(400, np.uint8))
+    
+    third = _name()
+    assert registry.publish(third, np.zeros(400, np.uint8)) is not None
+    registry.acquire(third, 'user')
+    assert registry.attach(evicted) is None
+    assert registry.attach(kept) is not None
+    # Nothing left to evict
+    assert registry.publish(_name(), np.zeros(400, np.uint8)) is None
+    assert registry.stats()['bytes'] == 800
+
+def test_sweep_unlinks_volumes_of_expired_sessions(registry, redis_client):
+    name = _name()
+    registry.publish(name, np.ones(10, np.uint8))
+    registry.acquire(name, 'gone')
+    registry.sweep(force=True)
+    assert registry.attach(name) is None
+    assert registry.stats() == {'segments': 0, 'bytes': 0, 'budget_bytes': 1000, 'attached_locally': 0}
+
+def test_lost_volume_answers_409(app, client, auth_headers, loaded_volume):
+    with app.app_context():
+        value = share_array('user_admin', 'series:volume', loaded_volume)
+        assert value == {'shared': 'series:volume'}
+        np.testing.assert_array_equal(resolve_array(value), loaded_volume)
+        get_session('user_admin').update({'dicom_volume': value})
+        
+        release_array('user_admin', value)
+        app.extensions['shared_volumes'].purge()
+        with pytest.raises(SessionDataLost):
+            resolve_array(value)
+    
+    response = client.get('/api/viewer/get_slice?slice_index=0', headers=auth_headers)
+    assert response.status_code == 409
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from app.utils import ingest
+from app.utils.dicom_utils import compute_volume_stats, get_window_presets, first_window_value, CT_WINDOW_PRESETS
+from app.utils.session_store import get_session
+
+def test_whole_numbers_give_exact_statistics():
+    rng = np.random.default_rng(0)
+    volume = rng.integers(-1024, 2000, (9, 12, 14)).astype(np.int16)
+    stats = compute_volume_stats(volume, slab_size=4)
+
+    assert stats['min'] == volume.min() and stats['max'] == volume.max()
+    assert stats['mean'] == pytest.approx(volume.mean())
+    assert stats['std'] == pytest.approx(volume.std())
+    for axis, others in enumerate([(1, 2), (0, 2), (0, 1)]):
+        assert stats['slice_min'][axis] == volume.min(axis=others).tolist()
+        assert stats['slice_max'][axis] == volume.max(axis=others).tolist()
+    # One bin per value: percentiles are the values themselves
+    assert stats['histogram'].sum() == volume.size
+    assert len(stats['histogram']) == volume.max() - volume.min() + 1
+    for q in (1, 50, 99):
+        assert stats['percentiles'][f"p{q}"] == np.percentile(volume, q, method='inverted_cdf')
+
+def test_real_values_and_flat_volume():
+    volume = np.random.default_rng(1).normal(0, 1, (5, 8, 8)).astype(np.float32)
+    stats = compute_volume_stats(volume, bins=256)
+    width = (stats['max'] - stats['min']) / 256
+    assert len(stats['histogram']) == 256
+    assert abs(stats['percentiles']['p50'] - np.median(volume)) <= width
+
+    stats = compute_volume_stats(np.full((2, 3, 3), 7.0))
+    assert stats['std'] == 0 and stats['percentiles']['p99'] == 7.0
+
+@pytest.mark.parametrize('value, expected', [
+    ('40\\400', 40.0), ([50, 60], 50.0), ('35', 35.0), (None, None), ('', None), ([], None), ('nan', None)
+])
+def test_first_window_value(value, expected):
+    assert first_window_value(value) == expected
+
+def test_window_presets():
+    stats = compute_volume_stats(np.arange(-1000, 1000, dtype=np.int16).reshape(10, 10, 20))
+    presets, default = get_window_presets({'WindowCenter': '40\\300', 'WindowWidth': [400, 1500], 'Modality': 'CT'}, stats)
+    assert default == 'header'
+    assert presets['header'] == {'window_center': 40.0, 'window_width': 400.0}
+    assert presets['full'] == {'window_center': -0.5, 'window_width': 1999.0}
+    assert presets['auto']['window_width'] < presets['full']['window_width']
+    assert set(CT_WINDOW_PRESETS) <= set(presets)
+
+    presets, default = get_window_presets({'WindowWidth': 0, 'Modality': 'MR'}, stats)
+    assert default == 'auto' and set(presets) == {'auto', 'full'}
+    assert get_window_presets({}) == ({}, None)
+
+def test_volume_stats_are_computed_once(tmp_path, monkeypatch):
+    volume = np.arange(24, dtype=np.int16).reshape(2, 3, 4)
+    stats = ingest.get_volume_stats(volume, str(tmp_path), '-iso1')
+    assert (tmp_path / 'stats-iso1.json').exists()
+
+    monkeypatch.setattr(ingest, 'compute_volume_stats', lambda volume: pytest.fail('recomputed'))
+    cached = ingest.get_volume_stats(volume, str(tmp_path), '-iso1')
+    np.testing.assert_array_equal(cached['histogram'], stats['histogram'])
+    assert cached['percentiles'] == stats['percentiles']
+
+    # Stats of another shape are stale
+    monkeypatch.undo()
+    assert ingest.get_volume_stats(volume[:1], str(tmp_path), '-iso1')['slice_min'][0] == [0]
+
+def test_slice_and_metadata_use_presets(app, client, auth_headers, loaded_volume):
+    with app.app_context():
+        get_session('user_admin').update({'dicom_stats': {
+            key: value for key, value in compute_volume_stats(loaded_volume).items() if key != 'histogram'
+        }})
+    result = client.get('/api/viewer/get_metadata', headers=auth_headers).get_json()
+    assert result['default_window_preset'] == 'header'
+    assert {'header', 'auto', 'full'} <= set(result['window_presets'])
+    assert result['statistics']['min'] == loaded_volume.min()
+
+    response = client.get('/api/viewer/get_slice?slice_index=1&window_preset=full', headers=auth_headers)
+    assert response.status_code == 200 and response.mimetype == 'image/png'
+    response = client.get('/api/viewer/get_slice?slice_index=1&window_preset=nope', headers=auth_headers)
+    assert response.status_code == 400 and 'nope' in response.get_json()['error']
@@ -0,0 +1,98 @@
+from io import BytesIO
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.utils.brick_store import write_bricks, BrickVolume
+from app.utils.tiles import (
+    pyramid_levels,
+    tile_bounds,
+    read_region,
+    downsample,
+    read_tile,
+    read_tile_layers,
+    render_tile
+)
+
+def test_pyramid_levels():
+    levels = pyramid_levels((600, 300), 256)
+    assert [(l['factor'], l['height'], l['width'], l['rows'], l['columns']) for l in levels] == [
+        (1, 600, 300, 3, 2),
+        (2, 300, 150, 2, 1),
+        (4, 150, 75, 1, 1)
+    ]
+    assert len(pyramid_levels((64, 64), 256)) == 1
+
+def test_tile_bounds_edges_and_errors():
+    assert tile_bounds((600, 300), 256, 0, 1, 2) == ((512, 600), (256, 300))
+    assert tile_bounds((600, 300), 256, 1, 0, 1) == ((512, 600), (0, 300))
+    assert tile_bounds((600, 300), 256, 2, 0, 0) == ((0, 600), (0, 300))
+    for level, tx, ty in ((3, 0, 0), (-1, 0, 0), (0, 2, 0), (1, 0, 2)):
+        with pytest.raises(ValueError):
+            tile_bounds((600, 300), 256, level, tx, ty)
+
+def test_downsample_mean_with_partial_blocks():
+    rng = np.random.default_rng(0)
+    region = rng.integers(0, 1000, (70, 37)).astype(np.int16)
+    result = downsample(region, 4)
+
+    assert result.shape == (18, 10)
+    np.testing.assert_allclose(result[:17, :9], region[:68, :36].reshape(17, 4, 9, 4).mean(axis=(1, 3)))
+    assert result[17, 9] == pytest.approx(region[68:, 36:].mean())
+    assert downsample(region, 1) is region
+
+def test_downsample_max_keeps_thin_structures():
+    mask = np.zeros((16, 16), dtype=np.uint8)
+    mask[5, :] = 1
+    assert downsample(mask, 8, 'max').tolist() == [[1, 1], [0, 0]]
+
+def test_read_tile_matches_in_memory_volume(tmp_path):
+    rng = np.random.default_rng(1)
+    volume = rng.integers(-1000, 1000, (6, 50, 70)).astype(np.float32)
+    write_bricks(volume, str(tmp_path / 'bricks'), brick_size=16)
+    bricks = BrickVolume(str(tmp_path / 'bricks'))
+
+    for axis, index in ((0, 3), (1, 20), (2, 69)):
+        plane = np.take(volume, index, axis=axis)
+        bounds = tile_bounds(plane.shape, 8, 1, 1, 0)
+        np.testing.assert_array_equal(read_region(bricks, axis, index, *bounds), read_region(volume, axis, index, *bounds))
+        np.testing.assert_allclose(read_tile(bricks, axis, index, bounds, 2), downsample(plane[0:16, 16:32], 2))
+
+def test_read_tile_layers_splits_labels():
+    mask = np.zeros((2, 8, 8), dtype=np.uint8)
+    mask[1, 0, 0], mask[1, 7, 7] = 1, 2
+    roi_masks = [
+        {'label': 'plain', 'mask': mask},
+        {'label': 'tissue', 'mask': mask, 'labels': [[1, 'fat'], [2, 'bone']]}
+    ]
+    layers, names = read_tile_layers(roi_masks, 0, 1, ((0, 8), (0, 8)), 4)
+    assert names == ['plain', 'fat', 'bone']
+    assert [layer.tolist() for layer in layers] == [[[1, 0], [0, 2]], [[1, 0], [0, 0]], [[0, 0], [0, 1]]]
+
+def test_render_tile_modes():
+    image = np.linspace(-100, 300, 64, dtype=np.float32).reshape(8, 8)
+
+    gray = Image.open(BytesIO(render_tile(image, [], (100, 200), [[1, 0, 0]])))
+    assert gray.mode == 'L' and gray.size == (8, 8)
+    pixels = np.asarray(gray)
+    assert pixels[0, 0] == 0 and pixels[-1, -1] == 255
+
+    layer = np.zeros((8, 8), dtype=np.uint8)
+    layer[2, 3] = 1
+    rgba = np.asarray(Image.open(BytesIO(render_tile(image, [layer], (100, 200), [[1, 0, 0]]))))
+    assert rgba.shape == (8, 8, 4)
+    assert rgba[2, 3, 0] > rgba[2, 3, 1]
+    np.testing.assert_array_equal(rgba[0, :, 0], pixels[0])
+
+def test_tile_endpoints(app, client, auth_headers, loaded_volume):
+    app.config['TILE_SIZE'] = 8
+    info = client.get('/api/viewer/tile_info?view=axial', headers=auth_headers).get_json()
+    assert (info['num_slices'], info['height'], info['width']) == (6, 16, 20)
+    assert [(level['rows'], level['columns']) for level in info['levels']] == [(2, 3), (1, 2), (1, 1)]
+
+    response = client.get('/api/viewer/get_tile?slice_index=2&level=0&tx=2&ty=1', headers=auth_headers)
+    assert response.status_code == 200 and response.mimetype == 'image/png'
+    assert Image.open(BytesIO(response.get_data())).size == (4, 8)
+
+    for query in ('slice_index=6', 'level=3', 'tx=3', 'slice_index=x'):
+        assert client.get(f"/api/viewer/get_tile?{query}", headers=auth_headers).status_code == 400
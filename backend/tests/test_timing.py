@@ -0,0 +1,33 @@
+from app.utils.timing import stage, timed, record, run_collected, is_collecting
+
+@timed('double')
+def _double(value):
+    with stage('inner'):
+        return value * 2
+
+def test_stages_are_only_collected_when_sampled():
+    assert not is_collecting()
+    with stage('ignored'):
+        pass
+    
+    def job():
+        _double(1)
+        _double(2)
+        record({'remote': 0.5})
+        return 'done'
+    
+    result, timings = run_collected(job)
+    assert result == 'done'
+    assert set(timings) == {'double', 'inner', 'remote'}
+    assert timings['remote'] == 0.5
+    assert not is_collecting()
+
+def test_server_timing_header(app, client, auth_headers, loaded_volume):
+    response = client.get('/api/viewer/get_slice?slice_index=1', headers=auth_headers)
+    entries = dict(entry.split(';dur=') for entry in response.headers['Server-Timing'].split(', '))
+    assert {'session_fetch', 'render', 'encode', 'total'} <= set(entries)
+    assert float(entries['total']) >= float(entries['encode'])
+    
+    app.config['TIMING_SAMPLE_RATE'] = 0
+    response = client.get('/api/viewer/get_slice?slice_index=1', headers=auth_headers)
+    assert 'Server-Timing' not in response.headers
@@ -0,0 +1,51 @@
+import io
+import os
+
+from app.utils.blob_store import blob_path, collect_garbage
+from app.utils.file_utils import store_file, get_blob_root
+
+def _upload(client, auth_headers, paths):
+    files = [(open(path, 'rb'), os.path.basename(path)) for path in paths]
+    try:
+        return client.post('/api/upload/dicom', headers=auth_headers, data={'files': files},
+                           content_type='multipart/form-data')
+    finally:
+        for f, _ in files:
+            f.close()
+
+def test_identical_content_is_stored_once(app, tmp_path):
+    first, second = tmp_path / 'a', tmp_path / 'b'
+    first.mkdir()
+    second.mkdir()
+    with app.app_context():
+        a = store_file(io.BytesIO(b'mask'), 'roi.nii.gz', str(first))
+        b = store_file(io.BytesIO(b'mask'), 'other.nii.gz', str(second))
+        again = store_file(io.BytesIO(b'mask'), 'roi.nii.gz', str(first))
+        blob = blob_path(get_blob_root(), a['sha256'])
+        
+        assert a['saved_filename'] == b['saved_filename'] == f"{a['sha256'][:32]}.nii.gz"
+        assert not a['deduplicated'] and b['deduplicated'] and again['unchanged']
+        assert os.path.samefile(a['path'], b['path']) and os.stat(blob).st_nlink == 3
+        
+        os.remove(a['path'])
+        assert collect_garbage(get_blob_root(), grace_period=0)['blobs'] == 0
+        os.remove(b['path'])
+        assert collect_garbage(get_blob_root(), grace_period=3600) == {'blobs': 0, 'bytes': 0, 'kept': 1}
+        assert collect_garbage(get_blob_root(), grace_period=0) == {'blobs': 1, 'bytes': 4, 'kept': 0}
+        assert not os.path.exists(blob)
+
+def test_reupload_replaces_instances_and_gc(app, client, auth_headers, dicom_files):
+    response = _upload(client, auth_headers, dicom_files)
+    assert response.status_code == 201
+    assert response.get_json()['series_info']['shape'] == [8, 32, 32]
+    
+    response = _upload(client, auth_headers, dicom_files)
+    assert response.get_json()['duplicates'] == 8
+    dicom_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'user_admin', 'dicom')
+    assert len(os.listdir(dicom_dir)) == 8  # Named by SOPInstanceUID, not added again
+    
+    assert client.delete('/api/upload/dicom', headers=auth_headers).get_json()['deleted']
+    app.config['BLOB_GC_GRACE_SECONDS'] = 0
+    result = client.post('/api/upload/gc', headers=auth_headers).get_json()
+    assert result['blobs']['blobs'] == 8
+    assert len(result['series_caches_removed']) == 1
@@ -0,0 +1,21 @@
+import json
+import os
+import subprocess
+import sys
+
+from app.utils.warmup import HEAVY_MODULES
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_create_app_defers_heavy_imports():
+    script = (
+        "import json, sys\n"
+        "from app import create_app\n"
+        "create_app('testing')\n"
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, '-c', script], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    # numpy is cheap next to the rest and used throughout the session store
+    assert json.loads(output.splitlines()[-1]) == ['numpy']